@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 import logging
+import multiprocessing
+from multiprocessing import shared_memory
 import os
 import threading
 
@@ -9,34 +11,78 @@ from dipy.tracking.streamlinespeed import length
 from dipy.tracking.vox2track import _streamlines_in_mask
 import h5py
 import nibabel as nib
+from nibabel.streamlines import ArraySequence
 import numpy as np
 from scipy.ndimage import map_coordinates
 
 from scilpy.image.labels import get_data_as_labels
-from scilpy.io.hdf5 import reconstruct_streamlines_from_hdf5
+from scilpy.io.hdf5 import (assert_header_compatible_hdf5,
+                            reconstruct_streamlines_from_hdf5,
+                            STREAMLINES_KEYS)
 from scilpy.tractanalysis.reproducibility_measures import \
-    compute_bundle_adjacency_voxel
-from scilpy.tractanalysis.streamlines_metrics import compute_tract_counts_map
+    compute_bundle_adjacency_voxel_indices
+from scilpy.tractograms.streamline_and_mask_operations import \
+    get_sparse_density_map
 from scilpy.tractograms.streamline_operations import \
-    resample_streamlines_num_points
+    array_sequence_from_flat
 from scilpy.utils.metrics_tools import compute_lesion_stats
 
 
 d = threading.local()
 
 
+def _get_endpoints_labels(tractogram, data_labels):
+    """
+    Labels of the first and last point of each streamline. Only the
+    endpoints are read (from the offsets and lengths), and, for a
+    StatefulTractogram, only they are converted to voxel space, center
+    origin (as if the streamlines were resampled to 2 points).
+    """
+    if isinstance(tractogram, StatefulTractogram):
+        streamlines = tractogram.streamlines
+    else:
+        streamlines = ArraySequence(tractogram)
+
+    offsets = np.asarray(streamlines._offsets, dtype=np.intp)
+    lengths = np.asarray(streamlines._lengths, dtype=np.intp)
+    # Rows alternate: first point, last point.
+    rows = np.column_stack((offsets, offsets + lengths - 1)).ravel()
+    endpoints = array_sequence_from_flat(streamlines._data[rows],
+                                         np.full(len(offsets), 2))
+
+    if isinstance(tractogram, StatefulTractogram):
+        # vox space, center origin: compatible with map_coordinates
+        endpoints = StatefulTractogram.from_sft(endpoints, tractogram)
+        endpoints.to_vox()
+        endpoints.to_center()
+        endpoints = endpoints.streamlines
+
+    labels = map_coordinates(data_labels, endpoints._data.T, order=0)
+    return labels[0::2], labels[1::2]
+
+
+def _get_pairs_indices(start_labels, end_labels, ordered_labels):
+    # Linearized (row, col) index of each pair of labels in the matrix.
+    return np.searchsorted(ordered_labels, start_labels) * \
+        len(ordered_labels) + np.searchsorted(ordered_labels, end_labels)
+
+
 def compute_triu_connectivity_from_labels(tractogram, data_labels,
                                           keep_background=False,
                                           hide_labels=None):
     """
-    Compute a connectivity matrix.
+    Compute a connectivity matrix, from the labels of the endpoints of the
+    streamlines.
 
     Parameters
     ----------
-    tractogram: StatefulTractogram, or list[np.ndarray]
+    tractogram: StatefulTractogram, list[np.ndarray], or iterator
         Streamlines. A StatefulTractogram input is recommanded.
         When using directly with a list of streamlines, streamlines must be in
         vox space, center origin.
+        Can also be an iterator (ex, a generator) of StatefulTractograms or
+        of lists of streamlines, to process a large tractogram by chunks (see
+        lazy_sft_chunks).
     data_labels: np.ndarray
         The loaded nifti image.
     keep_background: Bool
@@ -53,40 +99,41 @@ def compute_triu_connectivity_from_labels(tractogram, data_labels,
         Else, shape (nb_labels, nb_labels)
     ordered_labels: List
         The list of labels. Name of each row / column.
-    start_labels: List
-        For each streamline, the label at starting point.
-    end_labels: List
-        For each streamline, the label at ending point.
+    start_labels: np.ndarray or None
+        For each streamline, the smallest label of its two endpoints. None
+        if the tractogram was given by chunks.
+    end_labels: np.ndarray or None
+        For each streamline, the largest label of its two endpoints. None
+        if the tractogram was given by chunks.
     """
-    if isinstance(tractogram, StatefulTractogram):
-        # vox space, center origin: compatible with map_coordinates
-        sfs_2_pts = resample_streamlines_num_points(tractogram, 2)
-        sfs_2_pts.to_vox()
-        sfs_2_pts.to_center()
-        streamlines = sfs_2_pts.streamlines
+    is_chunked = not isinstance(tractogram, (StatefulTractogram,
+                                             ArraySequence, list))
+    chunks = tractogram if is_chunked else [tractogram]
 
-    else:
-        streamlines = tractogram
-
-    ordered_labels = list(np.sort(np.unique(data_labels)))
+    ordered_labels = np.unique(data_labels)
     assert ordered_labels[0] >= 0, "Only accepting positive labels."
     nb_labels = len(ordered_labels)
     logging.debug("Computing connectivity matrix for {} labels."
                   .format(nb_labels))
 
     matrix = np.zeros((nb_labels, nb_labels), dtype=int)
-
-    labels = map_coordinates(data_labels, streamlines._data.T, order=0)
-    start_labels = labels[0::2]
-    end_labels = labels[1::2]
-
-    # sort each pair of labels for start to be smaller than end
-    start_labels, end_labels = zip(*[sorted(pair) for pair in
-                                     zip(start_labels, end_labels)])
-
-    np.add.at(matrix, (start_labels, end_labels), 1)
-    assert matrix.sum() == len(streamlines)
-
+    nb_streamlines = 0
+    for chunk in chunks:
+        start_labels, end_labels = _get_endpoints_labels(chunk, data_labels)
+
+        # sort each pair of labels for start to be smaller than end
+        start_labels, end_labels = (np.minimum(start_labels, end_labels),
+                                    np.maximum(start_labels, end_labels))
+
+        # Counting all pairs at once, on a linearized (row, col) index.
+        pairs = _get_pairs_indices(start_labels, end_labels, ordered_labels)
+        matrix += np.bincount(pairs, minlength=nb_labels ** 2).reshape(
+            (nb_labels, nb_labels))
+        nb_streamlines += len(pairs)
+    assert matrix.sum() == nb_streamlines
+    ordered_labels = ordered_labels.tolist()
+    if is_chunked:
+        start_labels, end_labels = None, None
     # Rejecting background
     if not keep_background and ordered_labels[0] == 0:
         logging.debug("Rejecting background.")
@@ -117,6 +164,126 @@ def compute_triu_connectivity_from_labels(tractogram, data_labels,
     return matrix, ordered_labels, start_labels, end_labels
 
 
+class ConnectivityAccumulator(object):
+    """
+    Online version of compute_triu_connectivity_from_labels, to be fed during
+    tracking: the streamlines are not kept, only the labels of their
+    endpoints and their length are accumulated in a streamline count matrix
+    and a length matrix.
+    """
+    def __init__(self, data_labels, voxel_size=1.0, buffer_size=10000):
+        """
+        Parameters
+        ----------
+        data_labels: np.ndarray
+            The labels volume.
+        voxel_size: float or np.ndarray
+            Voxel size (mm), to compute the streamline lengths in mm.
+        buffer_size: int
+            Number of streamlines buffered before their labels are looked up
+            (all at once).
+        """
+        self.data_labels = data_labels
+        self.voxel_size = voxel_size
+        self.buffer_size = buffer_size
+
+        self.ordered_labels = np.unique(data_labels)
+        assert self.ordered_labels[0] >= 0, "Only accepting positive labels."
+        nb_labels = len(self.ordered_labels)
+        self.count_matrix = np.zeros((nb_labels, nb_labels), dtype=np.int64)
+        self.length_matrix = np.zeros((nb_labels, nb_labels))
+        self._endpoints = []
+        self._lengths = []
+
+    def add_streamline(self, streamline):
+        """
+        Parameters
+        ----------
+        streamline: np.ndarray of shape (N, 3)
+            The streamline, in vox space, center origin.
+        """
+        self._endpoints.append(streamline[[0, -1]])
+        self._lengths.append(
+            length(np.asarray(streamline) * self.voxel_size))
+        if len(self._lengths) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Adds the buffered streamlines to the matrices.
+        """
+        if len(self._lengths) == 0:
+            return
+
+        endpoints = np.concatenate(self._endpoints)
+        labels = map_coordinates(self.data_labels, endpoints.T, order=0)
+        start_labels = np.minimum(labels[0::2], labels[1::2])
+        end_labels = np.maximum(labels[0::2], labels[1::2])
+        pairs = _get_pairs_indices(start_labels, end_labels,
+                                   self.ordered_labels)
+
+        shape = self.count_matrix.shape
+        self.count_matrix += np.bincount(
+            pairs, minlength=np.prod(shape)).reshape(shape)
+        self.length_matrix += np.bincount(
+            pairs, weights=self._lengths,
+            minlength=np.prod(shape)).reshape(shape)
+        self._endpoints = []
+        self._lengths = []
+
+    def reset(self):
+        """
+        Empties the matrices and the buffer.
+        """
+        self._endpoints = []
+        self._lengths = []
+        self.count_matrix[:] = 0
+        self.length_matrix[:] = 0
+
+    def merge(self, other):
+        """
+        Adds the streamlines of another accumulator (ex, from another
+        process), with the same labels.
+        """
+        if not np.array_equal(self.ordered_labels, other.ordered_labels):
+            raise ValueError('Cannot merge connectivity accumulators with '
+                             'different labels.')
+        self.flush()
+        other.flush()
+        self.count_matrix += other.count_matrix
+        self.length_matrix += other.length_matrix
+
+    def get_matrices(self, keep_background=False):
+        """
+        Parameters
+        ----------
+        keep_background: bool
+            By default, the background (label 0) is not included in the
+            matrices. If True, label 0 is kept.
+
+        Returns
+        -------
+        count_matrix: np.ndarray
+            Streamline count matrix (upper triangular), as
+            compute_triu_connectivity_from_labels.
+        length_matrix: np.ndarray
+            Average streamline length (mm) of each connection.
+        ordered_labels: List
+            The list of labels. Name of each row / column.
+        """
+        self.flush()
+        count_matrix = self.count_matrix.copy()
+        length_matrix = np.divide(self.length_matrix, count_matrix,
+                                  out=np.zeros_like(self.length_matrix),
+                                  where=count_matrix > 0)
+        ordered_labels = self.ordered_labels.tolist()
+        if not keep_background and ordered_labels[0] == 0:
+            ordered_labels = ordered_labels[1:]
+            count_matrix = count_matrix[1:, 1:]
+            length_matrix = length_matrix[1:, 1:]
+        return count_matrix, length_matrix, ordered_labels
+
+
 def load_node_nifti(directory, in_label, out_label, ref_img):
     in_filename = os.path.join(directory,
                                '{}_{}.nii.gz'.format(in_label, out_label))
@@ -130,18 +297,6 @@ def load_node_nifti(directory, in_label, out_label, ref_img):
     return None
 
 
-def multi_proc_compute_connectivity_matrices_from_hdf5(args):
-    (hdf5_filename, labels_img, comb,
-     compute_volume, compute_streamline_count, compute_length,
-     similarity_directory, metrics_data, metrics_names, lesion_data,
-     include_dps, weighted, min_lesion_vol) = args
-    return compute_connectivity_matrices_from_hdf5(
-        hdf5_filename, labels_img, comb[0], comb[1],
-        compute_volume, compute_streamline_count, compute_length,
-        similarity_directory, metrics_data, metrics_names, lesion_data,
-        include_dps, weighted, min_lesion_vol)
-
-
 def compute_connectivity_matrices_from_hdf5(
         hdf5_filename, labels_img, in_label, out_label,
         compute_volume=True, compute_streamline_count=True,
@@ -200,53 +355,88 @@ def compute_connectivity_matrices_from_hdf5(
             described above.
         dps_keys: The list of keys included from dps.
     """
+    metrics_data = metrics_data or []
     if len(metrics_data) > 0:
         assert len(metrics_data) == len(metrics_names)
 
+    with h5py.File(hdf5_filename, 'r') as hdf5_file:
+        return _compute_connection_measures(
+            hdf5_file, labels_img, in_label, out_label,
+            compute_volume, compute_streamline_count, compute_length,
+            similarity_directory, metrics_data, metrics_names,
+            _prepare_lesion_data(lesion_data), include_dps, weighted,
+            min_lesion_vol)
+
+
+def _prepare_lesion_data(lesion_data):
+    """
+    Converts the (lesion_labels, lesion_img) given by the user into
+    (lesion_labels, lesion_atlas, lesion_mask, voxel_sizes), loaded once for
+    all connections.
+    """
+    if lesion_data is None:
+        return None
+    lesion_labels, lesion_img = lesion_data
+    voxel_sizes = lesion_img.header.get_zooms()[0:3]
+    lesion_img.set_filename('tmp.nii.gz')
+    lesion_atlas = get_data_as_labels(lesion_img)
+    return (lesion_labels, lesion_atlas, lesion_atlas.astype(np.uint8),
+            voxel_sizes)
+
+
+def _compute_connection_measures(
+        hdf5_file, labels_img, in_label, out_label, compute_volume,
+        compute_streamline_count, compute_length, similarity_directory,
+        metrics_data, metrics_names, lesion_data, include_dps, weighted,
+        min_lesion_vol):
+    """
+    Computes the measures of one connection, from an opened hdf5 file. See
+    compute_connectivity_matrices_from_hdf5 for a description of the
+    parameters. Here, lesion_data is the output of _prepare_lesion_data.
+    """
     affine, dimensions, voxel_sizes, _ = get_reference_info(labels_img)
 
     measures_to_return = {}
 
     # Getting the bundle from the hdf5
-    with h5py.File(hdf5_filename, 'r') as hdf5_file:
-        key = '{}_{}'.format(in_label, out_label)
-        if key not in hdf5_file:
-            logging.debug("Connection {} not found in the hdf5".format(key))
-            return None
-        streamlines = reconstruct_streamlines_from_hdf5(hdf5_file[key])
-        if len(streamlines) == 0:
-            logging.debug("Connection {} contained no streamline".format(key))
-            return None
-        logging.debug("Found {} streamlines for connection {}"
-                      .format(len(streamlines), key))
-
-        # Getting dps info from the hdf5
-        dps_keys = []
-        if include_dps:
-            for dps_key in hdf5_file[key].keys():
-                if dps_key not in ['data', 'offsets', 'lengths']:
-                    if 'commit' in dps_key:
-                        dps_values = np.sum(hdf5_file[key][dps_key])
-                    else:
-                        dps_values = np.average(hdf5_file[key][dps_key])
-                    measures_to_return[dps_key] = dps_values
-                    dps_keys.append(dps_key)
+    key = '{}_{}'.format(in_label, out_label)
+    if key not in hdf5_file:
+        logging.debug("Connection {} not found in the hdf5".format(key))
+        return None
+    streamlines = reconstruct_streamlines_from_hdf5(hdf5_file[key])
+    if len(streamlines) == 0:
+        logging.debug("Connection {} contained no streamline".format(key))
+        return None
+    logging.debug("Found {} streamlines for connection {}"
+                  .format(len(streamlines), key))
+
+    # Getting dps info from the hdf5
+    dps_keys = []
+    if include_dps:
+        for dps_key in hdf5_file[key].keys():
+            if dps_key not in STREAMLINES_KEYS:
+                if 'commit' in dps_key:
+                    dps_values = np.sum(hdf5_file[key][dps_key])
+                else:
+                    dps_values = np.average(hdf5_file[key][dps_key])
+                measures_to_return[dps_key] = dps_values
+                dps_keys.append(dps_key)
 
     # If density is not required, do not compute it
-    # Only required for volume, similarity and any metrics
+    # Only required for volume, similarity, lesions and any metrics.
+    # Sparse: only the voxels of the bundle are kept (linear indices).
     if (compute_volume or similarity_directory is not None or
-            len(metrics_data) > 0):
-        density = compute_tract_counts_map(streamlines, dimensions)
+            len(metrics_data) > 0 or lesion_data is not None):
+        voxels, density = get_sparse_density_map(streamlines, dimensions)
 
     if compute_length:
         # scil_tractogram_segment_connections_from_labels.py requires
         # isotropic voxels
-        mean_length = np.average(length(list(streamlines))) * voxel_sizes[0]
+        mean_length = np.average(length(streamlines)) * voxel_sizes[0]
         measures_to_return['length_mm'] = mean_length
 
     if compute_volume:
-        measures_to_return['volume_mm3'] = np.count_nonzero(density) * \
-            np.prod(voxel_sizes)
+        measures_to_return['volume_mm3'] = len(voxels) * np.prod(voxel_sizes)
 
     if compute_streamline_count:
         measures_to_return['streamline_count'] = len(streamlines)
@@ -257,30 +447,32 @@ def compute_connectivity_matrices_from_hdf5(
         if density_sim is None:
             ba_vox = 0
         else:
-            ba_vox = compute_bundle_adjacency_voxel(density, density_sim)
+            ba_vox = compute_bundle_adjacency_voxel_indices(
+                np.column_stack(np.unravel_index(voxels, dimensions)),
+                np.argwhere(density_sim > 0))
 
         measures_to_return['similarity'] = ba_vox
 
     for metric_data, metric_name in zip(metrics_data, metrics_names):
+        # Values of the bundle's voxels only (zero density elsewhere).
+        values = np.take(metric_data, voxels)
         if weighted:
-            avg_value = np.average(metric_data, weights=density)
+            avg_value = np.average(values, weights=density)
         else:
-            avg_value = np.average(metric_data[density > 0])
+            avg_value = np.average(values)
         measures_to_return[metric_name] = avg_value
 
     if lesion_data is not None:
-        lesion_labels, lesion_img = lesion_data
-        voxel_sizes = lesion_img.header.get_zooms()[0:3]
-        lesion_img.set_filename('tmp.nii.gz')
-        lesion_atlas = get_data_as_labels(lesion_img)
+        lesion_labels, lesion_atlas, lesion_mask, lesion_voxel_sizes = \
+            lesion_data
+        # Lesion labels of the bundle's voxels, as a flat "volume".
         tmp_dict = compute_lesion_stats(
-            density.astype(bool), lesion_atlas,
-            voxel_sizes=voxel_sizes, single_label=True,
+            np.ones(len(voxels), dtype=bool), np.take(lesion_atlas, voxels),
+            voxel_sizes=lesion_voxel_sizes, single_label=True,
             min_lesion_vol=min_lesion_vol,
             precomputed_lesion_labels=lesion_labels)
 
-        tmp_ind = _streamlines_in_mask(list(streamlines),
-                                       lesion_atlas.astype(np.uint8),
+        tmp_ind = _streamlines_in_mask(list(streamlines), lesion_mask,
                                        np.eye(3), [0, 0, 0])
         streamlines_count = len(
             np.where(tmp_ind == [0, 1][True])[0].tolist())
@@ -295,3 +487,239 @@ def compute_connectivity_matrices_from_hdf5(
             measures_to_return['lesion_streamline_count'] = 0
 
     return {(in_label, out_label): measures_to_return}, dps_keys
+
+
+def _compute_connections_range(hdf5_filename, comb_list, labels_img,
+                               metrics_data, lesion_data, kwargs):
+    """
+    Computes the measures of a range of connections, opening the hdf5 file
+    only once.
+    """
+    outputs = []
+    with h5py.File(hdf5_filename, 'r') as hdf5_file:
+        for in_label, out_label in comb_list:
+            outputs.append(_compute_connection_measures(
+                hdf5_file, labels_img, in_label, out_label,
+                metrics_data=metrics_data, lesion_data=lesion_data,
+                **kwargs))
+    return outputs
+
+
+def _init_shared_connectivity_args(descriptions, labels_img, lesion_info,
+                                   kwargs):
+    """
+    Pool initializer: attaches the shared memory blocks (metrics and lesion
+    atlas) once per process, and keeps them in a global for easier access
+    by _compute_connections_shared_range.
+    """
+    global shared_connectivity_args
+    blocks = [shared_memory.SharedMemory(name=name)
+              for name, _, _ in descriptions]
+    arrays = [np.ndarray(shape, dtype=dtype, buffer=block.buf)
+              for block, (_, shape, dtype) in zip(blocks, descriptions)]
+    lesion_data = None
+    if lesion_info is not None:
+        lesion_labels, voxel_sizes = lesion_info
+        lesion_mask = arrays.pop()
+        lesion_data = (lesion_labels, arrays.pop(), lesion_mask, voxel_sizes)
+    shared_connectivity_args = (blocks, labels_img, arrays, lesion_data,
+                                kwargs)
+
+
+def _compute_connections_shared_range(hdf5_filename, comb_list):
+    """
+    multiprocessing.pool.starmap input function. Computes the measures of
+    a range of connections, with the metrics from the shared memory (see
+    _init_shared_connectivity_args).
+    """
+    _, labels_img, metrics_data, lesion_data, kwargs = \
+        shared_connectivity_args
+    return _compute_connections_range(hdf5_filename, comb_list, labels_img,
+                                      metrics_data, lesion_data, kwargs)
+
+
+def compute_all_connectivity_matrices_from_hdf5(
+        hdf5_filename, labels_img, comb_list,
+        compute_volume=True, compute_streamline_count=True,
+        compute_length=True, similarity_directory=None, metrics_data=None,
+        metrics_names=None, lesion_data=None, include_dps=False,
+        weighted=False, min_lesion_vol=0, processes=1, batch_size=100):
+    """
+    Computes the measures of all connections in a single pass over the hdf5
+    file. Connections are processed in contiguous batches; each batch opens
+    the hdf5 file only once. With more than one process, the metrics (and
+    the lesion atlas) are placed in shared memory once, instead of being
+    sent with every connection.
+
+    Parameters
+    ----------
+    hdf5_filename: str
+        Name of the hdf5 file containing the precomputed connections (bundles)
+    labels_img: nib.Nifti1Image
+        The labels image (reference).
+    comb_list: list[tuple]
+        The list of (in_label, out_label) connections to compute.
+    processes: int
+        Number of processes to use.
+    batch_size: int
+        Maximal number of connections sent to a process at once.
+
+    See compute_connectivity_matrices_from_hdf5 for a description of the
+    other parameters.
+
+    Returns
+    -------
+    outputs: list
+        For each connection found in the hdf5 (with at least one
+        streamline), the output of compute_connectivity_matrices_from_hdf5.
+    """
+    metrics_data = metrics_data or []
+    metrics_names = metrics_names or []
+    assert len(metrics_data) == len(metrics_names)
+    kwargs = {'compute_volume': compute_volume,
+              'compute_streamline_count': compute_streamline_count,
+              'compute_length': compute_length,
+              'similarity_directory': similarity_directory,
+              'metrics_names': metrics_names,
+              'include_dps': include_dps,
+              'weighted': weighted,
+              'min_lesion_vol': min_lesion_vol}
+
+    # Only keeping the connections present in the file, in the file's order
+    # for faster reading.
+    with h5py.File(hdf5_filename, 'r') as hdf5_file:
+        file_keys = {key: i for i, key in enumerate(hdf5_file.keys())}
+    comb_list = [comb for comb in comb_list
+                 if '{}_{}'.format(*comb) in file_keys]
+    comb_list.sort(key=lambda comb: file_keys['{}_{}'.format(*comb)])
+    nb_combs = len(comb_list)
+    if nb_combs == 0:
+        return []
+
+    lesion_data = _prepare_lesion_data(lesion_data)
+    if processes <= 1 or nb_combs <= 1:
+        outputs = _compute_connections_range(hdf5_filename, comb_list,
+                                             labels_img, metrics_data,
+                                             lesion_data, kwargs)
+        return [it for it in outputs if it is not None]
+
+    # Contiguous ranges of connections, at least one per process.
+    nb_chunks = max(processes, int(np.ceil(nb_combs / batch_size)))
+    bounds = np.linspace(0, nb_combs,
+                         min(nb_chunks, nb_combs) + 1).astype(int)
+
+    arrays = list(metrics_data)
+    lesion_info = None
+    if lesion_data is not None:
+        lesion_labels, lesion_atlas, lesion_mask, voxel_sizes = lesion_data
+        arrays.extend([lesion_atlas, lesion_mask])
+        lesion_info = (lesion_labels, voxel_sizes)
+
+    blocks = []
+    try:
+        descriptions = []
+        for arr in arrays:
+            block = shared_memory.SharedMemory(create=True,
+                                               size=max(arr.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[:] = arr
+            descriptions.append((block.name, arr.shape, arr.dtype))
+
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(processes, initializer=_init_shared_connectivity_args,
+                      initargs=(descriptions, labels_img, lesion_info,
+                                kwargs)) as pool:
+            results = pool.starmap(
+                _compute_connections_shared_range,
+                [(hdf5_filename, comb_list[start:end])
+                 for start, end in zip(bounds[:-1], bounds[1:])])
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return [it for outputs in results for it in outputs if it is not None]
+
+
+def _add_sparse(running_sum, indices, values):
+    """
+    Adds a sparse map (sorted unique indices, values) to a running sum in
+    the same representation.
+    """
+    if running_sum is None:
+        return indices, values.astype(np.float32)
+
+    sum_indices, sum_values = running_sum
+    new_indices = np.union1d(sum_indices, indices)
+    new_values = np.zeros(len(new_indices), dtype=np.float32)
+    new_values[np.searchsorted(new_indices, sum_indices)] = sum_values
+    new_values[np.searchsorted(new_indices, indices)] += values
+    return new_indices, new_values
+
+
+def compute_average_density_maps_from_hdf5(hdf5_filenames, keys,
+                                           binary=False):
+    """
+    Computes the population average density map of each connection. Each
+    hdf5 file is opened once and each of its groups is read once; the
+    running sum of each connection is kept as a sparse map, so memory scales
+    with the number of traversed voxels rather than with the number of
+    connections times the size of the image. To bound memory with many
+    connections, call it on batches of keys.
+
+    Parameters
+    ----------
+    hdf5_filenames: list of str
+        HDF5 files from scil_tractogram_segment_connections_from_labels.py,
+        all with the same header.
+    keys: list of str
+        The connections (ex: '1_2') to average. A connection missing from
+        a file counts as an empty map for that subject.
+    binary: bool
+        If true, binarize the density maps before the average. Else, they
+        are normalized by their maximum.
+
+    Returns
+    -------
+    average_maps: dict
+        For each key with at least one streamline, a tuple (indices, values)
+        where indices are the linear indices (C order) of the non-zero
+        voxels, and values their average density (float32).
+    affine: np.ndarray
+        The affine of the hdf5 files.
+    dimensions: np.ndarray
+        The dimensions of the hdf5 files.
+    """
+    with h5py.File(hdf5_filenames[0], 'r') as hdf5_file_ref:
+        affine = hdf5_file_ref.attrs['affine']
+        dimensions = hdf5_file_ref.attrs['dimensions']
+
+    running_sums = {}
+    for hdf5_filename in hdf5_filenames:
+        with h5py.File(hdf5_filename, 'r') as hdf5_file:
+            assert_header_compatible_hdf5(hdf5_file, (affine, dimensions))
+            for key in keys:
+                if key not in hdf5_file:
+                    continue
+
+                # scil_tractogram_segment_connections_from_labels.py saves
+                # the streamlines in VOX/CORNER
+                streamlines = reconstruct_streamlines_from_hdf5(
+                    hdf5_file[key])
+                indices, density = get_sparse_density_map(streamlines,
+                                                          dimensions)
+                if len(indices) == 0:
+                    continue
+
+                if binary:
+                    density = np.ones(len(indices), dtype=np.float32)
+                else:
+                    density = density / np.max(density)
+                running_sums[key] = _add_sparse(running_sums.get(key),
+                                                indices, density)
+
+    average_maps = {}
+    for key, (indices, values) in running_sums.items():
+        average_maps[key] = (indices, values / len(hdf5_filenames))
+
+    return average_maps, affine, dimensions
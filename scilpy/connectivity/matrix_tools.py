@@ -1,24 +1,92 @@
 # -*- coding: utf-8 -*-
-import itertools
+import hashlib
+import multiprocessing
+import os
+import tempfile
 import warnings
 from warnings import simplefilter
 
 import bct
 from dipy.utils.optpkg import optional_package
 import numpy as np
+from numpy.lib.format import open_memmap
 from scipy.cluster import hierarchy
 
 from scilpy.image.labels import get_data_as_labels
+from scilpy.image.volume_math import EPSILON
+from scilpy.io.utils import load_matrix_in_any_format
 from scilpy.stats.matrix_stats import omega_sigma
-from scilpy.tractanalysis.reproducibility_measures import \
-    approximate_surface_node
 
 simplefilter("ignore", hierarchy.ClusterWarning)
 
 cl, have_bct, _ = optional_package('bct')
 
+GRAPH_MEASURES = ['betweenness_centrality', 'modularity', 'assortativity',
+                  'participation', 'clustering', 'nodal_strength',
+                  'local_efficiency', 'global_efficiency', 'density',
+                  'rich_club', 'path_length', 'edge_count']
+SMALL_WORLD_MEASURES = ['omega', 'sigma']
 
-def compute_olo(array):
+
+def load_matrix_stack(filenames, out_filename=None):
+    """
+    Load many matrices (ex, one per subject) once, into a single stack of
+    shape (N, X, Y), on which the functions of this module can be applied
+    in vectorized form.
+
+    Parameters
+    ----------
+    filenames: list of str
+        Matrices (.npy or .txt). A .npy file may itself contain a stack
+        (N, X, Y): all its matrices are added.
+    out_filename: str, optional
+        If set, the stack is written directly in this .npy file, memory-
+        mapped: only one input file is in memory at a time.
+
+    Returns
+    -------
+    stack: np.ndarray or np.memmap of shape (N, X, Y)
+        The matrices, as float64.
+    """
+    def _load(filename):
+        if os.path.splitext(filename)[1] == '.npy':
+            return np.load(filename, mmap_mode='r')
+        return load_matrix_in_any_format(filename)
+
+    # First pass: the shapes only (headers, for .npy files).
+    nb_matrices = 0
+    shape = None
+    for filename in filenames:
+        matrix = _load(filename)
+        if matrix.ndim not in [2, 3] or \
+                (shape is not None and matrix.shape[-2:] != shape):
+            raise ValueError('Matrix {} has shape {}, expecting (X, Y) or '
+                             '(N, X, Y) with (X, Y) = {}.'.format(
+                                 filename, matrix.shape, shape))
+        shape = matrix.shape[-2:]
+        nb_matrices += 1 if matrix.ndim == 2 else len(matrix)
+
+    stack_shape = (nb_matrices,) + shape
+    if out_filename is not None:
+        stack = open_memmap(out_filename, mode='w+', dtype=np.float64,
+                            shape=stack_shape)
+    else:
+        stack = np.zeros(stack_shape)
+
+    i = 0
+    for filename in filenames:
+        matrix = _load(filename)
+        if matrix.ndim == 2:
+            matrix = matrix[None]
+        stack[i:i + len(matrix)] = matrix
+        i += len(matrix)
+
+    if out_filename is not None:
+        stack.flush()
+    return stack
+
+
+def compute_olo(array, cache_dir=None):
     """
     Optimal Leaf Ordering permutes a weighted matrix that has a
     symmetric sparsity pattern using hierarchical clustering.
@@ -27,6 +95,9 @@ def compute_olo(array):
     ----------
     array: ndarray (NxN)
         Connectivity matrix.
+    cache_dir: str, optional
+        Directory where the permutation is saved, keyed by the content of
+        the matrix, to be reused when the same matrix is ordered again.
 
     Returns
     -------
@@ -36,10 +107,28 @@ def compute_olo(array):
     if array.ndim != 2:
         raise ValueError('RCM can only be applied to 2D array.')
 
+    cache_filename = None
+    if cache_dir is not None:
+        contiguous = np.ascontiguousarray(array, dtype=np.float64)
+        digest = hashlib.sha1(contiguous.tobytes())
+        digest.update(str(contiguous.shape).encode())
+        cache_filename = os.path.join(
+            cache_dir, 'olo_{}.npy'.format(digest.hexdigest()))
+        if os.path.isfile(cache_filename):
+            return np.load(cache_filename)
+
     Z = hierarchy.ward(array)
     perm = hierarchy.leaves_list(
         hierarchy.optimal_leaf_ordering(Z, array))
 
+    if cache_filename is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written then renamed, in case of concurrent runs.
+        fd, tmp_filename = tempfile.mkstemp(dir=cache_dir, suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, perm)
+        os.replace(tmp_filename, cache_filename)
+
     return perm
 
 
@@ -49,19 +138,20 @@ def apply_olo(array, perm):
 
     Parameters
     ----------
-    array: ndarray (NxN)
-        Sparse connectivity matrix.
+    array: ndarray (NxN) or (MxNxN)
+        Sparse connectivity matrix, or a stack of matrices.
     perm: ndarray (N,)
         Permutations for rows and columns to be applied.
 
     Returns
     -------
-    ndarray (N,N)
+    ndarray (N,N) or (M,N,N)
         Reordered array.
     """
-    if array.ndim != 2:
-        raise ValueError('RCM can only be applied to 2D array.')
-    return array[perm].T[perm]
+    if array.ndim not in [2, 3]:
+        raise ValueError('RCM can only be applied to 2D array (or a stack '
+                         'of 2D arrays).')
+    return np.swapaxes(array[..., perm, :], -1, -2)[..., perm, :]
 
 
 def apply_reordering(array, ordering):
@@ -71,51 +161,108 @@ def apply_reordering(array, ordering):
 
     Parameters
     ----------
-    array: ndarray (NxN)
-        Sparse connectivity matrix.
+    array: ndarray (NxN) or (MxNxN)
+        Sparse connectivity matrix, or a stack of matrices.
     ordering: list of lists
         First elements of the list is the permutation to apply to the rows.
         First elements of the list is the permutation to apply to the columns.
 
     Returns
     -------
-    tmp_array: ndarray (N,N)
+    tmp_array: ndarray (N,N) or (M,N,N)
         Reordered array.
     """
-    if array.ndim != 2:
-        raise ValueError('RCM can only be applied to 2D array.')
+    if array.ndim not in [2, 3]:
+        raise ValueError('RCM can only be applied to 2D array (or a stack '
+                         'of 2D arrays).')
     if not isinstance(ordering, list) or len(ordering) != 2:
         raise ValueError('Ordering should be a list of lists.\n'
                          '[[x1, x2,..., xn], [y1, y2,..., yn]]')
     ind_1, ind_2 = ordering
-    if (np.array(ind_1) > array.shape[0]).any() \
-            or (ind_2 > np.array(array.shape[1])).any():
+    if (np.array(ind_1) > array.shape[-2]).any() \
+            or (ind_2 > np.array(array.shape[-1])).any():
         raise ValueError('Indices from configuration are larger than the'
                          'matrix size, maybe you need a labels list?')
-    tmp_array = array[tuple(ind_1), :]
-    tmp_array = tmp_array[:, tuple(ind_2)]
+    tmp_array = array[..., ind_1, :]
+    tmp_array = tmp_array[..., ind_2]
 
     return tmp_array
 
 
+def scale_matrix(matrix, method):
+    """
+    Scale each matrix independently, to facilitate comparison across
+    subjects.
+
+    Parameters
+    ----------
+    matrix: np.ndarray of shape (X, Y) or (N, X, Y)
+        Matrix, or a stack of matrices.
+    method: str
+        One of 'max_at_one' (maximum value set to one), 'sum_to_one' (sum of
+        all values set to one) or 'log_10' (base 10 logarithm of the non-zero
+        values, as in scil_connectivity_math.py).
+
+    Returns
+    -------
+    matrix: np.ndarray
+        The scaled matrix (float64).
+    """
+    data = np.asarray(matrix, dtype=np.float64)
+    if method == 'max_at_one':
+        return data / np.max(data, axis=(-2, -1), keepdims=True)
+    if method == 'sum_to_one':
+        return data / np.sum(data, axis=(-2, -1), keepdims=True)
+    if method == 'log_10':
+        output_data = np.zeros(data.shape, dtype=np.float64)
+        output_data[data > EPSILON] = np.log10(data[data > EPSILON])
+        output_data[np.abs(output_data) < EPSILON] = -65536
+        return output_data
+    raise ValueError('Unknown scaling method {}.'.format(method))
+
+
 def evaluate_graph_measures(conn_matrix, len_matrix, avg_node_wise,
-                            small_world):
+                            small_world, measures=None, seed=None,
+                            cache_dir=None):
     """
-    toDo Finish docstring
+    Evaluate graph theory measures (using bct) from connectivity matrices.
 
     Parameters
     ----------
-    conn_matrix: np.ndarray of shape ??
-    len_matrix: np.ndarray of shape ??
+    conn_matrix: np.ndarray of shape (N, N)
+        Typically a streamline count weighted matrix.
+    len_matrix: np.ndarray of shape (N, N)
+        Length-weighted matrix.
     avg_node_wise: bool
         If true, return a single value for node-wise measures.
     small_world: bool
         If true, compute measure related to small worldness (omega and sigma).
         This option is much slower.
+    measures: list of str, optional
+        Subset of GRAPH_MEASURES (and SMALL_WORLD_MEASURES) to compute.
+        Default: all GRAPH_MEASURES, plus SMALL_WORLD_MEASURES if
+        small_world.
+    seed: int, optional
+        Seed of the reference networks of the small-world measures.
+    cache_dir: str, optional
+        Directory where the reference networks measures are cached. See
+        scilpy.stats.matrix_stats.omega_sigma.
+
+    Returns
+    -------
+    gtm_dict: dict
+        The measures, as floats or lists of floats.
     """
     if not have_bct:
         raise RuntimeError("bct ist not installed. Please install to use "
                            "this connectivity script.")
+    if measures is None:
+        measures = list(GRAPH_MEASURES)
+    unknown = set(measures) - set(GRAPH_MEASURES + SMALL_WORLD_MEASURES)
+    if unknown:
+        raise ValueError('Unknown graph measures: {}'.format(sorted(unknown)))
+    if small_world:
+        measures = list(measures) + SMALL_WORLD_MEASURES
     N = len_matrix.shape[0]
 
     def avg_cast(_input):
@@ -134,28 +281,43 @@ def evaluate_graph_measures(conn_matrix, len_matrix, avg_node_wise,
         func_cast = list_cast
 
     gtm_dict = {}
-    betweenness_centrality = bct.betweenness_wei(len_matrix) / ((N-1)*(N-2))
-    gtm_dict['betweenness_centrality'] = func_cast(betweenness_centrality)
-    ci, gtm_dict['modularity'] = bct.modularity_louvain_und(conn_matrix,
-                                                            seed=0)
-
-    gtm_dict['assortativity'] = bct.assortativity_wei(conn_matrix,
-                                                      flag=0)
-    gtm_dict['participation'] = func_cast(bct.participation_coef_sign(
-        conn_matrix, ci)[0])
-    gtm_dict['clustering'] = func_cast(bct.clustering_coef_wu(conn_matrix))
-
-    gtm_dict['nodal_strength'] = func_cast(bct.strengths_und(conn_matrix))
-    gtm_dict['local_efficiency'] = func_cast(bct.efficiency_wei(len_matrix,
-                                                                local=True))
-    gtm_dict['global_efficiency'] = func_cast(bct.efficiency_wei(len_matrix))
-    gtm_dict['density'] = func_cast(bct.density_und(conn_matrix)[0])
-
-    # Rich club always gives an error for the matrix rank and gives NaN
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        tmp_rich_club = bct.rich_club_wu(conn_matrix)
-    gtm_dict['rich_club'] = func_cast(tmp_rich_club[~np.isnan(tmp_rich_club)])
+    if 'betweenness_centrality' in measures:
+        betweenness_centrality = \
+            bct.betweenness_wei(len_matrix) / ((N-1)*(N-2))
+        gtm_dict['betweenness_centrality'] = func_cast(betweenness_centrality)
+    if 'modularity' in measures or 'participation' in measures:
+        ci, modularity = bct.modularity_louvain_und(conn_matrix, seed=0)
+        if 'modularity' in measures:
+            gtm_dict['modularity'] = modularity
+
+    if 'assortativity' in measures:
+        gtm_dict['assortativity'] = bct.assortativity_wei(conn_matrix,
+                                                          flag=0)
+    if 'participation' in measures:
+        gtm_dict['participation'] = func_cast(bct.participation_coef_sign(
+            conn_matrix, ci)[0])
+    if 'clustering' in measures:
+        gtm_dict['clustering'] = func_cast(
+            bct.clustering_coef_wu(conn_matrix))
+
+    if 'nodal_strength' in measures:
+        gtm_dict['nodal_strength'] = func_cast(bct.strengths_und(conn_matrix))
+    if 'local_efficiency' in measures:
+        gtm_dict['local_efficiency'] = func_cast(
+            bct.efficiency_wei(len_matrix, local=True))
+    if 'global_efficiency' in measures:
+        gtm_dict['global_efficiency'] = func_cast(
+            bct.efficiency_wei(len_matrix))
+    if 'density' in measures:
+        gtm_dict['density'] = func_cast(bct.density_und(conn_matrix)[0])
+
+    if 'rich_club' in measures:
+        # Rich club always gives an error for the matrix rank and gives NaN
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            tmp_rich_club = bct.rich_club_wu(conn_matrix)
+        gtm_dict['rich_club'] = func_cast(
+            tmp_rich_club[~np.isnan(tmp_rich_club)])
 
     # Path length gives an infinite distance for unconnected nodes
     # All of this is simply to fix that
@@ -164,19 +326,214 @@ def evaluate_graph_measures(conn_matrix, len_matrix, avg_node_wise,
         len_matrix = np.delete(len_matrix, empty_connections, axis=0)
         len_matrix = np.delete(len_matrix, empty_connections, axis=1)
 
-    path_length_tuple = bct.distance_wei(len_matrix)
-    gtm_dict['path_length'] = func_cast(path_length_tuple[0])
-    gtm_dict['edge_count'] = func_cast(path_length_tuple[1])
+    if 'path_length' in measures or 'edge_count' in measures:
+        path_length_tuple = bct.distance_wei(len_matrix)
+        for i, key in enumerate(['path_length', 'edge_count']):
+            if key not in measures:
+                continue
+            gtm_dict[key] = func_cast(path_length_tuple[i])
+            if not avg_node_wise:
+                for j in empty_connections:
+                    gtm_dict[key].insert(j, -1)
+
+    if 'omega' in measures or 'sigma' in measures:
+        omega, sigma = omega_sigma(len_matrix, seed=seed,
+                                   cache_dir=cache_dir)
+        if 'omega' in measures:
+            gtm_dict['omega'] = omega
+        if 'sigma' in measures:
+            gtm_dict['sigma'] = sigma
 
-    if not avg_node_wise:
-        for i in empty_connections:
-            gtm_dict['path_length'].insert(i, -1)
-            gtm_dict['edge_count'].insert(i, -1)
+    return gtm_dict
 
-    if small_world:
-        gtm_dict['omega'], gtm_dict['sigma'] = omega_sigma(len_matrix)
 
-    return gtm_dict
+def _evaluate_graph_measures_wrapper(args):
+    return evaluate_graph_measures(*args)
+
+
+def evaluate_graph_measures_batch(conn_matrices, len_matrices, avg_node_wise,
+                                  small_world, measures=None, seed=None,
+                                  cache_dir=None, nbr_processes=1):
+    """
+    Evaluate graph theory measures for many subjects, one subject per
+    sub-process. See evaluate_graph_measures for the parameters.
+
+    Parameters
+    ----------
+    conn_matrices: list of np.ndarray
+        One matrix per subject.
+    len_matrices: list of np.ndarray
+        One matrix per subject, in the same order.
+    nbr_processes: int
+        Number of sub-processes.
+
+    Returns
+    -------
+    gtm_dicts: list of dict
+        The measures of each subject, in the input order.
+    """
+    if len(conn_matrices) != len(len_matrices):
+        raise ValueError('There should be as many length matrices as '
+                         'connectivity matrices.')
+
+    args = [(conn_matrix, len_matrix, avg_node_wise, small_world, measures,
+             seed, cache_dir)
+            for conn_matrix, len_matrix in zip(conn_matrices, len_matrices)]
+    nbr_processes = min(nbr_processes, len(args))
+    if nbr_processes <= 1:
+        return [_evaluate_graph_measures_wrapper(arg) for arg in args]
+
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(nbr_processes) as pool:
+        return pool.map(_evaluate_graph_measures_wrapper, args, chunksize=1)
+
+
+class ParcelStatistics:
+    """
+    Statistics of all the parcels (labels) of an atlas, computed in a single
+    pass over the volume: voxel count, surface (as in
+    scilpy.tractanalysis.reproducibility_measures.approximate_surface_node)
+    and centroid. Computed once, they can be reused to normalize any number
+    of matrices associated with the same atlas.
+
+    Parameters
+    ----------
+    labels: np.ndarray of shape (L,)
+        Sorted labels present in the atlas (including the background).
+    voxel_counts: np.ndarray of shape (L,)
+        Number of voxels of each label.
+    surface_counts: np.ndarray of shape (L,)
+        Number of voxel faces of each label not shared with another voxel of
+        the same label.
+    centroids: np.ndarray of shape (L, 3)
+        Centroid of each label, in voxel space.
+    voxel_sizes: tuple of float
+        Voxel size (mm) of the atlas.
+    """
+    def __init__(self, labels, voxel_counts, surface_counts, centroids,
+                 voxel_sizes):
+        self.labels = np.asarray(labels)
+        self.voxel_counts = np.asarray(voxel_counts)
+        self.surface_counts = np.asarray(surface_counts)
+        self.centroids = np.asarray(centroids)
+        self.voxel_sizes = tuple(float(v) for v in voxel_sizes)
+
+    @classmethod
+    def from_atlas(cls, atlas_img, cache_dir=None):
+        """
+        Compute the statistics of all the labels of an atlas.
+
+        Parameters
+        ----------
+        atlas_img: nib.Nifti1Image
+            Atlas (labels) image.
+        cache_dir: str, optional
+            Directory where the statistics are saved, keyed by the content
+            of the atlas, to be reused whenever the same atlas is given.
+
+        Returns
+        -------
+        parcel_stats: ParcelStatistics
+        """
+        atlas_data = get_data_as_labels(atlas_img)
+        voxel_sizes = atlas_img.header.get_zooms()[:3]
+
+        cache_filename = None
+        if cache_dir is not None:
+            contiguous = np.ascontiguousarray(atlas_data)
+            digest = hashlib.sha1(contiguous.tobytes())
+            digest.update(str((contiguous.shape, contiguous.dtype.str,
+                               voxel_sizes)).encode())
+            cache_filename = os.path.join(
+                cache_dir, 'parcel_stats_{}.npz'.format(digest.hexdigest()))
+            if os.path.isfile(cache_filename):
+                return cls.load(cache_filename)
+
+        labels, inverse = np.unique(atlas_data, return_inverse=True)
+        inverse = inverse.reshape(atlas_data.shape)
+        nb_labels = len(labels)
+        voxel_counts = np.bincount(inverse.ravel(), minlength=nb_labels)
+
+        # A face is on the surface if the neighbor, on that side, has another
+        # label or is outside the volume (padded with -1).
+        surface_counts = np.zeros(nb_labels, dtype=np.int64)
+        for axis in range(3):
+            pad_width = [(0, 0)] * 3
+            pad_width[axis] = (1, 1)
+            padded = np.pad(inverse, pad_width, constant_values=-1)
+            before = np.take(padded, np.arange(padded.shape[axis] - 1),
+                             axis=axis)
+            after = np.take(padded, np.arange(1, padded.shape[axis]),
+                            axis=axis)
+            boundary = before != after
+            for side in [before, after]:
+                surface_counts += np.bincount(
+                    side[boundary & (side >= 0)], minlength=nb_labels)
+
+        centroids = np.zeros((nb_labels, 3))
+        for axis in range(3):
+            shape = [1, 1, 1]
+            shape[axis] = atlas_data.shape[axis]
+            coords = np.broadcast_to(
+                np.arange(atlas_data.shape[axis]).reshape(shape),
+                atlas_data.shape)
+            centroids[:, axis] = np.bincount(
+                inverse.ravel(), weights=coords.ravel(),
+                minlength=nb_labels) / voxel_counts
+
+        parcel_stats = cls(labels, voxel_counts, surface_counts, centroids,
+                           voxel_sizes)
+        if cache_filename is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Written then renamed, in case of concurrent runs.
+            fd, tmp_filename = tempfile.mkstemp(dir=cache_dir,
+                                                suffix='.npz')
+            with os.fdopen(fd, 'wb') as f:
+                parcel_stats.save(f)
+            os.replace(tmp_filename, cache_filename)
+
+        return parcel_stats
+
+    def save(self, filename):
+        """Save the statistics in a .npz file (or file object)."""
+        np.savez(filename, labels=self.labels,
+                 voxel_counts=self.voxel_counts,
+                 surface_counts=self.surface_counts,
+                 centroids=self.centroids,
+                 voxel_sizes=np.asarray(self.voxel_sizes))
+
+    @classmethod
+    def load(cls, filename):
+        """Load statistics saved with save()."""
+        with np.load(filename) as data:
+            return cls(data['labels'], data['voxel_counts'],
+                       data['surface_counts'], data['centroids'],
+                       data['voxel_sizes'])
+
+    def _get_indices(self, labels_list):
+        labels_list = np.asarray(labels_list)
+        indices = np.minimum(np.searchsorted(self.labels, labels_list),
+                             len(self.labels) - 1)
+        found = self.labels[indices] == labels_list
+        return indices, found
+
+    def get_volumes(self, labels_list):
+        """Volume (mm3) of each label of labels_list, 0 if absent."""
+        indices, found = self._get_indices(labels_list)
+        return np.where(found, self.voxel_counts[indices], 0) * \
+            np.prod(self.voxel_sizes)
+
+    def get_surfaces(self, labels_list):
+        """Surface (mm2) of each label of labels_list, 0 if absent."""
+        indices, found = self._get_indices(labels_list)
+        return np.where(found, self.surface_counts[indices], 0) * \
+            np.prod(self.voxel_sizes[:2])
+
+    def get_centroids(self, labels_list):
+        """Centroid (voxel space) of each label of labels_list, NaN if
+        absent."""
+        indices, found = self._get_indices(labels_list)
+        return np.where(found[:, None], self.centroids[indices], np.nan)
 
 
 def normalize_matrix_from_values(matrix, norm_factor, inverse):
@@ -184,73 +541,75 @@ def normalize_matrix_from_values(matrix, norm_factor, inverse):
     Parameters
     ----------
     matrix: np.ndarray
-        Connectivity matrix
-    norm_factor: np.ndarray of shape ?
+        Connectivity matrix (X, Y), or stack of matrices (N, X, Y).
+    norm_factor: np.ndarray of shape (X, Y) or (N, X, Y)
         Matrix used for edge-wise multiplication. Ex: length or volume of the
-        bundles.
+        bundles. The same (X, Y) matrix can be used for a whole stack.
     inverse: bool
         If true, divide by the matrix rather than multiply.
+
+    Returns
+    -------
+    matrix: np.ndarray
+        The normalized matrix. Edges where norm_factor is not positive are
+        unchanged.
     """
-    where_above0 = norm_factor > 0
+    norm_factor = np.where(norm_factor > 0, norm_factor, 1)
     if inverse:
-        matrix[where_above0] /= norm_factor[where_above0]
-    else:
-        matrix[where_above0] *= norm_factor[where_above0]
-    return matrix
+        return matrix / norm_factor
+    return matrix * norm_factor
 
 
 def normalize_matrix_from_parcel(matrix, atlas_img, labels_list,
-                                 parcel_from_volume):
+                                 parcel_from_volume, parcel_stats=None):
     """
     Parameters
     ----------
     matrix: np.ndarray
-        Connectivity matrix
+        Connectivity matrix (X, Y), or stack of matrices (N, X, Y) sharing
+        the same atlas.
     atlas_img: nib.Nifti1Image
-        Atlas for edge-wise division.
+        Atlas for edge-wise division. Can be None if parcel_stats is given.
     labels_list: np.ndarray
         The list of labels of interest for edge-wise division.
     parcel_from_volume: bool
         If true, parcel from volume. Else, parcel from surface.
+    parcel_stats: ParcelStatistics, optional
+        Precomputed statistics of the atlas. If None, they are computed from
+        atlas_img.
+
+    Returns
+    -------
+    matrix: np.ndarray
+        The normalized matrix.
     """
-    atlas_data = get_data_as_labels(atlas_img)
+    if parcel_stats is None:
+        parcel_stats = ParcelStatistics.from_atlas(atlas_img)
 
-    voxels_size = atlas_img.header.get_zooms()[:3]
+    voxels_size = parcel_stats.voxel_sizes
     if voxels_size[0] != voxels_size[1] \
             or voxels_size[0] != voxels_size[2]:
         raise ValueError('Atlas must have an isotropic resolution.')
 
-    voxels_vol = np.prod(atlas_img.header.get_zooms()[:3])
-    voxels_sur = np.prod(atlas_img.header.get_zooms()[:2])
-
-    if len(labels_list) != matrix.shape[0] \
-            and len(labels_list) != matrix.shape[1]:
+    if len(labels_list) != matrix.shape[-2] \
+            and len(labels_list) != matrix.shape[-1]:
         raise ValueError('labels_list should have the same number of label as '
                          'the input matrix.')
 
-    pos_list = range(len(labels_list))
-    all_comb = list(itertools.combinations(pos_list, r=2))
-    all_comb.extend(zip(pos_list, pos_list))
-
-    # Prevent useless computations for approximate_surface_node()
-    factor_list = []
-    for label in labels_list:
-        if parcel_from_volume:
-            factor_list.append(
-                np.count_nonzero(atlas_data == label) * voxels_vol)
-        else:
-            if np.count_nonzero(atlas_data == label):
-                roi = np.zeros(atlas_data.shape)
-                roi[atlas_data == label] = 1
-                factor_list.append(
-                    approximate_surface_node(roi) * voxels_sur)
-            else:
-                factor_list.append(0)
-
-    for pos_1, pos_2 in all_comb:
-        factor = factor_list[pos_1] + factor_list[pos_2]
-        if abs(factor) > 0.001:
-            matrix[pos_1, pos_2] /= factor
-            matrix[pos_2, pos_1] /= factor
-
-    return matrix
+    if parcel_from_volume:
+        factors = parcel_stats.get_volumes(labels_list)
+    else:
+        factors = parcel_stats.get_surfaces(labels_list)
+
+    # Edge-wise factor: sum of the two nodes
+    nb_labels = len(labels_list)
+    edge_factors = factors[:, None] + factors[None, :]
+    edge_factors[np.abs(edge_factors) <= 0.001] = 1
+    # toDo. The diagonal has always been divided twice by its factor. Kept
+    #  as is for reproducibility.
+    np.fill_diagonal(edge_factors, np.diag(edge_factors) ** 2)
+
+    divisor = np.ones(matrix.shape[-2:])
+    divisor[:nb_labels, :nb_labels] = edge_factors[:matrix.shape[-2],
+                                                   :matrix.shape[-1]]
+    return matrix / divisor
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+
+import h5py
+import nibabel as nib
+import numpy as np
+from dipy.io.stateful_tractogram import Origin, Space, StatefulTractogram
+from nibabel.streamlines import ArraySequence
+
+from scilpy.connectivity.connectivity import (
+    ConnectivityAccumulator,
+    compute_all_connectivity_matrices_from_hdf5,
+    compute_average_density_maps_from_hdf5,
+    compute_connectivity_matrices_from_hdf5,
+    compute_triu_connectivity_from_labels)
+from scilpy.io.hdf5 import (construct_hdf5_group_from_streamlines,
+                            reconstruct_streamlines_from_hdf5)
+from scilpy.tractanalysis.streamlines_metrics import compute_tract_counts_map
+
+tmp_dir = tempfile.TemporaryDirectory()
+
+
+def _create_hdf5(filename, labels_img, comb_list, seed=0):
+    rng = np.random.RandomState(seed)
+    with h5py.File(filename, 'w') as hdf5_file:
+        hdf5_file.attrs['affine'] = labels_img.affine
+        hdf5_file.attrs['dimensions'] = labels_img.shape
+        hdf5_file.attrs['voxel_sizes'] = [1, 1, 1]
+        hdf5_file.attrs['voxel_order'] = 'RAS'
+        for in_label, out_label in comb_list:
+            nb_streamlines = rng.randint(1, 10)
+            streamlines = ArraySequence(
+                [rng.uniform(1, 9, (rng.randint(2, 10), 3))
+                 for _ in range(nb_streamlines)])
+            group = hdf5_file.create_group('{}_{}'.format(in_label,
+                                                          out_label))
+            construct_hdf5_group_from_streamlines(
+                group, streamlines,
+                dps={'commit2_weights': rng.rand(nb_streamlines),
+                     'some_dps': rng.rand(nb_streamlines)})
+
+
+def test_compute_all_connectivity_matrices_from_hdf5():
+    labels_img = nib.Nifti1Image(np.zeros((10, 10, 10), dtype=np.uint16),
+                                 np.eye(4))
+    in_hdf5 = os.path.join(tmp_dir.name, 'decompose.h5')
+    _create_hdf5(in_hdf5, labels_img, [(1, 2), (1, 3), (2, 2), (3, 4)])
+
+    rng = np.random.RandomState(1)
+    metrics_data = [rng.rand(10, 10, 10), rng.rand(10, 10, 10)]
+    metrics_names = ['fa', 'md']
+    lesion_atlas = np.zeros((10, 10, 10), dtype=np.int32)
+    lesion_atlas[2:5, 2:5, 2:5] = 1
+    lesion_atlas[6:9, 6:9, 6:9] = 2
+    lesion_data = (np.array([1, 2]),
+                   nib.Nifti1Image(lesion_atlas, np.eye(4)))
+
+    # (1, 4) is not in the hdf5.
+    comb_list = [(1, 2), (1, 3), (1, 4), (2, 2), (3, 4)]
+    args = (True, True, True, None, metrics_data, metrics_names,
+            lesion_data, True, True, 0)
+    expected = [compute_connectivity_matrices_from_hdf5(
+        in_hdf5, labels_img, *comb, *args) for comb in comb_list]
+    expected = [it for it in expected if it is not None]
+    assert len(expected) == 4
+
+    for processes in [1, 2]:
+        outputs = compute_all_connectivity_matrices_from_hdf5(
+            in_hdf5, labels_img, comb_list, *args, processes=processes,
+            batch_size=1)
+        assert len(outputs) == len(expected)
+        assert [it[1] for it in outputs] == [it[1] for it in expected]
+        results = {}
+        for measures, _ in outputs:
+            results.update(measures)
+        for measures, _ in expected:
+            for node, values in measures.items():
+                assert results[node] == values
+
+
+def test_compute_triu_connectivity_from_labels():
+    # Non-contiguous labels: 0 (background), 2, 7.
+    data_labels = np.zeros((10, 10, 10), dtype=np.uint16)
+    data_labels[:3] = 2
+    data_labels[7:] = 7
+    img = nib.Nifti1Image(data_labels, np.eye(4))
+
+    # Streamlines (vox space, corner origin): 2-7, 7-2, 2-0, 7-7.
+    streamlines = [np.array([[1.5, 5, 5], [4, 5, 5], [8.5, 5, 5]]),
+                   np.array([[9.5, 1, 1], [1.2, 1, 1]]),
+                   np.array([[2.5, 5, 5], [5.5, 5, 5]]),
+                   np.array([[8.5, 1, 1], [9.5, 9, 9], [7.5, 9, 9]])]
+    sft = StatefulTractogram(streamlines, img, Space.VOX,
+                             origin=Origin.TRACKVIS)
+
+    expected = np.array([[0, 1, 0],
+                         [0, 0, 2],
+                         [0, 0, 1]])
+    matrix, ordered_labels, start_labels, end_labels = \
+        compute_triu_connectivity_from_labels(sft, data_labels,
+                                              keep_background=True)
+    assert np.array_equal(matrix, expected)
+    assert ordered_labels == [0, 2, 7]
+    assert np.array_equal(start_labels, [2, 2, 0, 7])
+    assert np.array_equal(end_labels, [7, 7, 2, 7])
+
+    # By chunks, in another space.
+    sft.to_rasmm()
+    sft.to_center()
+    chunks = (sft[i:i + 3] for i in range(0, len(sft), 3))
+    matrix, ordered_labels, start_labels, _ = \
+        compute_triu_connectivity_from_labels(chunks, data_labels)
+    assert np.array_equal(matrix, expected[1:, 1:])
+    assert ordered_labels == [2, 7]
+    assert start_labels is None
+
+
+def test_connectivity_accumulator():
+    data_labels = np.zeros((10, 10, 10), dtype=np.uint16)
+    data_labels[:3] = 2
+    data_labels[7:] = 7
+
+    # Streamlines (vox space, center origin): 2-7, 7-2, 2-0, 7-7.
+    streamlines = [np.array([[1., 4.5, 4.5], [3.5, 4.5, 4.5], [8., 4.5, 4.5]]),
+                   np.array([[9., 0.5, 0.5], [0.7, 0.5, 0.5]]),
+                   np.array([[2., 4.5, 4.5], [5., 4.5, 4.5]]),
+                   np.array([[8., 0.5, 0.5], [8., 0.5, 2.5]])]
+    expected, ordered_labels, _, _ = compute_triu_connectivity_from_labels(
+        streamlines, data_labels)
+
+    accumulator = ConnectivityAccumulator(data_labels, voxel_size=2.0,
+                                          buffer_size=3)
+    other = ConnectivityAccumulator(data_labels, voxel_size=2.0)
+    for streamline in streamlines[:3]:
+        accumulator.add_streamline(streamline)
+    other.add_streamline(streamlines[3])
+    accumulator.merge(other)
+
+    count_matrix, length_matrix, labels = accumulator.get_matrices()
+    assert np.array_equal(count_matrix, expected)
+    assert labels == ordered_labels
+    # Mean length (mm) of 2-7 (14mm and 16.6mm) and of 7-7 (4mm).
+    assert np.allclose(length_matrix, [[0, 15.3], [0, 4]])
+
+    count_matrix, _, labels = accumulator.get_matrices(keep_background=True)
+    assert labels == [0, 2, 7]
+    assert count_matrix[0, 1] == 1
+
+    accumulator.reset()
+    assert accumulator.get_matrices()[0].sum() == 0
+
+
+def test_compute_average_density_maps_from_hdf5():
+    labels_img = nib.Nifti1Image(np.zeros((10, 10, 10), dtype=np.uint16),
+                                 np.eye(4))
+    hdf5_filenames = [os.path.join(tmp_dir.name, 'avg_{}.h5'.format(i))
+                      for i in range(3)]
+    # (3, 4) is missing from the last file.
+    _create_hdf5(hdf5_filenames[0], labels_img, [(1, 2), (3, 4)], seed=0)
+    _create_hdf5(hdf5_filenames[1], labels_img, [(1, 2), (3, 4)], seed=1)
+    _create_hdf5(hdf5_filenames[2], labels_img, [(1, 2)], seed=2)
+
+    for binary in [False, True]:
+        average_maps, affine, dimensions = \
+            compute_average_density_maps_from_hdf5(
+                hdf5_filenames, ['1_2', '3_4'], binary)
+        assert np.array_equal(affine, np.eye(4))
+        assert sorted(average_maps.keys()) == ['1_2', '3_4']
+
+        for key, (indices, values) in average_maps.items():
+            expected = np.zeros(dimensions, dtype=np.float32)
+            for hdf5_filename in hdf5_filenames:
+                with h5py.File(hdf5_filename, 'r') as hdf5_file:
+                    if key not in hdf5_file:
+                        continue
+                    density = compute_tract_counts_map(
+                        reconstruct_streamlines_from_hdf5(hdf5_file[key]),
+                        dimensions)
+                if binary:
+                    expected[density > 0] += 1
+                else:
+                    expected += density / np.max(density)
+            expected /= len(hdf5_filenames)
+
+            density_data = np.zeros(dimensions, dtype=np.float32)
+            density_data.flat[indices] = values
+            assert np.allclose(density_data, expected)
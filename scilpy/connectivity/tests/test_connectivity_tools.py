@@ -1,12 +1,68 @@
 # -*- coding: utf-8 -*-
+import os
+import tempfile
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from scilpy.connectivity.matrix_tools import (
+    GRAPH_MEASURES, ParcelStatistics, apply_olo, apply_reordering, compute_olo,
+    evaluate_graph_measures, evaluate_graph_measures_batch, load_matrix_stack,
+    normalize_matrix_from_parcel, normalize_matrix_from_values, scale_matrix)
+from scilpy.tractanalysis.reproducibility_measures import \
+    approximate_surface_node
+
+tmp_dir = tempfile.TemporaryDirectory()
+
+
+def _get_matrix(seed=0, size=8):
+    rng = np.random.RandomState(seed)
+    matrix = rng.rand(size, size)
+    return matrix + matrix.T
+
+
+def test_load_matrix_stack():
+    matrices = [_get_matrix(i) for i in range(3)]
+    filenames = [os.path.join(tmp_dir.name, 'm0.npy'),
+                 os.path.join(tmp_dir.name, 'm1.txt'),
+                 os.path.join(tmp_dir.name, 'm2.npy')]
+    np.save(filenames[0], matrices[0])
+    np.savetxt(filenames[1], matrices[1])
+    np.save(filenames[2], np.stack(matrices[1:]))
+
+    stack = load_matrix_stack(filenames)
+    assert stack.shape == (4, 8, 8)
+    assert np.allclose(stack, np.stack(matrices[:2] + matrices[1:]))
+
+    out_filename = os.path.join(tmp_dir.name, 'stack.npy')
+    load_matrix_stack(filenames, out_filename)
+    assert np.array_equal(np.load(out_filename), stack)
 
 
 def test_compute_olo():
-    pass
+    matrix = _get_matrix()
+    perm = compute_olo(matrix)
+    assert np.array_equal(np.sort(perm), np.arange(8))
+
+    cache_dir = os.path.join(tmp_dir.name, 'olo_cache')
+    assert np.array_equal(compute_olo(matrix, cache_dir=cache_dir), perm)
+    assert len(os.listdir(cache_dir)) == 1
+    # Second call: loaded from the cache.
+    assert np.array_equal(compute_olo(matrix, cache_dir=cache_dir), perm)
+    compute_olo(matrix * 2, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
 
 
 def test_apply_olo():
-    pass
+    matrix = _get_matrix()
+    perm = np.array([3, 1, 0, 2, 7, 6, 5, 4])
+    reordered = apply_olo(matrix, perm)
+    assert np.array_equal(reordered, matrix[perm].T[perm])
+
+    stack = apply_olo(np.stack([matrix, matrix.T * 2]), perm)
+    assert np.array_equal(stack[0], reordered)
+    assert np.array_equal(stack[1], (matrix.T * 2)[perm].T[perm])
 
 
 def test_parse_ordering():
@@ -14,16 +70,123 @@ def test_parse_ordering():
 
 
 def test_apply_reordering():
-    pass
+    matrix = _get_matrix()
+    ordering = [[3, 1, 1, 5], [0, 2, 7]]
+    reordered = apply_reordering(matrix, ordering)
+    assert reordered.shape == (4, 3)
+    assert reordered[1, 2] == matrix[1, 7]
+
+    stack = apply_reordering(np.stack([matrix, matrix * 2]), ordering)
+    assert np.array_equal(stack[1], reordered * 2)
 
 
 def test_evaluate_graph_measures():
-    pass
+    conn_matrix = _get_matrix(size=10)
+    conn_matrix[conn_matrix < 1] = 0
+    np.fill_diagonal(conn_matrix, 0)
+    len_matrix = conn_matrix * 10
+
+    gtm_dict = evaluate_graph_measures(conn_matrix, len_matrix, True, False)
+    assert sorted(gtm_dict.keys()) == sorted(GRAPH_MEASURES)
+
+    subset = evaluate_graph_measures(conn_matrix, len_matrix, True, False,
+                                     measures=['participation', 'density'])
+    assert sorted(subset.keys()) == ['density', 'participation']
+    for key, value in subset.items():
+        assert np.allclose(value, gtm_dict[key])
+
+    with pytest.raises(ValueError):
+        evaluate_graph_measures(conn_matrix, len_matrix, True, False,
+                                measures=['unknown'])
+
+    # Sequential and spawned sub-processes.
+    for nbr_processes in [1, 2]:
+        batch = evaluate_graph_measures_batch(
+            [conn_matrix, conn_matrix * 2], [len_matrix, len_matrix], False,
+            False, measures=['nodal_strength'], nbr_processes=nbr_processes)
+        assert np.allclose(batch[1]['nodal_strength'],
+                           np.array(batch[0]['nodal_strength']) * 2)
 
 
 def test_normalize_matrix_from_values():
-    pass
+    matrix = _get_matrix()
+    length = _get_matrix(1)
+    length[0, 1] = 0
+    normalized = normalize_matrix_from_values(matrix, length, inverse=True)
+    assert normalized[0, 1] == matrix[0, 1]
+    assert np.isclose(normalized[2, 3], matrix[2, 3] / length[2, 3])
+
+    # A stack, with the same length matrix for all.
+    stack = normalize_matrix_from_values(np.stack([matrix, matrix]), length,
+                                         inverse=False)
+    assert np.allclose(stack[1], normalize_matrix_from_values(
+        matrix, length, inverse=False))
 
 
 def test_normalize_matrix_from_parcel():
-    pass
+    atlas = np.zeros((10, 10, 10), dtype=np.int16)
+    atlas[:2] = 1
+    atlas[3:5] = 2
+    atlas[6:9, :5] = 5
+    atlas_img = nib.Nifti1Image(atlas, np.diag([2., 2., 2., 1.]))
+    labels_list = np.array([1, 2, 3, 5])
+    matrix = _get_matrix(size=4)
+
+    normalized = normalize_matrix_from_parcel(matrix, atlas_img, labels_list,
+                                              parcel_from_volume=True)
+    # Volumes (mm3) of labels 1 and 5: 1600 and 1200. Label 3 is empty.
+    assert np.isclose(normalized[0, 3], matrix[0, 3] / 2800)
+    assert np.isclose(normalized[2, 3], matrix[2, 3] / 1200)
+    assert np.isclose(normalized[0, 0], matrix[0, 0] / 3200 ** 2)
+
+    stack = normalize_matrix_from_parcel(np.stack([matrix, matrix]),
+                                         atlas_img, labels_list,
+                                         parcel_from_volume=True)
+    assert np.allclose(stack[1], normalized)
+
+    parcel_stats = ParcelStatistics.from_atlas(atlas_img)
+    normalized = normalize_matrix_from_parcel(matrix, atlas_img, labels_list,
+                                              parcel_from_volume=False)
+    assert np.allclose(normalize_matrix_from_parcel(
+        matrix, None, labels_list, parcel_from_volume=False,
+        parcel_stats=parcel_stats), normalized)
+
+
+def test_parcel_statistics():
+    atlas = np.zeros((10, 10, 10), dtype=np.int16)
+    atlas[:2] = 1
+    atlas[3:5, 2:4, 2:4] = 2
+    atlas[9, 9, 9] = 7
+    atlas_img = nib.Nifti1Image(atlas, np.diag([2., 2., 2., 1.]))
+
+    parcel_stats = ParcelStatistics.from_atlas(atlas_img)
+    assert np.array_equal(parcel_stats.get_volumes([2, 7, 3]), [64, 8, 0])
+    # As approximate_surface_node: faces not shared with the same label.
+    expected = [approximate_surface_node((atlas == label).astype(float))
+                for label in [1, 2, 7]]
+    assert np.array_equal(parcel_stats.get_surfaces([1, 2, 7]),
+                          np.array(expected) * 4)
+    centroids = parcel_stats.get_centroids([2, 3])
+    assert np.allclose(centroids[0], [3.5, 2.5, 2.5])
+    assert np.isnan(centroids[1]).all()
+
+    cache_dir = os.path.join(tmp_dir.name, 'parcel_cache')
+    ParcelStatistics.from_atlas(atlas_img, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+    cached = ParcelStatistics.from_atlas(atlas_img, cache_dir=cache_dir)
+    assert np.array_equal(cached.surface_counts, parcel_stats.surface_counts)
+    assert cached.voxel_sizes == parcel_stats.voxel_sizes
+
+
+def test_scale_matrix():
+    matrix = _get_matrix()
+    matrix[0, 0] = 0
+    stack = np.stack([matrix, matrix * 3])
+    assert np.allclose(np.max(scale_matrix(stack, 'max_at_one'),
+                              axis=(1, 2)), 1)
+    assert np.allclose(np.sum(scale_matrix(stack, 'sum_to_one'),
+                              axis=(1, 2)), 1)
+    log_matrix = scale_matrix(matrix, 'log_10')
+    # As in scil_connectivity_math.py, zeros are set to -65536.
+    assert log_matrix[0, 0] == -65536
+    assert np.isclose(log_matrix[1, 2], np.log10(matrix[1, 2]))
@@ -11,6 +11,7 @@ from scilpy.tractograms.streamline_operations import \
 from dipy.core.interpolation import trilinear_interpolate4d, \
     nearestneighbor_interpolate
 from dipy.io.stateful_tractogram import Origin, Space
+from scipy.ndimage import map_coordinates
 
 
 class DataVolume(object):
@@ -101,6 +102,68 @@ class DataVolume(object):
             raise NotImplementedError("We have not prepared the DataVolume to "
                                       "work in RASMM space yet.")
 
+    def get_values_at_coordinates(self, coords, space, origin):
+        """
+        Vectorized version of get_value_at_coordinate: get the voxel values at
+        many coordinates at once. Coordinates must be in the given space and
+        origin.
+
+        If the coordinates are out of bound, the nearest voxel value is taken.
+
+        Parameters
+        ----------
+        coords: np.ndarray (N, 3)
+            Coordinates of the points.
+        space: dipy Space
+            'vox' or 'voxmm'.
+        origin: dipy Origin
+            'corner' or 'center'.
+
+        Return
+        ------
+        values: ndarray (N, self.dim[-1])
+            The values evaluated at each coordinate. Contrary to
+            get_value_at_coordinate, the last dimension is never squeezed.
+        """
+        if self.interpolation is None:
+            raise Exception("No interpolation method was given, cannot run "
+                            "this method..")
+
+        coords = np.asarray(coords, dtype=np.float64).reshape((-1, 3))
+        if space == Space.VOXMM:
+            coords = coords / np.asarray(self.voxres[:3], dtype=np.float64)
+        elif space != Space.VOX:
+            raise NotImplementedError("We have not prepared the DataVolume to "
+                                      "work in RASMM space yet.")
+
+        # Clipping out of bound coordinates, as in _clip_vox_to_bound, then
+        # working in origin center, as dipy's interpolation functions.
+        eps = float(1e-8)
+        upper = np.asarray(self.dim[0:3], dtype=np.float64) - eps
+        if origin == Origin('corner'):
+            coords = np.clip(coords, 0, upper) - 0.5
+        elif origin == Origin('center'):
+            coords = np.clip(coords, -0.5, upper - 0.5)
+        else:
+            raise ValueError("Origin should be 'center' or 'corner'.")
+
+        if self.interpolation == 'nearest':
+            # Equivalent to dipy's nearestneighbor_interpolate.
+            idx = np.round(coords).astype(int)
+            idx = np.clip(idx, 0, np.asarray(self.dim[0:3]) - 1)
+            return np.asarray(self.data[idx[:, 0], idx[:, 1], idx[:, 2]],
+                              dtype=np.float64)
+
+        # Trilinear. Equivalent to dipy's trilinear_interpolate4d: at the
+        # borders (between the last voxel center and the border), the value
+        # of the last voxel is used, i.e. mode='nearest'.
+        values = np.zeros((len(coords), self.dim[3]))
+        for i in range(self.dim[3]):
+            values[:, i] = map_coordinates(self.data[..., i], coords.T,
+                                           order=1, mode='nearest',
+                                           output=np.float64)
+        return values
+
     def is_idx_in_bound(self, i, j, k):
         """
         Test if voxel is in dataset range.
@@ -441,6 +504,11 @@ class FibertubeDataVolume(DataVolume):
             raise NotImplementedError("We have not prepared the DataVolume "
                                       "to work in RASMM space yet.")
 
+    def get_values_at_coordinates(self, coords, space, origin):
+        values = [self.get_value_at_coordinate(x, y, z, space, origin)
+                  for x, y, z in coords]
+        return np.asarray(values).reshape((len(values), -1))
+
     def is_idx_in_bound(self, i, j, k):
         return super().is_idx_in_bound(i, j, k)
 
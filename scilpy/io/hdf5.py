@@ -3,12 +3,19 @@
 import logging
 
 from dipy.io.stateful_tractogram import StatefulTractogram, Space, Origin
-import nibabel as nib
 from dipy.io.utils import create_nifti_header
+from dipy.utils.optpkg import optional_package
 from nibabel.streamlines.array_sequence import ArraySequence
 import numpy as np
 
-from scilpy.io.streamlines import reconstruct_streamlines
+from scilpy.io.utils import HDF5_COMPRESSION_CHOICES
+from scilpy.tractograms.streamline_operations import (
+    array_sequence_from_flat, get_compact_data)
+
+hdf5plugin, have_hdf5plugin, _ = optional_package('hdf5plugin')
+
+# Keys of a streamline group that are not data_per_streamline.
+STREAMLINES_KEYS = ['data', 'offsets', 'lengths', 'data_per_point']
 
 
 def reconstruct_sft_from_hdf5(hdf5_handle, group_keys, space=Space.VOX,
@@ -78,68 +85,79 @@ def reconstruct_sft_from_hdf5(hdf5_handle, group_keys, space=Space.VOX,
     groups_len = []
     streamlines = []
     dps = []
-    for i, group_key in enumerate(group_keys):
+    dpp = []
+    for group_key in group_keys:
         # Get streamlines
+        group_dps = {}
+        group_dpp = {}
         if group_key not in hdf5_handle:
             if allow_empty:
-                tmp_streamlines = []
+                tmp_streamlines = ArraySequence()
             else:
                 raise ValueError("Group key {} not found in the hdf5. "
                                  "Possible choices: {}"
                                  .format(group_key, list(hdf5_handle.keys())))
         else:
             # If key exists, tmp_streamlines should not be empty.
-            tmp_streamlines = reconstruct_streamlines_from_hdf5(
-                hdf5_handle[group_key])
-
-        if merge_groups:
-            streamlines.extend(tmp_streamlines)
-            groups_len.append(len(tmp_streamlines))
-        else:
-            streamlines.append(tmp_streamlines)
-
-        # Load dps / dpp
-        if i == 0 or not merge_groups:
-            dps.append({})
-        if len(tmp_streamlines) > 0:
-            for sub_key in hdf5_handle[group_key].keys():
-                if sub_key not in ['data', 'offsets', 'lengths']:
-                    data = hdf5_handle[group_key][sub_key]
-                    if data.shape == hdf5_handle[group_key]['offsets'].shape:
-                        # Discovered dps
-                        if load_dps:
-                            if i == 0 or not merge_groups:
-                                dps[i][sub_key] = data
-                            else:
-                                dps[i][sub_key] = np.concatenate(
-                                    (dps[i][sub_key], data))
-                    else:
-                        if load_dpp:
-                            raise NotImplementedError(
-                                "Don't know how to load dpp yet.")
-                        raise NotImplementedError("DPP data? Other?")
+            group = hdf5_handle[group_key]
+            tmp_streamlines = reconstruct_streamlines_from_hdf5(group)
+
+            # Load dps / dpp
+            if len(tmp_streamlines) > 0:
+                if load_dps:
+                    for sub_key in group.keys():
+                        if sub_key not in STREAMLINES_KEYS:
+                            group_dps[sub_key] = group[sub_key][()]
+                if load_dpp and 'data_per_point' in group:
+                    for sub_key in group['data_per_point'].keys():
+                        group_dpp[sub_key] = array_sequence_from_flat(
+                            group['data_per_point'][sub_key][()],
+                            tmp_streamlines._lengths)
+
+        groups_len.append(len(tmp_streamlines))
+        streamlines.append(tmp_streamlines)
+        dps.append(group_dps)
+        dpp.append(group_dpp)
 
-    # 3) Format as SFT
     if merge_groups:
-        if len(streamlines) == 0 and not allow_empty:
+        # Groups without streamlines have no dps / dpp.
+        non_empty = [i for i, n in enumerate(groups_len) if n > 0]
+        streamlines = [_concatenate_array_sequences(streamlines)]
+        dps = [{key: np.concatenate([dps[i][key] for i in non_empty])
+                for key in set().union(*dps)}]
+        dpp = [{key: _concatenate_array_sequences([dpp[i][key]
+                                                   for i in non_empty])
+                for key in set().union(*dpp)}]
+
+        if len(streamlines[0]) == 0 and not allow_empty:
             raise ValueError("Cannot load an empty tractogram from HDF5. Set "
                              "`allow_empty` to True if you want to force it.")
-        sft = StatefulTractogram(streamlines, header, space=space,
-                                 origin=origin, data_per_streamline=dps[0])
-        return sft, groups_len
-    else:
-        sfts = []
-        for (sub_streamlines, sub_dps) in zip(streamlines, dps):
-            if len(streamlines) == 0 and not allow_empty:
-                raise ValueError("Cannot load an empty tractogram from HDF5. "
-                                 "Set `allow_empty` to True if you want to "
-                                 "force it.")
-            else:
-                sfts.append(
-                    StatefulTractogram(sub_streamlines, header, space=space,
+
+    # 3) Format as SFT
+    sfts = []
+    for (sub_streamlines, sub_dps, sub_dpp) in zip(streamlines, dps, dpp):
+        sfts.append(StatefulTractogram(sub_streamlines, header, space=space,
                                        origin=origin,
-                                       data_per_streamline=sub_dps))
-        return sfts, groups_len
+                                       data_per_streamline=sub_dps,
+                                       data_per_point=sub_dpp))
+    if merge_groups:
+        return sfts[0], groups_len
+    return sfts, groups_len
+
+
+def _concatenate_array_sequences(sequences):
+    """
+    Concatenates ArraySequences (streamlines or dpp) with a single copy of
+    their data.
+    """
+    sequences = [seq for seq in sequences if len(seq) > 0]
+    if len(sequences) == 0:
+        return ArraySequence()
+    if len(sequences) == 1:
+        return sequences[0]
+    data = np.concatenate([get_compact_data(seq) for seq in sequences])
+    lengths = np.concatenate([seq._lengths for seq in sequences])
+    return array_sequence_from_flat(data, lengths)
 
 
 def assert_header_compatible_hdf5(hdf5_handle, ref):
@@ -171,6 +189,8 @@ def reconstruct_streamlines_from_hdf5(hdf5_group):
     """
     Function to reconstruct streamlines from hdf5, mainly to facilitate
     decomposition into thousands of connections and decrease I/O usage.
+    The ArraySequence is built directly on the data read from the hdf5,
+    without splitting it into individual streamlines.
 
     Parameters
     ----------
@@ -179,21 +199,69 @@ def reconstruct_streamlines_from_hdf5(hdf5_group):
 
     Returns
     -------
-    streamlines : list of np.ndarray
-        List of streamlines.
+    streamlines : ArraySequence
+        The streamlines.
     """
     if 'data' not in hdf5_group:
         raise ValueError("Expecting data in bundle's group.")
 
-    data = np.array(hdf5_group['data']).flatten()
-    offsets = np.array(hdf5_group['offsets'])
-    lengths = np.array(hdf5_group['lengths'])
+    streamlines = ArraySequence()
+    streamlines._data = np.asarray(hdf5_group['data'][()],
+                                   dtype=np.float32).reshape((-1, 3))
+    streamlines._offsets = np.asarray(hdf5_group['offsets'][()],
+                                      dtype=np.intp)
+    streamlines._lengths = np.asarray(hdf5_group['lengths'][()],
+                                      dtype=np.intp)
 
-    return reconstruct_streamlines(data, offsets, lengths)
+    return streamlines
+
+
+def get_hdf5_dataset_options(compression=None, compression_level=None):
+    """
+    Returns the keyword arguments to give to h5py's create_dataset to store
+    chunked (and optionally compressed) datasets.
+
+    Parameters
+    ----------
+    compression: str or None
+        One of 'gzip', 'lzf' or 'blosc'. If None, datasets are chunked but
+        not compressed. Blosc requires the optional hdf5plugin package (and
+        the plugin to read the file back).
+    compression_level: int or None
+        Compression level (0-9) for gzip and blosc. Not used for lzf. If
+        None, uses 4 for gzip and 5 for blosc.
+
+    Returns
+    -------
+    options: dict
+    """
+    options = {'chunks': True}
+    if compression is None:
+        return options
+
+    if compression == 'gzip':
+        options.update({'compression': 'gzip',
+                        'compression_opts': 4 if compression_level is None
+                        else compression_level,
+                        'shuffle': True})
+    elif compression == 'lzf':
+        options.update({'compression': 'lzf', 'shuffle': True})
+    elif compression == 'blosc':
+        if not have_hdf5plugin:
+            raise ImportError("Blosc compression requires the hdf5plugin "
+                              "package.")
+        options.update(hdf5plugin.Blosc(
+            cname='lz4', clevel=5 if compression_level is None
+            else compression_level, shuffle=hdf5plugin.Blosc.SHUFFLE))
+    else:
+        raise ValueError("Unknown compression {}. Choices are {}."
+                         .format(compression, HDF5_COMPRESSION_CHOICES))
+    return options
 
 
 def construct_hdf5_from_sft(hdf5_handle, sfts, groups_keys='streamlines',
-                            save_dps=False, save_dpp=False):
+                            save_dps=False, save_dpp=False, compression=None,
+                            compression_level=None):
     """
     Create a hdf5 from a SFT.
 
@@ -208,6 +276,10 @@ def construct_hdf5_from_sft(hdf5_handle, sfts, groups_keys='streamlines',
         If True, save the DPS keys to hdf5.
     save_dpp: bool
         If True, save the DPP keys to hdf5.
+    compression: str or None
+        See get_hdf5_dataset_options.
+    compression_level: int or None
+        See get_hdf5_dataset_options.
     """
     if isinstance(sfts, StatefulTractogram):
         sfts = [sfts]
@@ -227,7 +299,8 @@ def construct_hdf5_from_sft(hdf5_handle, sfts, groups_keys='streamlines',
         construct_hdf5_group_from_streamlines(
             group, sft.streamlines,
             sft.data_per_streamline if save_dps else None,
-            sft.data_per_point if save_dpp else None)
+            sft.data_per_point if save_dpp else None,
+            compression=compression, compression_level=compression_level)
 
 
 def construct_hdf5_header(hdf5_handle, ref_sft):
@@ -240,10 +313,17 @@ def construct_hdf5_header(hdf5_handle, ref_sft):
 
 
 def construct_hdf5_group_from_streamlines(hdf5_group, streamlines,
-                                          dps=None, dpp=None):
+                                          dps=None, dpp=None,
+                                          compression=None,
+                                          compression_level=None):
     """
     Create a hdf5 group from streamlines.
 
+    The streamlines are stored as chunked datasets 'data', 'offsets' and
+    'lengths'. The data_per_streamline are stored as datasets next to them,
+    and the data_per_point in a sub-group 'data_per_point', with the same
+    layout as 'data'.
+
     Parameters
     ----------
     hdf5_group: h5py.group
@@ -254,23 +334,40 @@ def construct_hdf5_group_from_streamlines(hdf5_group, streamlines,
         The data_per_streamline
     dpp: dict or None
         The data_per_point
+    compression: str or None
+        See get_hdf5_dataset_options.
+    compression_level: int or None
+        See get_hdf5_dataset_options.
     """
-    hdf5_group.create_dataset('data', data=streamlines.get_data(),
-                              dtype=np.float32)
-    hdf5_group.create_dataset('offsets', data=streamlines.copy()._offsets,
-                              dtype=np.int64)
-    hdf5_group.create_dataset('lengths', data=streamlines.copy()._lengths,
-                              dtype=np.int32)
+    options = get_hdf5_dataset_options(compression, compression_level)
+    if not isinstance(streamlines, ArraySequence):
+        streamlines = ArraySequence(streamlines)
+
+    # Only copying the data if the sequence is not already compact (ex, if
+    # it is a view on a sliced tractogram).
+    lengths = np.asarray(streamlines._lengths, dtype=np.int32)
+    offsets = np.cumsum(lengths, dtype=np.int64) - lengths
+    hdf5_group.create_dataset('data', data=get_compact_data(streamlines),
+                              dtype=np.float32, **options)
+    hdf5_group.create_dataset('offsets', data=offsets, dtype=np.int64,
+                              **options)
+    hdf5_group.create_dataset('lengths', data=lengths, dtype=np.int32,
+                              **options)
     if dps is not None:
         for dps_key, dps_value in dps.items():
-            if dps_key not in ['data', 'offsets', 'lengths']:
+            if dps_key not in STREAMLINES_KEYS:
                 hdf5_group.create_dataset(dps_key, data=dps_value,
-                                          dtype=np.float32)
+                                          dtype=np.float32, **options)
             else:
                 raise ValueError("Please do not use data_per_streamline keys "
-                                 "'data', 'offsets' or 'lengths', this "
-                                 "causes unclear management in the hdf5.")
-
-    if dpp is not None:
-        raise NotImplementedError(
-            "NOT IMPLEMENTED: Cannot save data_per_point in the hdf5 yet.")
+                                 "{}, this causes unclear management in the "
+                                 "hdf5.".format(STREAMLINES_KEYS))
+
+    if dpp is not None and len(dpp) > 0:
+        dpp_group = hdf5_group.create_group('data_per_point')
+        for dpp_key, dpp_value in dpp.items():
+            if not isinstance(dpp_value, ArraySequence):
+                dpp_value = ArraySequence(dpp_value)
+            dpp_group.create_dataset(dpp_key,
+                                     data=get_compact_data(dpp_value),
+                                     dtype=np.float32, **options)
@@ -1,18 +1,27 @@
 # -*- coding: utf-8 -*-
 
 from itertools import islice
+import json
 import logging
 import os
+import struct
 import tempfile
 
+from dipy.io.stateful_tractogram import Origin, Space, StatefulTractogram
 from dipy.io.streamline import load_tractogram
 from dipy.io.streamline import save_tractogram as _save_tractogram
 from dipy.io.utils import is_header_compatible
 import nibabel as nib
-from nibabel.streamlines.array_sequence import ArraySequence
 import numpy as np
 
 from scilpy.io.utils import load_matrix_in_any_format
+from scilpy.tractograms.streamline_operations import (
+    array_sequence_from_flat, iter_compact_data)
+
+# Scilpy's native tractogram format (see save_sft_cache).
+SFT_CACHE_EXTENSION = '.sft'
+_SFT_CACHE_MAGIC = b'SCILSFT1'
+_SFT_CACHE_ALIGNMENT = 64
 
 
 def check_tracts_same_format(parser, tractogram_1, tractogram_2):
@@ -84,7 +93,14 @@ def load_tractogram_with_reference(parser, args, filepath, arg_name=None):
         bbox_check = True
 
     _, ext = os.path.splitext(filepath)
-    if ext == '.trk':
+    if ext == SFT_CACHE_EXTENSION:
+        if (is_argument_set(args, 'reference') or
+                arg_name and args.__getattribute__(arg_name + '_ref')):
+            logging.warning('Reference is discarded for this file format '
+                            '{}.'.format(filepath))
+        sft = load_sft_cache(filepath, bbox_valid_check=bbox_check)
+
+    elif ext == '.trk':
         if (is_argument_set(args, 'reference') or
                 arg_name and args.__getattribute__(arg_name + '_ref')):
             logging.warning('Reference is discarded for this file format '
@@ -127,7 +143,160 @@ def save_tractogram(sft, filename, no_empty, bbox_valid_check=True):
         if len(sft.streamlines) == 0:
             logging.info("Writing an empty file (0 streamlines): {} "
                          .format(filename))
-        _save_tractogram(sft, filename, bbox_valid_check=bbox_valid_check)
+        if os.path.splitext(filename)[1] == SFT_CACHE_EXTENSION:
+            save_sft_cache(sft, filename, bbox_valid_check=bbox_valid_check)
+        else:
+            _save_tractogram(sft, filename,
+                             bbox_valid_check=bbox_valid_check)
+
+
+def _align(position):
+    return -(-position // _SFT_CACHE_ALIGNMENT) * _SFT_CACHE_ALIGNMENT
+
+
+def save_sft_cache(sft, filename, dtype=np.float32, bbox_valid_check=True):
+    """
+    Saves a StatefulTractogram in scilpy's native format (.sft): a small
+    JSON header (reference, space, origin, and the description of each
+    array), followed by the raw arrays: the flat points, offsets, lengths,
+    and one column per data_per_streamline and data_per_point key.
+
+    The streamlines are saved in their current space and origin, so that
+    loading the file requires no decoding and no space conversion. Every
+    array can be memory-mapped, see load_sft_cache.
+
+    Parameters
+    ----------
+    sft: StatefulTractogram
+        The tractogram to save.
+    filename: str
+        Output filename (.sft).
+    dtype: np.dtype
+        Type of the points. Either float32 or float16 (half the size, but
+        with a precision of ~0.01 voxel or mm).
+    bbox_valid_check: bool
+        If True, verifies that all streamlines are in the bounding box.
+    """
+    if bbox_valid_check and not sft.is_bbox_in_vox_valid():
+        raise ValueError("Bounding box is not valid in voxel space, cannot "
+                         "save a valid file if some coordinates are "
+                         "invalid.")
+
+    streamlines = sft.streamlines
+    lengths = np.asarray(streamlines._lengths, dtype=np.int64)
+    arrays = {'offsets': np.cumsum(lengths) - lengths,
+              'lengths': lengths}
+    for key, value in sft.data_per_streamline.items():
+        arrays['dps/' + key] = np.asarray(value)
+
+    # Points and dpp are written in chunks, to avoid copying them in memory
+    # (they can be sliced views or memory-mapped, see load_dpp_files_as_dpp).
+    sequences = {'data': (streamlines, np.dtype(dtype))}
+    for key, value in sft.data_per_point.items():
+        sequences['dpp/' + key] = (value, value._data.dtype)
+
+    # Positions are relative to the first aligned byte after the header.
+    position = 0
+    description = {}
+    for name, (seq, seq_dtype) in sequences.items():
+        shape = (int(seq.total_nb_rows),) + seq._data.shape[1:]
+        description[name] = {'dtype': seq_dtype.str,
+                             'shape': list(shape),
+                             'offset': position}
+        position = _align(position + int(np.prod(shape)) * seq_dtype.itemsize)
+    for name, array in arrays.items():
+        description[name] = {'dtype': array.dtype.str,
+                             'shape': list(array.shape),
+                             'offset': position}
+        position = _align(position + array.nbytes)
+
+    affine, dimensions, voxel_sizes, voxel_order = sft.space_attributes
+    header = json.dumps({'affine': np.asarray(affine).tolist(),
+                         'dimensions': np.asarray(dimensions).tolist(),
+                         'voxel_sizes': np.asarray(voxel_sizes).tolist(),
+                         'voxel_order': str(voxel_order),
+                         'space': sft.space.value,
+                         'origin': sft.origin.value,
+                         'arrays': description}).encode('utf-8')
+    data_start = _align(len(_SFT_CACHE_MAGIC) + 8 + len(header))
+
+    with open(filename, 'wb') as f:
+        f.write(_SFT_CACHE_MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for name, (seq, seq_dtype) in sequences.items():
+            f.seek(data_start + description[name]['offset'])
+            for data in iter_compact_data(seq):
+                np.ascontiguousarray(data, dtype=seq_dtype).tofile(f)
+        for name, array in arrays.items():
+            f.seek(data_start + description[name]['offset'])
+            np.ascontiguousarray(array).tofile(f)
+        f.truncate(data_start + position)
+
+
+def load_sft_cache(filename, bbox_valid_check=True):
+    """
+    Loads a StatefulTractogram saved with save_sft_cache. The arrays are
+    memory-mapped in copy-on-write mode, so modifying the tractogram (ex,
+    changing its space) never modifies the file. The points and the
+    data_per_streamline are read at once (StatefulTractogram copies them),
+    while the data_per_point are only read when needed.
+
+    Parameters
+    ----------
+    filename: str
+        Input filename (.sft).
+    bbox_valid_check: bool
+        If True, verifies that all streamlines are in the bounding box.
+
+    Returns
+    -------
+    sft: StatefulTractogram
+        The tractogram, in the space and origin in which it was saved.
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(_SFT_CACHE_MAGIC)) != _SFT_CACHE_MAGIC:
+            raise IOError('{} is not a valid {} file.'
+                          .format(filename, SFT_CACHE_EXTENSION))
+        header_length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    data_start = _align(len(_SFT_CACHE_MAGIC) + 8 + header_length)
+
+    arrays = {}
+    for name, description in header['arrays'].items():
+        shape = tuple(description['shape'])
+        if np.prod(shape) == 0:
+            arrays[name] = np.zeros(shape, dtype=description['dtype'])
+        else:
+            arrays[name] = np.memmap(
+                filename, dtype=description['dtype'], mode='c',
+                offset=data_start + description['offset'], shape=shape)
+
+    streamlines = array_sequence_from_flat(
+        arrays['data'].astype(np.float32, copy=False), arrays['lengths'])
+    streamlines._offsets = np.asarray(arrays['offsets'], dtype=np.intp)
+    dps = {name[len('dps/'):]: array for name, array in arrays.items()
+           if name.startswith('dps/')}
+    dpp = {name[len('dpp/'):]: array_sequence_from_flat(array,
+                                                        arrays['lengths'])
+           for name, array in arrays.items() if name.startswith('dpp/')}
+
+    space_attributes = (np.array(header['affine'], dtype=np.float32),
+                        np.array(header['dimensions'], dtype=np.int16),
+                        np.array(header['voxel_sizes'], dtype=np.float32),
+                        header['voxel_order'])
+    sft = StatefulTractogram(streamlines, space_attributes,
+                             Space(header['space']),
+                             origin=Origin(header['origin']),
+                             data_per_point=dpp,
+                             data_per_streamline=dps)
+    if bbox_valid_check and not sft.is_bbox_in_vox_valid():
+        raise ValueError("Bounding box is not valid in voxel space, cannot "
+                         "load a valid file if some coordinates are invalid."
+                         "\nPlease set bbox_valid_check to False and then "
+                         "use the function remove_invalid_streamlines to "
+                         "discard invalid streamlines.")
+    return sft
 
 
 def verify_compatibility_with_reference_sft(ref_sft, files_to_verify,
@@ -178,7 +347,7 @@ def load_dps_files_as_dps(parser, dps_files, sft, keys=None, overwrite=False):
     ----------
     parser: parser
     dps_files: list[str]
-        Either .npy or .txt files.
+        Either .npy or .txt files. Npy files are memory-mapped.
     sft: StatefulTractogram
     keys: list[str]
         If None, use the filenames as keys.
@@ -209,7 +378,7 @@ def load_dps_files_as_dps(parser, dps_files, sft, keys=None, overwrite=False):
                          "You must allow overwriting keys."
                          .format(key))
 
-        data = np.squeeze(load_matrix_in_any_format(file))
+        data = np.squeeze(_load_data_file(file))
         if len(data) != len(sft):
             parser.error('Wrong dps size in file {}. Expected one value per '
                          'streamline ({}) but got {} values!'
@@ -228,7 +397,8 @@ def load_dpp_files_as_dpp(parser, dpp_files, sft, keys=None, overwrite=False):
     ----------
     parser: parser
     dpp_files: list[str]
-        Either .npy or .txt files.
+        Either .npy or .txt files, with one row per point. Npy files are
+        memory-mapped: the values are only read when accessed.
     sft: StatefulTractogram
     keys: list[str]
         If None, use the filenames as keys.
@@ -254,21 +424,36 @@ def load_dpp_files_as_dpp(parser, dpp_files, sft, keys=None, overwrite=False):
         else:
             key = keys[i]
 
-        if key in sft.data_per_streamline and not overwrite:
+        if key in sft.data_per_point and not overwrite:
             parser.error("Key {} already exists in your tractogram's dpp. "
                          "You must allow overwriting keys."
                          .format(key))
 
-        data = np.squeeze(load_matrix_in_any_format(file))
-        if len(data) != len(sft.streamlines._data):
+        data = np.squeeze(_load_data_file(file))
+        nb_points = sft.streamlines.total_nb_rows
+        if len(data) != nb_points:
             parser.error('Wrong dpp size in file {}. Expected one value per '
                          'point in your tractogram ({}) but got {}!'
-                         .format(file, len(sft.streamlines._data), len(data)))
+                         .format(file, nb_points, len(data)))
+        if data.ndim == 1:
+            data = data[:, None]
         new_keys.append(key)
-        sft.data_per_point[key] = data
+
+        # Attaching the flat (possibly memory-mapped) buffer directly: the
+        # values are only read from disk when accessed.
+        sft.data_per_point[key] = array_sequence_from_flat(
+            data, sft.streamlines._lengths)
     return sft, new_keys
 
 
+def _load_data_file(filename):
+    """Loads a dps or dpp file. Npy files are memory-mapped (copy-on-write),
+    other formats are read in memory."""
+    if os.path.splitext(filename)[1] == '.npy':
+        return np.load(filename, mmap_mode='c')
+    return load_matrix_in_any_format(filename)
+
+
 def streamlines_to_memmap(input_streamlines,
                           strs_dtype='float32'):
     """
@@ -333,6 +518,9 @@ def reconstruct_streamlines(data, offsets, lengths, indices=None):
     Function to reconstruct streamlines from its data, offsets and lengths
     (from the nibabel tractogram object).
 
+    The points of the requested streamlines are gathered with a single
+    fancy-indexed copy, so only the required rows are read from a memmap.
+
     Parameters
     ----------
     data : np.ndarray
@@ -346,19 +534,24 @@ def reconstruct_streamlines(data, offsets, lengths, indices=None):
 
     Returns
     -------
-    streamlines : list of np.ndarray
-        List of streamlines.
+    streamlines : ArraySequence
+        The streamlines.
     """
-
-    if data.ndim == 2:
-        data = np.array(data).flatten()
-
-    if indices is None:
-        indices = np.arange(len(offsets))
-
-    streamlines = []
-    for i in indices:
-        streamline = data[offsets[i]*3:offsets[i]*3 + lengths[i]*3]
-        streamlines.append(streamline.reshape((lengths[i], 3)))
-
-    return ArraySequence(streamlines)
+    if not isinstance(data, np.ndarray):
+        # Ex: a h5py dataset.
+        data = np.asarray(data)
+    data = data.reshape((-1, 3))
+    offsets = np.asarray(offsets, dtype=np.intp)
+    lengths = np.asarray(lengths, dtype=np.intp)
+
+    if indices is not None:
+        indices = np.asarray(indices, dtype=np.intp)
+        offsets = offsets[indices]
+        lengths = lengths[indices]
+
+    # Row of each point in data: start of its streamline + its position.
+    new_offsets = np.cumsum(lengths) - lengths
+    rows = np.repeat(offsets - new_offsets, lengths) + \
+        np.arange(np.sum(lengths), dtype=np.intp)
+
+    return array_sequence_from_flat(np.asarray(data[rows]), lengths)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import argparse
+import os
+import tempfile
+
+import nibabel as nib
+import numpy as np
+from dipy.io.stateful_tractogram import Origin, Space, StatefulTractogram
+
+from scilpy.io.streamlines import (load_dpp_files_as_dpp, load_sft_cache,
+                                   save_sft_cache)
+
+tmp_dir = tempfile.TemporaryDirectory()
+
+
+def _get_sft(nb_streamlines=6):
+    rng = np.random.RandomState(0)
+    img = nib.Nifti1Image(np.zeros((10, 10, 10), dtype=np.uint8),
+                          np.diag([2., 2., 2., 1.]))
+    streamlines = [rng.uniform(1, 9, (rng.randint(2, 8), 3))
+                   for _ in range(nb_streamlines)]
+    dpp = {'color': [rng.rand(len(s), 3).astype(np.float32)
+                     for s in streamlines]}
+    dps = {'weight': rng.rand(nb_streamlines, 1),
+           'cluster': np.arange(nb_streamlines)[:, None]}
+    return StatefulTractogram(streamlines, img, Space.VOX,
+                              origin=Origin.TRACKVIS, data_per_point=dpp,
+                              data_per_streamline=dps)
+
+
+def _assert_sft_equal(sft, loaded):
+    assert loaded.space == sft.space
+    assert loaded.origin == sft.origin
+    assert np.allclose(loaded.affine, sft.affine)
+    assert np.array_equal(loaded.dimensions, sft.dimensions)
+    assert len(loaded) == len(sft)
+    for s, loaded_s in zip(sft.streamlines, loaded.streamlines):
+        assert np.allclose(s, loaded_s)
+    assert sorted(loaded.data_per_point.keys()) == \
+        sorted(sft.data_per_point.keys())
+    for key in sft.data_per_point.keys():
+        for d, loaded_d in zip(sft.data_per_point[key],
+                               loaded.data_per_point[key]):
+            assert np.array_equal(d, loaded_d)
+    assert sorted(loaded.data_per_streamline.keys()) == \
+        sorted(sft.data_per_streamline.keys())
+    for key in sft.data_per_streamline.keys():
+        assert np.array_equal(loaded.data_per_streamline[key],
+                              sft.data_per_streamline[key])
+
+
+def test_sft_cache_roundtrip():
+    sft = _get_sft()
+    filename = os.path.join(tmp_dir.name, 'roundtrip.sft')
+    save_sft_cache(sft, filename)
+    _assert_sft_equal(sft, load_sft_cache(filename))
+
+    # Saved in the current space and origin.
+    sft.to_rasmm()
+    sft.to_center()
+    save_sft_cache(sft, filename)
+    loaded = load_sft_cache(filename)
+    assert loaded.space == Space.RASMM
+    assert loaded.origin == Origin.NIFTI
+    _assert_sft_equal(sft, loaded)
+
+
+def test_sft_cache_sliced_and_empty():
+    # Sliced (non-compact) input: only the selected points are saved.
+    sft = _get_sft()[[4, 0, 2]]
+    filename = os.path.join(tmp_dir.name, 'sliced.sft')
+    save_sft_cache(sft, filename)
+    loaded = load_sft_cache(filename)
+    _assert_sft_equal(sft, loaded)
+    assert len(loaded.streamlines.get_data()) == \
+        sft.streamlines.total_nb_rows
+
+    empty = _get_sft()[[]]
+    filename = os.path.join(tmp_dir.name, 'empty.sft')
+    save_sft_cache(empty, filename)
+    loaded = load_sft_cache(filename)
+    assert len(loaded) == 0
+    assert sorted(loaded.data_per_point.keys()) == ['color']
+
+
+def test_sft_cache_copy_on_write():
+    sft = _get_sft()
+    filename = os.path.join(tmp_dir.name, 'cow.sft')
+    save_sft_cache(sft, filename)
+    with open(filename, 'rb') as f:
+        content = f.read()
+
+    loaded = load_sft_cache(filename)
+    assert isinstance(loaded.data_per_point['color']._data, np.memmap)
+    loaded.streamlines._data[:] += 1
+    loaded.data_per_streamline['weight'][:] = 0
+    loaded.data_per_point['color']._data[:] = 0
+    loaded.to_rasmm()
+
+    with open(filename, 'rb') as f:
+        assert f.read() == content
+    _assert_sft_equal(sft, load_sft_cache(filename))
+
+
+def test_load_dpp_files_as_dpp_memmap():
+    sft = _get_sft()
+    nb_points = sft.streamlines.total_nb_rows
+    values = np.arange(nb_points, dtype=np.float32)
+    filename = os.path.join(tmp_dir.name, 'dpp_values.npy')
+    np.save(filename, values)
+
+    sft, new_keys = load_dpp_files_as_dpp(argparse.ArgumentParser(),
+                                          [filename], sft)
+    assert new_keys == ['dpp_values']
+
+    # Attached without being read: the buffer is still the memmap.
+    dpp = sft.data_per_point['dpp_values']
+    assert isinstance(dpp._data, np.memmap)
+    assert dpp._data.shape == (nb_points, 1)
+
+    # Aligned with the streamlines, point by point.
+    assert np.array_equal(dpp._offsets, sft.streamlines._offsets)
+    assert np.array_equal(dpp._lengths, sft.streamlines._lengths)
+    start = 0
+    for s, d in zip(sft.streamlines, dpp):
+        assert len(d) == len(s)
+        assert np.array_equal(np.squeeze(d, axis=1),
+                              values[start:start + len(s)])
+        start += len(s)
+
+    # Copy-on-write: modifying the dpp does not modify the file.
+    dpp._data[:] = -1
+    assert np.array_equal(np.load(filename), values)
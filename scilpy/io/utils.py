@@ -23,6 +23,7 @@ from scilpy.utils.spatial import RAS_AXES_NAMES
 
 
 FLOATING_POINTS_PRECISION = 12
+HDF5_COMPRESSION_CHOICES = ['gzip', 'lzf', 'blosc']
 
 eddy_options = ["mb", "mb_offs", "slspec", "mporder", "s2v_lambda", "field",
                 "field_mat", "flm", "slm", "fwhm", "niter", "s2v_niter",
@@ -183,11 +184,21 @@ def add_json_args(parser):
                     help='Sort keys in output json.')
 
 
-def add_processes_arg(parser):
+def add_processes_arg(parser, threads=False):
+    """
+    Parameters
+    ----------
+    parser: ArgumentParser
+        Parser
+    threads: bool
+        If True, the value is used as a number of threads rather than a
+        number of sub-processes. Only changes the help message.
+    """
     parser.add_argument('--processes', dest='nbr_processes',
                         metavar='NBR', type=int, default=1,
-                        help='Number of sub-processes to start. \n'
-                             'Default: [%(default)s]')
+                        help='Number of {} to start. \n'
+                             'Default: [%(default)s]'
+                        .format('threads' if threads else 'sub-processes'))
 
 
 def add_reference_arg(parser, arg_name=None):
@@ -694,6 +705,22 @@ def add_compression_arg(p, additional_msg=''):
                         + additional_msg + '[%(const)s]')
 
 
+def add_hdf5_compression_args(p):
+    """
+    Parameters
+    ----------
+    p: ArgumentParser
+        Parser
+    """
+    g = p.add_argument_group('HDF5 storage options')
+    g.add_argument('--hdf5_compression', choices=HDF5_COMPRESSION_CHOICES,
+                   help='Compression of the hdf5 datasets. Datasets are '
+                        'always chunked. \nBlosc requires the hdf5plugin '
+                        'package, to write and to read the file.')
+    g.add_argument('--hdf5_compression_level', type=ranged_type(int, 0, 9),
+                   help='Compression level for gzip [4] and blosc [5].')
+
+
 def verify_compression_th(compress_th):
     """
     Verify that the compression threshold is between 0.001 and 1. Else,
@@ -925,8 +952,8 @@ def assert_roi_radii_format(parser):
 def assert_headers_compatible(parser, required, optional=None, reference=None):
     """
     Verifies the compatibility between the first item in the required argument
-    and the remaining ones, as well as with those in optional. If any .tck
-    is present, a reference must be provided.
+    and the remaining ones, as well as with those in optional. If any .tck,
+    .fib, .vtk or .dpy is present, a reference must be provided.
 
     Arguments
     ---------
@@ -937,7 +964,7 @@ def assert_headers_compatible(parser, required, optional=None, reference=None):
     optional: str or List[str or None], optional
         List of files. May contain None, they will be discarted.
     reference: str, optional
-        Reference for any .tck passed.
+        Reference for any .tck, .fib, .vtk or .dpy passed.
     """
     all_valid = True
 
@@ -963,10 +990,10 @@ def assert_headers_compatible(parser, required, optional=None, reference=None):
     files = []
     for filepath in list_files:
         _, in_extension = split_name_with_nii(filepath)
-        if in_extension in ['.trk', '.nii', '.nii.gz']:
+        if in_extension in ['.trk', '.trx', '.nii', '.nii.gz']:
             headers.append(filepath)
             files.append(filepath)
-        elif in_extension == '.tck':
+        elif in_extension in ['.tck', '.fib', '.vtk', '.dpy']:
             if reference is None:
                 parser.error(
                     '{} must be provided with a reference.'.format(filepath))
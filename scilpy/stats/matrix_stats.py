@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import itertools
+import json
 import logging
+import os
+import tempfile
 
 import bct
 
@@ -11,49 +15,146 @@ from statsmodels.stats.multitest import multipletests
 from scilpy.tractanalysis.reproducibility_measures import compute_dice_voxel
 
 
-def _ttest_stat_only(x, y, tail):
-    t = np.mean(x) - np.mean(y)
-    n1, n2 = len(x), len(y)
-    s = np.sqrt(((n1 - 1) * np.var(x, ddof=1) + (n2 - 1)
-                 * np.var(y, ddof=1)) / (n1 + n2 - 2))
-    denom = s * np.sqrt(1 / n1 + 1 / n2)
-    if denom == 0:
-        return 0
+def _orient_stat(t, tail):
     if tail == 'both':
-        return np.abs(t / denom)
+        return np.abs(t)
     if tail == 'left':
-        return -t / denom
-    else:
-        return t / denom
+        return -t
+    return t
+
+
+def _ttest_stat_only(x, y, tail):
+    """
+    Two-sample t statistic, computed along the last axis, so that all edges
+    can be tested at once (x: (..., n1), y: (..., n2)). Edges with a null
+    variance get a statistic of 0.
+    """
+    n1, n2 = x.shape[-1], y.shape[-1]
+    t = np.mean(x, axis=-1) - np.mean(y, axis=-1)
+    s = np.sqrt(((n1 - 1) * np.var(x, axis=-1, ddof=1) + (n2 - 1)
+                 * np.var(y, axis=-1, ddof=1)) / (n1 + n2 - 2))
+    denom = s * np.sqrt(1 / n1 + 1 / n2)
+    t = np.divide(t, denom, out=np.zeros_like(t), where=denom != 0)
+    return _orient_stat(t, tail)
 
 
 def _ttest_paired_stat_only(x, y, tail):
-    n = len(x - y)
-    sample_ss = np.sum((x - y)**2) - np.sum(x - y)**2 / n
+    """
+    Paired t statistic, computed along the last axis (x, y: (..., n)).
+    """
+    diff = x - y
+    n = diff.shape[-1]
+    sample_ss = np.sum(diff**2, axis=-1) - np.sum(diff, axis=-1)**2 / n
     unbiased_std = np.sqrt(sample_ss / (n - 1))
 
-    z = np.mean(x - y) / unbiased_std
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.mean(diff, axis=-1) / unbiased_std
     t = z * np.sqrt(n)
-    if tail == 'both':
-        return np.abs(t)
-    if tail == 'left':
-        return -t
+    return _orient_stat(t, tail)
+
+
+def _ttest_batch_stat(data, design, nb_g1, paired, tail):
+    """
+    T statistics of many relabelings of the data at once.
+
+    Parameters
+    ----------
+    data: np.ndarray of shape (nb_edges, nb_observations)
+        Unpaired: both groups, concatenated and centered per edge.
+        Paired: the differences g1 - g2.
+    design: np.ndarray of shape (nb_observations, nb_relabelings)
+        Unpaired: 1 for the observations assigned to g1, else 0.
+        Paired: the sign (+1 or -1) given to each difference.
+    nb_g1: int
+        Number of observations in g1 (unpaired only).
+
+    Returns
+    -------
+    t: np.ndarray of shape (nb_edges, nb_relabelings)
+    """
+    nb_obs = data.shape[1]
+    sum_sq = np.sum(data**2, axis=1)[:, None]
+    sum_design = data @ design
+    if paired:
+        sample_ss = sum_sq - sum_design**2 / nb_obs
+        # Rounding errors of the one-pass formula
+        sample_ss[sample_ss <= 1e-12 * sum_sq] = 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = sum_design / np.sqrt(sample_ss * nb_obs / (nb_obs - 1))
+        t = np.nan_to_num(t, nan=0.0, posinf=np.inf, neginf=-np.inf)
     else:
-        return t
+        nb_g2 = nb_obs - nb_g1
+        sum_g1 = sum_design
+        sum_g2 = np.sum(data, axis=1)[:, None] - sum_g1
+        sum_sq_g1 = data**2 @ design
+        sum_sq_g2 = sum_sq - sum_sq_g1
+        sample_ss = sum_sq_g1 - sum_g1**2 / nb_g1 + \
+            sum_sq_g2 - sum_g2**2 / nb_g2
+        sample_ss[sample_ss <= 1e-12 * sum_sq] = 0
+        denom = np.sqrt(sample_ss / (nb_obs - 2) * (1 / nb_g1 + 1 / nb_g2))
+        t = sum_g1 / nb_g1 - sum_g2 / nb_g2
+        t = np.divide(t, denom, out=np.zeros_like(t), where=denom != 0)
+    return _orient_stat(t, tail)
+
+
+def _ttest_permutation_pval(matrices_g1, matrices_g2, paired, tail,
+                            nb_permutations, batch_size, rng):
+    """
+    P-values of a permutation test, for all edges (rows) at once. Group
+    labels (or, for a paired test, the signs of the differences) are
+    shuffled batch_size permutations at a time.
+
+    The fraction of permutations with a statistic at least as extreme as the
+    observed one is halved, to follow the convention of the parametric test
+    of ttest_two_matrices (sf(|t|) for 'both', sf(t) / 2 for 'left' and
+    'right'). Both methods thus give comparable p-values.
+    """
+    nb_g1 = matrices_g1.shape[1]
+    if paired:
+        data = matrices_g1 - matrices_g2
+        identity = np.ones((data.shape[1], 1))
+    else:
+        data = np.hstack((matrices_g1, matrices_g2))
+        # The t statistic is invariant to a shift of both groups. Centering
+        # reduces the rounding errors of the one-pass variance.
+        data = data - np.mean(data, axis=1, keepdims=True)
+        identity = np.zeros((data.shape[1], 1))
+        identity[:nb_g1] = 1
+    nb_obs = data.shape[1]
+
+    observed = _ttest_batch_stat(data, identity, nb_g1, paired, tail)
+    nb_greater = np.zeros(len(data), dtype=np.int64)
+    for start in range(0, nb_permutations, batch_size):
+        nb_batch = min(batch_size, nb_permutations - start)
+        if paired:
+            design = rng.choice([-1.0, 1.0], size=(nb_obs, nb_batch))
+        else:
+            design = np.zeros((nb_obs, nb_batch))
+            for i in range(nb_batch):
+                design[rng.permutation(nb_obs)[:nb_g1], i] = 1
+        stats = _ttest_batch_stat(data, design, nb_g1, paired, tail)
+        nb_greater += np.count_nonzero(
+            (stats >= observed) |
+            np.isclose(stats, observed, rtol=1e-9, atol=1e-12), axis=1)
+
+    return (nb_greater + 1) / (nb_permutations + 1) / 2.0
 
 
 def ttest_two_matrices(matrices_g1, matrices_g2, paired, tail, fdr,
-                       bonferroni):
+                       bonferroni, nb_permutations=0, batch_size=100,
+                       rng_seed=None):
     """
     Parameters
     ----------
-    matrices_g1: np.ndarray of shape ?  (toDO)
-    matrices_g2: np.ndarray of shape ?
+    matrices_g1: np.ndarray of shape (N, N, nb_subjects_g1)
+    matrices_g2: np.ndarray of shape (N, N, nb_subjects_g2)
     paired: bool
         Use paired sample t-test instead of population t-test. The two matrices
         must be ordered the same way.
     tail: str.
-        One of ['left', 'right', 'both'].
+        One of ['left', 'right', 'both']. Note that the p-values are half
+        those of the usual convention: sf(|t|) for 'both' (instead of
+        2 * sf(|t|)) and sf(t) / 2 for 'left' and 'right'.
     fdr: bool
         Perform a false discovery rate (FDR) correction for the p-values. Uses
         the number of non-zero edges as number of tests (value between 0.01 and
@@ -61,20 +162,37 @@ def ttest_two_matrices(matrices_g1, matrices_g2, paired, tail, fdr,
     bonferroni: bool
         Perform a Bonferroni correction for the p-values. Uses the number of
         non-zero edges as number of tests.
+    nb_permutations: int
+        If > 0, p-values are obtained from a permutation test (group labels
+        are shuffled, or the signs of the differences for a paired test)
+        instead of the Student t distribution. They follow the same
+        convention as the parametric p-values (see tail).
+    batch_size: int
+        Number of permutations evaluated at once. Memory usage is roughly
+        nb_edges x batch_size x 8 bytes, a few times over.
+    rng_seed: int
+        Seed of the permutations.
+
+    Returns
+    -------
+    matrix_pval: np.ndarray of shape (N, N)
+        P-values. Edges without data in both groups are set to -0.000001.
     """
     matrix_shape = matrices_g1.shape[0:2]
     nb_group_g1 = matrices_g1.shape[2]
     nb_group_g2 = matrices_g2.shape[2]
 
-    # Todo better reshape, more simple
-    sum_both_groups = np.sum(matrices_g1, axis=2) + np.sum(matrices_g2, axis=2)
-    nbr_non_zeros = np.count_nonzero(np.triu(sum_both_groups))
+    matrices_g1 = matrices_g1.reshape((np.prod(matrix_shape), nb_group_g1))
+    matrices_g2 = matrices_g2.reshape((np.prod(matrix_shape), nb_group_g2))
 
+    # Skip edges with no data, leaves a negative epsilon instead
+    non_empty = np.any(matrices_g1, axis=1) | np.any(matrices_g2, axis=1)
+    nbr_non_zeros = np.count_nonzero(np.triu(non_empty.reshape(matrix_shape)))
     logging.info('The provided matrices contain {} non zeros elements.'
                  .format(nbr_non_zeros))
+    matrices_g1 = matrices_g1[non_empty]
+    matrices_g2 = matrices_g2[non_empty]
 
-    matrices_g1 = matrices_g1.reshape((np.prod(matrix_shape), nb_group_g1))
-    matrices_g2 = matrices_g2.reshape((np.prod(matrix_shape), nb_group_g2))
     # Negative epsilon, to differentiate from null p-values
     matrix_pval = np.ones(np.prod(matrix_shape)) * -0.000001
 
@@ -85,52 +203,75 @@ def ttest_two_matrices(matrices_g1, matrices_g2, paired, tail, fdr,
                  .format(matrix_shape[0], matrix_shape[1],
                           nb_group_g1, nb_group_g2))
 
-    # For conversion to p-values
-    if paired:
-        dof = nb_group_g1 - 1
+    if nb_permutations > 0:
+        logging.info('Using {} permutations.'.format(nb_permutations))
+        rng = np.random.RandomState(rng_seed)
+        matrix_pval[non_empty] = _ttest_permutation_pval(
+            matrices_g1, matrices_g2, paired, tail, nb_permutations,
+            batch_size, rng)
     else:
-        dof = nb_group_g1 + nb_group_g2 - 2
-
-    for ind in range(np.prod(matrix_shape)):
-        # Skip edges with no data, leaves a negative epsilon instead
-        if not matrices_g1[ind].any() and not matrices_g2[ind].any():
-            continue
-
+        # For conversion to p-values
         if paired:
-            t_stat = (_ttest_paired_stat_only(
-                matrices_g1[ind], matrices_g2[ind], tail))
+            dof = nb_group_g1 - 1
+            t_stat = _ttest_paired_stat_only(matrices_g1, matrices_g2, tail)
         else:
-            t_stat = _ttest_stat_only(
-                matrices_g1[ind], matrices_g2[ind], tail)
+            dof = nb_group_g1 + nb_group_g2 - 2
+            t_stat = _ttest_stat_only(matrices_g1, matrices_g2, tail)
 
         pval = stats_t.sf(t_stat, dof)
-        matrix_pval[ind] = pval if tail == 'both' else pval / 2.0
+        matrix_pval[non_empty] = pval if tail == 'both' else pval / 2.0
 
-    corr_matrix_pval = matrix_pval.reshape(matrix_shape)
-    if fdr:
-        logging.info('Using FDR, the results will be q-values.')
-        corr_matrix_pval = np.triu(corr_matrix_pval)
+    matrix_pval = matrix_pval.reshape(matrix_shape)
+    if fdr or bonferroni:
+        if fdr:
+            logging.info('Using FDR, the results will be q-values.')
+        corr_matrix_pval = np.triu(matrix_pval)
         corr_matrix_pval[corr_matrix_pval > 0] = multipletests(
-            corr_matrix_pval[corr_matrix_pval > 0], 0, method='fdr_bh')[1]
+            corr_matrix_pval[corr_matrix_pval > 0], 0,
+            method='fdr_bh' if fdr else 'bonferroni')[1]
 
         # Symmetrize  the matrix
         matrix_pval = corr_matrix_pval + corr_matrix_pval.T - \
             np.diag(corr_matrix_pval.diagonal())
-    elif bonferroni:
-        corr_matrix_pval = np.triu(corr_matrix_pval)
-        corr_matrix_pval[corr_matrix_pval > 0] = multipletests(
-            corr_matrix_pval[corr_matrix_pval > 0], 0, method='bonferroni')[1]
-
-        # Symmetrize  the matrix
-        matrix_pval = corr_matrix_pval + corr_matrix_pval.T - \
-            np.diag(corr_matrix_pval.diagonal())
-    else:
-        matrix_pval = matrix_pval.reshape(matrix_shape)
 
     return matrix_pval
 
 
-def omega_sigma(matrix):
+def _get_null_networks_cache_filename(matrix, nb_iterations, seed,
+                                      cache_dir):
+    # The reference networks are rewirings of the matrix itself: the key
+    # must identify its content, not only its size and density.
+    matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+    digest = hashlib.sha1(matrix.tobytes())
+    digest.update(str((matrix.shape, nb_iterations, seed)).encode())
+    density = bct.density_und(matrix)[0]
+    return os.path.join(cache_dir, 'null_networks_{}_{:.4f}_{}_{}.json'.format(
+        matrix.shape[0], density, seed, digest.hexdigest()[:16]))
+
+
+def _compute_null_networks_measures(matrix, nb_iterations, seed):
+    # Without a seed, the global random state is used, as in bct.
+    rng = None if seed is None else np.random.RandomState(seed)
+    transitivity_rand_list = []
+    transitivity_latt_list = []
+    path_length_rand_list = []
+    for i in range(nb_iterations):
+        logging.info('Generating random and lattice matrices, '
+                     'iteration #{}.'.format(i))
+        random = bct.randmio_und(matrix, 10, seed=rng)[0]
+        lattice = bct.latmio_und(matrix, 10, seed=rng)[1]
+
+        transitivity_rand_list.append(bct.transitivity_wu(random))
+        transitivity_latt_list.append(bct.transitivity_wu(lattice))
+        path_length_rand_list.append(
+            float(np.average(bct.distance_wei(random)[0])))
+
+    return {'transitivity_rand': float(np.mean(transitivity_rand_list)),
+            'transitivity_latt': float(np.mean(transitivity_latt_list)),
+            'path_length_rand': float(np.mean(path_length_rand_list))}
+
+
+def omega_sigma(matrix, nb_iterations=10, seed=None, cache_dir=None):
     """Returns the small-world coefficients (omega & sigma) of a graph.
     Omega ranges between -1 and 1. Values close to 0 mean the matrix
     features small-world characteristics.
@@ -143,6 +284,14 @@ def omega_sigma(matrix):
     ----------
     matrix : numpy.ndarray
         A weighted undirected graph.
+    nb_iterations : int
+        Number of random and lattice reference networks.
+    seed : int, optional
+        Seed of the rewiring of the reference networks.
+    cache_dir : str, optional
+        Directory where the measures of the reference networks are saved,
+        to be reused when the same matrix is evaluated again with the same
+        seed (for instance, in a cohort re-run). Requires a seed.
     Returns
     -------
     smallworld : tuple of float
@@ -157,25 +306,36 @@ def omega_sigma(matrix):
            Brain Connectivity. 1 (0038): 367-75.  PMC 3604768. PMID 22432451.
            doi:10.1089/brain.2011.0038.
     """
-    transitivity_rand_list = []
-    transitivity_latt_list = []
-    path_length_rand_list = []
-    for i in range(10):
-        logging.info('Generating random and lattice matrices, '
-                     'iteration #{}.'.format(i))
-        random = bct.randmio_und(matrix, 10)[0]
-        lattice = bct.latmio_und(matrix, 10)[1]
-
-        transitivity_rand_list.append(bct.transitivity_wu(random))
-        transitivity_latt_list.append(bct.transitivity_wu(lattice))
-        path_length_rand_list.append(
-            float(np.average(bct.distance_wei(random)[0])))
+    if cache_dir is not None and seed is None:
+        raise ValueError('Caching the reference networks requires a seed.')
+
+    null_measures = None
+    if cache_dir is not None:
+        cache_filename = _get_null_networks_cache_filename(
+            matrix, nb_iterations, seed, cache_dir)
+        if os.path.isfile(cache_filename):
+            logging.info('Using cached reference networks {}.'
+                         .format(cache_filename))
+            with open(cache_filename) as f:
+                null_measures = json.load(f)
+
+    if null_measures is None:
+        null_measures = _compute_null_networks_measures(matrix, nb_iterations,
+                                                        seed)
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Written then renamed, in case of concurrent runs.
+            fd, tmp_filename = tempfile.mkstemp(dir=cache_dir,
+                                                suffix='.json')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(null_measures, f)
+            os.replace(tmp_filename, cache_filename)
 
     transitivity = bct.transitivity_wu(matrix)
     path_length = float(np.average(bct.distance_wei(matrix)[0]))
-    transitivity_rand = np.mean(transitivity_rand_list)
-    transitivity_latt = np.mean(transitivity_latt_list)
-    path_length_rand = np.mean(path_length_rand_list)
+    transitivity_rand = null_measures['transitivity_rand']
+    transitivity_latt = null_measures['transitivity_latt']
+    path_length_rand = null_measures['path_length_rand']
 
     omega = (path_length_rand / path_length) - \
         (transitivity / transitivity_latt)
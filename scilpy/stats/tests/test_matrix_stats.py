@@ -1,10 +1,99 @@
 # -*- coding: utf-8 -*-
+import os
+import tempfile
+
+import numpy as np
+import pytest
+from scipy.stats import ttest_ind, ttest_rel
+
+from scilpy.stats.matrix_stats import omega_sigma, ttest_two_matrices
+
+
+def _get_matrices(nb_subjects=6):
+    rng = np.random.RandomState(0)
+    matrices_g1 = rng.rand(5, 5, nb_subjects)
+    matrices_g2 = rng.rand(5, 5, nb_subjects) + 0.5
+    # No data for an edge: skipped.
+    matrices_g1[0, 1] = 0
+    matrices_g2[0, 1] = 0
+    return matrices_g1, matrices_g2
 
 
 def test_ttest_two_matrices():
-    # toDo
-    pass
+    matrices_g1, matrices_g2 = _get_matrices()
+
+    for paired, scipy_test in [(False, ttest_ind), (True, ttest_rel)]:
+        matrix_pval = ttest_two_matrices(matrices_g1, matrices_g2, paired,
+                                         'both', False, False)
+        assert matrix_pval.shape == (5, 5)
+        assert matrix_pval[0, 1] < 0
+
+        # Same statistic as scipy, but one-sided p-values for 'both'.
+        expected = scipy_test(matrices_g1[2, 3], matrices_g2[2, 3]).pvalue
+        assert np.isclose(matrix_pval[2, 3], expected / 2)
+
+        matrix_qval = ttest_two_matrices(matrices_g1, matrices_g2, paired,
+                                         'both', True, False)
+        triu = np.triu(matrix_pval) > 0
+        assert np.all(matrix_qval[triu] >= matrix_pval[triu])
+        assert np.allclose(matrix_qval, matrix_qval.T)
+
+
+def test_ttest_two_matrices_permutations():
+    matrices_g1, matrices_g2 = _get_matrices()
+
+    for paired in [False, True]:
+        matrix_pval = ttest_two_matrices(
+            matrices_g1, matrices_g2, paired, 'left', False, False,
+            nb_permutations=200, batch_size=30, rng_seed=0)
+        assert matrix_pval[0, 1] < 0
+        valid = matrix_pval > 0
+        assert np.all(matrix_pval[valid] >= 1 / 402)
+        assert np.all(matrix_pval[valid] <= 1)
+        # Mean of g1 is lower: the left hypothesis is supported.
+        assert np.median(matrix_pval[valid]) < 0.05
+
+        # Reproducible with the same seed.
+        assert np.array_equal(matrix_pval, ttest_two_matrices(
+            matrices_g1, matrices_g2, paired, 'left', False, False,
+            nb_permutations=200, batch_size=30, rng_seed=0))
+
+
+def test_ttest_two_matrices_permutations_convention():
+    rng = np.random.RandomState(0)
+    matrices_g1 = rng.rand(5, 5, 8)
+    matrices_g2 = rng.rand(5, 5, 8) + 0.3
+
+    # Same convention as the parametric p-values, for all tails.
+    for paired in [False, True]:
+        for tail in ['left', 'right', 'both']:
+            expected = ttest_two_matrices(matrices_g1, matrices_g2, paired,
+                                          tail, False, False)
+            matrix_pval = ttest_two_matrices(
+                matrices_g1, matrices_g2, paired, tail, False, False,
+                nb_permutations=5000, batch_size=500, rng_seed=0)
+            assert np.allclose(matrix_pval, expected, atol=0.05)
 
 
 def test_omega_sigma():
-    pass
+    rng = np.random.RandomState(0)
+    matrix = rng.rand(12, 12)
+    matrix[matrix < 0.6] = 0
+    matrix = matrix + matrix.T
+    np.fill_diagonal(matrix, 0)
+
+    expected = omega_sigma(matrix, nb_iterations=2, seed=0)
+    assert np.allclose(omega_sigma(matrix, nb_iterations=2, seed=0),
+                       expected)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        assert np.allclose(omega_sigma(matrix, nb_iterations=2, seed=0,
+                                       cache_dir=cache_dir), expected)
+        assert len(os.listdir(cache_dir)) == 1
+        # Second call: reference measures loaded from the cache.
+        assert np.allclose(omega_sigma(matrix, nb_iterations=2, seed=0,
+                                       cache_dir=cache_dir), expected)
+        assert len(os.listdir(cache_dir)) == 1
+
+    with pytest.raises(ValueError):
+        omega_sigma(matrix, cache_dir='unused')
@@ -12,7 +12,7 @@ from tqdm import tqdm
 
 import numpy as np
 from dipy.data import get_sphere
-from dipy.io.stateful_tractogram import Space
+from dipy.io.stateful_tractogram import Origin, Space
 from dipy.reconst.shm import sh_to_sf_matrix
 from dipy.tracking.streamlinespeed import compress_streamlines
 
@@ -35,7 +35,8 @@ class Tracker(object):
                  nbr_processes=1, save_seeds=False,
                  mmap_mode: Union[str, None] = None, rng_seed=1234,
                  track_forward_only=False, skip=0, verbose=False,
-                 append_last_point=True):
+                 append_last_point=True, connectivity_sink=None,
+                 save_streamlines=True):
         """
         Parameters
         ----------
@@ -84,6 +85,14 @@ class Tracker(object):
             direction (based on the propagator's definition of invalid; ex
             when angle is too sharp of sh_threshold not reached) are never
             added.
+        connectivity_sink: ConnectivityAccumulator, optional
+            If set, each successful streamline (before compression) is added
+            to this accumulator (see scilpy.connectivity.connectivity). With
+            several processes, the copies of the workers are merged into it.
+        save_streamlines: bool
+            If False, the streamlines are not kept: track() then returns
+            empty lists. Ex, with a connectivity_sink, for connectome-only
+            studies.
         """
         self.propagator = propagator
         self.mask = mask
@@ -99,6 +108,8 @@ class Tracker(object):
         self.track_forward_only = track_forward_only
         self.append_last_point = append_last_point
         self.skip = skip
+        self.connectivity_sink = connectivity_sink
+        self.save_streamlines = save_streamlines
 
         self.origin = self.propagator.origin
         self.space = self.propagator.space
@@ -133,10 +144,11 @@ class Tracker(object):
         Return
         ------
         streamlines: list of numpy.array
-            List of streamlines, represented as an array of positions.
+            List of streamlines, represented as an array of positions. Empty
+            if save_streamlines is False.
         seeds: list of numpy.array
             List of seeding positions, one 3-dimensional position per
-            streamline.
+            streamline. Empty if save_streamlines is False.
         """
         if self.nbr_processes < 2:
             chunk_id = 0
@@ -151,12 +163,15 @@ class Tracker(object):
 
                 pool = self._prepare_multiprocessing_pool(tmpdir)
 
-                lines_per_process, seeds_per_process = zip(*pool.map(
-                    self._get_streamlines_sub, zipped_chunks))
+                lines_per_process, seeds_per_process, sinks_per_process = \
+                    zip(*pool.map(self._get_streamlines_sub, zipped_chunks))
                 pool.close()
                 # Make sure all worker processes have exited before leaving
                 # context manager.
                 pool.join()
+                if self.connectivity_sink is not None:
+                    for sink in sinks_per_process:
+                        self.connectivity_sink.merge(sink)
                 lines = [line for line in itertools.chain(*lines_per_process)]
                 seeds = [seed for seed in itertools.chain(*seeds_per_process)]
 
@@ -247,14 +262,22 @@ class Tracker(object):
         -------
         lines: list
             List of list of 3D positions (streamlines).
+        seeds: list
+            List of seeds.
+        connectivity_sink: ConnectivityAccumulator or None
+            This process' copy of the accumulator, with only its own
+            streamlines.
         """
         chunk_id, lock = params
         global multiprocess_init_args
 
         self._reload_data_for_new_process(multiprocess_init_args)
+        if self.connectivity_sink is not None:
+            # This is a copy: the main process merges the copies.
+            self.connectivity_sink.reset()
         try:
             streamlines, seeds = self._get_streamlines(chunk_id, lock)
-            return streamlines, seeds
+            return streamlines, seeds, self.connectivity_sink
         except Exception as e:
             logging.error("Operation _get_streamlines_sub() failed.")
             traceback.print_exception(*sys.exc_info(), file=sys.stderr)
@@ -342,7 +365,11 @@ class Tracker(object):
             # Forward and backward tracking
             line = self._get_line_both_directions(seed, line_generator)
 
-            if line is not None:
+            if line is not None and self.connectivity_sink is not None:
+                self.connectivity_sink.add_streamline(
+                    self._to_vox_center(np.array(line, dtype='float32')))
+
+            if line is not None and self.save_streamlines:
                 streamline = np.array(line, dtype='float32')
 
                 if self.compression_th is not None:
@@ -370,6 +397,17 @@ class Tracker(object):
                 p.close()
         return streamlines, seeds
 
+    def _to_vox_center(self, streamline):
+        """
+        Converts a streamline from the propagator's space and origin to vox
+        space, center origin (as expected by the connectivity sink).
+        """
+        if self.space == Space.VOXMM:
+            streamline = streamline / self.seed_generator.voxres
+        if self.origin == Origin.TRACKVIS:
+            streamline = streamline - 0.5
+        return streamline
+
     def _get_line_both_directions(self, seeding_pos, line_generator):
         """
         Generate a streamline from an initial position following the tracking
@@ -153,6 +153,60 @@ def add_out_options(p):
     return out_g
 
 
+def add_connectivity_options(p):
+    """
+    Options that are available in both scil_tracking_local and
+    scil_tracking_local_dev scripts, to compute connectivity matrices during
+    the tracking.
+    """
+    conn_g = p.add_argument_group('Connectivity options')
+    conn_g.add_argument('--in_labels',
+                        help='Labels volume (.nii.gz), used to label the '
+                             'endpoints of the streamlines.')
+    conn_g.add_argument('--out_connectivity', metavar='OUT_MATRIX',
+                        help='Output streamline count matrix (.npy), upper '
+                             'triangular,\nwithout the background.')
+    conn_g.add_argument('--out_length_matrix', metavar='OUT_MATRIX',
+                        help='Output average streamline length (mm) matrix '
+                             '(.npy).')
+    conn_g.add_argument('--out_labels_list', metavar='OUT_FILE',
+                        help='Output .txt file with the ordered labels (name '
+                             'of each\nrow / column).')
+    conn_g.add_argument('--connectivity_only', action='store_true',
+                        help='Do not save the tractogram, only the '
+                             'connectivity outputs.')
+    return conn_g
+
+
+def verify_connectivity_options(parser, args):
+    if args.in_labels and not args.out_connectivity:
+        parser.error('--in_labels requires --out_connectivity.')
+    if (args.out_connectivity or args.out_length_matrix or
+            args.out_labels_list) and not args.in_labels:
+        parser.error('The connectivity outputs require --in_labels.')
+    if args.connectivity_only and not args.in_labels:
+        parser.error('--connectivity_only requires --in_labels.')
+
+
+def save_connectivity_matrices(connectivity_sink, out_connectivity,
+                               out_length_matrix=None, out_labels_list=None):
+    """
+    Saves the matrices of a ConnectivityAccumulator, as given with the
+    options of add_connectivity_options.
+    """
+    count_matrix, length_matrix, ordered_labels = \
+        connectivity_sink.get_matrices()
+    np.save(out_connectivity, count_matrix)
+    if out_length_matrix:
+        np.save(out_length_matrix, length_matrix)
+    if out_labels_list:
+        with open(out_labels_list, "w") as text_file:
+            for i, label in enumerate(ordered_labels):
+                text_file.write("{} = {}\n".format(i, label))
+    logging.info('Saved connectivity matrix to {0}.'
+                 .format(out_connectivity))
+
+
 def verify_streamline_length_options(parser, args):
     if not args.min_length >= 0:
         parser.error('min_length must be >= 0, but {}mm was provided.'
@@ -179,12 +233,14 @@ def tqdm_if_verbose(generator: Iterable, verbose: bool, *args, **kwargs):
 
 def save_tractogram(
         streamlines_generator, tracts_format, ref_img, total_nb_seeds,
-        out_tractogram, min_length, max_length, compress, save_seeds, verbose
+        out_tractogram, min_length, max_length, compress, save_seeds, verbose,
+        connectivity_sink=None
 ):
     """ Save the streamlines on-the-fly using a generator. Tracts are
     filtered according to their length and compressed if requested. Seeds
     are saved if requested. The tractogram is shifted and scaled according
-    to the file format.
+    to the file format. The streamlines can also be added on-the-fly to
+    connectivity matrices.
 
     Parameters
     ----------
@@ -196,8 +252,9 @@ def save_tractogram(
         Image used as reference.
     total_nb_seeds : int
         Total number of seeds.
-    out_tractogram : str
-        Output tractogram filename.
+    out_tractogram : str or None
+        Output tractogram filename. If None, the tractogram is not saved
+        (only useful with a connectivity_sink).
     min_length : float
         Minimum length of a streamline in mm.
     max_length : float
@@ -209,7 +266,9 @@ def save_tractogram(
         data_per_streamline property.
     verbose : bool
         If True, display progression bar.
-
+    connectivity_sink : ConnectivityAccumulator, optional
+        If set, each streamline kept after the length filtering is added to
+        this accumulator (see scilpy.connectivity.connectivity).
     """
 
     voxel_size = ref_img.header.get_zooms()[0]
@@ -225,6 +284,13 @@ def save_tractogram(
                                           miniters=int(total_nb_seeds / 100),
                                           leave=False):
             if (scaled_min_length <= length(strl) <= scaled_max_length):
+                if out_tractogram is None:
+                    if connectivity_sink is not None:
+                        connectivity_sink.add_streamline(strl)
+                    continue
+                # Kept as is: strl may be modified in place below.
+                sink_strl = strl.copy() if connectivity_sink else None
+
                 # Seeds are saved with origin `center` by our own convention.
                 # Other scripts (e.g. scil_tractogram_seed_density_map) expect
                 # so.
@@ -254,6 +320,18 @@ def save_tractogram(
 
                 yield TractogramItem(strl, dps, {})
 
+                # Only reached once the item was consumed. LazyTractogram
+                # peeks at the first item in a separate pass, which is never
+                # resumed: that streamline must not be counted twice.
+                if connectivity_sink is not None:
+                    connectivity_sink.add_streamline(sink_strl)
+
+    if out_tractogram is None:
+        # Connectivity only: consume the generator without saving.
+        for _ in tracks_generator_wrapper():
+            pass
+        return
+
     tractogram = LazyTractogram.from_data_func(tracks_generator_wrapper)
     tractogram.affine_to_rasmm = ref_img.affine
 
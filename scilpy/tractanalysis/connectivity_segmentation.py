@@ -3,10 +3,12 @@ import itertools
 import logging
 import os
 
+import numba
 import numpy as np
 from dipy.io.stateful_tractogram import StatefulTractogram
 from dipy.tracking.streamlinespeed import length
 from nibabel.streamlines import ArraySequence
+from numba import njit, prange
 
 from scilpy.io.hdf5 import construct_hdf5_group_from_streamlines
 from scilpy.io.streamlines import save_tractogram
@@ -16,7 +18,12 @@ from scilpy.tractograms.streamline_and_mask_operations import \
 from scilpy.tractograms.streamline_operations import \
     (remove_loops as perform_remove_loops,
      remove_sharp_turns_qb,
-     remove_streamlines_with_overlapping_points, filter_streamlines_by_length)
+     remove_streamlines_with_overlapping_points, filter_streamlines_by_length,
+     _set_numba_threads)
+
+# Keys of the arrays returned by compute_connectivity_arrays.
+CONNECTIVITY_KEYS = ['strl_idx', 'start_label', 'end_label', 'in_idx',
+                     'out_idx']
 
 
 def extract_longest_segments_from_profile(strl_indices, atlas_data):
@@ -141,6 +148,156 @@ def compute_connectivity(indices, atlas_data, real_labels, segmenting_func):
     return connectivity
 
 
+@njit(parallel=True)
+def _longest_segments_kernel(labels, out_of_bounds, offsets, lengths,
+                             out_start, out_end):
+    """
+    Numba kernel applying, to each streamline's labels profile, the same
+    logic as extract_longest_segments_from_profile. out_start and out_end
+    must be preallocated (to -1) to the number of streamlines; they stay -1
+    for streamlines without a valid segment.
+    """
+    for i in prange(lengths.shape[0]):
+        offset = offsets[i]
+        nb_voxels = lengths[i]
+
+        # Managing streamlines out of bound.
+        skip = False
+        for k in range(nb_voxels):
+            if out_of_bounds[offset + k]:
+                skip = True
+                break
+        if skip:
+            continue
+
+        # First labelled voxel.
+        start_idx = -1
+        for k in range(nb_voxels):
+            if labels[offset + k] > 0:
+                start_idx = k
+                break
+        if start_idx < 0:
+            continue
+
+        # Must then leave the labels (label 0, WM), before the last voxel.
+        wm_idx = -1
+        for k in range(start_idx + 1, nb_voxels):
+            if labels[offset + k] == 0:
+                wm_idx = k
+                break
+        if wm_idx < 0 or wm_idx + 1 >= nb_voxels:
+            continue
+
+        # Last labelled voxel.
+        end_idx = -1
+        for k in range(nb_voxels - 1, start_idx, -1):
+            if labels[offset + k] > 0:
+                end_idx = k
+                break
+        if end_idx < 0 or end_idx <= start_idx + 1:
+            continue
+
+        out_start[i] = start_idx
+        out_end[i] = end_idx
+
+
+def compute_connectivity_arrays(indices, atlas_data, nbr_processes=1):
+    """
+    Same as compute_connectivity with extract_longest_segments_from_profile,
+    but array-based: the labels of all voxels are fetched at once, the
+    longest segments are found in parallel over streamlines, and the output
+    is a set of flat arrays instead of a dict of lists of dicts.
+
+    Parameters
+    ----------
+    indices: ArraySequence
+        The list of 3D indices [i, j, k] of all voxels traversed by all
+        streamlines. This is the output of the
+        streamlines_to_voxel_coordinates function.
+    atlas_data: np.ndarray
+        The loaded image containing the labels.
+    nbr_processes: int
+        Number of threads to use.
+
+    Returns
+    -------
+    connectivity: dict
+        A dict of flat arrays (see CONNECTIVITY_KEYS), with one entry per
+        streamline with a valid segment, in the order of the streamlines:
+
+           >>> 'strl_idx': The index of the streamline in the raw data.
+           >>> 'start_label', 'end_label': The labels at both ends.
+           >>> 'in_idx', 'out_idx': The index of the voxels (in indices) at
+           >>>     both ends of the segment.
+    """
+    nb_streamlines = len(indices._lengths)
+    out_start = np.full(nb_streamlines, -1, dtype=np.int64)
+    out_end = np.full(nb_streamlines, -1, dtype=np.int64)
+
+    if nb_streamlines > 0:
+        coords = np.asarray(indices._data, dtype=np.intp).reshape((-1, 3))
+        out_of_bounds = np.any(coords >= atlas_data.shape[:3], axis=1)
+        coords[out_of_bounds] = 0
+        labels = atlas_data[tuple(coords.T)]
+
+        previous = _set_numba_threads(nbr_processes)
+        try:
+            _longest_segments_kernel(
+                labels, out_of_bounds,
+                np.asarray(indices._offsets, dtype=np.int64),
+                np.asarray(indices._lengths, dtype=np.int64),
+                out_start, out_end)
+        finally:
+            numba.set_num_threads(previous)
+
+    strl_idx = np.flatnonzero(out_start >= 0)
+    offsets = np.asarray(indices._offsets, dtype=np.intp)[strl_idx]
+    in_idx = out_start[strl_idx]
+    out_idx = out_end[strl_idx]
+    if len(strl_idx) > 0:
+        start_label = labels[offsets + in_idx]
+        end_label = labels[offsets + out_idx]
+    else:
+        start_label = np.zeros(0, dtype=atlas_data.dtype)
+        end_label = np.zeros(0, dtype=atlas_data.dtype)
+
+    return {'strl_idx': strl_idx,
+            'start_label': start_label,
+            'end_label': end_label,
+            'in_idx': in_idx,
+            'out_idx': out_idx}
+
+
+def _get_pair_info(con_info, in_label, out_label):
+    """
+    Information on the streamlines going from in_label to out_label, then
+    from out_label to in_label, as a list of dicts with keys 'strl_idx',
+    'in_idx' and 'out_idx'. con_info is either the output of
+    compute_connectivity or of compute_connectivity_arrays (with the
+    additional key 'sorted_keys', see construct_hdf5_from_connectivity).
+    """
+    if 'strl_idx' not in con_info:
+        pair_info = []
+        if out_label in con_info[in_label]:
+            pair_info.extend(con_info[in_label][out_label])
+        if in_label in con_info[out_label]:
+            pair_info.extend(con_info[out_label][in_label])
+        return pair_info
+
+    # toDo. As with compute_connectivity's output, self-connections
+    #  (in_label == out_label) are listed twice.
+    order, sorted_keys, max_label = con_info['sorted_keys']
+    pair_info = []
+    for start, end in [(in_label, out_label), (out_label, in_label)]:
+        key = int(start) * max_label + int(end)
+        lo, hi = np.searchsorted(sorted_keys, [key, key + 1])
+        for i in order[lo:hi]:
+            pair_info.append({'strl_idx': con_info['strl_idx'][i],
+                              'in_idx': con_info['in_idx'][i],
+                              'out_idx': con_info['out_idx'][i]})
+    return pair_info
+
+
 def construct_hdf5_from_connectivity(
         sft, indices, points_to_idx, real_labels, con_info,
         hdf5_file, saving_options, out_paths,
@@ -148,7 +305,7 @@ def construct_hdf5_from_connectivity(
         remove_loops, loop_max_angle,               # step 2
         remove_outliers, outlier_threshold,         # step 3
         remove_curv_dev, curv_qb_distance,          # step 4
-        nbr_cpu
+        nbr_cpu, compression=None, compression_level=None
 ):
     """
     Parameters
@@ -162,7 +319,8 @@ def construct_hdf5_from_connectivity(
     real_labels: np.ndarray
         The labels.
     con_info: dict
-        The result from compute_connectivity.
+        The result from compute_connectivity or (faster)
+        compute_connectivity_arrays.
     hdf5_file: hdf5 file
         The opened hdf5_file to which to add the bundles (as groups).
     saving_options: dict
@@ -188,7 +346,11 @@ def construct_hdf5_from_connectivity(
         If true, remove sharp turns base on Quickbundles. Else skip step 4.
     curv_qb_distance: float
     nbr_cpu: int
-        Number of cpu for steps allowing multiprocessing.
+        Number of threads for steps allowing it (loop detection).
+    compression: str or None
+        Compression of the hdf5 datasets. See get_hdf5_dataset_options.
+    compression_level: int or None
+        Compression level of the hdf5 datasets.
     """
     sft.to_vox()
     sft.to_corner()
@@ -196,6 +358,17 @@ def construct_hdf5_from_connectivity(
     comb_list = list(itertools.combinations(real_labels, r=2))
     comb_list.extend(zip(real_labels, real_labels))
 
+    if 'strl_idx' in con_info:
+        # Sorting the segments by (start_label, end_label) once. The sort is
+        # stable: streamlines stay ordered inside each pair.
+        max_label = int(max(np.max(real_labels, initial=0),
+                            np.max(con_info['start_label'], initial=0),
+                            np.max(con_info['end_label'], initial=0))) + 1
+        keys = con_info['start_label'].astype(np.int64) * max_label + \
+            con_info['end_label']
+        order = np.argsort(keys, kind='stable')
+        con_info = dict(con_info, sorted_keys=(order, keys[order], max_label))
+
     # Each connection is processed independently. Multiprocessing would be
     # a burden on the I/O of most SSD/HD.
     iteration_counter = 0
@@ -208,12 +381,8 @@ def construct_hdf5_from_connectivity(
                       .format(iteration_counter, len(comb_list),
                               in_label, out_label))
 
-        # Extracting this connection's info from the big dict con_info
-        pair_info = []
-        if out_label in con_info[in_label]:
-            pair_info.extend(con_info[in_label][out_label])
-        if in_label in con_info[out_label]:
-            pair_info.extend(con_info[out_label][in_label])
+        # Extracting this connection's info from con_info
+        pair_info = _get_pair_info(con_info, in_label, out_label)
         if len(pair_info) == 0:
             logging.debug("No streamlines found for this connection: not "
                           "saving in the hdf5.")
@@ -378,7 +547,8 @@ def construct_hdf5_from_connectivity(
         group = hdf5_file.create_group('{}_{}'.format(in_label, out_label))
         construct_hdf5_group_from_streamlines(
             group, current_sft.streamlines,
-            dps=current_sft.data_per_streamline)
+            dps=current_sft.data_per_streamline,
+            compression=compression, compression_level=compression_level)
 
 
 def _save_intermediate(sft, saving_options, out_paths, in_label, out_label,
@@ -12,7 +12,8 @@ from scilpy.tracking.fibertube_utils import (streamlines_to_segments,
                                              dist_segment_segment,
                                              dist_point_segment)
 from scilpy.tracking.utils import tqdm_if_verbose
-from scilpy.tractograms.uncompress import streamlines_to_voxel_coordinates
+from scilpy.tractograms.streamline_operations import \
+    streamlines_to_voxel_coordinates_parallel
 
 
 def fibertube_density(sft, samples_per_voxel_axis, verbose=False):
@@ -64,11 +65,11 @@ def fibertube_density(sft, samples_per_voxel_axis, verbose=False):
     # Everything will be in vox and corner for streamlines_to_voxel_coordinates.
     sft.to_vox()
     sft.to_corner()
-    vox_idx_for_streamline = streamlines_to_voxel_coordinates(sft.streamlines)
-    mask_idx = np.concatenate(vox_idx_for_streamline)
+    # Voxels as linear indices in the volume
+    vox_idx_for_streamline = streamlines_to_voxel_coordinates_parallel(
+        sft.streamlines, dimensions=sft.dimensions)
     mask = np.zeros((sft.dimensions), dtype=np.uint8)
-    # Numpy array indexing in 3D works like this
-    mask[mask_idx[:, 0], mask_idx[:, 1], mask_idx[:, 2]] = 1
+    mask.flat[vox_idx_for_streamline.get_data()] = 1
 
     sampling_density = np.array([samples_per_voxel_axis,
                                  samples_per_voxel_axis,
@@ -279,8 +279,28 @@ def compute_bundle_adjacency_voxel(binary_1, binary_2, non_overlap=False):
     -------
     float: Distance in millimeters between both bundles.
     """
-    b1_ind = np.argwhere(binary_1 > 0)
-    b2_ind = np.argwhere(binary_2 > 0)
+    return compute_bundle_adjacency_voxel_indices(np.argwhere(binary_1 > 0),
+                                                  np.argwhere(binary_2 > 0),
+                                                  non_overlap)
+
+
+def compute_bundle_adjacency_voxel_indices(b1_ind, b2_ind, non_overlap=False):
+    """
+    Same as compute_bundle_adjacency_voxel, but from the coordinates of the
+    voxels of each bundle. Useful with sparse density maps.
+
+    Parameters
+    ----------
+    b1_ind: ndarray
+        Coordinates of the voxels of the first bundle, of shape (N, 3).
+    b2_ind: ndarray
+        Coordinates of the voxels of the second bundle, of shape (M, 3).
+    non_overlap: bool
+        Exclude overlapping voxels from the computation.
+    Returns
+    -------
+    float: Distance in millimeters between both bundles.
+    """
     b1_tree = cKDTree(b1_ind)
     b2_tree = cKDTree(b2_ind)
 
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import itertools
+
+import numpy as np
+from nibabel.streamlines import ArraySequence
+
+from scilpy.tractanalysis.connectivity_segmentation import (
+    _get_pair_info, compute_connectivity, compute_connectivity_arrays,
+    extract_longest_segments_from_profile)
+from scilpy.tractograms.uncompress import streamlines_to_voxel_coordinates
+
+
+def test_compute_connectivity_arrays():
+    rng = np.random.RandomState(0)
+    atlas = np.zeros((20, 20, 20), dtype=np.uint16)
+    atlas[:4] = rng.randint(1, 4, (4, 20, 20))
+    atlas[16:] = rng.randint(2, 6, (4, 20, 20))
+    atlas[8:10, 8:10] = 7
+    streamlines = ArraySequence(
+        [rng.uniform(0.1, 19.9, (rng.randint(2, 15), 3)).astype(np.float32)
+         for _ in range(500)])
+    indices = streamlines_to_voxel_coordinates(streamlines)
+    real_labels = np.unique(atlas)[1:]
+
+    expected = compute_connectivity(indices, atlas, real_labels,
+                                    extract_longest_segments_from_profile)
+    for nbr_processes in [1, 2]:
+        con_info = compute_connectivity_arrays(indices, atlas,
+                                               nbr_processes)
+        max_label = int(real_labels.max()) + 1
+        keys = con_info['start_label'].astype(np.int64) * max_label + \
+            con_info['end_label']
+        order = np.argsort(keys, kind='stable')
+        con_info['sorted_keys'] = (order, keys[order], max_label)
+
+        pairs = list(itertools.combinations(real_labels, 2)) + \
+            list(zip(real_labels, real_labels))
+        for in_label, out_label in pairs:
+            expected_info = _get_pair_info(expected, in_label, out_label)
+            info = _get_pair_info(con_info, in_label, out_label)
+            assert [(it['strl_idx'], it['in_idx'], it['out_idx'])
+                    for it in info] == \
+                [(it['strl_idx'], it['in_idx'], it['out_idx'])
+                 for it in expected_info]
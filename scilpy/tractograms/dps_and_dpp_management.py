@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import numpy as np
 
+from scilpy.tractograms.streamline_operations import \
+    array_sequence_from_flat, get_flat_points_indices
 from scilpy.viz.color import clip_and_normalize_data_for_cmap
 
 
@@ -113,7 +115,15 @@ def convert_dps_to_dpp(sft, keys, overwrite=False):
     return sft
 
 
-def project_map_to_streamlines(sft, map_volume, endpoints_only=False):
+def _get_endpoints_rows(lengths):
+    """Rows of the first and last points of each streamline, in a compact
+    flat array (all streamlines concatenated)."""
+    ends = np.cumsum(lengths) - 1
+    return np.concatenate((ends - lengths + 1, ends))
+
+
+def project_map_to_streamlines(sft, map_volume, endpoints_only=False,
+                               chunk_size=1000000):
     """
     Projects a map onto the points of streamlines. The result is a
     data_per_point.
@@ -128,53 +138,44 @@ def project_map_to_streamlines(sft, map_volume, endpoints_only=False):
         If True, will only project the map_volume onto the endpoints of the
         streamlines (all values along streamlines set to NaN). If False,
         will project the map_volume onto all points of the streamlines.
+    chunk_size: int, optional
+        Maximal number of points interpolated at once, to limit memory usage.
 
     Returns
     -------
-    streamline_data: List[List]
+    streamline_data: ArraySequence
         The values that could now be associated to a data_per_point key.
-        The map_volume projected to each point of the streamlines.
+        The map_volume projected to each point of the streamlines, of shape
+        (nb_points, dimension) for each streamline. Values of all points are
+        stored in a single flat array.
     """
     if len(map_volume.data.shape) == 4:
         dimension = map_volume.data.shape[3]
     else:
         dimension = 1
 
-    streamline_data = []
+    streamlines = sft.streamlines
+    lengths = np.asarray(streamlines._lengths, dtype=np.intp)
+    flat_indices = get_flat_points_indices(streamlines)
+
     if endpoints_only:
-        for s in sft.streamlines:
-            p1_data = map_volume.get_value_at_coordinate(
-                s[0][0], s[0][1], s[0][2],
-                space=sft.space, origin=sft.origin)
-            p2_data = map_volume.get_value_at_coordinate(
-                s[-1][0], s[-1][1], s[-1][2],
-                space=sft.space, origin=sft.origin)
-
-            thisstreamline_data = np.ones((len(s), dimension)) * np.nan
-
-            thisstreamline_data[0] = p1_data
-            thisstreamline_data[-1] = p2_data
-            thisstreamline_data = np.asarray(thisstreamline_data)
-
-            streamline_data.append(
-                np.reshape(thisstreamline_data,
-                           (len(thisstreamline_data), dimension)))
+        rows = _get_endpoints_rows(lengths)
+        values = np.full((len(flat_indices), dimension), np.nan)
     else:
-        # toDo: there is a double loop. Could be faster?
-        for s in sft.streamlines:
-            thisstreamline_data = []
-            for p in s:
-                thisstreamline_data.append(map_volume.get_value_at_coordinate(
-                    p[0], p[1], p[2], space=sft.space, origin=sft.origin))
+        rows = np.arange(len(flat_indices))
+        values = np.zeros((len(flat_indices), dimension))
 
-            streamline_data.append(
-                np.reshape(thisstreamline_data,
-                           (len(thisstreamline_data), dimension)))
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        values[chunk] = map_volume.get_values_at_coordinates(
+            streamlines._data[flat_indices[chunk]],
+            space=sft.space, origin=sft.origin)
 
-    return streamline_data
+    return array_sequence_from_flat(values, lengths)
 
 
-def project_dpp_to_map(sft, dpp_key, sum_lines=False, endpoints_only=False):
+def project_dpp_to_map(sft, dpp_key, sum_lines=False, endpoints_only=False,
+                       chunk_size=1000000):
     """
     Saves the values of data_per_point keys to the underlying voxels. Averages
     the values of various streamlines in each voxel. Returns one map per key.
@@ -193,6 +194,8 @@ def project_dpp_to_map(sft, dpp_key, sum_lines=False, endpoints_only=False):
         instead.
     endpoints_only: bool
         If true, only project the streamline's endpoints.
+    chunk_size: int, optional
+        Maximal number of points accumulated at once, to limit memory usage.
 
     Returns
     -------
@@ -205,19 +208,34 @@ def project_dpp_to_map(sft, dpp_key, sum_lines=False, endpoints_only=False):
     # the voxel where it is.
     sft.to_corner()
 
+    streamlines = sft.streamlines
+    dpp = sft.data_per_point[dpp_key]
+    points_indices = get_flat_points_indices(streamlines)
+    dpp_indices = get_flat_points_indices(dpp)
+
+    if endpoints_only:
+        rows = _get_endpoints_rows(
+            np.asarray(streamlines._lengths, dtype=np.intp))
+    else:
+        rows = np.arange(len(points_indices))
+
     # count: could also use compute_tract_counts_map.
-    count = np.zeros(sft.dimensions)
-    the_map = np.zeros(sft.dimensions)
-    for s in range(len(sft)):
-        if endpoints_only:
-            points = [0, -1]
-        else:
-            points = range(len(sft.streamlines[s]))
-
-        for p in points:
-            x, y, z = sft.streamlines[s][p, :].astype(int)  # Or floor
-            count[x, y, z] += 1
-            the_map[x, y, z] += np.squeeze(sft.data_per_point[dpp_key][s][p])
+    nb_voxels = int(np.prod(sft.dimensions))
+    count = np.zeros(nb_voxels)
+    the_map = np.zeros(nb_voxels)
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        voxels = streamlines._data[points_indices[chunk]].astype(int)  # floor
+        voxels = np.ravel_multi_index(voxels.T, sft.dimensions)
+        values = np.asarray(dpp._data[dpp_indices[chunk]], dtype=float)
+        values = values.reshape((len(chunk), -1))
+
+        count += np.bincount(voxels, minlength=nb_voxels)
+        the_map += np.bincount(voxels, weights=np.squeeze(values, axis=1),
+                               minlength=nb_voxels)
+
+    count = count.reshape(sft.dimensions)
+    the_map = the_map.reshape(sft.dimensions)
 
     if not sum_lines:
         count = np.maximum(count, 1e-6)  # Avoid division by 0
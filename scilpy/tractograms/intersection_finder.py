@@ -1,13 +1,63 @@
 import time
 import math
 import logging
+import numba
 import numpy as np
 
+from numba import njit, prange
 from scipy.spatial import KDTree
 from scilpy.tracking.fibertube_utils import (streamlines_to_segments,
                                              dist_segment_segment)
 from dipy.io.stateful_tractogram import StatefulTractogram
 from scilpy.tracking.utils import tqdm_if_verbose
+from scilpy.tractograms.streamline_operations import _set_numba_threads
+
+
+@njit(parallel=True)
+def _segment_pairs_distance_kernel(data, seg_rows, seg_streamline, radii,
+                                   pairs_a, pairs_b, external_distance,
+                                   collision_point):
+    """
+    Numba kernel computing, for each candidate pair of segments, the distance
+    between the two segments (external to their radius) and a rough estimate
+    of their collision point (midpoint of the closest points).
+    """
+    for k in prange(len(pairs_a)):
+        a = pairs_a[k]
+        b = pairs_b[k]
+        distance, _, p_coll, q_coll = dist_segment_segment(
+            data[seg_rows[a]], data[seg_rows[a] + 1],
+            data[seg_rows[b]], data[seg_rows[b] + 1])
+        external_distance[k] = (distance - radii[seg_streamline[a]] -
+                                radii[seg_streamline[b]])
+        collision_point[k] = (p_coll + q_coll) / 2
+
+
+@njit
+def _resolve_intersections_kernel(seg_streamline, hits_a, hits_b,
+                                  hits_external_distance, hits_collision,
+                                  invalid, collisions, obstacle, excluded):
+    """
+    Numba kernel going through the hits (pairs of segments that are either
+    colliding or closer than min_distance), sorted by segment and then by
+    neighbor, and flagging the streamlines in that order. A streamline that
+    has already collided or been excluded can neither collide again nor be
+    collided with.
+    """
+    for k in range(len(hits_a)):
+        si = seg_streamline[hits_a[k]]
+        neighbor_si = seg_streamline[hits_b[k]]
+        if invalid[si] or excluded[si]:
+            continue
+        if invalid[neighbor_si] or excluded[neighbor_si]:
+            continue
+
+        if hits_external_distance[k] < 0:
+            invalid[si] = True
+            collisions[si] = hits_collision[k]
+            obstacle[neighbor_si] = True
+        else:
+            excluded[si] = True
 
 
 class IntersectionFinder:
@@ -76,7 +126,8 @@ class IntersectionFinder:
         other reasons."""
         return self._excluded
 
-    def find_intersections(self, min_distance=0):
+    def find_intersections(self, min_distance=0, nbr_processes=1,
+                           chunk_size=100000):
         """
         Finds intersections within the initialized data of the object
 
@@ -93,6 +144,13 @@ class IntersectionFinder:
                 Streamlines that don't collide, but should be excluded for
                 other reasons. (ex: distance does not respect min_distance)
 
+        Candidate pairs of segments are gathered from the KDTree by batches
+        of segments, and their distances are computed in parallel. The
+        streamlines are then flagged sequentially, in the order of their
+        segments, and for each segment in the order of its neighbors' index.
+        The result is thus deterministic and does not depend on the number
+        of threads: the first collider always wins.
+
         Parameters
         ----------
         min_distance: float
@@ -103,9 +161,17 @@ class IntersectionFinder:
             option is the same as filtering with a large diameter
             but only saving a small diameter in out_tractogram.
             (Value in mm)
+        nbr_processes: int
+            Number of threads used to query the KDTree and to compute the
+            distances between segments. If None or 0, uses all available
+            threads.
+        chunk_size: int
+            Number of segments for which neighbors are queried at once.
+            Bounds the memory used by the candidate pairs.
         """
         start_time = time.time()
         streamlines = self.streamlines
+        nb_segments = len(self.seg_centers)
 
         invalid = np.full((len(streamlines)), False, dtype=np.bool_)
         collisions = np.zeros((len(streamlines), 3), dtype=np.float32)
@@ -117,56 +183,63 @@ class IntersectionFinder:
         #                           streamline.
         # segi : Segment Index    | index of streamline segment within the
         #                           entire tractogram.
-        for segi, center in tqdm_if_verbose(enumerate(self.seg_centers),
-                                            self.verbose,
-                                            total=len(self.seg_centers)):
-            si = self.seg_indices[segi][0]
-
-            # [Pruning 1] If current streamline has already collided or been
-            #             excluded, skip.
-            if invalid[si] or excluded[si]:
-                continue
-
-            neighbors = self.tree.query_ball_point(
-                center,
-                self.max_seg_length + self.max_diameter + min_distance,
-                workers=-1)
-
-            for neighbor_segi in neighbors:
-                neighbor_si = self.seg_indices[neighbor_segi][0]
-
-                # [Pruning 2] Skip if neighbor is our streamline
-                if neighbor_si == si:
-                    continue
-
-                # [Pruning 3] If neighbor has already collided or been
-                #             excluded, skip.
-                if invalid[neighbor_si] or excluded[neighbor_si]:
-                    continue
-
-                p0 = streamlines[si][self.seg_indices[segi][1]]
-                p1 = streamlines[si][self.seg_indices[segi][1] + 1]
-                q0 = streamlines[neighbor_si][
-                    self.seg_indices[neighbor_segi][1]]
-                q1 = streamlines[neighbor_si][
-                    self.seg_indices[neighbor_segi][1] + 1]
-
-                rp = self.diameters[si] / 2
-                rq = self.diameters[neighbor_si] / 2
-
-                distance, _, p_coll, q_coll = dist_segment_segment(p0, p1,
-                                                                   q0, q1)
-                external_distance = distance - rp - rq
-
-                if external_distance < 0:
-                    invalid[si] = True
-                    # Rough estimate of collision point
-                    collisions[si] = (p_coll + q_coll) / 2
-                    obstacle[neighbor_si] = True
-                    break
-                if min_distance != 0 and external_distance < min_distance:
-                    excluded[si] = True
-                    break
+        seg_streamline = np.ascontiguousarray(self.seg_indices[:, 0],
+                                              dtype=np.int64)
+        seg_rows = (np.asarray(streamlines._offsets, dtype=np.int64)[
+            seg_streamline] + self.seg_indices[:, 1]).astype(np.int64)
+        radii = np.asarray(self.diameters, dtype=np.float64) / 2
+        data = streamlines._data
+        radius = self.max_seg_length + self.max_diameter + min_distance
+        workers = nbr_processes or -1
+
+        hits_a, hits_b, hits_distance, hits_collision = [], [], [], []
+        previous = _set_numba_threads(nbr_processes)
+        try:
+            for first in tqdm_if_verbose(range(0, nb_segments, chunk_size),
+                                         self.verbose,
+                                         total=math.ceil(nb_segments /
+                                                         chunk_size)):
+                last = min(first + chunk_size, nb_segments)
+                neighbors = self.tree.query_ball_point(
+                    self.seg_centers[first:last], radius,
+                    workers=workers, return_sorted=True)
+
+                # Candidate pairs, sorted by segment and then by neighbor.
+                nb_neighbors = np.fromiter(map(len, neighbors), dtype=np.int64,
+                                           count=len(neighbors))
+                pairs_a = np.repeat(np.arange(first, last, dtype=np.int64),
+                                    nb_neighbors)
+                pairs_b = np.fromiter(
+                    (n for segment in neighbors for n in segment),
+                    dtype=np.int64, count=int(np.sum(nb_neighbors)))
+
+                # [Pruning] Skip neighbors from our own streamline
+                other = seg_streamline[pairs_a] != seg_streamline[pairs_b]
+                pairs_a = pairs_a[other]
+                pairs_b = pairs_b[other]
+
+                external_distance = np.empty(len(pairs_a), dtype=np.float64)
+                collision_point = np.empty((len(pairs_a), 3),
+                                           dtype=np.float32)
+                _segment_pairs_distance_kernel(
+                    data, seg_rows, seg_streamline, radii, pairs_a, pairs_b,
+                    external_distance, collision_point)
+
+                # Only keep pairs that collide or are too close.
+                hit = external_distance < 0
+                if min_distance != 0:
+                    hit |= external_distance < min_distance
+                hits_a.append(pairs_a[hit])
+                hits_b.append(pairs_b[hit])
+                hits_distance.append(external_distance[hit])
+                hits_collision.append(collision_point[hit])
+        finally:
+            numba.set_num_threads(previous)
+
+        _resolve_intersections_kernel(
+            seg_streamline, np.concatenate(hits_a), np.concatenate(hits_b),
+            np.concatenate(hits_distance), np.concatenate(hits_collision),
+            invalid, collisions, obstacle, excluded)
 
         logging.debug("Finished finding intersections in " +
                       str(round(time.time() - start_time, 2)) + " seconds.")
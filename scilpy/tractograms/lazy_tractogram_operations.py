@@ -1,20 +1,40 @@
 # -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 import logging
 import os
+import queue
+import threading
 
 import nibabel as nib
 import numpy as np
+from dipy.io.stateful_tractogram import Origin, Space, StatefulTractogram
 from dipy.io.utils import is_header_compatible
-from nibabel.streamlines import LazyTractogram
+from nibabel.streamlines import ArraySequence, LazyTractogram, Tractogram
+from nibabel.streamlines.tck import TckFile
+from nibabel.streamlines.trk import TrkFile, header_2_dtype
+import trx.trx_file_memmap as tmm
 
+from scilpy.io.streamlines import (ichunk, load_sft_cache,
+                                   SFT_CACHE_EXTENSION)
+from scilpy.tractograms.streamline_operations import (
+    array_sequence_from_flat, get_compact_data)
 
-def lazy_streamlines_count(in_tractogram_path):
+# Formats that can be read by chunks of streamlines.
+LAZY_TRACTOGRAM_EXTENSIONS = ['.trk', '.tck', '.trx', SFT_CACHE_EXTENSION]
+
+
+def lazy_streamlines_count(in_tractogram_path, verify=False):
     """ Gets the number of streamlines as written in the tractogram header.
 
     Parameters
     ----------
     in_tractogram_path: str
-        Tractogram filepath, must be .trk or .tck.
+        Tractogram filepath, must be .trk, .tck, .trx or .sft.
+    verify: bool
+        If True, counts the streamlines by reading the whole file (in
+        chunks) instead of trusting the header. Ex: the header of a tck
+        file that was not properly closed may be wrong.
 
     Return
     ------
@@ -22,29 +42,274 @@ def lazy_streamlines_count(in_tractogram_path):
         Number of streamlines present in the tractogram.
     """
     _, ext = os.path.splitext(in_tractogram_path)
-    if ext == '.trk':
-        key = 'nb_streamlines'
-    elif ext == '.tck':
-        key = 'count'
-    else:
+    if ext not in LAZY_TRACTOGRAM_EXTENSIONS:
         raise IOError('{} is not supported for lazy loading'.format(ext))
 
+    if verify:
+        return int(sum(len(chunk) for chunk, _ in
+                       _lazy_streamlines_chunks(in_tractogram_path)))
+
+    if ext == '.trx':
+        trx = tmm.load(in_tractogram_path)
+        count = int(trx.header['NB_STREAMLINES'])
+        trx.close()
+        return count
+    if ext == SFT_CACHE_EXTENSION:
+        return len(load_sft_cache(in_tractogram_path,
+                                  bbox_valid_check=False))
+
+    key = 'nb_streamlines' if ext == '.trk' else 'count'
     tractogram_file = nib.streamlines.load(in_tractogram_path,
                                            lazy_load=True)
     return int(tractogram_file.header[key])
 
 
-def lazy_concatenate(in_tractograms, out_ext):
+def _lazy_streamlines_chunks(in_tractogram, chunk_size=10000):
+    """
+    Yields the streamlines of a tractogram (in rasmm), by chunks of
+    chunk_size streamlines, never loading the whole file in memory. The trk
+    and tck files are decoded with nibabel's lazy loading, the trx and sft
+    files are memory-mapped. Other formats must be loaded beforehand, and
+    given as a StatefulTractogram.
+
+    Yields
+    ------
+    chunk: ArraySequence
+        The streamlines of the chunk, in rasmm.
+    keys: tuple(list, list)
+        The data_per_point and data_per_streamline keys of the tractogram.
+    """
+    if not isinstance(in_tractogram, StatefulTractogram):
+        _, ext = os.path.splitext(in_tractogram)
+        if ext not in LAZY_TRACTOGRAM_EXTENSIONS:
+            raise IOError('{} is not supported for lazy loading'.format(ext))
+        if ext == '.trx':
+            trx = tmm.load(in_tractogram)
+            keys = (list(trx.data_per_vertex.keys()),
+                    list(trx.data_per_streamline.keys()))
+            try:
+                for start in range(0, len(trx.streamlines), chunk_size):
+                    yield (trx.streamlines[start:start + chunk_size].copy(),
+                           keys)
+            finally:
+                trx.close()
+            return
+        if ext != SFT_CACHE_EXTENSION:
+            tractogram = nib.streamlines.load(in_tractogram,
+                                              lazy_load=True).tractogram
+            keys = (list(tractogram.data_per_point.keys()),
+                    list(tractogram.data_per_streamline.keys()))
+            for chunk in ichunk(tractogram.streamlines, chunk_size):
+                yield ArraySequence(chunk), keys
+            return
+        in_tractogram = load_sft_cache(in_tractogram, bbox_valid_check=False)
+
+    sft = in_tractogram
+    keys = (list(sft.data_per_point.keys()),
+            list(sft.data_per_streamline.keys()))
+    for start in range(0, len(sft), chunk_size):
+        # Converting a copy: the sft may be memory-mapped, or used later.
+        chunk = StatefulTractogram.from_sft(
+            sft.streamlines[start:start + chunk_size].copy(), sft)
+        chunk.to_rasmm()
+        chunk.to_center()
+        yield chunk.streamlines, keys
+
+
+def lazy_sft_chunks(in_tractogram, reference, chunk_size=10000):
+    """
+    Yields the streamlines of a tractogram as StatefulTractograms of at
+    most chunk_size streamlines, never loading the whole file in memory.
+    The data_per_point and data_per_streamline are not loaded.
+
+    Parameters
+    ----------
+    in_tractogram: str or StatefulTractogram
+        Tractogram filepath, must be .trk, .tck, .trx or .sft. Other formats
+        must be loaded beforehand, and given as a StatefulTractogram.
+    reference: nib.Nifti1Image or str
+        Reference of the tractogram (must be compatible with the file's
+        header).
+    chunk_size: int
+        Number of streamlines per chunk.
+
+    Yields
+    ------
+    sft: StatefulTractogram
+        The streamlines of the chunk, in rasmm, center origin.
+    """
+    for chunk, _ in _lazy_streamlines_chunks(in_tractogram, chunk_size):
+        yield StatefulTractogram(chunk, reference, Space.RASMM,
+                                 origin=Origin.NIFTI)
+
+
+def _update_running_stats(stats, values):
+    """
+    Merges the statistics of values into stats (a dict with count, mean, m2,
+    min and max), using the parallel algorithm of Chan et al. for the
+    variance.
+    """
+    if len(values) == 0:
+        return
+    values = np.asarray(values, dtype=np.float64)
+    count = len(values)
+    mean = np.mean(values)
+    m2 = np.sum((values - mean) ** 2)
+
+    total = stats['count'] + count
+    delta = mean - stats['mean']
+    stats['m2'] += m2 + delta ** 2 * stats['count'] * count / total
+    stats['mean'] += delta * count / total
+    stats['count'] = total
+    stats['min'] = min(stats['min'], np.min(values))
+    stats['max'] = max(stats['max'], np.max(values))
+
+
+def lazy_streamlines_statistics(in_tractogram, chunk_size=10000,
+                                bin_size=10.):
+    """
+    Computes statistics on a tractogram in a single pass over the file, by
+    chunks of streamlines, in bounded memory: number of streamlines and of
+    points, min / mean / max / std of the lengths (in mm and in number of
+    points) and of the step sizes, bounding box, and a histogram of the
+    lengths.
+
+    Lengths and step sizes are computed in rasmm. They are equal to those in
+    voxmm unless the affine contains shearing.
+
+    Parameters
+    ----------
+    in_tractogram: str or StatefulTractogram
+        Tractogram filepath, read lazily (.trk, .tck, .trx or .sft), or a
+        tractogram already loaded (for the other formats).
+    chunk_size: int
+        Number of streamlines loaded at once.
+    bin_size: float
+        Width of the bins of the histogram of lengths, in mm.
+
+    Return
+    ------
+    statistics: dict
+        The statistics, ready to be saved as json. The histogram's bin i
+        counts the streamlines with a length in [i * bin_size,
+        (i + 1) * bin_size[.
+    """
+    names = ['length_mm', 'length_nb_points', 'step_size']
+    stats = {name: {'count': 0, 'mean': 0., 'm2': 0.,
+                    'min': np.inf, 'max': -np.inf} for name in names}
+    nb_points = 0
+    bbox_min = np.full(3, np.inf)
+    bbox_max = np.full(3, -np.inf)
+    histogram = np.zeros(0, dtype=np.int64)
+    keys = ([], [])
+
+    for chunk, keys in _lazy_streamlines_chunks(in_tractogram, chunk_size):
+        lengths = np.asarray(chunk._lengths, dtype=np.intp)
+        data = np.asarray(get_compact_data(chunk), dtype=np.float64)
+        if len(data) == 0:
+            continue
+
+        # Steps between consecutive points, without the ones between two
+        # streamlines.
+        steps = np.sqrt(np.sum(np.diff(data, axis=0) ** 2, axis=1))
+        ends = np.cumsum(lengths)
+        is_step = np.ones(len(steps), dtype=bool)
+        is_step[ends[(ends > 0) & (ends < len(data))] - 1] = False
+        steps[~is_step] = 0
+
+        cumulative = np.concatenate(([0.], np.cumsum(steps)))
+        lengths_mm = np.zeros(len(lengths))
+        not_empty = lengths > 0
+        lengths_mm[not_empty] = cumulative[ends[not_empty] - 1] - \
+            cumulative[ends[not_empty] - lengths[not_empty]]
+
+        _update_running_stats(stats['length_mm'], lengths_mm)
+        _update_running_stats(stats['length_nb_points'], lengths)
+        _update_running_stats(stats['step_size'], steps[is_step])
+
+        nb_points += len(data)
+        bbox_min = np.minimum(bbox_min, np.min(data, axis=0))
+        bbox_max = np.maximum(bbox_max, np.max(data, axis=0))
+
+        bins = np.bincount((lengths_mm // bin_size).astype(np.intp))
+        if len(bins) > len(histogram):
+            histogram = np.pad(histogram, (0, len(bins) - len(histogram)))
+        histogram[:len(bins)] += bins
+
+    statistics = {'number_streamlines': int(stats['length_mm']['count']),
+                  'number_points': int(nb_points)}
+    for name in names:
+        empty = stats[name]['count'] == 0
+        statistics.update({
+            'min_' + name: np.nan if empty else float(stats[name]['min']),
+            'mean_' + name: np.nan if empty else float(stats[name]['mean']),
+            'max_' + name: np.nan if empty else float(stats[name]['max']),
+            'std_' + name: np.nan if empty else
+            float(np.sqrt(stats[name]['m2'] / stats[name]['count']))})
+    statistics.update({
+        'bounding_box_min_rasmm': bbox_min.tolist() if nb_points else None,
+        'bounding_box_max_rasmm': bbox_max.tolist() if nb_points else None,
+        'length_histogram_bin_size_mm': float(bin_size),
+        'length_histogram': histogram.tolist(),
+        'data_per_point_keys': keys[0],
+        'data_per_streamline_keys': keys[1]})
+    return statistics
+
+
+def _put_unless_stopped(out_queue, item, stop):
+    """Puts item in a bounded queue, unless stop is set before there is
+    room for it. Returns True if the item was put."""
+    while not stop.is_set():
+        try:
+            out_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _read_streamlines_into_queue(filename, out_queue, stop, chunk_size):
+    """Reader thread of lazy_concatenate: decodes a file by chunks of
+    streamlines and puts them in a bounded queue. Ends with None, or with
+    the exception raised while reading. Returns as soon as stop is set, even
+    if the queue is full."""
+    try:
+        logging.info("Lazy-loading file {}".format(filename))
+        tractogram_file = nib.streamlines.load(filename, lazy_load=True)
+        items = ichunk(tractogram_file.streamlines, chunk_size)
+        for item in items:
+            if not _put_unless_stopped(out_queue, item, stop):
+                return
+    except Exception as e:
+        item = e
+    else:
+        item = None
+    _put_unless_stopped(out_queue, item, stop)
+
+
+def lazy_concatenate(in_tractograms, out_ext, nbr_processes=1,
+                     chunk_size=1000, queue_size=10):
     """
     Concatenates tractograms, if they can be concatenated. Headers must be
     compatible.
 
+    With more than one process, files are decoded by reader threads, ahead
+    of the writer, each one in its own bounded queue of chunks. The order of
+    the streamlines is preserved and the memory used is bounded by
+    nbr_processes * queue_size * chunk_size streamlines.
+
     Parameters
     ----------
     in_tractograms: list
         List of filenames to concatenate
     out_ext: str
         Output format. Accepting .trk and .tck.
+    nbr_processes: int
+        Number of reader threads.
+    chunk_size: int
+        Number of streamlines per chunk, with reader threads.
+    queue_size: int
+        Maximum number of chunks waiting to be written, per reader thread.
 
     Returns
     -------
@@ -60,6 +325,30 @@ def lazy_concatenate(in_tractograms, out_ext):
             for s in tractogram_file.streamlines:
                 yield s
 
+    def threaded_generator_from_nib(filenames):
+        stop = threading.Event()
+        queues = [queue.Queue(maxsize=queue_size) for _ in filenames]
+        # Readers start in the order of the files, and the writer always
+        # empties the queue of the earliest unfinished file, so a reader
+        # blocked on a full queue never prevents the others from starting.
+        executor = ThreadPoolExecutor(max_workers=nbr_processes)
+        try:
+            for filename, file_queue in zip(filenames, queues):
+                executor.submit(_read_streamlines_into_queue, filename,
+                                file_queue, stop, chunk_size)
+            for file_queue in queues:
+                item = file_queue.get()
+                while item is not None:
+                    if isinstance(item, Exception):
+                        raise item
+                    yield from item
+                    item = file_queue.get()
+        finally:
+            # Ends the readers, even those blocked on a full queue, and
+            # cancels those not started (ex, the writer stopped early).
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
     # Verifying headers
     # Header will stay None for tck output. Will become a trk header (for
     # trk output) if we find at least one trk input.
@@ -78,7 +367,259 @@ def lazy_concatenate(in_tractograms, out_ext):
                          "Result cannot be saved as a .trk.")
 
     # Now preparing data
-    generator = list_generator_from_nib(in_tractograms)
+    if nbr_processes is not None and nbr_processes > 1:
+        generator = threaded_generator_from_nib(in_tractograms)
+    else:
+        generator = list_generator_from_nib(in_tractograms)
     out_tractogram = LazyTractogram(lambda: generator,
                                     affine_to_rasmm=np.eye(4))
     return out_tractogram, header
+
+
+def _copy_bytes(in_file, out_file, nb_bytes, buffer_size=2**24):
+    """Copies nb_bytes from the current position of in_file to out_file."""
+    while nb_bytes > 0:
+        buffer = in_file.read(min(buffer_size, nb_bytes))
+        if len(buffer) == 0:
+            raise IOError('Unexpected end of file.')
+        out_file.write(buffer)
+        nb_bytes -= len(buffer)
+
+
+def _get_raw_trk_blocks(in_tractograms):
+    """Returns, for each trk file, the (offset, size, count) of its
+    streamlines records, or None if the records cannot be copied as is:
+    headers must be identical (except for the count) and little-endian, and
+    the count must be known."""
+    count_offset = header_2_dtype.fields['nb_streamlines'][1]
+    reference_header = None
+    blocks = []
+    for in_file in in_tractograms:
+        with open(in_file, 'rb') as f:
+            header = TrkFile._read_header(f)
+            f.seek(0)
+            raw_header = f.read(header['_offset_data'])
+        size = os.path.getsize(in_file) - header['_offset_data']
+        if header['endianness'] != '<' or \
+                (header['nb_streamlines'] == 0 and size > 0):
+            return None
+        # Raw header without the count
+        raw_header = raw_header[:count_offset] + raw_header[count_offset + 4:]
+        if reference_header is None:
+            reference_header = raw_header
+        elif raw_header != reference_header:
+            return None
+        blocks.append((header['_offset_data'], size,
+                       int(header['nb_streamlines'])))
+    return blocks
+
+
+def _get_raw_tck_blocks(in_tractograms):
+    """Returns, for each tck file, the (offset, size, count) of its
+    streamlines data (without the end-of-file delimiter), or None if the
+    data cannot be copied as is: all files must be stored as Float32LE."""
+    blocks = []
+    eof = TckFile.EOF_DELIMITER.astype('<f4').tobytes()
+    for in_file in in_tractograms:
+        with open(in_file, 'rb') as f:
+            header = TckFile._read_header(f)
+            if header['datatype'] != 'Float32LE':
+                return None
+            f.seek(-len(eof), os.SEEK_END)
+            if f.read() != eof:
+                return None
+        size = os.path.getsize(in_file) - header['_offset_data'] - len(eof)
+        blocks.append((header['_offset_data'], size,
+                       int(header['count'])))
+    return blocks
+
+
+def lazy_concatenate_raw(in_tractograms, out_filename):
+    """
+    Concatenates trk or tck files by copying their streamlines records as
+    raw bytes, without decoding them. Only possible when all inputs and the
+    output have the same format and, for trk, identical headers (except for
+    the number of streamlines).
+
+    Parameters
+    ----------
+    in_tractograms: list
+        List of filenames to concatenate.
+    out_filename: str
+        Output filename.
+
+    Returns
+    -------
+    success: bool
+        False if the files could not be concatenated this way (nothing is
+        written). Use lazy_concatenate instead.
+    """
+    _, out_ext = os.path.splitext(out_filename)
+    if out_ext not in ['.trk', '.tck'] or \
+            any(os.path.splitext(f)[1] != out_ext for f in in_tractograms):
+        return False
+
+    if out_ext == '.trk':
+        blocks = _get_raw_trk_blocks(in_tractograms)
+    else:
+        blocks = _get_raw_tck_blocks(in_tractograms)
+    if blocks is None:
+        return False
+    nb_streamlines = sum(block[2] for block in blocks)
+
+    with open(out_filename, 'wb') as out_file:
+        if out_ext == '.trk':
+            with open(in_tractograms[0], 'rb') as f:
+                header = bytearray(f.read(blocks[0][0]))
+            count_dtype, count_offset = header_2_dtype.fields['nb_streamlines']
+            header[count_offset:count_offset + 4] = \
+                np.array(nb_streamlines, dtype=count_dtype).tobytes()
+            out_file.write(header)
+        else:
+            with open(in_tractograms[0], 'rb') as f:
+                header = TckFile._read_header(f)
+            header['nb_streamlines'] = nb_streamlines
+            TckFile._write_header(out_file, header)
+
+        for in_file, (offset, size, _) in zip(in_tractograms, blocks):
+            logging.info("Copying the streamlines of {}".format(in_file))
+            with open(in_file, 'rb') as f:
+                f.seek(offset)
+                _copy_bytes(f, out_file, size)
+
+        if out_ext == '.tck':
+            out_file.write(TckFile.EOF_DELIMITER.astype('<f4').tobytes())
+    return True
+
+
+def _memmap_from_file(filename, dtype, width, nb_rows):
+    """Opens a raw file as a (nb_rows, width) memmap. Copy-on-write mode: the
+    file is never modified, but the array is writable, as required by some
+    cython functions (ex, dipy's set_number_of_points)."""
+    if nb_rows == 0:
+        return np.zeros((0, width), dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='c', shape=(nb_rows, width))
+
+
+def lazy_memmap_tractogram(in_tractogram_path, tmp_dir):
+    """
+    Streams a tractogram file, one streamline at a time, into memory-mapped
+    arrays stored in tmp_dir. The result can then be sliced in any order
+    (ex, to split or shuffle it) without ever loading the whole tractogram in
+    memory.
+
+    Parameters
+    ----------
+    in_tractogram_path: str
+        Tractogram filepath, must be .trk or .tck.
+    tmp_dir: str
+        Directory where the memory-mapped files are written. Must remain
+        available as long as the returned data is used.
+
+    Returns
+    -------
+    streamlines: ArraySequence
+        The streamlines (in rasmm), backed by a memory-mapped file.
+    data_per_streamline: dict
+        Each key is a memory-mapped array of shape (nb_streamlines, x).
+    data_per_point: dict
+        Each key is an ArraySequence backed by a memory-mapped file.
+    header: nibabel header
+        The header of the input file, to be used when saving.
+    """
+    tractogram_file = nib.streamlines.load(in_tractogram_path,
+                                           lazy_load=True)
+
+    # Keeping track of the dtype and width of each data: (dtype, width).
+    formats = {}
+    lengths = []
+
+    def _filename(name):
+        return os.path.join(tmp_dir, '{}.dat'.format(name))
+
+    with ExitStack() as stack:
+        files = {}
+
+        def _write(name, values):
+            values = np.asarray(values)
+            if values.ndim < 2:
+                values = values.reshape((-1, 1))
+            if name not in files:
+                files[name] = stack.enter_context(open(_filename(name), 'wb'))
+                formats[name] = (values.dtype, values.shape[1])
+            files[name].write(
+                np.ascontiguousarray(values, formats[name][0]).tobytes())
+
+        # Only the streamlines generator applies the affine to rasmm. Items
+        # are only read (in parallel) if there is some data to keep.
+        tractogram = tractogram_file.tractogram
+        if len(tractogram.data_per_streamline) + \
+                len(tractogram.data_per_point) > 0:
+            items = iter(tractogram)
+        else:
+            items = None
+
+        for streamline in tractogram.streamlines:
+            lengths.append(len(streamline))
+            _write('streamlines', streamline)
+            if items is not None:
+                item = next(items)
+                for key, value in item.data_for_streamline.items():
+                    _write('dps_' + key, value)
+                for key, value in item.data_for_points.items():
+                    _write('dpp_' + key, value)
+
+    lengths = np.asarray(lengths, dtype=np.intp)
+    nb_points = int(np.sum(lengths))
+
+    dtype, _ = formats.get('streamlines', (np.float32, 3))
+    streamlines = array_sequence_from_flat(
+        _memmap_from_file(_filename('streamlines'), dtype, 3, nb_points),
+        lengths)
+
+    data_per_streamline = {}
+    data_per_point = {}
+    for name, (dtype, width) in formats.items():
+        if name.startswith('dps_'):
+            data_per_streamline[name[4:]] = _memmap_from_file(
+                _filename(name), dtype, width, len(lengths))
+        elif name.startswith('dpp_'):
+            data_per_point[name[4:]] = array_sequence_from_flat(
+                _memmap_from_file(_filename(name), dtype, width, nb_points),
+                lengths)
+
+    return streamlines, data_per_streamline, data_per_point, \
+        tractogram_file.header
+
+
+def lazy_save_subset(streamlines, data_per_streamline, data_per_point,
+                     indices, out_filename, header):
+    """
+    Saves the streamlines at the given indices, in the given order. Typically
+    used with the output of lazy_memmap_tractogram: only the selected
+    streamlines are read from the memory-mapped files, on-the-fly while
+    saving.
+
+    Parameters
+    ----------
+    streamlines: ArraySequence
+        The streamlines, in rasmm.
+    data_per_streamline: dict
+        The data_per_streamline, indexable by indices.
+    data_per_point: dict
+        The data_per_point, indexable by indices.
+    indices: np.ndarray
+        The indices of the streamlines to save.
+    out_filename: str
+        Output filename (.trk or .tck).
+    header: nibabel header
+        The header to use for saving.
+    """
+    indices = np.asarray(indices, dtype=int)
+    tractogram = Tractogram(
+        streamlines[indices],
+        data_per_streamline={k: v[indices]
+                             for k, v in data_per_streamline.items()},
+        data_per_point={k: v[indices] for k, v in data_per_point.items()},
+        affine_to_rasmm=np.eye(4))
+    nib.streamlines.save(tractogram, out_filename, header=header)
@@ -1,11 +1,11 @@
 # -*- coding: utf-8 -*-
 from enum import Enum
-from multiprocessing import Pool
+import multiprocessing
+from multiprocessing import shared_memory
 
 import numpy as np
 from dipy.io.stateful_tractogram import StatefulTractogram
-
-from nibabel.streamlines import ArraySequence
+from numba import njit
 
 from scipy.ndimage import map_coordinates
 
@@ -14,7 +14,8 @@ from scilpy.tractograms.streamline_operations import \
     resample_streamlines_step_size
 
 from scilpy.tractograms.streamline_operations import \
-    filter_streamlines_by_length, _get_point_on_line, _get_streamline_pt_index
+    array_sequence_from_flat, filter_streamlines_by_length, \
+    get_flat_points_indices, _get_point_on_line, _get_streamline_pt_index
 
 
 class CuttingStyle(Enum):
@@ -51,6 +52,152 @@ def get_endpoints_density_map(sft, point_to_select=1, to_millimeters=False):
     return endpoints_map_head + endpoints_map_tail
 
 
+@njit
+def _closest_edge(point, direction, edge):
+    """Same as c_get_closest_edge in streamlines_metrics.pyx (eps=1)."""
+    for c in range(3):
+        if direction[c] >= 0.0:
+            edge[c] = np.floor(point[c] + 1.)
+        else:
+            edge[c] = np.ceil(point[c] - 1.)
+
+
+@njit
+def _traversed_voxels_kernel(data, offsets, lengths, dimensions):
+    """
+    Numba kernel returning, for each streamline, the linear indices of the
+    voxels it traverses, with the same traversal as compute_tract_counts_map
+    (streamlines_metrics.pyx). Returns (streamline_ids, voxel_indices);
+    a voxel may be listed more than once for the same streamline.
+    """
+    capacity = max(16, 2 * int(lengths.sum()))
+    out_ids = np.empty(capacity, dtype=np.int64)
+    out_voxels = np.empty(capacity, dtype=np.int64)
+    nb_out = 0
+
+    in_pt = np.zeros(3)
+    next_pt = np.zeros(3)
+    dir_vect = np.zeros(3)
+    cur_edge = np.zeros(3)
+    voxel = np.zeros(3, dtype=np.int64)
+    for track_idx in range(lengths.shape[0]):
+        start = offsets[track_idx]
+        for pno in range(lengths[track_idx] - 1):
+            for c in range(3):
+                in_pt[c] = data[start + pno, c]
+                next_pt[c] = data[start + pno + 1, c]
+                dir_vect[c] = next_pt[c] - in_pt[c]
+                cur_edge[c] = in_pt[c]
+            dir_vect_norm = np.sqrt(dir_vect[0] ** 2 + dir_vect[1] ** 2 +
+                                    dir_vect[2] ** 2)
+            if dir_vect_norm == 0:
+                continue
+            remaining_dist = dir_vect_norm
+
+            if np.floor(cur_edge[0]) != cur_edge[0] and \
+                    np.floor(cur_edge[1]) != cur_edge[1] and \
+                    np.floor(cur_edge[2]) != cur_edge[2]:
+                _closest_edge(in_pt, dir_vect, cur_edge)
+
+            while True:
+                length_ratio = 10000.
+                for c in range(3):
+                    if dir_vect[c] != 0:
+                        length_ratio = min(abs((cur_edge[c] - in_pt[c]) /
+                                               dir_vect[c]), length_ratio)
+                remaining_dist -= length_ratio * dir_vect_norm
+                if remaining_dist < 0 and not abs(remaining_dist) < 1e-8:
+                    break
+
+                for c in range(3):
+                    voxel[c] = int(np.floor(in_pt[c] + 0.5 * length_ratio *
+                                            dir_vect[c]))
+                if nb_out == capacity:
+                    capacity *= 2
+                    out_ids = _grow(out_ids, capacity)
+                    out_voxels = _grow(out_voxels, capacity)
+                nb_out = _add_voxel(out_ids, out_voxels, nb_out, track_idx,
+                                    voxel, dimensions)
+
+                for c in range(3):
+                    in_pt[c] = length_ratio * dir_vect[c] + in_pt[c]
+                    if abs(in_pt[c]) <= 1e-16:
+                        in_pt[c] = 0.0
+                _closest_edge(in_pt, dir_vect, cur_edge)
+
+        # Add last point
+        for c in range(3):
+            voxel[c] = int(np.floor(in_pt[c] + 0.5 * (next_pt[c] - in_pt[c])))
+        if nb_out == capacity:
+            capacity *= 2
+            out_ids = _grow(out_ids, capacity)
+            out_voxels = _grow(out_voxels, capacity)
+        nb_out = _add_voxel(out_ids, out_voxels, nb_out, track_idx, voxel,
+                            dimensions)
+
+    return out_ids[:nb_out], out_voxels[:nb_out]
+
+
+@njit
+def _grow(array, capacity):
+    new_array = np.empty(capacity, dtype=array.dtype)
+    new_array[:array.shape[0]] = array
+    return new_array
+
+
+@njit
+def _add_voxel(out_ids, out_voxels, nb_out, track_idx, voxel, dimensions):
+    """Adds the voxel if it is in the volume and if it is not the same as
+    the previous one. Returns the new number of voxels."""
+    for c in range(3):
+        if voxel[c] < 0 or voxel[c] >= dimensions[c]:
+            return nb_out
+    el_no = (voxel[0] * dimensions[1] + voxel[1]) * dimensions[2] + voxel[2]
+    if nb_out > 0 and out_ids[nb_out - 1] == track_idx and \
+            out_voxels[nb_out - 1] == el_no:
+        return nb_out
+    out_ids[nb_out] = track_idx
+    out_voxels[nb_out] = el_no
+    return nb_out + 1
+
+
+def get_sparse_density_map(streamlines, dimensions):
+    """
+    Compute the density map of the streamlines (the number of streamlines
+    traversing each voxel, as compute_tract_counts_map), in a sparse
+    representation: only the traversed voxels are kept. Memory and time
+    scale with the size of the bundle instead of the size of the image.
+
+    Parameters
+    ----------
+    streamlines: ArraySequence
+        The streamlines, in voxel space, corner origin.
+    dimensions: tuple
+        The dimensions of the image.
+
+    Returns
+    -------
+    indices: np.ndarray
+        The sorted linear indices (C order, see np.unravel_index) of the
+        voxels traversed by at least one streamline.
+    counts: np.ndarray
+        The number of streamlines traversing each of these voxels.
+    """
+    dimensions = np.asarray(dimensions[:3], dtype=np.int64)
+    if len(streamlines) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    ids, voxels = _traversed_voxels_kernel(
+        streamlines._data,
+        np.asarray(streamlines._offsets, dtype=np.int64),
+        np.asarray(streamlines._lengths, dtype=np.int64), dimensions)
+
+    # Each streamline is counted once per voxel, even if it comes back.
+    nb_voxels = np.prod(dimensions)
+    pairs = np.unique(ids * nb_voxels + voxels)
+    return np.unique(pairs % nb_voxels, return_counts=True)
+
+
 def get_head_tail_density_maps(sft, point_to_select=1, to_millimeters=False):
     """
     Compute two separate endpoints density maps for the head and tail of
@@ -254,6 +401,146 @@ def _trim_streamline_in_mask_keep_longest(
     return [cut_strl]
 
 
+def _cut_streamlines_chunk(streamlines, volumes, cut_func):
+    """
+    Cuts a chunk of streamlines with cut_func.
+
+    Parameters
+    ----------
+    streamlines: ArraySequence
+        The streamlines, in voxel space, corner origin.
+    volumes: list[np.ndarray]
+        The volumes (masks or labels) given to cut_func after the
+        streamline's indices, points and mapping.
+    cut_func: callable
+        One of the _trim_streamline_* or _cut_streamline_* functions. Must
+        return a list of new streamlines.
+
+    Returns
+    -------
+    data: np.ndarray
+        The points of all new streamlines, concatenated.
+    lengths: np.ndarray
+        The number of points of each new streamline.
+    """
+    # Get the indices of the voxels
+    # intersected by the streamlines and the mapping from points to indices
+    indices, points_to_idx = streamlines_to_voxel_coordinates(
+        streamlines, return_mapping=True)
+
+    if not np.array_equal(streamlines._lengths, points_to_idx._lengths):
+        raise ValueError("Error in the streamlines_to_voxel_coordinates "
+                         "function. Try running the "
+                         "scil_tractogram_remove_invalid.py script with the \n"
+                         "--remove_single_point and "
+                         "--remove_overlapping_points options.")
+
+    new_strmls = [strml for (i, s, pt) in zip(indices, streamlines,
+                                              points_to_idx)
+                  for strml in cut_func(i, s, pt, *volumes)]
+    lengths = np.asarray([len(strml) for strml in new_strmls], dtype=np.intp)
+    if len(new_strmls) == 0:
+        return np.zeros((0, 3), dtype=streamlines._data.dtype), lengths
+    return np.concatenate(new_strmls), lengths
+
+
+def _init_shared_cut_args(descriptions):
+    """
+    Pool initializer: attaches the shared memory blocks (streamlines and
+    volumes) once per process, and keeps them in a global for easier access
+    by _cut_streamlines_shared_chunk.
+    """
+    global shared_cut_args
+    blocks = [shared_memory.SharedMemory(name=name)
+              for name, _, _ in descriptions]
+    arrays = [np.ndarray(shape, dtype=dtype, buffer=block.buf)
+              for block, (_, shape, dtype) in zip(blocks, descriptions)]
+    shared_cut_args = (blocks, arrays)
+
+
+def _cut_streamlines_shared_chunk(start, end, cut_func):
+    """
+    multiprocessing.pool.starmap input function. Cuts the streamlines
+    [start, end[ from the shared memory (see _init_shared_cut_args).
+    """
+    data, offsets, *volumes = shared_cut_args[1]
+    streamlines = array_sequence_from_flat(
+        data[offsets[start]:offsets[end]],
+        np.diff(offsets[start:end + 1]))
+    return _cut_streamlines_chunk(streamlines, volumes, cut_func)
+
+
+def _cut_streamlines_by_chunks(streamlines, volumes, cut_func, processes=1,
+                               chunk_size=10000):
+    """
+    Cuts all streamlines with cut_func. With more than one process, the
+    streamlines and volumes are placed in shared memory once, and each
+    process receives contiguous ranges of streamlines.
+
+    Parameters
+    ----------
+    streamlines: ArraySequence
+        The streamlines, in voxel space, corner origin.
+    volumes: list[np.ndarray]
+        The volumes (masks or labels) given to cut_func.
+    cut_func: callable
+        A module-level function returning a list of new streamlines. See
+        _cut_streamlines_chunk.
+    processes: int
+        Number of processes to use.
+    chunk_size: int
+        Maximal number of streamlines sent to a process at once.
+
+    Returns
+    -------
+    new_strmls: ArraySequence
+        The new streamlines, as a single flat buffer.
+    """
+    nb_streamlines = len(streamlines)
+    if processes <= 1 or nb_streamlines <= 1:
+        return array_sequence_from_flat(
+            *_cut_streamlines_chunk(streamlines, volumes, cut_func))
+
+    # Contiguous ranges of streamlines, at least one per process.
+    nb_chunks = max(processes, int(np.ceil(nb_streamlines / chunk_size)))
+    bounds = np.linspace(0, nb_streamlines,
+                         min(nb_chunks, nb_streamlines) + 1).astype(int)
+
+    # Offsets of the compacted data, computed once for all the chunks.
+    offsets = np.concatenate(([0], np.cumsum(streamlines._lengths,
+                                             dtype=np.intp)))
+    arrays = [streamlines._data[get_flat_points_indices(streamlines)],
+              offsets] + \
+        [np.asarray(v) for v in volumes]
+    blocks = []
+    try:
+        descriptions = []
+        for arr in arrays:
+            block = shared_memory.SharedMemory(create=True,
+                                               size=max(arr.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[:] = arr
+            descriptions.append((block.name, arr.shape, arr.dtype))
+
+        # Spawn: forking after numba's threads started (ex, when resampling
+        # the streamlines first) may hang the process.
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(processes, initializer=_init_shared_cut_args,
+                      initargs=(descriptions,)) as pool:
+            results = pool.starmap(
+                _cut_streamlines_shared_chunk,
+                [(start, end, cut_func)
+                 for start, end in zip(bounds[:-1], bounds[1:])])
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return array_sequence_from_flat(
+        np.concatenate([data for data, _ in results]),
+        np.concatenate([lengths for _, lengths in results]))
+
+
 def cut_streamlines_with_mask(
     sft, mask, cutting_style=CuttingStyle.DEFAULT, min_len=0, processes=1
 ):
@@ -292,20 +579,6 @@ def cut_streamlines_with_mask(
     sft.to_vox()
     sft.to_corner()
 
-    # Get the indices of the voxels
-    # intersected by the streamlines and the mapping from points to indices
-    indices, points_to_idx = streamlines_to_voxel_coordinates(
-        sft.streamlines,
-        return_mapping=True
-    )
-
-    if len(sft.streamlines[0]) != len(points_to_idx[0]):
-        raise ValueError("Error in the streamlines_to_voxel_coordinates "
-                         "function. Try running the "
-                         "scil_tractogram_remove_invalid.py script with the \n"
-                         "--remove_single_point and "
-                         "--remove_overlapping_points options.")
-
     # Select the trimming function. If keep_longest is set, the longest
     # segment of the streamline that crosses the mask will be kept. If
     # trim_endpoints is set, the endpoints of the streamlines will be cut.
@@ -318,15 +591,8 @@ def cut_streamlines_with_mask(
         trim_func = _trim_streamline_in_mask
 
     # Trim streamlines with the mask and return the new streamlines
-    pool = Pool(processes)
-    lists_of_new_strmls = pool.starmap(
-        trim_func, [(i, s, pt, mask) for (i, s, pt) in zip(
-            indices, sft.streamlines, points_to_idx)])
-    pool.close()
-    # Flatten the list of lists of new streamlines in a single list of
-    # new streamlines
-    new_strmls = ArraySequence([strml for list_of_strml in lists_of_new_strmls
-                                for strml in list_of_strml])
+    new_strmls = _cut_streamlines_by_chunks(sft.streamlines, [mask],
+                                            trim_func, processes)
 
     new_sft = StatefulTractogram.from_sft(
         new_strmls, sft)
@@ -359,6 +625,8 @@ def cut_streamlines_between_labels(
         in the label map will be used.
     min_len: float
         Minimum length from the resulting streamlines.
+    processes: int
+        Number of processes to use.
 
     Returns
     -------
@@ -386,31 +654,10 @@ def cut_streamlines_between_labels(
     mask = label_data_2 != unique_vals[1]
     label_data_2[mask] = 0
 
-    (indices, points_to_idx) = streamlines_to_voxel_coordinates(
-        sft.streamlines,
-        return_mapping=True
-    )
-
-    if len(sft.streamlines[0]) != len(points_to_idx[0]):
-        raise ValueError("Error in the streamlines_to_voxel_coordinates "
-                         "function. Try running the "
-                         "scil_tractogram_remove_invalid.py script with the \n"
-                         "--remove_single_point and "
-                         "--remove_overlapping_points options.")
-
-    # Trim streamlines with the mask and return the new streamlines
-    pool = Pool(processes)
-    lists_of_new_strmls = pool.starmap(
-        _cut_streamline_with_labels, [(i, s, pt, label_data_1, label_data_2)
-                                      for (i, s, pt) in zip(
-                                          indices, sft.streamlines,
-                                          points_to_idx)])
-    pool.close()
-    # Flatten the list of lists of new streamlines in a single list of
-    # new streamlines
-    list_of_new_strmls = [strml for strml in lists_of_new_strmls
-                          if strml is not None]
-    new_strmls = ArraySequence(list_of_new_strmls)
+    # Trim streamlines with the masks and return the new streamlines
+    new_strmls = _cut_streamlines_by_chunks(
+        sft.streamlines, [label_data_1, label_data_2],
+        _cut_streamline_with_labels, processes)
 
     new_sft = StatefulTractogram.from_sft(
         new_strmls, sft)
@@ -454,7 +701,6 @@ def _cut_streamline_with_labels(
                                                      roi_data_2,
                                                      idx)
 
-    cut_strl = None
     # If the streamline intersects both ROIs
     if in_strl_idx is not None and out_strl_idx is not None:
         # Compute the new streamline by keeping only the segment between
@@ -462,7 +708,8 @@ def _cut_streamline_with_labels(
         cut_strl = compute_streamline_segment(streamline, idx,
                                               in_strl_idx, out_strl_idx,
                                               pts_to_idx)
-    return cut_strl
+        return [cut_strl]
+    return []
 
 
 def _get_longest_streamline_segment_in_roi(all_strl_indices):
@@ -1,16 +1,18 @@
 # -*- coding: utf-8 -*-
 import copy
 import logging
-from multiprocessing import Pool
+import multiprocessing
 
+import numba
 import numpy as np
 import scipy.ndimage as ndi
 from dipy.io.stateful_tractogram import StatefulTractogram
 from dipy.segment.clustering import qbx_and_merge
 from dipy.tracking import metrics as tm
-from dipy.tracking.streamlinespeed import (compress_streamlines,
-                                           length,
-                                           set_number_of_points)
+from dipy.tracking.distances import bundles_distances_mdf
+from dipy.tracking.streamlinespeed import length, set_number_of_points
+from nibabel.streamlines.array_sequence import ArraySequence
+from numba import njit, prange
 from scipy.interpolate import splev, splprep
 from scipy.spatial.transform import Rotation
 
@@ -156,10 +158,11 @@ def get_streamlines_as_linspaces(sft):
     return positions
 
 
-def compress_sft(sft, tol_error=0.01):
+def compress_sft(sft, tol_error=0.01, nbr_processes=1):
     """
-    Compress a stateful tractogram. Uses Dipy's compress_streamlines, but
-    deals with space better.
+    Compress a stateful tractogram. Uses the same algorithm as Dipy's
+    compress_streamlines, but deals with space better and keeps the
+    data_per_point of the remaining points.
 
     Dipy's description:
     The compression consists in merging consecutive segments that are
@@ -189,28 +192,31 @@ def compress_sft(sft, tol_error=0.01):
         Tolerance error in mm (default: 0.01). A rule of thumb is to set it
         to 0.01mm for deterministic streamlines and 0.1mm for probabilitic
         streamlines.
+    nbr_processes: int
+        Number of threads to use.
 
     Returns
     -------
     compressed_sft: StatefulTractogram
+        The compressed tractogram, in the same space as the input. The input
+        sft is moved to rasmm for the computation, then back to its original
+        space.
     """
     # Go to world space
     orig_space = sft.space
     sft.to_rasmm()
 
     # Compress streamlines
-    compressed_streamlines = compress_streamlines(sft.streamlines,
-                                                  tol_error=tol_error)
-    if sft.data_per_point is not None and sft.data_per_point.keys():
-        logging.warning("Initial StatefulTractogram contained data_per_point. "
-                        "This information will not be carried in the final "
-                        "tractogram.")
+    compressed_streamlines, dpp = compress_streamlines_flat(
+        sft.streamlines, tol_error=tol_error,
+        data_per_point=sft.data_per_point, nbr_processes=nbr_processes)
 
     compressed_sft = StatefulTractogram.from_sft(
-        compressed_streamlines, sft,
+        compressed_streamlines, sft, data_per_point=dpp,
         data_per_streamline=sft.data_per_streamline)
 
     # Return to original space
+    sft.to_space(orig_space)
     compressed_sft.to_space(orig_space)
 
     return compressed_sft
@@ -508,9 +514,396 @@ def filter_streamlines_by_total_length_per_dim(
     return filtered_sft, np.nonzero(mask_good_ids), rejected_sft
 
 
-def resample_streamlines_num_points(sft, num_points):
+def get_flat_points_indices(streamlines):
+    """
+    Returns, for each point of each streamline (in order), its row index in
+    the flat data buffer of the ArraySequence. Useful to work directly on
+    streamlines._data, even when the ArraySequence is a sliced view (which
+    can reuse, skip or reorder rows of the buffer).
+
+    Parameters
+    ----------
+    streamlines: ArraySequence
+        The streamlines.
+
+    Returns
+    -------
+    indices: np.ndarray
+        Array of shape (total_nb_points,), of type np.intp.
+    """
+    lengths = np.asarray(streamlines._lengths, dtype=np.intp)
+    offsets = np.asarray(streamlines._offsets, dtype=np.intp)
+    if len(lengths) == 0:
+        return np.zeros(0, dtype=np.intp)
+
+    # Position of each point within its own streamline.
+    compact_offsets = np.cumsum(lengths) - lengths
+    local = np.arange(np.sum(lengths), dtype=np.intp) - \
+        np.repeat(compact_offsets, lengths)
+    return np.repeat(offsets, lengths) + local
+
+
+def array_sequence_from_flat(data, lengths):
+    """
+    Builds an ArraySequence directly from a flat data buffer, without copying
+    the data.
+
+    Parameters
+    ----------
+    data: np.ndarray
+        The concatenated points (or values) of all streamlines, of shape
+        (total_nb_points, ...).
+    lengths: np.ndarray
+        The number of points of each streamline.
+
+    Returns
+    -------
+    seq: ArraySequence
+    """
+    # Contiguous: some Cython functions walk the lengths with a pointer.
+    lengths = np.ascontiguousarray(lengths, dtype=np.intp)
+    seq = ArraySequence()
+    seq._data = data
+    seq._lengths = lengths
+    seq._offsets = np.cumsum(lengths) - lengths
+    return seq
+
+
+def get_compact_data(seq):
     """
-    Resample streamlines using number of points per streamline
+    Returns the data of an ArraySequence, in the order of its elements (as
+    seq.copy()._data would). No copy is made if the buffer is already
+    compact.
+
+    Parameters
+    ----------
+    seq: ArraySequence
+        The streamlines (or data_per_point).
+
+    Returns
+    -------
+    data: np.ndarray
+        Array of shape (total_nb_points, ...).
+    """
+    indices = get_flat_points_indices(seq)
+    if len(indices) == len(seq._data) and \
+            np.array_equal(indices, np.arange(len(indices))):
+        return seq._data
+    return seq._data[indices]
+
+
+def iter_compact_data(seq, chunk_size=10000):
+    """
+    Iterates over the data of an ArraySequence, in the order of its elements
+    (as get_compact_data would return it), a few elements at the time. Only
+    one chunk is in memory at once, even if the sequence is a view on a
+    memory-mapped buffer.
+
+    Parameters
+    ----------
+    seq: ArraySequence
+        The streamlines (or data_per_point).
+    chunk_size: int
+        Number of elements (ex, streamlines) per chunk.
+
+    Yields
+    ------
+    data: np.ndarray
+        The data of the next chunk_size elements, of shape (nb_points, ...).
+    """
+    offsets = np.asarray(seq._offsets, dtype=np.int64)
+    lengths = np.asarray(seq._lengths, dtype=np.int64)
+    for start in range(0, len(lengths), chunk_size):
+        chunk_offsets = offsets[start:start + chunk_size]
+        chunk_lengths = lengths[start:start + chunk_size]
+        nb_points = np.sum(chunk_lengths)
+        if nb_points == 0:
+            continue
+        ends = np.cumsum(chunk_lengths)
+        first = chunk_offsets[0]
+        if np.array_equal(chunk_offsets - first, ends - chunk_lengths):
+            # Contiguous chunk: a simple slice, no fancy indexing.
+            yield seq._data[first:first + nb_points]
+        else:
+            rows = np.repeat(chunk_offsets - (ends - chunk_lengths),
+                             chunk_lengths) + np.arange(nb_points)
+            yield seq._data[rows]
+
+
+def _set_numba_threads(nbr_processes):
+    """Sets the number of numba threads, within the allowed range. Returns
+    the previous value so it can be restored."""
+    previous = numba.get_num_threads()
+    nbr_processes = nbr_processes or numba.config.NUMBA_NUM_THREADS
+    numba.set_num_threads(int(max(1, min(nbr_processes,
+                                         numba.config.NUMBA_NUM_THREADS))))
+    return previous
+
+
+@njit(parallel=True)
+def _resample_flat_kernel(data, offsets, lengths, out_lengths,
+                          out_idx0, out_idx1, out_ratio):
+    """
+    Numba kernel computing, for each output point, the two flat indices
+    between which it must be interpolated, and the interpolation ratio.
+    Follows the same arc-length logic as dipy's set_number_of_points.
+    Outputs must be preallocated to sum(out_lengths).
+    """
+    nb_streamlines = lengths.shape[0]
+    out_offsets = np.zeros(nb_streamlines, dtype=np.int64)
+    for i in range(1, nb_streamlines):
+        out_offsets[i] = out_offsets[i - 1] + out_lengths[i - 1]
+
+    for i in prange(nb_streamlines):
+        start = offsets[i]
+        n = lengths[i]
+        new_n = out_lengths[i]
+        pos = out_offsets[i]
+
+        if n < 2:
+            for k in range(new_n):
+                out_idx0[pos + k] = start
+                out_idx1[pos + k] = start
+                out_ratio[pos + k] = 0.
+            continue
+
+        # Arc length at each point
+        arclengths = np.zeros(n, dtype=np.float64)
+        for j in range(1, n):
+            seg = 0.
+            for d in range(3):
+                diff = data[start + j, d] - data[start + j - 1, d]
+                seg += diff * diff
+            arclengths[j] = arclengths[j - 1] + np.sqrt(seg)
+
+        step = arclengths[n - 1] / (new_n - 1)
+        j = 0
+        for k in range(new_n - 1):
+            target = k * step
+            while j < n - 2 and arclengths[j + 1] < target:
+                j += 1
+            seg_len = arclengths[j + 1] - arclengths[j]
+            ratio = 0.
+            if seg_len > 0.:
+                ratio = (target - arclengths[j]) / seg_len
+            out_idx0[pos + k] = start + j
+            out_idx1[pos + k] = start + j + 1
+            out_ratio[pos + k] = min(max(ratio, 0.), 1.)
+
+        # Last point always the one from the original streamline.
+        out_idx0[pos + new_n - 1] = start + n - 1
+        out_idx1[pos + new_n - 1] = start + n - 1
+        out_ratio[pos + new_n - 1] = 0.
+
+
+@njit(parallel=True)
+def _compress_flat_kernel(data, offsets, lengths, tol_error,
+                          max_segment_length, keep):
+    """
+    Numba kernel flagging the points to keep when compressing streamlines.
+    Follows the same linearization logic as dipy's compress_streamlines.
+    keep must be preallocated (to False) to sum(lengths): it is indexed in
+    the compact order of the streamlines, not in the data buffer order.
+    """
+    nb_streamlines = lengths.shape[0]
+    compact_offsets = np.zeros(nb_streamlines, dtype=np.int64)
+    for i in range(1, nb_streamlines):
+        compact_offsets[i] = compact_offsets[i - 1] + lengths[i - 1]
+
+    for i in prange(nb_streamlines):
+        start = offsets[i]
+        n = lengths[i]
+        pos = compact_offsets[i]
+
+        if n <= 2:
+            for k in range(n):
+                keep[pos + k] = True
+            continue
+
+        # First point is always kept.
+        keep[pos] = True
+        prev_idx = 0
+        for next_idx in range(2, n):
+            # Distance between last kept point and current point.
+            seg = 0.
+            for d in range(3):
+                diff = data[start + next_idx, d] - data[start + prev_idx, d]
+                seg += diff * diff
+            seg = np.sqrt(seg)
+
+            if seg > max_segment_length:
+                keep[pos + next_idx - 1] = True
+                prev_idx = next_idx - 1
+                continue
+
+            # Check that each point is not offset by more than tol_error.
+            for k in range(prev_idx + 1, next_idx):
+                # Distance from point k to the line (prev_idx, next_idx)
+                ax = data[start + next_idx, 0] - data[start + prev_idx, 0]
+                ay = data[start + next_idx, 1] - data[start + prev_idx, 1]
+                az = data[start + next_idx, 2] - data[start + prev_idx, 2]
+                bx = data[start + k, 0] - data[start + prev_idx, 0]
+                by = data[start + k, 1] - data[start + prev_idx, 1]
+                bz = data[start + k, 2] - data[start + prev_idx, 2]
+                cx = ay * bz - az * by
+                cy = az * bx - ax * bz
+                cz = ax * by - ay * bx
+                if seg > 0.:
+                    dist = np.sqrt(cx * cx + cy * cy + cz * cz) / seg
+                else:
+                    dist = np.sqrt(bx * bx + by * by + bz * bz)
+
+                if dist > tol_error:
+                    keep[pos + next_idx - 1] = True
+                    prev_idx = next_idx - 1
+                    break
+
+        # Last point is always kept.
+        keep[pos + n - 1] = True
+
+
+def _interpolate_flat(data, idx0, idx1, ratio):
+    """Interpolates rows of a flat buffer. Non-float data (ex, labels)
+    takes the value of the nearest point instead."""
+    if np.issubdtype(data.dtype, np.floating):
+        r = ratio.reshape((-1,) + (1,) * (data.ndim - 1))
+        return ((1. - r) * data[idx0] + r * data[idx1]).astype(data.dtype)
+    return np.where((ratio >= 0.5).reshape((-1,) + (1,) * (data.ndim - 1)),
+                    data[idx1], data[idx0])
+
+
+def resample_streamlines_flat(streamlines, nb_points, data_per_point=None,
+                              nbr_processes=1):
+    """
+    Resamples all streamlines at once, working directly on the flat data
+    buffer of the ArraySequence. Gives the same result as dipy's
+    set_number_of_points, but also interpolates the data_per_point.
+
+    Parameters
+    ----------
+    streamlines: ArraySequence
+        The streamlines to resample.
+    nb_points: int or np.ndarray
+        Number of points of the output streamlines, either the same for all
+        streamlines or one value per streamline. Must be at least 2.
+    data_per_point: dict, optional
+        Dictionary of ArraySequence (ex, sft.data_per_point). Float data is
+        linearly interpolated, other types take the nearest point's value.
+    nbr_processes: int
+        Number of threads to use.
+
+    Returns
+    -------
+    new_streamlines: ArraySequence
+        The resampled streamlines.
+    new_data_per_point: dict
+        The resampled data_per_point. Empty if data_per_point is None.
+    """
+    streamlines = ArraySequence(streamlines)
+    lengths = np.asarray(streamlines._lengths, dtype=np.int64)
+    out_lengths = np.broadcast_to(np.asarray(nb_points, dtype=np.int64),
+                                  lengths.shape).copy()
+    if np.any(out_lengths < 2):
+        raise ValueError("The number of points should be greater than 1!")
+
+    total = int(np.sum(out_lengths))
+    idx0 = np.empty(total, dtype=np.int64)
+    idx1 = np.empty(total, dtype=np.int64)
+    ratio = np.empty(total, dtype=np.float64)
+
+    data = streamlines._data
+    if len(lengths):
+        previous = _set_numba_threads(nbr_processes)
+        try:
+            _resample_flat_kernel(data, streamlines._offsets.astype(np.int64),
+                                  lengths, out_lengths, idx0, idx1, ratio)
+        finally:
+            numba.set_num_threads(previous)
+
+    new_streamlines = array_sequence_from_flat(
+        _interpolate_flat(data, idx0, idx1, ratio).reshape((total, 3)),
+        out_lengths)
+
+    new_data_per_point = {}
+    if data_per_point is not None:
+        # idx are indices in the streamlines' buffer. Convert to the dpp's
+        # own buffer, which may be organized differently.
+        first = np.repeat(streamlines._offsets, out_lengths)
+        for key in data_per_point.keys():
+            dpp = ArraySequence(data_per_point[key])
+            dpp_first = np.repeat(dpp._offsets, out_lengths)
+            new_data_per_point[key] = array_sequence_from_flat(
+                _interpolate_flat(dpp._data, idx0 - first + dpp_first,
+                                  idx1 - first + dpp_first, ratio),
+                out_lengths)
+
+    return new_streamlines, new_data_per_point
+
+
+def compress_streamlines_flat(streamlines, tol_error=0.01,
+                              max_segment_length=10., data_per_point=None,
+                              nbr_processes=1):
+    """
+    Compresses all streamlines at once, working directly on the flat data
+    buffer of the ArraySequence. Gives the same result as dipy's
+    compress_streamlines, but also keeps the data_per_point of the remaining
+    points.
+
+    Parameters
+    ----------
+    streamlines: ArraySequence
+        The streamlines to compress. Should be in rasmm space.
+    tol_error: float
+        Tolerance error in mm. See compress_sft for more information.
+    max_segment_length: float
+        Maximum length, in mm, of any segment of the compressed streamlines.
+    data_per_point: dict, optional
+        Dictionary of ArraySequence (ex, sft.data_per_point).
+    nbr_processes: int
+        Number of threads to use.
+
+    Returns
+    -------
+    new_streamlines: ArraySequence
+        The compressed streamlines.
+    new_data_per_point: dict
+        The compressed data_per_point. Empty if data_per_point is None.
+    """
+    streamlines = ArraySequence(streamlines)
+    lengths = np.asarray(streamlines._lengths, dtype=np.int64)
+    keep = np.zeros(int(np.sum(lengths)), dtype=bool)
+    if len(lengths):
+        previous = _set_numba_threads(nbr_processes)
+        try:
+            _compress_flat_kernel(streamlines._data,
+                                  streamlines._offsets.astype(np.int64),
+                                  lengths, float(tol_error),
+                                  float(max_segment_length), keep)
+        finally:
+            numba.set_num_threads(previous)
+
+    # Number of kept points per streamline
+    strl_ids = np.repeat(np.arange(len(lengths)), lengths)
+    out_lengths = np.bincount(strl_ids[keep], minlength=len(lengths))
+
+    new_streamlines = array_sequence_from_flat(
+        streamlines._data[get_flat_points_indices(streamlines)[keep]],
+        out_lengths)
+
+    new_data_per_point = {}
+    if data_per_point is not None:
+        for key in data_per_point.keys():
+            dpp = ArraySequence(data_per_point[key])
+            new_data_per_point[key] = array_sequence_from_flat(
+                dpp._data[get_flat_points_indices(dpp)[keep]], out_lengths)
+
+    return new_streamlines, new_data_per_point
+
+
+def resample_streamlines_num_points(sft, num_points, nbr_processes=1):
+    """
+    Resample streamlines using number of points per streamline. The
+    data_per_point is interpolated along the streamlines.
 
     Parameters
     ----------
@@ -518,6 +911,8 @@ def resample_streamlines_num_points(sft, num_points):
         SFT containing the streamlines to subsample.
     num_points: int
         Number of points per streamline in the output.
+    nbr_processes: int
+        Number of threads to use.
 
     Return
     ------
@@ -530,18 +925,21 @@ def resample_streamlines_num_points(sft, num_points):
         raise ValueError("The value of num_points should be greater than 1!")
 
     # Resampling
-    lines = set_number_of_points(sft.streamlines, num_points)
+    lines, dpp = resample_streamlines_flat(sft.streamlines, num_points,
+                                           sft.data_per_point, nbr_processes)
 
     # Creating sft
-    # CAREFUL. Data_per_point will be lost.
-    resampled_sft = _warn_and_save(lines, sft)
+    resampled_sft = StatefulTractogram.from_sft(
+        lines, sft, data_per_point=dpp,
+        data_per_streamline=sft.data_per_streamline)
 
     return resampled_sft
 
 
-def resample_streamlines_step_size(sft, step_size):
+def resample_streamlines_step_size(sft, step_size, nbr_processes=1):
     """
-    Resample streamlines using a fixed step size.
+    Resample streamlines using a fixed step size. The data_per_point is
+    interpolated along the streamlines.
 
     Parameters
     ----------
@@ -549,6 +947,8 @@ def resample_streamlines_step_size(sft, step_size):
         SFT containing the streamlines to subsample.
     step_size: float
         Size of the new steps, in mm.
+    nbr_processes: int
+        Number of threads to use.
 
     Return
     ------
@@ -573,37 +973,26 @@ def resample_streamlines_step_size(sft, step_size):
     # Resampling
     lengths = length(sft.streamlines)
     nb_points = np.ceil(lengths / step_size).astype(int)
-    if np.any(nb_points == 1):
+    if np.any(nb_points < 2):
         logging.warning("Some streamlines are shorter than the provided "
                         "step size...")
-        nb_points[nb_points == 1] = 2
+    nb_points[nb_points < 2] = 2
 
-    resampled_streamlines = [set_number_of_points(s, n) for s, n in
-                             zip(sft.streamlines, nb_points)]
+    resampled_streamlines, dpp = resample_streamlines_flat(
+        sft.streamlines, nb_points, sft.data_per_point, nbr_processes)
 
     # Creating sft
-    resampled_sft = _warn_and_save(resampled_streamlines, sft)
+    resampled_sft = StatefulTractogram.from_sft(
+        resampled_streamlines, sft, data_per_point=dpp,
+        data_per_streamline=sft.data_per_streamline)
 
     # Return to original space
+    sft.to_space(orig_space)
     resampled_sft.to_space(orig_space)
 
     return resampled_sft
 
 
-def _warn_and_save(new_streamlines, sft):
-    """Last step of the two resample functions:
-    Warn that we loose data_per_point, then create resampled SFT."""
-
-    if sft.data_per_point is not None and sft.data_per_point.keys():
-        logging.info("Initial StatefulTractogram contained data_per_point. "
-                     "This information will not be carried in the final "
-                     "tractogram.")
-    new_sft = StatefulTractogram.from_sft(
-        new_streamlines, sft, data_per_streamline=sft.data_per_streamline)
-
-    return new_sft
-
-
 def smooth_line_gaussian(streamline, sigma):
     """
     Smooths a streamline using a gaussian filter. Enforces the endpoints to
@@ -692,6 +1081,155 @@ def smooth_line_spline(streamline, smoothing_parameter, nb_ctrl_points):
     return smoothed_streamline
 
 
+@njit(parallel=True)
+def _gaussian_smoothing_flat_kernel(data, offsets, lengths, weights, out):
+    """
+    Numba kernel convolving each streamline with the given (symmetric)
+    weights, independently for each streamline, using the same 'reflect'
+    boundary mode as scipy.ndimage.gaussian_filter1d. Endpoints are kept.
+    out must be preallocated to sum(lengths), in compact order.
+    """
+    nb_streamlines = lengths.shape[0]
+    radius = (weights.shape[0] - 1) // 2
+    compact_offsets = np.zeros(nb_streamlines, dtype=np.int64)
+    for i in range(1, nb_streamlines):
+        compact_offsets[i] = compact_offsets[i - 1] + lengths[i - 1]
+
+    for i in prange(nb_streamlines):
+        start = offsets[i]
+        n = lengths[i]
+        pos = compact_offsets[i]
+        for k in range(n):
+            if k == 0 or k == n - 1:
+                for d in range(3):
+                    out[pos + k, d] = data[start + k, d]
+                continue
+
+            for d in range(3):
+                out[pos + k, d] = 0.
+            for m in range(-radius, radius + 1):
+                # Reflect mode: (d c b a | a b c d | d c b a)
+                j = (k + m) % (2 * n)
+                if j >= n:
+                    j = 2 * n - 1 - j
+                for d in range(3):
+                    out[pos + k, d] += weights[m + radius] * \
+                        data[start + j, d]
+
+
+def smooth_streamlines_gaussian(streamlines, sigma, nbr_processes=1):
+    """
+    Smooths all streamlines at once using a gaussian filter, working directly
+    on the flat data buffer of the ArraySequence. Each streamline is filtered
+    independently. Same result as calling smooth_line_gaussian on each
+    streamline. The number of points is unchanged, so data_per_point remains
+    valid.
+
+    Parameters
+    ----------
+    streamlines: ArraySequence
+        The streamlines to smooth.
+    sigma: float
+        The sigma of the gaussian filter.
+    nbr_processes: int
+        Number of threads to use.
+
+    Returns
+    -------
+    smoothed_streamlines: ArraySequence
+        The smoothed streamlines.
+    """
+    if sigma < 0.00001:
+        raise ValueError('Cant have a 0 sigma with gaussian.')
+
+    streamlines = ArraySequence(streamlines)
+    lengths = np.asarray(streamlines._lengths, dtype=np.int64)
+
+    # Same kernel as scipy's gaussian_filter1d (truncate=4.0)
+    radius = int(4.0 * float(sigma) + 0.5)
+    x = np.arange(-radius, radius + 1)
+    weights = np.exp(-0.5 / sigma ** 2 * x ** 2)
+    weights /= np.sum(weights)
+
+    out = np.empty((int(np.sum(lengths)), 3), dtype=streamlines._data.dtype)
+    if len(lengths):
+        previous = _set_numba_threads(nbr_processes)
+        try:
+            _gaussian_smoothing_flat_kernel(
+                streamlines._data, streamlines._offsets.astype(np.int64),
+                lengths, weights, out)
+        finally:
+            numba.set_num_threads(previous)
+
+    return array_sequence_from_flat(out, lengths)
+
+
+def _smooth_chunk_spline(args):
+    """Process-pool task: smooths a chunk of streamlines with splines, and
+    returns the flat result."""
+    streamlines, smoothing_parameter, nb_ctrl_points = args
+    if len(streamlines) == 0:
+        return np.zeros((0, 3), dtype=np.float32)
+    return np.concatenate([smooth_line_spline(s, smoothing_parameter,
+                                              nb_ctrl_points)
+                           for s in streamlines]).astype(np.float32)
+
+
+def smooth_streamlines_spline(streamlines, smoothing_parameter,
+                              nb_ctrl_points, nbr_processes=1,
+                              chunk_size=10000):
+    """
+    Smooths all streamlines using splines (see smooth_line_spline). With more
+    than one process, contiguous chunks of streamlines are processed in a
+    pool of (spawned) processes. The number of points is unchanged, so
+    data_per_point remains valid.
+
+    Parameters
+    ----------
+    streamlines: ArraySequence
+        The streamlines to smooth.
+    smoothing_parameter: float
+        The sigma of the spline.
+    nb_ctrl_points: int
+        The number of control points.
+    nbr_processes: int
+        Number of processes to use.
+    chunk_size: int
+        Number of streamlines sent to a process at once.
+
+    Returns
+    -------
+    smoothed_streamlines: ArraySequence
+        The smoothed streamlines.
+    """
+    if smoothing_parameter < 0.00001:
+        raise ValueError('Cant have a 0 sigma with spline.')
+
+    streamlines = ArraySequence(streamlines)
+    starts = range(0, len(streamlines), chunk_size)
+
+    if nbr_processes is not None and nbr_processes > 1 and len(starts) > 1:
+        # A slice of an ArraySequence shares the whole buffer: each chunk is
+        # copied (compacted) before being pickled, one chunk at a time.
+        tasks = ((streamlines[i:i + chunk_size].copy(), smoothing_parameter,
+                  nb_ctrl_points) for i in starts)
+        # Spawn rather than fork: forking after the numba thread pool was
+        # started (by any other kernel of this module) hangs at exit.
+        pool = multiprocessing.get_context('spawn').Pool(nbr_processes)
+        results = list(pool.imap(_smooth_chunk_spline, tasks))
+        pool.close()
+        pool.join()
+    else:
+        results = [_smooth_chunk_spline((streamlines[i:i + chunk_size],
+                                         smoothing_parameter, nb_ctrl_points))
+                   for i in starts]
+
+    if len(results) == 0:
+        return ArraySequence()
+    return array_sequence_from_flat(np.concatenate(results),
+                                    streamlines._lengths.copy())
+
+
 def generate_matched_points(sft):
     """
     Generates an array where each element i is set to the index of the
@@ -811,6 +1349,438 @@ def parallel_transport_streamline(streamline, nb_streamlines, radius,
     return new_streamlines
 
 
+@njit(parallel=True)
+def _parallel_transport_frames_kernel(data, offsets, lengths, V, W):
+    """
+    Numba kernel computing, for each point of each streamline, the normal (V)
+    and binormal (W) vectors of the parallel transport frame, as in
+    parallel_transport_streamline. V and W must be preallocated to
+    (sum(lengths), 3), in compact order.
+    """
+    nb_streamlines = lengths.shape[0]
+    compact_offsets = np.zeros(nb_streamlines, dtype=np.int64)
+    for i in range(1, nb_streamlines):
+        compact_offsets[i] = compact_offsets[i - 1] + lengths[i - 1]
+
+    for i in prange(nb_streamlines):
+        start = offsets[i]
+        n = lengths[i]
+        pos = compact_offsets[i]
+        if n < 2:
+            continue
+
+        # Tangents, as np.gradient (centered differences, one-sided at ends)
+        xyz = data[start:start + n].astype(np.float64)
+        T = np.empty((n, 3))
+        T[0] = xyz[1] - xyz[0]
+        T[n - 1] = xyz[n - 1] - xyz[n - 2]
+        for j in range(1, n - 1):
+            T[j] = (xyz[j + 1] - xyz[j - 1]) / 2.
+        for j in range(n):
+            norm = np.sqrt(np.sum(T[j] ** 2))
+            if norm > 0.:
+                T[j] /= norm
+
+        # Normal vector at the first point: kind of perpendicular to the
+        # first direction.
+        v = xyz[0] - xyz[1]
+        v = np.array([v[2], v[0], v[1]])
+        v /= np.sqrt(np.sum(v ** 2))
+        V[pos] = v
+        for j in range(n - 1):
+            # Torsion vector
+            B = np.cross(T[j], T[j + 1])
+            norm_b = np.sqrt(np.sum(B ** 2))
+            if norm_b < 1e-3:
+                V[pos + j + 1] = V[pos + j]
+            else:
+                # Rotate V around B by the torsion angle (Rodrigues' formula)
+                B /= norm_b
+                cos_t = min(max(np.sum(T[j] * T[j + 1]), -1.), 1.)
+                sin_t = np.sqrt(1. - cos_t ** 2)
+                v = V[pos + j].astype(np.float64)
+                V[pos + j + 1] = v * cos_t + np.cross(B, v) * sin_t + \
+                    B * np.sum(B * v) * (1. - cos_t)
+
+        for j in range(n):
+            W[pos + j] = np.cross(T[j], V[pos + j].astype(np.float64))
+
+
+def parallel_transport_streamlines(streamlines, nb_per_streamline, radius,
+                                   rng=None, nbr_processes=1):
+    """
+    Batched version of parallel_transport_streamline: generates new
+    streamlines for many input streamlines at once. The parallel transport
+    frames are computed from the flat data buffer, and all new streamlines
+    are displaced in a single vectorized operation. With the same rng, gives
+    the same result as calling parallel_transport_streamline on each
+    streamline in order.
+
+    Parameters
+    ----------
+    streamlines: ArraySequence
+        The streamlines to transport.
+    nb_per_streamline: int or np.ndarray
+        The number of streamlines to generate, either the same for all
+        streamlines or one value per streamline.
+    radius: float
+        The radius of the circle around the original streamlines in which the
+        new streamlines will be generated.
+    rng: numpy.random.Generator, optional
+        The random number generator to use. If None, a generator with seed 0
+        is used.
+    nbr_processes: int
+        Number of threads to use to compute the frames.
+
+    Returns
+    -------
+    new_streamlines: ArraySequence
+        The generated streamlines, grouped by input streamline.
+    parent_ids: np.ndarray
+        For each new streamline, the index of the input streamline it was
+        generated from.
+    """
+    if rng is None:
+        rng = np.random.default_rng(0)
+
+    streamlines = ArraySequence(streamlines)
+    lengths = np.asarray(streamlines._lengths, dtype=np.int64)
+    counts = np.broadcast_to(np.asarray(nb_per_streamline, dtype=np.int64),
+                             lengths.shape)
+
+    total = int(np.sum(lengths))
+    V = np.zeros((total, 3), dtype=np.float64)
+    W = np.zeros((total, 3), dtype=np.float64)
+    if len(lengths):
+        previous = _set_numba_threads(nbr_processes)
+        try:
+            _parallel_transport_frames_kernel(
+                streamlines._data, streamlines._offsets.astype(np.int64),
+                lengths, V, W)
+        finally:
+            numba.set_num_threads(previous)
+
+    # Random displacement of each new streamline. Drawn in the same order as
+    # successive rng.uniform calls in parallel_transport_streamline.
+    parent_ids = np.repeat(np.arange(len(lengths)), counts)
+    rand = rng.random((len(parent_ids), 3))
+    rand_v = -1. + 2. * rand[:, 0]
+    rand_w = -1. + 2. * rand[:, 1]
+    scale = rand[:, 2] / np.sqrt(rand_v ** 2 + rand_w ** 2) * radius
+
+    # For each point of each new streamline: its point in the parent, and its
+    # new streamline's index.
+    new_lengths = lengths[parent_ids]
+    compact_offsets = np.cumsum(lengths) - lengths
+    local = np.arange(np.sum(new_lengths), dtype=np.int64) - \
+        np.repeat(np.cumsum(new_lengths) - new_lengths, new_lengths)
+    compact_idx = np.repeat(compact_offsets[parent_ids], new_lengths) + local
+    new_ids = np.repeat(np.arange(len(parent_ids)), new_lengths)
+
+    data = streamlines._data[get_flat_points_indices(streamlines)[
+        compact_idx]]
+    displacement = (V[compact_idx] * rand_v[new_ids, None] +
+                    W[compact_idx] * rand_w[new_ids, None]) * \
+        scale[new_ids, None]
+    new_data = (data + displacement).astype(streamlines._data.dtype)
+
+    return array_sequence_from_flat(new_data, new_lengths), parent_ids
+
+
+@njit(parallel=True)
+def _winding_flat_kernel(data, offsets, lengths, windings):
+    """
+    Numba kernel computing the winding angle (in degrees) of each streamline,
+    as in dipy.tracking.metrics.winding: the total turning angle of the
+    streamline once projected on its two main axes.
+    """
+    for i in prange(lengths.shape[0]):
+        start = offsets[i]
+        n = lengths[i]
+        if n < 2:
+            windings[i] = 0.
+            continue
+
+        # Center the points and project on the two main axes.
+        xyz = data[start:start + n].astype(np.float64)
+        centered = xyz - xyz.sum(axis=0) / n
+        _, eigvecs = np.linalg.eigh(np.dot(centered.T, centered))
+        proj = np.dot(centered, np.ascontiguousarray(eigvecs[:, 1:]))
+
+        turn = 0.
+        for j in range(n - 1):
+            norms = np.sqrt((proj[j, 0] ** 2 + proj[j, 1] ** 2) *
+                            (proj[j + 1, 0] ** 2 + proj[j + 1, 1] ** 2))
+            if norms == 0.:
+                continue
+            cos_angle = (proj[j, 0] * proj[j + 1, 0] +
+                         proj[j, 1] * proj[j + 1, 1]) / norms
+            turn += np.arccos(min(max(cos_angle, -1.), 1.))
+        windings[i] = np.rad2deg(turn)
+
+
+def get_streamlines_winding(streamlines, nbr_processes=1):
+    """
+    Computes the winding angle of all streamlines at once, working directly on
+    the flat data buffer of the ArraySequence, which is shared between
+    threads (no copy). Same result as dipy.tracking.metrics.winding.
+
+    Parameters
+    ----------
+    streamlines: ArraySequence
+        The streamlines.
+    nbr_processes: int
+        Number of threads to use.
+
+    Returns
+    -------
+    windings: np.ndarray
+        The winding angle of each streamline, in degrees.
+    """
+    streamlines = ArraySequence(streamlines)
+    windings = np.zeros(len(streamlines), dtype=np.float64)
+    if len(streamlines):
+        previous = _set_numba_threads(nbr_processes)
+        try:
+            _winding_flat_kernel(streamlines._data,
+                                 streamlines._offsets.astype(np.int64),
+                                 streamlines._lengths.astype(np.int64),
+                                 windings)
+        finally:
+            numba.set_num_threads(previous)
+    return windings
+
+
+@njit
+def _traverse_voxels(data, start, nb_points, dims, vox_out, lin_out,
+                     pti_out, vox_offset, pti_offset, write):
+    """
+    Numba version of the voxel traversal of uncompress.pyx, for a single
+    streamline: finds all voxels traversed by the streamline (in order) and,
+    for each point, the index of its voxel. Nothing is written if write is
+    False; the sizes are only counted. Returns (nb_voxels, nb_mapped_points).
+    """
+    # First point
+    x = int(data[start, 0])
+    y = int(data[start, 1])
+    z = int(data[start, 2])
+    nb_out = 0
+    nb_pti = 0
+    if write:
+        _write_voxel(x, y, z, dims, vox_out, lin_out, vox_offset)
+        pti_out[pti_offset] = 0
+    nb_out += 1
+    nb_pti += 1
+
+    next_x = data[start, 0] * 1.
+    next_y = data[start, 1] * 1.
+    next_z = data[start, 2] * 1.
+    jit_x = jit_y = jit_z = -1.
+    for p in range(nb_points - 1):
+        if jit_x > -1.:
+            # Use the jittered point (see below)
+            cur_x, cur_y, cur_z = jit_x, jit_y, jit_z
+            jit_x = jit_y = jit_z = -1.
+        else:
+            cur_x = data[start + p, 0] * 1.
+            cur_y = data[start + p, 1] * 1.
+            cur_z = data[start + p, 2] * 1.
+
+        next_x = data[start + p + 1, 0] * 1.
+        next_y = data[start + p + 1, 1] * 1.
+        next_z = data[start + p + 1, 2] * 1.
+
+        # Make sure that the next point is not exactly on a voxel
+        # intersection or on the face of the voxel.
+        if abs(next_x - np.floor(next_x)) < 1e-8 or \
+                abs(next_y - np.floor(next_y)) < 1e-8 or \
+                abs(next_z - np.floor(next_z)) < 1e-8:
+            next_x -= 0.000001
+            next_y -= 0.000001
+            next_z -= 0.000001
+            if next_x < 0. or next_y < 0. or next_z < 0.:
+                next_x += 0.000002
+                next_y += 0.000002
+                next_z += 0.000002
+            jit_x, jit_y, jit_z = next_x, next_y, next_z
+
+        dir_x = next_x - cur_x
+        dir_y = next_y - cur_y
+        dir_z = next_z - cur_z
+        dir_norm = np.sqrt(dir_x * dir_x + dir_y * dir_y + dir_z * dir_z)
+        remaining_distance = dir_norm
+
+        # If consecutive coordinates are the same, skip one.
+        if dir_norm == 0:
+            continue
+
+        while True:
+            # Smallest ratio of the direction's length to get to an edge.
+            length_ratio = 10000.
+            if dir_x != 0:
+                edge = np.floor(cur_x + 1.) if dir_x >= 0. \
+                    else np.ceil(cur_x - 1.)
+                length_ratio = min(abs((edge - cur_x) / dir_x), length_ratio)
+            if dir_y != 0:
+                edge = np.floor(cur_y + 1.) if dir_y >= 0. \
+                    else np.ceil(cur_y - 1.)
+                length_ratio = min(abs((edge - cur_y) / dir_y), length_ratio)
+            if dir_z != 0:
+                edge = np.floor(cur_z + 1.) if dir_z >= 0. \
+                    else np.ceil(cur_z - 1.)
+                length_ratio = min(abs((edge - cur_z) / dir_z), length_ratio)
+
+            remaining_distance -= length_ratio * dir_norm
+            if remaining_distance <= 0.:
+                if write:
+                    pti_out[pti_offset + nb_pti] = nb_out - 1
+                nb_pti += 1
+                break
+
+            # Tag the voxel containing the new current point.
+            move_ratio = length_ratio + 0.00000001
+            cur_x += move_ratio * dir_x
+            cur_y += move_ratio * dir_y
+            cur_z += move_ratio * dir_z
+            x = int(cur_x)
+            y = int(cur_y)
+            z = int(cur_z)
+            if write:
+                _write_voxel(x, y, z, dims, vox_out, lin_out,
+                             vox_offset + nb_out)
+            nb_out += 1
+
+    # Check last point
+    last_x = int(next_x)
+    last_y = int(next_y)
+    last_z = int(next_z)
+    if x != last_x or y != last_y or z != last_z:
+        if write:
+            _write_voxel(last_x, last_y, last_z, dims, vox_out, lin_out,
+                         vox_offset + nb_out)
+            pti_out[pti_offset + nb_pti] = nb_out
+        nb_out += 1
+        nb_pti += 1
+
+    return nb_out, nb_pti
+
+
+@njit
+def _write_voxel(x, y, z, dims, vox_out, lin_out, row):
+    """Writes the voxel either as [i, j, k] or as a linear index."""
+    if lin_out.shape[0] > 0:
+        lin_out[row] = (x * dims[1] + y) * dims[2] + z
+    else:
+        vox_out[row, 0] = x
+        vox_out[row, 1] = y
+        vox_out[row, 2] = z
+
+
+@njit(parallel=True)
+def _count_voxels_kernel(data, offsets, lengths, vox_lengths, pti_lengths):
+    """First pass: number of voxels (and mapped points) of each streamline."""
+    dims = np.zeros(3, dtype=np.int64)
+    vox_dummy = np.zeros((0, 3), dtype=np.uint16)
+    lin_dummy = np.zeros(0, dtype=np.int32)
+    pti_dummy = np.zeros(0, dtype=np.uint16)
+    for i in prange(lengths.shape[0]):
+        if lengths[i] == 0:
+            continue
+        nb_out, nb_pti = _traverse_voxels(
+            data, offsets[i], lengths[i], dims, vox_dummy, lin_dummy,
+            pti_dummy, 0, 0, False)
+        vox_lengths[i] = nb_out
+        pti_lengths[i] = nb_pti
+
+
+@njit(parallel=True)
+def _fill_voxels_kernel(data, offsets, lengths, dims, vox_offsets,
+                        pti_offsets, vox_out, lin_out, pti_out):
+    """Second pass: fills the preallocated outputs."""
+    for i in prange(lengths.shape[0]):
+        if lengths[i] == 0:
+            continue
+        _traverse_voxels(data, offsets[i], lengths[i], dims, vox_out,
+                         lin_out, pti_out, vox_offsets[i], pti_offsets[i],
+                         True)
+
+
+def streamlines_to_voxel_coordinates_parallel(streamlines,
+                                              return_mapping=False,
+                                              dimensions=None,
+                                              nbr_processes=1):
+    """
+    Multi-threaded version of
+    scilpy.tractograms.uncompress.streamlines_to_voxel_coordinates. Gets the
+    indices of the voxels traversed by each streamline. A first pass counts
+    the number of voxels of each streamline, so that the outputs can be
+    allocated once and filled in parallel.
+
+    Parameters
+    ----------
+    streamlines: ArraySequence
+        Should be in voxel space, aligned to corner.
+    return_mapping: bool
+        If true, also returns the points_to_idx.
+    dimensions: tuple or None
+        If given, the voxels are returned as linear indices (of type int32)
+        into a volume of this shape (C order, as np.ravel_multi_index)
+        instead of [i, j, k] coordinates. This uses half the memory and can
+        be given directly to np.bincount.
+    nbr_processes: int
+        Number of threads to use.
+
+    Returns
+    -------
+    indices: ArraySequence
+        For each streamline, a np.ndarray of shape (nb_voxels, 3) of type
+        uint16, containing the traversed voxels. If dimensions is given, of
+        shape (nb_voxels,) of type int32 instead.
+    points_to_idx: ArraySequence (optional)
+        For each streamline, a np.ndarray of shape (nb_points) containing,
+        for each streamline point, the associated voxel in indices.
+    """
+    streamlines = ArraySequence(streamlines)
+    data = streamlines._data
+    offsets = np.asarray(streamlines._offsets, dtype=np.int64)
+    lengths = np.asarray(streamlines._lengths, dtype=np.int64)
+    nb_streamlines = len(lengths)
+
+    vox_lengths = np.zeros(nb_streamlines, dtype=np.intp)
+    pti_lengths = np.zeros(nb_streamlines, dtype=np.intp)
+    previous = _set_numba_threads(nbr_processes)
+    try:
+        if nb_streamlines:
+            _count_voxels_kernel(data, offsets, lengths, vox_lengths,
+                                 pti_lengths)
+        nb_voxels = int(np.sum(vox_lengths))
+
+        if dimensions is None:
+            vox_out = np.zeros((nb_voxels, 3), dtype=np.uint16)
+            lin_out = np.zeros(0, dtype=np.int32)
+            dims = np.zeros(3, dtype=np.int64)
+        else:
+            vox_out = np.zeros((0, 3), dtype=np.uint16)
+            lin_out = np.zeros(nb_voxels, dtype=np.int32)
+            dims = np.asarray(dimensions[:3], dtype=np.int64)
+        pti_out = np.zeros(int(np.sum(pti_lengths)), dtype=np.uint16)
+
+        if nb_streamlines:
+            _fill_voxels_kernel(
+                data, offsets, lengths, dims,
+                np.cumsum(vox_lengths) - vox_lengths,
+                np.cumsum(pti_lengths) - pti_lengths,
+                vox_out, lin_out, pti_out)
+    finally:
+        numba.set_num_threads(previous)
+
+    indices = array_sequence_from_flat(
+        vox_out if dimensions is None else lin_out, vox_lengths)
+    if not return_mapping:
+        return indices
+    return indices, array_sequence_from_flat(pti_out, pti_lengths)
+
+
 def remove_loops(streamlines, max_angle, num_processes=1):
     """
     Remove loops from a list of streamlines.
@@ -823,7 +1793,7 @@ def remove_loops(streamlines, max_angle, num_processes=1):
         Maximal winding angle a streamline can have before being classified as
         a loop.
     num_processes : int
-        Split the calculation to a pool of children processes.
+        Number of threads to use.
 
     Returns
     -------
@@ -832,17 +1802,49 @@ def remove_loops(streamlines, max_angle, num_processes=1):
     streamlines_clean: list or ndarray
         The remaining streamlines.
     """
-    pool = Pool(num_processes)
-    windings = pool.map(tm.winding, streamlines)
-    pool.close()
+    windings = get_streamlines_winding(streamlines, num_processes)
 
-    streamlines_clean = streamlines[np.array(windings) < max_angle]
-    ids = list(np.where(np.array(windings) < max_angle)[0])
+    streamlines_clean = streamlines[windings < max_angle]
+    ids = list(np.where(windings < max_angle)[0])
 
     return ids, streamlines_clean
 
 
-def remove_sharp_turns_qb(streamlines, qb_threshold=15.0, qb_seed=0):
+def assign_streamlines_to_centroids(streamlines, centroids, chunk_size=10000):
+    """
+    Assigns each streamline to its nearest centroid, using the minimum
+    average direct-flip (MDF) distance, as in QuickBundles.
+
+    Parameters
+    ----------
+    streamlines: list or ArraySequence
+        The streamlines to assign.
+    centroids: list of np.ndarray
+        The centroids, all with the same number of points.
+    chunk_size: int
+        Number of streamlines compared to the centroids at once, to limit the
+        memory usage.
+
+    Returns
+    -------
+    labels: np.ndarray
+        The index of the closest centroid for each streamline.
+    """
+    nb_points = len(centroids[0])
+    centroids = [np.asarray(c, dtype=np.float32) for c in centroids]
+    streamlines = ArraySequence(streamlines)
+    labels = np.zeros(len(streamlines), dtype=np.int64)
+    for start in range(0, len(streamlines), chunk_size):
+        chunk, _ = resample_streamlines_flat(
+            streamlines[start:start + chunk_size], nb_points)
+        dists = bundles_distances_mdf(
+            [s.astype(np.float32) for s in chunk], centroids)
+        labels[start:start + chunk_size] = np.argmin(dists, axis=1)
+    return labels
+
+
+def remove_sharp_turns_qb(streamlines, qb_threshold=15.0, qb_seed=0,
+                          nb_samples=None):
     """
     Remove sharp turns from a list of streamlines. Should only be used on
     bundled streamlines, not on whole-brain tractograms.
@@ -855,6 +1857,10 @@ def remove_sharp_turns_qb(streamlines, qb_threshold=15.0, qb_seed=0):
         The Quickbundles distance threshold.
     qb_seed: int
         Seed to initialize randomness in QuickBundles
+    nb_samples: int, optional
+        If set, and if there are more streamlines than this, QuickBundles is
+        only computed on a random subset of nb_samples streamlines. The
+        remaining streamlines are assigned to their nearest centroid.
 
     Returns
     -------
@@ -863,19 +1869,25 @@ def remove_sharp_turns_qb(streamlines, qb_threshold=15.0, qb_seed=0):
     """
     ids = []
     if len(streamlines) > 1:
-        curvature = []
-
         rng = np.random.RandomState(qb_seed)
-        clusters = qbx_and_merge(streamlines, [40, 30, 20, qb_threshold],
-                                 rng=rng, verbose=False)
+        if nb_samples is not None and nb_samples < len(streamlines):
+            clusters = qbx_and_merge(streamlines, [40, 30, 20, qb_threshold],
+                                     select_randomly=nb_samples,
+                                     rng=rng, verbose=False)
+            labels = assign_streamlines_to_centroids(streamlines,
+                                                     clusters.centroids)
+        else:
+            clusters = qbx_and_merge(streamlines, [40, 30, 20, qb_threshold],
+                                     rng=rng, verbose=False)
+            labels = np.zeros(len(streamlines), dtype=np.int64)
+            for i, cluster in enumerate(clusters):
+                labels[cluster.indices] = i
 
-        for cc in clusters.centroids:
-            curvature.append(tm.mean_curvature(cc))
-        mean_curvature = sum(curvature) / len(curvature)
+        curvature = np.array([tm.mean_curvature(cc)
+                              for cc in clusters.centroids])
+        mean_curvature = np.mean(curvature)
 
-        for i in range(len(clusters.centroids)):
-            if tm.mean_curvature(clusters.centroids[i]) <= mean_curvature:
-                ids.extend(clusters[i].indices)
+        ids = list(np.where(curvature[labels] <= mean_curvature)[0])
     else:
         logging.info("Impossible to remove sharp turns using Quickbundles "
                      "because the tractogram does not contain at least 2 "
@@ -885,7 +1897,8 @@ def remove_sharp_turns_qb(streamlines, qb_threshold=15.0, qb_seed=0):
 
 
 def remove_loops_and_sharp_turns(streamlines, max_angle, qb_threshold=None,
-                                 qb_seed=0, num_processes=1):
+                                 qb_seed=0, num_processes=1,
+                                 qb_nb_samples=None):
     """
     Remove loops and sharp turns from a list of streamlines.
 
@@ -904,7 +1917,10 @@ def remove_loops_and_sharp_turns(streamlines, max_angle, qb_threshold=None,
     qb_seed: int
         Seed to initialize randomness in QuickBundles
     num_processes : int
-        Split the calculation to a pool of children processes.
+        Number of threads to use to compute the winding angles.
+    qb_nb_samples: int, optional
+        If set, QuickBundles is computed on a subset of qb_nb_samples
+        streamlines. See remove_sharp_turns_qb.
 
     Returns
     -------
@@ -915,8 +1931,11 @@ def remove_loops_and_sharp_turns(streamlines, max_angle, qb_threshold=None,
     ids, streamlines_clean = remove_loops(streamlines, max_angle,
                                           num_processes)
 
-    if qb_threshold is not None:
-        ids = remove_sharp_turns_qb(streamlines_clean, qb_threshold, qb_seed)
+    if qb_threshold is not None and len(ids) > 0:
+        # Ids from the QB pass are ids in streamlines_clean.
+        qb_ids = remove_sharp_turns_qb(streamlines_clean, qb_threshold,
+                                       qb_seed, nb_samples=qb_nb_samples)
+        ids = list(np.asarray(ids)[qb_ids])
     return ids
 
 
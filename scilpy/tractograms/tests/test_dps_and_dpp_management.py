@@ -127,6 +127,25 @@ def test_project_map_to_streamlines():
     assert np.array_equal(dpp[0], [[1, 1]] * 3)
     assert np.array_equal(dpp[1], [[2, 2]] * 4)
 
+    # -----------------
+
+    # Test 3. Trilinear interpolation on random points (some out of bound),
+    # on a sliced tractogram, with small chunks: same as point by point.
+    rng = np.random.RandomState(0)
+    map_data = rng.rand(3, 3, 3, 2)
+    map_volume = DataVolume(map_data, voxres=[1, 1, 1],
+                            interpolation='trilinear')
+    fake_ref = nib.Nifti1Image(np.zeros((3, 3, 3)), affine=np.eye(4))
+    streamlines = [rng.rand(n, 3) * 4 - 0.5 for n in [5, 2, 7]]
+    sft = StatefulTractogram(streamlines, fake_ref, space=Space.VOX,
+                             origin=Origin('center'))[[2, 0]]
+
+    dpp = project_map_to_streamlines(sft, map_volume, chunk_size=3)
+    for s, d in zip(sft.streamlines, dpp):
+        expected = [map_volume.get_value_at_coordinate(
+            *p, space=sft.space, origin=sft.origin) for p in s]
+        assert np.allclose(d, expected)
+
 
 def test_project_dpp_to_map():
     fake_sft = _get_small_sft()
@@ -154,6 +173,11 @@ def test_project_dpp_to_map():
     expected[1, 1, 1] = 2 * 2  # only 2 points of the second streamline
     assert np.array_equal(map_data, expected)
 
+    # Small chunks: same result.
+    map_data = project_dpp_to_map(fake_sft, 'my_dpp', sum_lines=True,
+                                  endpoints_only=True, chunk_size=1)
+    assert np.array_equal(map_data, expected)
+
 
 def test_perform_operation_on_dpp():
     fake_sft = _get_small_sft()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import nibabel as nib
+import numpy as np
+from dipy.io.stateful_tractogram import Origin, Space, StatefulTractogram
+
+from scilpy.tracking.fibertube_utils import dist_segment_segment
+from scilpy.tractograms.intersection_finder import IntersectionFinder
+
+
+def _get_sft(nb_streamlines=50):
+    rng = np.random.RandomState(0)
+    streamlines = []
+    for _ in range(nb_streamlines):
+        start = rng.uniform(3, 6, 3)
+        direction = rng.normal(size=3)
+        direction /= np.linalg.norm(direction)
+        nb_points = rng.randint(3, 10)
+        steps = np.tile(direction * 0.2, (nb_points, 1)) + \
+            rng.normal(scale=0.02, size=(nb_points, 3))
+        streamlines.append((start + np.cumsum(steps, axis=0))
+                           .astype(np.float32))
+
+    img = nib.Nifti1Image(np.zeros((10, 10, 10)), np.eye(4))
+    sft = StatefulTractogram(streamlines, img, Space.VOX,
+                             origin=Origin.TRACKVIS)
+    # Sliced view, to make sure the flat buffer is read correctly.
+    sft = sft[rng.permutation(nb_streamlines)]
+    diameters = rng.uniform(0.02, 0.2, nb_streamlines)
+    return sft, diameters
+
+
+def _find_intersections_sequentially(finder, min_distance):
+    # Reference: one segment at a time, neighbors ordered by index.
+    radius = finder.max_seg_length + finder.max_diameter + min_distance
+    nb_streamlines = len(finder.streamlines)
+    invalid = np.zeros(nb_streamlines, dtype=bool)
+    collisions = np.zeros((nb_streamlines, 3), dtype=np.float32)
+    obstacle = np.zeros(nb_streamlines, dtype=bool)
+    excluded = np.zeros(nb_streamlines, dtype=bool)
+    for segi, (si, pi) in enumerate(finder.seg_indices):
+        if invalid[si] or excluded[si]:
+            continue
+        neighbors = finder.tree.query_ball_point(finder.seg_centers[segi],
+                                                 radius)
+        for neighbor_segi in sorted(neighbors):
+            neighbor_si, neighbor_pi = finder.seg_indices[neighbor_segi]
+            if neighbor_si == si or invalid[neighbor_si] or \
+                    excluded[neighbor_si]:
+                continue
+            distance, _, p_coll, q_coll = dist_segment_segment(
+                finder.streamlines[si][pi],
+                finder.streamlines[si][pi + 1],
+                finder.streamlines[neighbor_si][neighbor_pi],
+                finder.streamlines[neighbor_si][neighbor_pi + 1])
+            external_distance = distance - finder.diameters[si] / 2 - \
+                finder.diameters[neighbor_si] / 2
+            if external_distance < 0:
+                invalid[si] = True
+                collisions[si] = (p_coll + q_coll) / 2
+                obstacle[neighbor_si] = True
+                break
+            if min_distance != 0 and external_distance < min_distance:
+                excluded[si] = True
+                break
+    return invalid, collisions, obstacle, excluded
+
+
+def test_find_intersections():
+    sft, diameters = _get_sft()
+    finder = IntersectionFinder(sft, diameters)
+
+    for min_distance in [0, 0.05]:
+        expected = _find_intersections_sequentially(finder, min_distance)
+        assert np.any(expected[0])
+
+        for chunk_size in [5, 100000]:
+            finder.find_intersections(min_distance, chunk_size=chunk_size)
+            for expected_array, array in zip(
+                    expected, [finder.invalid, finder.collisions,
+                               finder.obstacle, finder.excluded]):
+                assert np.array_equal(expected_array, array)
@@ -1,10 +1,20 @@
 # -*- coding: utf-8 -*-
 import os
+import tempfile
+import threading
+import time
+
+import nibabel as nib
+import numpy as np
+from dipy.io.stateful_tractogram import Space
+from dipy.io.streamline import load_tractogram
 
 from scilpy import SCILPY_HOME
 from scilpy.io.fetcher import fetch_data, get_testing_files_dict
+from dipy.tracking.streamlinespeed import length
 from scilpy.tractograms.lazy_tractogram_operations import \
-    lazy_streamlines_count, lazy_concatenate
+    lazy_streamlines_count, lazy_concatenate, lazy_memmap_tractogram, \
+    lazy_save_subset, lazy_streamlines_statistics, lazy_concatenate_raw
 
 # If they already exist, this only takes 5 seconds (check md5sum)
 fetch_data(get_testing_files_dict(), keys=['tractograms.zip'])
@@ -17,9 +27,164 @@ def test_lazy_tractogram_count():
     assert nb == 10
 
 
+def test_lazy_streamlines_statistics():
+    in_file = os.path.join(main_path, 'bundle_4.tck')
+    streamlines = nib.streamlines.load(in_file).streamlines
+    lengths_mm = length(streamlines)
+    steps = np.hstack([np.linalg.norm(np.diff(s, axis=0), axis=1)
+                       for s in streamlines])
+
+    # Small chunks, to merge the statistics of many chunks.
+    stats = lazy_streamlines_statistics(in_file, chunk_size=3, bin_size=5.)
+    assert stats['number_streamlines'] == len(streamlines)
+    assert stats['number_points'] == len(streamlines.get_data())
+    assert np.isclose(stats['mean_length_mm'], np.mean(lengths_mm))
+    assert np.isclose(stats['std_length_mm'], np.std(lengths_mm))
+    assert np.isclose(stats['max_length_mm'], np.max(lengths_mm))
+    assert np.isclose(stats['mean_step_size'], np.mean(steps))
+    assert np.isclose(stats['std_step_size'], np.std(steps))
+    assert np.isclose(stats['min_step_size'], np.min(steps))
+    assert np.allclose(stats['bounding_box_min_rasmm'],
+                       np.min(streamlines.get_data(), axis=0))
+    assert np.array_equal(stats['length_histogram'],
+                          np.bincount((lengths_mm // 5).astype(int)))
+
+    assert lazy_streamlines_count(in_file, verify=True) == len(streamlines)
+
+    # Other formats are loaded first: same statistics from a loaded sft.
+    sft = load_tractogram(in_file, os.path.join(main_path,
+                                                'bundle_4_wm.nii.gz'))
+    sft.to_vox()
+    loaded_stats = lazy_streamlines_statistics(sft, chunk_size=3,
+                                               bin_size=5.)
+    for key, value in stats.items():
+        assert np.allclose(loaded_stats[key], value)
+    # The sft itself is unchanged.
+    assert sft.space == Space.VOX
+
+
 def test_lazy_concatenate():
     in_file1 = os.path.join(main_path, 'bundle_4.tck')
     in_file2 = os.path.join(main_path, 'bundle_4_cut_endpoints.tck')
 
     out_trk, out_header = lazy_concatenate([in_file1, in_file2], '.tck')
     assert len(out_trk) == 20
+
+
+def test_lazy_concatenate_threads():
+    in_file1 = os.path.join(main_path, 'bundle_4.tck')
+    in_file2 = os.path.join(main_path, 'bundle_4_cut_endpoints.tck')
+    expected = list(nib.streamlines.load(in_file1).streamlines) + \
+        list(nib.streamlines.load(in_file2).streamlines)
+
+    # Small chunks and queues, to make the readers wait for the writer.
+    out_tractogram, _ = lazy_concatenate([in_file1, in_file2], '.tck',
+                                         nbr_processes=2, chunk_size=3,
+                                         queue_size=1)
+    streamlines = list(out_tractogram.streamlines)
+    assert len(streamlines) == len(expected)
+    for s, e in zip(streamlines, expected):
+        assert np.allclose(s, e)
+
+
+def _run_with_timeout(func, timeout=20):
+    # Runs func in a thread, to fail rather than hang if it never returns.
+    errors = []
+
+    def _target():
+        try:
+            func()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=_target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'Threads of lazy_concatenate are blocked.'
+    return errors
+
+
+def test_lazy_concatenate_threads_early_stop():
+    in_file1 = os.path.join(main_path, 'bundle_4.tck')
+    in_file2 = os.path.join(main_path, 'bundle_4_cut_endpoints.tck')
+
+    def _close_early():
+        # One chunk per file: each reader ends blocked on its full queue.
+        out_tractogram, _ = lazy_concatenate([in_file1, in_file2], '.tck',
+                                             nbr_processes=2, chunk_size=30,
+                                             queue_size=1)
+        streamlines = out_tractogram.streamlines
+        next(streamlines)
+        time.sleep(0.5)
+        streamlines.close()
+
+    assert _run_with_timeout(_close_early) == []
+
+
+def test_lazy_concatenate_threads_error():
+    in_file = os.path.join(main_path, 'bundle_4.tck')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        in_bad = os.path.join(tmp_dir, 'bad.tck')
+        with open(in_bad, 'w') as f:
+            f.write('Not a tck file.')
+
+        def _read_all():
+            out_tractogram, _ = lazy_concatenate(
+                [in_bad, in_file, in_file], '.tck', nbr_processes=2,
+                chunk_size=3, queue_size=1)
+            list(out_tractogram.streamlines)
+
+        # The reader's error is raised by the writer.
+        errors = _run_with_timeout(_read_all)
+        assert len(errors) == 1
+
+
+def test_lazy_concatenate_raw():
+    in_file1 = os.path.join(main_path, 'bundle_4.tck')
+    in_file2 = os.path.join(main_path, 'bundle_4_cut_endpoints.tck')
+    expected = list(nib.streamlines.load(in_file1).streamlines) + \
+        list(nib.streamlines.load(in_file2).streamlines)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_file = os.path.join(tmp_dir, 'concatenated.tck')
+        assert lazy_concatenate_raw([in_file1, in_file2], out_file)
+
+        result = nib.streamlines.load(out_file)
+        assert int(result.header['count']) == len(expected)
+        assert len(result.streamlines) == len(expected)
+        for s, e in zip(result.streamlines, expected):
+            assert np.allclose(s, e)
+
+        # Formats differ: nothing is done.
+        assert not lazy_concatenate_raw([in_file1, in_file2],
+                                        os.path.join(tmp_dir, 'out.trk'))
+
+
+def test_lazy_memmap_tractogram():
+    in_file = os.path.join(main_path, 'bundle_4.tck')
+    expected = nib.streamlines.load(in_file).streamlines
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        streamlines, dps, dpp, _ = lazy_memmap_tractogram(in_file, tmp_dir)
+        assert isinstance(streamlines._data, np.memmap)
+        assert len(dps) == 0 and len(dpp) == 0
+        assert len(streamlines) == len(expected)
+        for s, e in zip(streamlines, expected):
+            assert np.allclose(s, e)
+
+
+def test_lazy_save_subset():
+    in_file = os.path.join(main_path, 'bundle_4.tck')
+    expected = nib.streamlines.load(in_file).streamlines
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        streamlines, dps, dpp, header = lazy_memmap_tractogram(in_file,
+                                                               tmp_dir)
+        out_file = os.path.join(tmp_dir, 'subset.tck')
+        indices = [7, 2, 5]
+        lazy_save_subset(streamlines, dps, dpp, indices, out_file, header)
+
+        subset = nib.streamlines.load(out_file).streamlines
+        assert len(subset) == len(indices)
+        for s, i in zip(subset, indices):
+            assert np.allclose(s, expected[i], atol=1e-5)
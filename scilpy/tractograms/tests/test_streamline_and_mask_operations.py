@@ -10,6 +10,7 @@ from scilpy import SCILPY_HOME
 from scilpy.image.utils import split_mask_blobs_kmeans
 from scilpy.io.fetcher import fetch_data, get_testing_files_dict
 from scilpy.tractograms.streamline_and_mask_operations import (
+    _cut_streamlines_by_chunks,
     _intersects_two_rois,
     _trim_streamline_in_mask,
     _trim_streamline_endpoints_in_mask,
@@ -19,8 +20,10 @@ from scilpy.tractograms.streamline_and_mask_operations import (
     cut_streamlines_with_mask,
     get_endpoints_density_map,
     get_head_tail_density_maps,
+    get_sparse_density_map,
     CuttingStyle)
 from scilpy.image.labels import get_labels_from_mask
+from scilpy.tractanalysis.streamlines_metrics import compute_tract_counts_map
 from scilpy.tractograms.uncompress import streamlines_to_voxel_coordinates
 
 
@@ -115,6 +118,22 @@ def test_get_head_tail_density_maps():
     assert np.allclose(head_map + tail_map, result)
 
 
+def test_get_sparse_density_map():
+    """ Test the get_sparse_density_map function. Compares against the
+    dense density map, on a sliced view of the streamlines.
+    """
+    sft, _, _, _, _ = _setup_files()
+    sft.to_vox()
+    sft.to_corner()
+    streamlines = sft.streamlines[::-2]
+
+    indices, counts = get_sparse_density_map(streamlines, sft.dimensions)
+    density = compute_tract_counts_map(streamlines, sft.dimensions)
+
+    assert np.array_equal(indices, np.flatnonzero(density))
+    assert np.array_equal(counts, density.ravel()[indices])
+
+
 def test_cut_outside_of_mask_streamlines():
     """ Test the cut_streamlines_with_mask function. This test loads a bundle
     with 10 streamlines, and "cuts it" with a mask that should only keep a
@@ -137,6 +156,46 @@ def test_cut_outside_of_mask_streamlines():
     assert np.allclose(cut_sft.streamlines._data, res.streamlines._data)
 
 
+def test_cut_streamlines_multiprocessing():
+    """ Test that cutting with many processes (streamlines and masks in
+    shared memory, sent by chunks) gives the same result as with one
+    process.
+    """
+
+    sft, _, head_tail_rois, _, center_roi = _setup_files()
+    # Results are returned in the input's space; it must not change between
+    # calls.
+    sft.to_vox()
+    sft.to_corner()
+
+    for style in CuttingStyle:
+        cut_sft = cut_streamlines_with_mask(sft, center_roi,
+                                            cutting_style=style)
+        cut_sft_mp = cut_streamlines_with_mask(sft, center_roi,
+                                               cutting_style=style,
+                                               processes=2)
+        assert np.array_equal(cut_sft.streamlines._lengths,
+                              cut_sft_mp.streamlines._lengths)
+        assert np.allclose(cut_sft.streamlines.get_data(),
+                           cut_sft_mp.streamlines.get_data())
+
+    head_tail_labels = get_labels_from_mask(head_tail_rois)
+    cut_sft = cut_streamlines_between_labels(sft, head_tail_labels)
+    cut_sft_mp = cut_streamlines_between_labels(sft, head_tail_labels,
+                                                processes=2)
+    assert np.array_equal(cut_sft.streamlines._lengths,
+                          cut_sft_mp.streamlines._lengths)
+    assert np.allclose(cut_sft.streamlines.get_data(),
+                       cut_sft_mp.streamlines.get_data())
+
+    # Empty chunks keep the dtype of the streamlines.
+    empty = _cut_streamlines_by_chunks(sft.streamlines,
+                                       [np.zeros_like(center_roi)],
+                                       _trim_streamline_in_mask, processes=2)
+    assert len(empty) == 0
+    assert empty.get_data().dtype == sft.streamlines._data.dtype
+
+
 def test_trim_streamline_in_mask():
     """ Test the _trim_streamline_in_mask function. This function is used by
     cut_streamlines_with_mask, and is tested here to ensure that it works
@@ -6,26 +6,44 @@ import numpy as np
 from numpy.testing import assert_array_almost_equal
 import pytest
 from dipy.io.streamline import load_tractogram
-from dipy.tracking.streamlinespeed import length
+from dipy.tracking.streamlinespeed import (compress_streamlines, length,
+                                           set_number_of_points)
 from dipy.io.stateful_tractogram import StatefulTractogram
+from dipy.tracking.distances import bundles_distances_mdf
+from dipy.tracking.metrics import winding
+from nibabel.streamlines import ArraySequence
 
 from scilpy import SCILPY_HOME
 from scilpy.io.fetcher import fetch_data, get_testing_files_dict
 from scilpy.tractograms.streamline_operations import (
+    array_sequence_from_flat,
+    assign_streamlines_to_centroids,
     compress_sft,
+    compress_streamlines_flat,
     cut_invalid_streamlines,
     filter_streamlines_by_length,
     filter_streamlines_by_total_length_per_dim,
     get_angles,
     get_streamlines_as_linspaces,
+    get_streamlines_winding,
+    iter_compact_data,
+    resample_streamlines_flat,
     resample_streamlines_num_points,
     resample_streamlines_step_size,
     smooth_line_gaussian,
     smooth_line_spline,
+    smooth_streamlines_gaussian,
+    smooth_streamlines_spline,
+    streamlines_to_voxel_coordinates_parallel,
     parallel_transport_streamline,
+    parallel_transport_streamlines,
+    remove_loops,
+    remove_loops_and_sharp_turns,
     remove_overlapping_points_streamlines,
+    remove_sharp_turns_qb,
     remove_single_point_streamlines)
 from scilpy.tractograms.tractogram_operations import concatenate_sft
+from scilpy.tractograms.uncompress import streamlines_to_voxel_coordinates
 
 fetch_data(get_testing_files_dict(), keys=['tractograms.zip'])
 tmp_dir = tempfile.TemporaryDirectory()
@@ -83,7 +101,24 @@ def test_compress_sft():
         assert np.allclose(s[0], sc[0])
         assert np.allclose(s[-1], sc[-1])
 
-        # Not testing more than that, as it uses Dipy's method, tested by Dipy
+        # Not testing more than that, compared to Dipy's method below.
+
+
+def test_compress_streamlines_flat():
+    sft = load_tractogram(in_long_sft, in_ref)
+    sft.to_rasmm()
+    # Sliced view: reordered, with a repeated streamline.
+    streamlines = sft.streamlines[[2, 0, 1, 0]]
+    dpp = {'index': [np.arange(len(s))[:, None] for s in streamlines]}
+
+    compressed, new_dpp = compress_streamlines_flat(
+        streamlines, tol_error=0.01, data_per_point=dpp, nbr_processes=2)
+    expected = compress_streamlines(streamlines, tol_error=0.01)
+    for s, sc, se, d in zip(streamlines, compressed, expected,
+                            new_dpp['index']):
+        assert_array_almost_equal(sc, se)
+        # Remaining dpp should be those of the remaining points
+        assert_array_almost_equal(s[d[:, 0]], sc)
 
 
 def test_cut_invalid_streamlines():
@@ -280,6 +315,33 @@ def test_resample_streamlines_num_points():
     assert np.all(lengths)
 
 
+def test_resample_streamlines_num_points_dpp():
+    sft = load_tractogram(in_short_sft, in_ref)
+    sft.data_per_point['position'] = [np.linspace(0, 1, len(s))[:, None]
+                                      for s in sft.streamlines]
+
+    resampled_sft = resample_streamlines_num_points(sft, 10)
+    for s, d in zip(resampled_sft.streamlines,
+                    resampled_sft.data_per_point['position']):
+        assert len(d) == len(s) == 10
+        assert d[0, 0] == 0
+        assert d[-1, 0] == 1
+
+
+def test_resample_streamlines_flat():
+    sft = load_tractogram(in_long_sft, in_ref)
+    streamlines = sft.streamlines[[2, 0, 1, 0]]
+    nb_points = [5, 12, 3, 40]
+
+    resampled, _ = resample_streamlines_flat(streamlines, nb_points,
+                                             nbr_processes=2)
+    for s, sr, n in zip(streamlines, resampled, nb_points):
+        assert_array_almost_equal(sr, set_number_of_points(s, n), decimal=4)
+
+    with pytest.raises(ValueError):
+        resample_streamlines_flat(streamlines, 1)
+
+
 def test_resample_streamlines_step_size():
     """ Test the resample_streamlines_step_size function to 1mm.
     """
@@ -398,6 +460,31 @@ def test_smooth_line_spline():
     assert dist_1 < dist_2
 
 
+def test_smooth_streamlines_gaussian():
+    sft = load_tractogram(in_long_sft, in_ref)
+    # Sliced view: reordered, with a repeated streamline.
+    streamlines = sft.streamlines[[2, 0, 1, 0]]
+
+    smoothed = smooth_streamlines_gaussian(streamlines, 5.0, nbr_processes=2)
+    for s, sm in zip(streamlines, smoothed):
+        assert_array_almost_equal(sm, smooth_line_gaussian(s, 5.0),
+                                  decimal=4)
+
+    with pytest.raises(ValueError):
+        _ = smooth_streamlines_gaussian(streamlines, 0.0)
+
+
+def test_smooth_streamlines_spline():
+    sft = load_tractogram(in_short_sft, in_ref)
+    streamlines = sft.streamlines[[2, 0, 1, 0]]
+
+    smoothed = smooth_streamlines_spline(streamlines, 5., 10,
+                                         nbr_processes=2, chunk_size=2)
+    for s, sm in zip(streamlines, smoothed):
+        assert_array_almost_equal(sm, smooth_line_spline(s, 5., 10),
+                                  decimal=4)
+
+
 def test_generate_matched_points():
     # toDo
     pass
@@ -423,17 +510,130 @@ def test_parallel_transport_streamline():
     assert len(pt_streamlines) == 20
 
 
+def test_get_streamlines_winding():
+    sft = load_tractogram(in_long_sft, in_ref)
+    streamlines = sft.streamlines[::-1]
+
+    windings = get_streamlines_winding(streamlines, nbr_processes=2)
+    expected = [winding(s) for s in streamlines]
+    assert_array_almost_equal(windings, expected, decimal=1)
+
+
+def test_parallel_transport_streamlines():
+    sft = load_tractogram(in_short_sft, in_ref)
+    streamlines = sft.streamlines[[2, 0, 1]]
+
+    new_streamlines, parent_ids = parallel_transport_streamlines(
+        streamlines, [1, 3, 2], 5., rng=np.random.default_rng(3),
+        nbr_processes=2)
+    assert np.array_equal(parent_ids, [0, 1, 1, 1, 2, 2])
+
+    # Same as the one-streamline version, with the same rng.
+    rng = np.random.default_rng(3)
+    expected = []
+    for s, n in zip(streamlines, [1, 3, 2]):
+        expected.extend(parallel_transport_streamline(s, n, 5., rng=rng))
+    assert len(new_streamlines) == len(expected)
+    for s, se in zip(new_streamlines, expected):
+        assert_array_almost_equal(s, se, decimal=4)
+
+
 def test_remove_loops():
-    # toDO
-    # Coverage will not work: uses multi-processing
-    pass
+    fake_straight_line = np.asarray([[0, 0, 0],
+                                     [1, 1, 1],
+                                     [2, 2, 2],
+                                     [3, 3, 3]], dtype=np.float32)
+    t = np.linspace(0, 4 * np.pi, 50)
+    fake_loop = np.stack([np.cos(t), np.sin(t), t / 10], axis=1).astype(
+        np.float32)
+    streamlines = ArraySequence([fake_straight_line, fake_loop,
+                                 fake_straight_line])
+
+    ids, clean = remove_loops(streamlines, 360)
+    assert ids == [0, 2]
+    assert len(clean) == 2
 
 
 def test_remove_sharp_turns_qb():
-    # toDO
-    pass
+    sft = load_tractogram(in_long_sft, in_ref)
+
+    ids = remove_sharp_turns_qb(sft.streamlines, qb_threshold=5)
+    assert 0 < len(ids) <= len(sft)
+
+    # Using a subsample: all streamlines must still be considered.
+    ids_sub = remove_sharp_turns_qb(sft.streamlines, qb_threshold=5,
+                                    nb_samples=len(sft) // 2)
+    assert 0 < len(ids_sub) <= len(sft)
+    assert np.max(ids_sub) < len(sft)
+
+
+def test_assign_streamlines_to_centroids():
+    sft = load_tractogram(in_long_sft, in_ref)
+    streamlines = list(sft.streamlines)
+    centroids = [set_number_of_points(s, 20).astype(np.float32)
+                 for s in streamlines[:3]]
+
+    labels = assign_streamlines_to_centroids(streamlines, centroids,
+                                             chunk_size=7)
+    resampled = [set_number_of_points(s, 20).astype(np.float32)
+                 for s in streamlines]
+    expected = np.argmin(bundles_distances_mdf(resampled, centroids), axis=1)
+    assert np.array_equal(labels, expected)
 
 
 def test_remove_loops_and_sharp_turns():
-    # ok. Just a combination of the two previous functions.
-    pass
+    sft = load_tractogram(in_long_sft, in_ref)
+    t = np.linspace(0, 4 * np.pi, 50)
+    fake_loop = np.stack([np.cos(t), np.sin(t), t / 10], axis=1) + 30
+    streamlines = ArraySequence([fake_loop.astype(np.float32)] +
+                                list(sft.streamlines))
+
+    # The loop (index 0) is removed before QB. Returned ids must index the
+    # input streamlines, not the loop-free ones.
+    ids = remove_loops_and_sharp_turns(streamlines, 360, qb_threshold=5)
+    expected = np.asarray(remove_sharp_turns_qb(sft.streamlines,
+                                                qb_threshold=5)) + 1
+    assert 0 not in ids
+    assert np.array_equal(ids, expected)
+
+
+def test_streamlines_to_voxel_coordinates_parallel():
+    sft = load_tractogram(in_long_sft, in_ref)
+    sft.to_vox()
+    sft.to_corner()
+
+    expected, expected_mapping = streamlines_to_voxel_coordinates(
+        sft.streamlines, return_mapping=True)
+    indices, mapping = streamlines_to_voxel_coordinates_parallel(
+        sft.streamlines, return_mapping=True, nbr_processes=2)
+    assert np.array_equal(indices._lengths, expected._lengths)
+    assert np.array_equal(indices.get_data(), expected.get_data())
+    assert np.array_equal(mapping.get_data(), expected_mapping.get_data())
+
+    # Linear indices
+    linear = streamlines_to_voxel_coordinates_parallel(
+        sft.streamlines, dimensions=sft.dimensions)
+    assert linear.get_data().dtype == np.int32
+    assert np.array_equal(
+        linear.get_data(),
+        np.ravel_multi_index(expected.get_data().T, sft.dimensions))
+
+    # Sliced streamlines (views on the same data)
+    indices = streamlines_to_voxel_coordinates_parallel(
+        sft.streamlines[::-2])
+    for s, e in zip(indices, expected[::-2]):
+        assert np.array_equal(s, e)
+
+
+def test_iter_compact_data():
+    rng = np.random.RandomState(0)
+    lengths = [4, 0, 7, 2, 5]
+    streamlines = array_sequence_from_flat(rng.rand(sum(lengths), 3),
+                                           lengths)
+
+    # Compact sequence and sliced view (not compact, not ordered).
+    for seq in [streamlines, streamlines[[3, 0, 1, 4]]]:
+        expected = seq.copy()._data
+        for chunk_size in [1, 2, 100]:
+            chunks = list(iter_compact_data(seq, chunk_size))
+            assert np.array_equal(np.concatenate(chunks), expected)
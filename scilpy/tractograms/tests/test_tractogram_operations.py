@@ -4,15 +4,18 @@ import logging
 import os
 import tempfile
 
+import nibabel as nib
 import numpy as np
 from dipy.io.stateful_tractogram import StatefulTractogram
 from dipy.io.streamline import load_tractogram
+from dipy.tracking.streamlinespeed import compress_streamlines
 
 from scilpy import SCILPY_HOME
 from scilpy.io.fetcher import fetch_data, get_testing_files_dict
 from scilpy.tractograms.streamline_operations import \
     resample_streamlines_step_size
 from scilpy.tractograms.tractogram_operations import (
+    compress_streamlines_wrapper,
     concatenate_sft,
     difference,
     difference_robust,
@@ -21,6 +24,8 @@ from scilpy.tractograms.tractogram_operations import (
     intersection_robust,
     perform_tractogram_operation_on_lines,
     perform_tractogram_operation_on_sft,
+    get_shuffled_indices,
+    get_split_indices_sequentially,
     shuffle_streamlines,
     split_sft_randomly,
     split_sft_randomly_per_cluster,
@@ -42,12 +47,36 @@ sft.data_per_streamline['test'] = [1] * len(sft)
 sft.data_per_point['test2'] = [[[1, 2, 3]] * len(s) for s in sft.streamlines]
 
 
+def test_compress_streamlines_wrapper():
+    # Non-lazy: list of streamlines
+    expected = compress_streamlines(sft.streamlines, 0.1)
+    compressed = compress_streamlines_wrapper(sft, 0.1)
+    for sc, se in zip(compressed, expected):
+        assert np.allclose(sc, se)
+
+    # Lazy: the compression is done by chunks, as the file is read.
+    lazy_tractogram = nib.streamlines.load(in_sft, lazy_load=True)
+    full_tractogram = nib.streamlines.load(in_sft)
+    expected = compress_streamlines(full_tractogram.streamlines, 0.1)
+    compressed = list(compress_streamlines_wrapper(lazy_tractogram, 0.1,
+                                                   chunk_size=3)())
+    assert len(compressed) == len(expected)
+    for sc, se in zip(compressed, expected):
+        assert np.allclose(sc, se)
+
+
 def test_shuffle_streamlines():
     # Shuffling pretty straightforward, not testing.
     # Verifying that initial SFT is not modified.
     sft2 = shuffle_streamlines(sft)
     assert not sft2 == sft
 
+    # Reproducible with a seed
+    assert np.array_equal(get_shuffled_indices(10, 3),
+                          get_shuffled_indices(10, 3))
+    assert np.array_equal(np.sort(get_shuffled_indices(10, 3)),
+                          np.arange(10))
+
 
 def test_flip_sft():
     # Flip x, verify that y and z are the same.
@@ -208,6 +237,22 @@ def test_upsample_tractogram():
         assert np.max(s - ref_s) < 4.3
         assert not np.array_equal(s, ref_s)
 
+    # 3. Reproducible with a seed, with any number of threads.
+    new_sft_1 = upsample_tractogram(sft2, nb=10, point_wise_std=0.5,
+                                    tube_radius=2, seed=4)
+    new_sft_2 = upsample_tractogram(sft2, nb=10, point_wise_std=0.5,
+                                    tube_radius=2, seed=4, nbr_processes=2)
+    for s1, s2 in zip(new_sft_1.streamlines, new_sft_2.streamlines):
+        assert np.allclose(s1, s2)
+
+
+def test_get_split_indices_sequentially():
+    all_indices = get_split_indices_sequentially(10, [3, 0, 4])
+    assert len(all_indices) == 3
+    assert np.array_equal(all_indices[0], [0, 1, 2])
+    assert len(all_indices[1]) == 0
+    assert np.array_equal(all_indices[2], [3, 4, 5, 6])
+
 
 def test_split_sft_randomly():
     sft_copy = StatefulTractogram.from_sft(sft.streamlines, sft)
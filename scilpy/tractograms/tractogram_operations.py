@@ -10,27 +10,26 @@ individually. See scilpy.tractograms.streamline_operations.py for the latter.
 from functools import reduce
 import itertools
 import logging
-import random
 
 from dipy.io.stateful_tractogram import set_sft_logger_level, \
     StatefulTractogram, Space
 from dipy.io.utils import get_reference_info, is_header_compatible
 from dipy.segment.clustering import qbx_and_merge
 from dipy.tracking.streamline import transform_streamlines
-from dipy.tracking.streamlinespeed import compress_streamlines
 from nibabel.streamlines import TrkFile, TckFile
 from nibabel.streamlines.array_sequence import ArraySequence
 import numpy as np
-from numpy.polynomial.polynomial import Polynomial
 from scipy.ndimage import map_coordinates
 from scipy.spatial import cKDTree
 
 from scilpy.tractanalysis.bundle_operations import uniformize_bundle_sft
 from scilpy.tractanalysis.streamlines_metrics import compute_tract_counts_map
-from scilpy.tractograms.streamline_operations import smooth_line_gaussian, \
-    resample_streamlines_step_size, parallel_transport_streamline, \
-    compress_sft, cut_invalid_streamlines, \
-    remove_overlapping_points_streamlines, remove_single_point_streamlines
+from scilpy.tractograms.streamline_operations import \
+    array_sequence_from_flat, get_flat_points_indices, \
+    resample_streamlines_step_size, parallel_transport_streamlines, \
+    compress_sft, compress_streamlines_flat, cut_invalid_streamlines, \
+    remove_overlapping_points_streamlines, remove_single_point_streamlines, \
+    smooth_streamlines_gaussian
 from scilpy.tractograms.streamline_and_mask_operations import \
     cut_streamlines_with_mask
 from scilpy.utils.spatial import generate_rotation_matrix
@@ -39,6 +38,28 @@ MIN_NB_POINTS = 10
 KEY_INDEX = np.concatenate((range(5), range(-1, -6, -1)))
 
 
+def get_shuffled_indices(nb_streamlines, rng_seed=None):
+    """
+    Computes a random permutation of the streamline indices, without
+    requiring the streamlines themselves. Can be used to shuffle a
+    tractogram that is not loaded in memory.
+
+    Parameters
+    ----------
+    nb_streamlines: int
+        The number of streamlines in the tractogram.
+    rng_seed: int
+        Random seed.
+
+    Returns
+    -------
+    indices: np.ndarray
+        The shuffled indices.
+    """
+    rng = np.random.RandomState(rng_seed)
+    return rng.permutation(nb_streamlines)
+
+
 def shuffle_streamlines(sft, rng_seed=None):
     """
     Shuffle the streamlines of a tractogram.
@@ -54,8 +75,7 @@ def shuffle_streamlines(sft, rng_seed=None):
     shuffled_sft: StatefulTractogram
         The shuffled tractogram.
     """
-    indices = np.arange(len(sft.streamlines))
-    random.shuffle(indices, random=rng_seed)
+    indices = get_shuffled_indices(len(sft.streamlines), rng_seed)
 
     streamlines = sft.streamlines[indices]
     data_per_streamline = sft.data_per_streamline[indices]
@@ -674,7 +694,8 @@ def transform_warp_sft(sft, linear_transfo, target, inverse=False,
     return new_sft
 
 
-def compress_streamlines_wrapper(tractogram, error_rate):
+def compress_streamlines_wrapper(tractogram, error_rate, nbr_processes=1,
+                                 chunk_size=100000):
     """
     Compresses the streamlines of a tractogram.
     Supports both nibabel.Tractogram dipy.StatefulTractogram
@@ -686,6 +707,11 @@ def compress_streamlines_wrapper(tractogram, error_rate):
         The tractogram to compress.
     error_rate: float
         The maximum distance (in mm) for point displacement during compression.
+    nbr_processes: int
+        Number of threads to use.
+    chunk_size: int
+        For lazy tractograms (TrkFile, TckFile), number of streamlines loaded
+        and compressed together.
 
     Returns
     -------
@@ -693,21 +719,73 @@ def compress_streamlines_wrapper(tractogram, error_rate):
         The compressed streamlines.
     """
     if isinstance(tractogram, (TrkFile, TckFile)):
-        return lambda: (compress_streamlines(
-            s, error_rate) for s in tractogram.streamlines)
+        def _compress_by_chunk():
+            for chunk in _iterate_by_chunk(tractogram.streamlines,
+                                           chunk_size):
+                compressed, _ = compress_streamlines_flat(
+                    chunk, error_rate, nbr_processes=nbr_processes)
+                yield from compressed
+        return _compress_by_chunk
     else:
         if hasattr(tractogram, 'streamlines'):
             tractogram = tractogram.streamlines
-        return [compress_streamlines(
-            s, error_rate) for s in tractogram]
+        compressed, _ = compress_streamlines_flat(
+            tractogram, error_rate, nbr_processes=nbr_processes)
+        return list(compressed)
+
+
+def _iterate_by_chunk(streamlines, chunk_size):
+    """Regroups a generator of streamlines into ArraySequences of chunk_size
+    streamlines."""
+    iterator = iter(streamlines)
+    while True:
+        chunk = ArraySequence(itertools.islice(iterator, chunk_size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def _add_smooth_point_wise_noise(streamlines, parents, parent_ids,
+                                 point_wise_std, rng):
+    """
+    Adds spatially smooth noise to all new streamlines at once. For each new
+    streamline, gaussian noise is drawn for each point, then a polynomial
+    (of degree 3) is fitted on it to avoid sharp changes along the
+    streamline. Points are moved away from their parent streamline (or in an
+    arbitrary direction if they are still on it) by the noise factor.
+    Streamlines of the same length are fitted together.
+    """
+    lengths = np.asarray(streamlines._lengths)
+    noise = rng.normal(loc=0, scale=point_wise_std, size=np.sum(lengths))
+    compact_offsets = np.cumsum(lengths) - lengths
+    noise_factor = np.zeros_like(noise)
+    for n in np.unique(lengths):
+        ids = np.where(lengths == n)[0]
+        # Index of each point, shape (n, nb streamlines of length n)
+        pts = compact_offsets[ids][None, :] + np.arange(n)[:, None]
+        x = np.arange(n)
+        coeffs = np.polyfit(x, noise[pts], min(3, n - 1))
+        noise_factor[pts] = np.vander(x, len(coeffs)) @ coeffs
+
+    data = streamlines._data[get_flat_points_indices(streamlines)]
+    parent_data = parents._data[get_flat_points_indices(
+        parents[parent_ids])]
+    vec = parent_data - data
+    norm = np.linalg.norm(vec, axis=-1, keepdims=True)
+    vec = np.where(norm > 0, vec / np.maximum(norm, 1e-12), 1 / np.sqrt(3))
+
+    new_data = (data + vec * noise_factor[:, None]).astype(data.dtype)
+    return array_sequence_from_flat(new_data, lengths)
 
 
 def upsample_tractogram(sft, nb, point_wise_std=None, tube_radius=None,
-                        gaussian=None, error_rate=None, seed=None):
+                        gaussian=None, error_rate=None, seed=None,
+                        nbr_processes=1):
     """
     Generates new streamlines by either adding gaussian noise around
     streamlines' points, or by translating copies of existing streamlines
-    by a random amount.
+    by a random amount. All new streamlines are generated at once, from the
+    flat data buffers (see parallel_transport_streamlines).
 
     The first streamlines of the returned tractogram are the initial
     streamlines, unchanged (if error_rate is None).
@@ -732,6 +810,8 @@ def upsample_tractogram(sft, nb, point_wise_std=None, tube_radius=None,
         None, no compression is done.
     seed: int, optional
         Seed for RNG. If None, uses random seed.
+    nbr_processes: int
+        Number of threads to use.
 
     Returns
     -------
@@ -752,52 +832,34 @@ def upsample_tractogram(sft, nb, point_wise_std=None, tube_radius=None,
     # Get the streamlines that will serve as a base for new ones
     indices = rng.choice(len(sft), nb, replace=True)
     unique_indices, count = np.unique(indices, return_counts=True)
-    resampled_sft = resample_streamlines_step_size(sft[unique_indices], 1)
-
-    # For all selected streamlines, add noise and smooth
-    new_streamlines = sft.streamlines
-    for s, c in zip(resampled_sft.streamlines, count):
-        # 1. Translate the streamline, up to a tube_radius distance.
-        if tube_radius is not None and tube_radius > 0:
-            new_s = parallel_transport_streamline(s, c, tube_radius)
-        else:
-            new_s = [s] * c
-
-        # 2. Add point-wise noise.
-        if point_wise_std is not None and point_wise_std > 0:
-            # Generate smooth noise_factor
-            noise = rng.normal(loc=0, scale=point_wise_std, size=len(s))
-
-            # Instead of generating random noise, we fit a polynomial to
-            # the noise and use it to generate a spatially smooth noise
-            # along the streamline (simply to avoid sharp changes in the
-            # noise factor).
-            x = np.arange(len(noise))
-            poly_coeffs = np.polyfit(x, noise, 3)
-            polynomial = Polynomial(poly_coeffs[::-1])
-            noise_factor = polynomial(x)
-
-            vec = s - new_s
-            norm = np.linalg.norm(vec, axis=0)
-            if np.any(norm == 0):
-                vec = np.ones_like(vec)
-                norm = np.linalg.norm(vec, axis=0)
-            vec /= norm
-
-            new_s += vec * np.expand_dims(noise_factor, axis=1)
+    resampled_sft = resample_streamlines_step_size(sft[unique_indices], 1,
+                                                   nbr_processes)
+    parents = resampled_sft.streamlines
+
+    # 1. Translate the streamlines, up to a tube_radius distance.
+    if tube_radius is not None and tube_radius > 0:
+        new_s, parent_ids = parallel_transport_streamlines(
+            parents, count, tube_radius, rng=rng,
+            nbr_processes=nbr_processes)
+    else:
+        parent_ids = np.repeat(np.arange(len(parents)), count)
+        new_s = parents[parent_ids].copy()
 
-            # Result is of shape [c, len(s), 3]. Splitting back
-            new_s = list(new_s)
+    # 2. Add point-wise noise.
+    if point_wise_std is not None and point_wise_std > 0:
+        new_s = _add_smooth_point_wise_noise(new_s, parents, parent_ids,
+                                             point_wise_std, rng)
 
-        # 3. Smooth the result.
-        if gaussian:
-            new_s = [smooth_line_gaussian(s, gaussian) for s in new_s]
+    # 3. Smooth the result.
+    if gaussian:
+        new_s = smooth_streamlines_gaussian(new_s, gaussian, nbr_processes)
 
-        new_streamlines.extend(new_s)
+    new_streamlines = sft.streamlines.copy()
+    new_streamlines.extend(new_s)
 
     if error_rate:
-        compressed_streamlines = compress_streamlines_wrapper(new_streamlines,
-                                                              error_rate)
+        compressed_streamlines, _ = compress_streamlines_flat(
+            new_streamlines, error_rate, nbr_processes=nbr_processes)
     else:
         compressed_streamlines = new_streamlines
 
@@ -805,6 +867,32 @@ def upsample_tractogram(sft, nb, point_wise_std=None, tube_radius=None,
     return new_sft
 
 
+def get_split_indices_sequentially(nb_streamlines, chunk_sizes):
+    """
+    Computes the indices of n sub-tractograms of sizes defined by chunk_sizes.
+    Streamlines are separated sequentially from the initial streamlines.
+
+    Parameters
+    ----------
+    nb_streamlines: int
+        The number of streamlines in the tractogram to subdivide.
+    chunk_sizes: list[int]
+        Number of streamlines to keep per chunk.
+
+    Return
+    ------
+    all_indices: list[np.ndarray]
+        The list of indices of each chunk. The number of chunks returned is
+        len(chunk_sizes).
+    """
+    if sum(chunk_sizes) > nb_streamlines:
+        raise ValueError("You asked for more streamlines than are available.")
+
+    ends = np.cumsum(chunk_sizes, dtype=int)
+    return [np.arange(end - nb_str, end)
+            for nb_str, end in zip(chunk_sizes, ends)]
+
+
 def split_sft_sequentially(orig_sft, chunk_sizes):
     """
     Divides a stateful tractogram into n sub-tractograms of sizes defined by
@@ -824,57 +912,42 @@ def split_sft_sequentially(orig_sft, chunk_sizes):
         The list of sub-tractograms as sfts. The number of tractograms returned
         is len(chunk_sizes).
     """
-    if sum(chunk_sizes) > len(orig_sft):
-        raise ValueError("You asked for more streamlines than are available.")
-
-    nb_chunks = len(chunk_sizes)
+    all_indices = get_split_indices_sequentially(len(orig_sft), chunk_sizes)
+    return [orig_sft[indices] for indices in all_indices]
 
-    curr = 0
-    sfts = []
-    for i in range(nb_chunks):
-        nb_str = chunk_sizes[i]
-        sfts.append(orig_sft[curr:curr + nb_str])
-        curr += chunk_sizes[i]
 
-    return sfts
-
-
-def split_sft_randomly(orig_sft, chunk_sizes, rng_seed,
-                       return_indices_only=False):
+def get_split_indices_randomly(nb_streamlines, chunk_sizes, rng_seed):
     """
-    Divides a stateful tractogram into n sub-tractograms of sizes defined by
-    chunk_sizes. Streamlines are separated randomly from the initial
-    streamlines.
+    Computes the indices of n sub-tractograms of sizes defined by chunk_sizes.
+    Streamlines are separated randomly from the initial streamlines. Only the
+    number of streamlines is needed, so the tractogram does not need to be
+    loaded.
 
     Parameters
     ----------
-    orig_sft: StatefulTractogram
-        Initial tractogram to subdivide
+    nb_streamlines: int
+        The number of streamlines in the tractogram to subdivide.
     chunk_sizes: int or list[int]
         Number of streamlines to keep (per sub-tractogram if it is a list).
     rng_seed: int
         Random seed.
-    return_indices_only: bool
-        If true, return a random list of indices. Else, return the Stateful
-        Tractogram containing the chosen streamlines.
 
     Return
     ------
-    all_chunks: list[StatefulTractogram] or list[list[int]]
-        The list of sub-tractograms as sfts. The number of tractograms returned
-        is len(chunk_sizes) + 1, where the last item of the list contains
+    all_indices: list[np.ndarray]
+        The list of indices of each chunk. The number of chunks returned is
+        len(chunk_sizes) + 1, where the last item of the list contains
         streamlines that were not included in any.
-        (Or the lists of indices if return_indices_only.)
     """
     if isinstance(chunk_sizes, int):
         chunk_sizes = [chunk_sizes]
 
-    if sum(chunk_sizes) > len(orig_sft):
+    if sum(chunk_sizes) > nb_streamlines:
         raise ValueError("You asked for more streamlines than are available.")
 
     # Shuffle all streamline indices
     rng = np.random.RandomState(rng_seed)
-    ind = np.arange(len(orig_sft.streamlines))
+    ind = np.arange(nb_streamlines)
     rng.shuffle(ind)
 
     # Separate indices.
@@ -888,29 +961,58 @@ def split_sft_randomly(orig_sft, chunk_sizes, rng_seed,
     # Append indices not included in any chunk
     final_indices.append(ind[start:])
 
+    return final_indices
+
+
+def split_sft_randomly(orig_sft, chunk_sizes, rng_seed,
+                       return_indices_only=False):
+    """
+    Divides a stateful tractogram into n sub-tractograms of sizes defined by
+    chunk_sizes. Streamlines are separated randomly from the initial
+    streamlines.
+
+    Parameters
+    ----------
+    orig_sft: StatefulTractogram
+        Initial tractogram to subdivide
+    chunk_sizes: int or list[int]
+        Number of streamlines to keep (per sub-tractogram if it is a list).
+    rng_seed: int
+        Random seed.
+    return_indices_only: bool
+        If true, return a random list of indices. Else, return the Stateful
+        Tractogram containing the chosen streamlines.
+
+    Return
+    ------
+    all_chunks: list[StatefulTractogram] or list[list[int]]
+        The list of sub-tractograms as sfts. The number of tractograms returned
+        is len(chunk_sizes) + 1, where the last item of the list contains
+        streamlines that were not included in any.
+        (Or the lists of indices if return_indices_only.)
+    """
+    final_indices = get_split_indices_randomly(len(orig_sft), chunk_sizes,
+                                               rng_seed)
+
     if return_indices_only:
         return final_indices
 
     # Format as sft
-    all_sfts = []
-    for i in range(len(chunk_sizes) + 1):
-        all_sfts.append(orig_sft[final_indices[i]])
-
-    return all_sfts
+    return [orig_sft[indices] for indices in final_indices]
 
 
-def split_sft_randomly_per_cluster(orig_sft, chunk_sizes, seed, thresholds):
+def get_split_indices_randomly_per_cluster(streamlines, chunk_sizes, seed,
+                                           thresholds):
     """
-    Divides a stateful tractogram into n sub-tractograms of sizes defined by
-    chunk_sizes. Streamlines are separated randomly from each Quickbundle
-    cluster created from the initial streamlines (trying to help
-    the randomization to ensure there are streamlines from all bundles in each
-    subset).
+    Computes the indices of n sub-tractograms of sizes defined by chunk_sizes.
+    Streamlines are separated randomly from each Quickbundle cluster created
+    from the initial streamlines. Only the streamlines are needed (not the
+    data_per_point or data_per_streamline), so they may be memory-mapped.
 
     Parameters
     ----------
-    orig_sft: StatefulTractogram
-        Initial tractogram to subdivide
+    streamlines: ArraySequence
+        Initial streamlines to subdivide.
     chunk_sizes: list[int]
         Number of streamlines to keep per chunk. We will ensure that the number
         of streamlines kept per cluster is proportional to the cluster's size.
@@ -923,22 +1025,22 @@ def split_sft_randomly_per_cluster(orig_sft, chunk_sizes, seed, thresholds):
 
     Returns
     -------
-    all_sfts: list[StatefulTractogram]
-        The list of sub-tractograms as sfts. The number of tractograms returned
-        is len(chunk_sizes) + 1, where the last item of the list contains
+    all_indices: list[np.ndarray]
+        The list of indices of each chunk. The number of chunks returned is
+        len(chunk_sizes) + 1, where the last item of the list contains
         streamlines that were not included in any.
     """
-
-    if sum(chunk_sizes) > len(orig_sft):
+    nb_streamlines = len(streamlines)
+    if sum(chunk_sizes) > nb_streamlines:
         raise ValueError("You asked for more streamlines than are available.")
 
     # Percent of streamlines to keep per chunk.
     nb_chunks = len(chunk_sizes)
-    percent_kept_per_chunk = [nb / len(orig_sft) for nb in chunk_sizes]
+    percent_kept_per_chunk = [nb / nb_streamlines for nb in chunk_sizes]
 
     logging.debug("Computing QBx")
     rng = np.random.RandomState(seed)
-    clusters = qbx_and_merge(orig_sft.streamlines, thresholds, nb_pts=20,
+    clusters = qbx_and_merge(streamlines, thresholds, nb_pts=20,
                              verbose=False, rng=rng)
 
     logging.info("Done. Now getting list of indices in each of the {} "
@@ -946,8 +1048,8 @@ def split_sft_randomly_per_cluster(orig_sft, chunk_sizes, seed, thresholds):
     total_indices = [[] for _ in range(nb_chunks + 1)]
     for cluster in clusters:
         if len(cluster.indices) > 1:
-            cluster_sft = orig_sft[cluster.indices]
-            size_cluster = len(cluster.indices)
+            cluster_indices = np.asarray(cluster.indices)
+            size_cluster = len(cluster_indices)
             chunk_sizes_in_cluster = \
                 [round(p * size_cluster) for p in percent_kept_per_chunk]
 
@@ -956,20 +1058,51 @@ def split_sft_randomly_per_cluster(orig_sft, chunk_sizes, seed, thresholds):
             while sum(chunk_sizes_in_cluster) > size_cluster:
                 chunk_sizes_in_cluster[-1] -= 1
 
-            all_chunks_inds_in_cluster = split_sft_randomly(
-                cluster_sft, chunk_sizes_in_cluster, seed,
-                return_indices_only=True)
+            all_chunks_inds_in_cluster = get_split_indices_randomly(
+                size_cluster, chunk_sizes_in_cluster, seed)
 
             assert len(all_chunks_inds_in_cluster) == nb_chunks + 1
 
             for i in range(nb_chunks + 1):
-                chunk_orig_inds = [cluster.indices[ind] for ind in
-                                   all_chunks_inds_in_cluster[i]]
-                total_indices[i].extend(chunk_orig_inds)
+                total_indices[i].extend(
+                    cluster_indices[all_chunks_inds_in_cluster[i]])
+
+    return [np.asarray(inds, dtype=int) for inds in total_indices]
 
-    final_sfts = [orig_sft[inds] for inds in total_indices]
 
-    return final_sfts
+def split_sft_randomly_per_cluster(orig_sft, chunk_sizes, seed, thresholds):
+    """
+    Divides a stateful tractogram into n sub-tractograms of sizes defined by
+    chunk_sizes. Streamlines are separated randomly from each Quickbundle
+    cluster created from the initial streamlines (trying to help
+    the randomization to ensure there are streamlines from all bundles in each
+    subset).
+
+    Parameters
+    ----------
+    orig_sft: StatefulTractogram
+        Initial tractogram to subdivide
+    chunk_sizes: list[int]
+        Number of streamlines to keep per chunk. We will ensure that the number
+        of streamlines kept per cluster is proportional to the cluster's size.
+        Final number will be a good approximation of nb_streamlines, but not
+        exact.
+    seed: int
+        Random seed.
+    thresholds: list[float]
+        QBx threshold values. Suggestion: [40, 30, 20].
+
+    Returns
+    -------
+    all_sfts: list[StatefulTractogram]
+        The list of sub-tractograms as sfts. The number of tractograms returned
+        is len(chunk_sizes) + 1, where the last item of the list contains
+        streamlines that were not included in any.
+    """
+    total_indices = get_split_indices_randomly_per_cluster(
+        orig_sft.streamlines, chunk_sizes, seed, thresholds)
+
+    return [orig_sft[inds] for inds in total_indices]
 
 
 def subsample_streamlines_alter(sft, min_dice=0.90, epsilon=0.01,
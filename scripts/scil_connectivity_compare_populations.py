@@ -27,6 +27,13 @@ statistical tests, useful when using --fdr or --bonferroni.
 of observations (subjects). They must be listed in the right order using --g1
 and --g2.
 
+--nb_permutations will compute the p-values with a permutation test instead
+of the Student t distribution: the group labels (or, with --paired, the signs
+of the differences) are shuffled and the t statistic of all edges is computed
+for each permutation. The p-values follow the same convention in both cases:
+they are half the usual ones (for --tail both, sf(|t|) instead of
+2 * sf(|t|)).
+
 Formerly: scil_compare_connectivity.py
 ----------------------------------------------------------------------------
 References:
@@ -95,6 +102,16 @@ def _build_arg_parser():
                    help='Binary filtering mask (.npy) to apply before '
                         'computing the measures.')
 
+    perm = p.add_argument_group('Permutation test')
+    perm.add_argument('--nb_permutations', type=int, default=0,
+                      help='If set, compute the p-values from this number of '
+                           'permutations. [%(default)s]')
+    perm.add_argument('--batch_size', type=int, default=100,
+                      help='Number of permutations evaluated at once. Lower '
+                           'it to reduce memory usage. [%(default)s]')
+    perm.add_argument('--seed', type=int, default=0,
+                      help='Random number generator seed. [%(default)s]')
+
     add_verbose_arg(p)
     add_overwrite_arg(p)
 
@@ -128,9 +145,15 @@ def main():
     if args.paired and matrices_g1.shape[2] != matrices_g2.shape[2]:
         parser.error('For paired statistic both groups must have the same '
                      'number of observations.')
+    if args.nb_permutations < 0 or args.batch_size < 1:
+        parser.error('--nb_permutations must be positive and --batch_size '
+                     'at least 1.')
 
     matrix_pval = ttest_two_matrices(matrices_g1, matrices_g2, args.paired,
-                                     args.tail, args.fdr, args.bonferroni)
+                                     args.tail, args.fdr, args.bonferroni,
+                                     nb_permutations=args.nb_permutations,
+                                     batch_size=args.batch_size,
+                                     rng_seed=args.seed)
 
     save_matrix_in_any_format(args.out_pval_matrix, matrix_pval)
 
@@ -71,7 +71,6 @@ Formerly: scil_compute_connectivity.py
 import argparse
 import itertools
 import logging
-import multiprocessing
 import os
 
 import coloredlogs
@@ -81,8 +80,7 @@ import numpy as np
 import scipy.ndimage as ndi
 
 from scilpy.connectivity.connectivity import \
-    compute_connectivity_matrices_from_hdf5, \
-    multi_proc_compute_connectivity_matrices_from_hdf5
+    compute_all_connectivity_matrices_from_hdf5
 from scilpy.image.labels import get_data_as_labels
 from scilpy.io.hdf5 import assert_header_compatible_hdf5
 from scilpy.io.image import get_data_as_mask
@@ -244,8 +242,8 @@ def main():
     # (one per node). Can be loaded and discarded when treating each node.
 
     # Preloading the metrics here (FA, T1) to avoid reloading for each
-    # node! But if there are many metrics, this could be heavy to keep in
-    # memory, especially if multiprocessing is used. Still probably better.
+    # node! With multiprocessing, they are shared between processes rather
+    # than copied.
     metrics_data = []
     metrics_names = []
     for m in args.metrics:
@@ -267,42 +265,16 @@ def main():
     if not args.no_self_connection:
         comb_list.extend(zip(labels_list, labels_list))
 
-    # Running everything!
+    # Running everything! The hdf5 is read once, by batches of connections.
     nbr_cpu = validate_nbr_processes(parser, args)
-    outputs = []
-    if nbr_cpu == 1:
-        for comb in comb_list:
-            outputs.append(compute_connectivity_matrices_from_hdf5(
-                args.in_hdf5, img_labels, comb[0], comb[1],
-                compute_volume, compute_streamline_count, compute_length,
-                similarity_directory, metrics_data, metrics_names,
-                lesion_data, args.include_dps, args.density_weighting,
-                args.min_lesion_vol))
-    else:
-        pool = multiprocessing.Pool(nbr_cpu)
-
-        # Dividing the process bundle by bundle
-        outputs = pool.map(
-            multi_proc_compute_connectivity_matrices_from_hdf5,
-            zip(itertools.repeat(args.in_hdf5),
-                itertools.repeat(img_labels),
-                comb_list,
-                itertools.repeat(compute_volume),
-                itertools.repeat(compute_streamline_count),
-                itertools.repeat(compute_length),
-                itertools.repeat(similarity_directory),
-                itertools.repeat(metrics_data),
-                itertools.repeat(metrics_names),
-                itertools.repeat(lesion_data),
-                itertools.repeat(args.include_dps),
-                itertools.repeat(args.density_weighting),
-                itertools.repeat(args.min_lesion_vol)
-                ))
-        pool.close()
-        pool.join()
-
-    # Removing None entries (combinaisons that do not exist)
-    outputs = [it for it in outputs if it is not None]
+    outputs = compute_all_connectivity_matrices_from_hdf5(
+        args.in_hdf5, img_labels, comb_list,
+        compute_volume, compute_streamline_count, compute_length,
+        similarity_directory, metrics_data, metrics_names,
+        lesion_data, args.include_dps, args.density_weighting,
+        args.min_lesion_vol, processes=nbr_cpu)
+
+    # (Combinaisons that do not exist are not in the outputs)
     if len(outputs) == 0:
         raise ValueError('No connection found at all! Matrices would be '
                          'all-zeros. Exiting.')
@@ -37,10 +37,14 @@ from scilpy.connectivity.connectivity import \
     compute_triu_connectivity_from_labels
 from scilpy.image.labels import get_data_as_labels
 
-from scilpy.io.streamlines import load_tractogram_with_reference
+from scilpy.io.streamlines import (SFT_CACHE_EXTENSION,
+                                   load_tractogram_with_reference,
+                                   verify_compatibility_with_reference_sft)
 from scilpy.io.utils import assert_inputs_exist, assert_outputs_exist, \
     add_verbose_arg, add_overwrite_arg, assert_headers_compatible, \
     add_reference_arg
+from scilpy.tractograms.lazy_tractogram_operations import (
+    LAZY_TRACTOGRAM_EXTENSIONS, lazy_sft_chunks)
 from scilpy.version import version_string
 
 
@@ -50,7 +54,8 @@ def _build_arg_parser():
                                 epilog=version_string)
 
     p.add_argument('in_tractogram',
-                   help='Tractogram (trk or tck).')
+                   help='Tractogram. Trk, tck, trx and sft files are read by '
+                        'chunks, never\nentirely loaded in memory.')
     p.add_argument('in_labels',
                    help='Input nifti volume.')
     p.add_argument('out_matrix',
@@ -82,6 +87,10 @@ def _build_arg_parser():
                         "streamline count is saved.")
     g.add_argument('--percentage', action='store_true')
 
+    p.add_argument('--chunk_size', type=int, default=100000,
+                   help='Number of streamlines read at once. '
+                        '[%(default)s]')
+
     add_verbose_arg(p)
     add_reference_arg(p)
     add_overwrite_arg(p)
@@ -134,19 +143,37 @@ def main():
 
     assert_inputs_exist(p, [args.in_labels, args.in_tractogram],
                         args.reference)
-    assert_headers_compatible(p, [args.in_labels, args.in_tractogram], [],
-                              args.reference)
+    _, in_ext = os.path.splitext(args.in_tractogram)
+    if in_ext == SFT_CACHE_EXTENSION:
+        # Verified once loaded (the header is in the file).
+        assert_headers_compatible(p, args.in_labels, [], args.reference)
+    else:
+        assert_headers_compatible(p, [args.in_labels, args.in_tractogram],
+                                  [], args.reference)
     assert_outputs_exist(p, args, args.out_matrix, args.out_fig)
 
-    # Loading
-    in_sft = load_tractogram_with_reference(p, args, args.in_tractogram)
+    # Loading. The streamlines are streamed by chunks. Headers are
+    # compatible: using the labels as reference.
     in_img = nib.load(args.in_labels)
     data_labels = get_data_as_labels(in_img)
+    if in_ext == SFT_CACHE_EXTENSION:
+        # Memory-mapped.
+        tractogram = load_tractogram_with_reference(p, args,
+                                                    args.in_tractogram)
+        verify_compatibility_with_reference_sft(tractogram, [args.in_labels],
+                                                p, args)
+    elif in_ext in LAZY_TRACTOGRAM_EXTENSIONS:
+        tractogram = args.in_tractogram
+    else:
+        # No lazy loading for this format.
+        tractogram = load_tractogram_with_reference(p, args,
+                                                    args.in_tractogram)
+    chunks = lazy_sft_chunks(tractogram, in_img, args.chunk_size)
 
     # Computing
     matrix, ordered_labels, _, _ = \
         compute_triu_connectivity_from_labels(
-            in_sft, data_labels, keep_background=args.keep_background,
+            chunks, data_labels, keep_background=args.keep_background,
             hide_labels=args.hide_labels)
 
     # Save figure will all versions of the matrix.
@@ -24,6 +24,9 @@ All operations are stricly > or <, there is no >= or <=.
 
 --greater_than or --lower_than expect the same convention:
     MATRICES_LIST VALUE_THR POPULATION_PERC
+The MATRICES_LIST can contain stacks of matrices (N, X, Y) saved as .npy
+(see scil_connectivity_stack_matrices.py), each of their matrices counting
+as one member of the population.
 It is strongly recommended (but not enforced) that the same number of
 connectivity matrices is used for each condition.
 
@@ -47,10 +50,10 @@ import logging
 
 import numpy as np
 
+from scilpy.connectivity.matrix_tools import load_matrix_stack
 from scilpy.image.volume_math import invert
 from scilpy.io.utils import (add_overwrite_arg, add_verbose_arg,
                              assert_outputs_exist,
-                             load_matrix_in_any_format,
                              save_matrix_in_any_format, assert_inputs_exist)
 from scilpy.version import version_string
 
@@ -88,19 +91,18 @@ def _build_arg_parser():
 
 
 def _filter(input_list, condition):
-    matrices = [load_matrix_in_any_format(i) for i in input_list[:-2]]
-    shape = matrices[0].shape
-    matrices = np.rollaxis(np.array(matrices), axis=0, start=3)
+    matrices = load_matrix_stack(input_list[:-2])
+    shape = matrices.shape[1:]
     value_threshold = float(input_list[-2])
-    population_threshold = int(float(input_list[-1]) * matrices.shape[-1])
+    population_threshold = int(float(input_list[-1]) * len(matrices))
 
-    empty_matrices = np.zeros(matrices.shape)
     # Only difference between both condition, the rest is identical
     if condition == 'lower':
-        empty_matrices[matrices < value_threshold] = 1
+        population_score = np.count_nonzero(matrices < value_threshold,
+                                            axis=0)
     else:
-        empty_matrices[matrices > value_threshold] = 1
-    population_score = np.sum(empty_matrices, axis=2)
+        population_score = np.count_nonzero(matrices > value_threshold,
+                                            axis=0)
 
     filter_mask = population_score > population_threshold
     logging.info('Condition {}_than resulted in {} filtered '
@@ -133,17 +135,13 @@ def main():
             conditions_list.append(('greater', input_list))
 
     condition_counter = 0
-    shape = load_matrix_in_any_format(conditions_list[0][1][0]).shape
-    output_mask = np.zeros(shape)
-
-    for input_list in args.lower_than:
-        condition_counter += 1
-        filter_mask = _filter(input_list, 'lower')
-        output_mask[filter_mask] += 1
-
-    for input_list in args.lower_than:
+    output_mask = None
+    for condition, input_list in conditions_list:
         condition_counter += 1
-        filter_mask = _filter(input_list, 'gteater')
+        filter_mask = _filter(input_list, condition)
+        if output_mask is None:
+            shape = filter_mask.shape
+            output_mask = np.zeros(shape)
         output_mask[filter_mask] += 1
 
     if not args.keep_condition_count:
@@ -12,6 +12,13 @@ the --append_json option as well as using the same output filename.
 >>> for i in hcp/*/; do scil_connectivity_graph_measures.py ${i}/sc_prob.npy
     ${i}/len_prob.npy hcp_prob.json --append_json --avg_node_wise; done
 
+Many subjects can also be evaluated at once, in parallel, with
+--in_conn_matrices and --in_length_matrices (same order in both lists):
+>>> scil_connectivity_graph_measures.py sub-01/sc.npy sub-01/len.npy pop.json
+    --in_conn_matrices sub-0[2-9]/sc.npy
+    --in_length_matrices sub-0[2-9]/len.npy
+    --avg_node_wise --processes 8
+
 Some measures output one value per node, the default behavior is to list
 them all. To obtain only the average use the --avg_node_wise option.
 
@@ -19,6 +26,12 @@ The computed connectivity measures are:
 centrality, modularity, assortativity, participation, clustering,
 nodal_strength, local_efficiency, global_efficiency, density, rich_club,
 path_length, edge_count, omega, sigma
+Use --measures to compute only some of them.
+
+The small-world measures compare the matrix to random and lattice reference
+networks, which is slow. With --seed and --cache_dir, the measures of the
+reference networks are saved and reused when the same matrix is evaluated
+again (for instance when re-running a cohort).
 
 For more details about the measures, please refer to
 - https://sites.google.com/site/bctnet/measures
@@ -41,13 +54,17 @@ import json
 import logging
 import os
 
-from scilpy.connectivity.matrix_tools import evaluate_graph_measures
+from scilpy.connectivity.matrix_tools import (GRAPH_MEASURES,
+                                              SMALL_WORLD_MEASURES,
+                                              evaluate_graph_measures_batch)
 from scilpy.io.utils import (add_json_args,
                              add_overwrite_arg,
+                             add_processes_arg,
                              add_verbose_arg,
                              assert_inputs_exist,
                              assert_outputs_exist,
-                             load_matrix_in_any_format)
+                             load_matrix_in_any_format,
+                             validate_nbr_processes)
 from scilpy.version import version_string
 
 
@@ -75,8 +92,27 @@ def _build_arg_parser():
     p.add_argument('--small_world', action='store_true',
                    help='Compute measure related to small worldness (omega '
                         'and sigma).\n This option is much slower.')
+    p.add_argument('--measures', nargs='+',
+                   choices=GRAPH_MEASURES + SMALL_WORLD_MEASURES,
+                   metavar='MEASURE',
+                   help='Only compute these measures. Default: all (omega '
+                        'and sigma only\nwith --small_world). Choices:\n'
+                        '%(choices)s')
+    p.add_argument('--seed', type=int,
+                   help='Seed of the small-world reference networks.')
+    p.add_argument('--cache_dir',
+                   help='Directory where the measures of the small-world '
+                        'reference networks\nare cached. Requires --seed.')
+
+    b = p.add_argument_group('Batch options')
+    b.add_argument('--in_conn_matrices', nargs='+', default=[],
+                   help='Connectivity matrices (.npy) of more subjects.')
+    b.add_argument('--in_length_matrices', nargs='+', default=[],
+                   help='Length-weighted matrices (.npy) of more subjects, '
+                        'in the same\norder as --in_conn_matrices.')
 
     add_json_args(p)
+    add_processes_arg(p)
     add_verbose_arg(p)
     add_overwrite_arg(p)
 
@@ -88,8 +124,15 @@ def main():
     args = parser.parse_args()
     logging.getLogger().setLevel(logging.getLevelName(args.verbose))
 
-    assert_inputs_exist(parser, [args.in_length_matrix,
-                                 args.in_conn_matrix])
+    assert_inputs_exist(parser, [args.in_length_matrix, args.in_conn_matrix]
+                        + args.in_conn_matrices + args.in_length_matrices,
+                        args.filtering_mask)
+    if len(args.in_conn_matrices) != len(args.in_length_matrices):
+        parser.error('--in_conn_matrices and --in_length_matrices must have '
+                     'the same length.')
+    if args.cache_dir and args.seed is None:
+        parser.error('--cache_dir requires --seed.')
+    nbr_cpu = validate_nbr_processes(parser, args)
 
     if not args.append_json:
         assert_outputs_exist(parser, args, args.out_json)
@@ -103,30 +146,34 @@ def main():
                      'overwrite.\nAmbiguous behavior, consider deleting the '
                      'output json file first instead.')
 
-    conn_matrix = load_matrix_in_any_format(args.in_conn_matrix)
-    len_matrix = load_matrix_in_any_format(args.in_length_matrix)
-
     if args.filtering_mask:
         mask_matrix = load_matrix_in_any_format(
             args.filtering_mask).astype(bool)
-        conn_matrix *= mask_matrix
-        len_matrix *= mask_matrix
+    else:
+        mask_matrix = 1
+
+    conn_matrices = [load_matrix_in_any_format(f) * mask_matrix
+                     for f in [args.in_conn_matrix] + args.in_conn_matrices]
+    len_matrices = [load_matrix_in_any_format(f) * mask_matrix
+                    for f in [args.in_length_matrix] +
+                    args.in_length_matrices]
 
-    gtm_dict = evaluate_graph_measures(conn_matrix, len_matrix,
-                                       args.avg_node_wise, args.small_world)
+    gtm_dicts = evaluate_graph_measures_batch(
+        conn_matrices, len_matrices, args.avg_node_wise, args.small_world,
+        measures=args.measures, seed=args.seed, cache_dir=args.cache_dir,
+        nbr_processes=nbr_cpu)
 
     if os.path.isfile(args.out_json) and args.append_json:
         with open(args.out_json) as json_data:
             out_dict = json.load(json_data)
-        for key in gtm_dict.keys():
-            if isinstance(out_dict[key], list):
-                out_dict[key].append(gtm_dict[key])
-            else:
-                out_dict[key] = [out_dict[key], gtm_dict[key]]
+        for key in gtm_dicts[0].keys():
+            if not isinstance(out_dict[key], list):
+                out_dict[key] = [out_dict[key]]
+            out_dict[key].extend([gtm_dict[key] for gtm_dict in gtm_dicts])
     else:
         out_dict = {}
-        for key in gtm_dict.keys():
-            out_dict[key] = [gtm_dict[key]]
+        for key in gtm_dicts[0].keys():
+            out_dict[key] = [gtm_dict[key] for gtm_dict in gtm_dicts]
 
     with open(args.out_json, 'w') as outfile:
         json.dump(out_dict, outfile,
@@ -7,9 +7,14 @@ Typically use after scil_tractogram_segment_connections_from_labels.py in
 order to obtain the average density map of each connection to allow the use
 of --similarity in scil_connectivity_compute_matrices.py.
 
-This script is parallelized, but will run much slower on non-SSD if too many
-processes are used. The output is a directory containing the thousands of
-connections:
+The connections are split between the processes. Each process handles its
+connections by batches of --batch_size: every hdf5 file is read once per
+batch, and a sparse running sum is kept for each connection of the batch
+only. Memory thus depends on the number of voxels traversed by the
+connections of a batch, rather than on the number of subjects or on the total
+number of connections. The script will run slower on non-SSD if too many
+processes are used, or if --batch_size is small. The output is a directory
+containing the thousands of connections:
 out_dir/
     |-- LABEL1_LABEL1.nii.gz
     |-- LABEL1_LABEL2.nii.gz
@@ -29,13 +34,12 @@ import h5py
 import numpy as np
 import nibabel as nib
 
-from scilpy.io.hdf5 import assert_header_compatible_hdf5, \
-    reconstruct_streamlines_from_hdf5
+from scilpy.connectivity.connectivity import \
+    compute_average_density_maps_from_hdf5
 from scilpy.io.utils import (add_overwrite_arg, add_verbose_arg,
                              add_processes_arg, assert_inputs_exist,
                              assert_output_dirs_exist_and_empty,
                              validate_nbr_processes)
-from scilpy.tractanalysis.streamlines_metrics import compute_tract_counts_map
 from scilpy.version import version_string
 
 
@@ -51,6 +55,9 @@ def _build_arg_parser():
 
     p.add_argument('--binary', action='store_true',
                    help='Binarize density maps before the population average.')
+    p.add_argument('--batch_size', type=int, default=1000,
+                   help='Number of connections averaged at once, per process.'
+                        '\nLower it to reduce memory usage. [%(default)s]')
 
     add_processes_arg(p)
     add_verbose_arg(p)
@@ -60,36 +67,24 @@ def _build_arg_parser():
 
 def _average_wrapper(args):
     hdf5_filenames = args[0]
-    key = args[1]
+    keys = args[1]
     binary = args[2]
     out_dir = args[3]
+    batch_size = args[4]
 
-    with h5py.File(hdf5_filenames[0], 'r') as hdf5_file_ref:
-        affine = hdf5_file_ref.attrs['affine']
-        dimensions = hdf5_file_ref.attrs['dimensions']
-        density_data = np.zeros(dimensions, dtype=np.float32)
+    density_data = None
+    for start in range(0, len(keys), batch_size):
+        average_maps, affine, dimensions = \
+            compute_average_density_maps_from_hdf5(
+                hdf5_filenames, keys[start:start + batch_size], binary)
 
-    for hdf5_filename in hdf5_filenames:
-        with h5py.File(hdf5_filename, 'r') as hdf5_file:
-            assert_header_compatible_hdf5(hdf5_file, (affine, dimensions))
-
-            # scil_tractogram_segment_connections_from_labels.py saves the
-            # streamlines in VOX/CORNER
-            streamlines = reconstruct_streamlines_from_hdf5(hdf5_file[key])
-            if len(streamlines) == 0:
-                continue
-            density = compute_tract_counts_map(streamlines, dimensions)
-
-        if binary:
-            density_data[density > 0] += 1
-        elif np.max(density) > 0:
-            density_data += density / np.max(density)
-
-    if np.max(density_data) > 0:
-        density_data /= len(hdf5_filenames)
-
-        nib.save(nib.Nifti1Image(density_data, affine),
-                 os.path.join(out_dir, '{}.nii.gz'.format(key)))
+        if density_data is None:
+            density_data = np.zeros(dimensions, dtype=np.float32)
+        for key, (indices, values) in average_maps.items():
+            density_data.flat[indices] = values
+            nib.save(nib.Nifti1Image(density_data, affine),
+                     os.path.join(out_dir, '{}.nii.gz'.format(key)))
+            density_data.flat[indices] = 0
 
 
 def main():
@@ -98,6 +93,8 @@ def main():
     logging.getLogger().setLevel(logging.getLevelName(args.verbose))
 
     assert_inputs_exist(parser, args.in_hdf5)
+    if args.batch_size < 1:
+        parser.error('--batch_size must be at least 1.')
     assert_output_dirs_exist_and_empty(parser, args, args.out_dir,
                                        create_dir=True)
 
@@ -106,18 +103,22 @@ def main():
         with h5py.File(filename, 'r') as curr_file:
             keys.extend(curr_file.keys())
 
-    keys = set(keys)
+    keys = sorted(set(keys))
     nbr_cpu = validate_nbr_processes(parser, args)
     if nbr_cpu == 1:
-        for key in keys:
-            _average_wrapper([args.in_hdf5, key, args.binary, args.out_dir])
+        _average_wrapper([args.in_hdf5, keys, args.binary, args.out_dir,
+                          args.batch_size])
     else:
-        pool = multiprocessing.Pool(nbr_cpu)
+        # Parallel over connections: each process reads its connections
+        # from all subjects.
+        keys_chunks = [keys[i::nbr_cpu] for i in range(nbr_cpu)]
+        pool = multiprocessing.get_context('spawn').Pool(nbr_cpu)
         _ = pool.map(_average_wrapper,
                      zip(itertools.repeat(args.in_hdf5),
-                         keys,
+                         keys_chunks,
                          itertools.repeat(args.binary),
-                         itertools.repeat(args.out_dir)))
+                         itertools.repeat(args.out_dir),
+                         itertools.repeat(args.batch_size)))
         pool.close()
         pool.join()
 
@@ -8,6 +8,11 @@ listed below.
 Some operations such as multiplication or addition accept float value as
 parameters instead of matrices.
 > scil_connectivity_math.py multiplication mat.npy 10 mult_10.npy
+
+Stacks of matrices (N, X, Y) saved as .npy (see
+scil_connectivity_stack_matrices.py) are supported by voxel-wise operations.
+For normalize_sum and normalize_max, each matrix of a stack is normalized
+independently.
 """
 
 import argparse
@@ -17,6 +22,7 @@ import os
 import nibabel as nib
 import numpy as np
 
+from scilpy.connectivity.matrix_tools import scale_matrix
 from scilpy.image.volume_math import (get_array_ops, get_operations_doc)
 from scilpy.io.utils import (add_overwrite_arg,
                              add_verbose_arg,
@@ -27,6 +33,9 @@ from scilpy.utils import is_float
 from scilpy.version import version_string
 
 OPERATIONS = get_array_ops()
+# Operations applied on each matrix of a stack rather than on the whole stack.
+STACK_OPERATIONS = {'normalize_max': 'max_at_one',
+                    'normalize_sum': 'sum_to_one'}
 
 ADDED_DOC = get_operations_doc(OPERATIONS).replace('images', 'matrices')
 ADDED_DOC = ADDED_DOC.replace('image', 'matrix')
@@ -73,7 +82,10 @@ def load_matrix(arg):
         logging.info('Loaded {} of shape {} and data_type {}.'.format(
             arg, data.shape, data.dtype))
 
-        if data.ndim > 2:
+        if data.ndim == 3:
+            logging.info('{} is considered as a stack of {} matrices.'.format(
+                arg, len(data)))
+        elif data.ndim > 3:
             logging.warning('{} has {} dimensions, be careful.'.format(
                 arg, data.ndim))
         elif data.ndim < 2:
@@ -135,7 +147,15 @@ def main():
 
     # Perform the requested operation
     try:
-        output_data = OPERATIONS[args.operation](input_matrices, ref_matrix)
+        if args.operation in STACK_OPERATIONS and len(ref_matrix.shape) == 3:
+            if len(input_matrices) != 1:
+                raise ValueError('Only one input is supported.')
+            output_data = scale_matrix(
+                input_matrices[0].get_fdata(dtype=np.float64),
+                STACK_OPERATIONS[args.operation])
+        else:
+            output_data = OPERATIONS[args.operation](input_matrices,
+                                                     ref_matrix)
     except ValueError:
         logging.error('{} operation failed.'.format(
             args.operation.capitalize()))
@@ -28,6 +28,10 @@ choose any number of non-mutually exclusive options:
    Compensate for the likelihood of ending in the node.
    Compensate for seeding bias when using interface seeding.
 
+   The volume and surface of all the nodes are computed in a single pass over
+   the atlas. With --cache_dir, they are saved and reused whenever the same
+   atlas is given again (ex, normalizing many matrices of one subject).
+
 -- Matrix scaling (Mutually exclusive)
  - max_at_one: Maximum value of the matrix will be set to one.
  - sum_to_one: Ensure the sum of all edges weight is one
@@ -36,6 +40,12 @@ choose any number of non-mutually exclusive options:
 The volume and length matrices should come from the
 scil_tractogram_segment_connections_from_labels.py script.
 
+The input matrix can also be a stack of matrices (N, X, Y) saved as a .npy
+file (see scil_connectivity_stack_matrices.py), for instance one matrix per
+subject. All matrices are then normalized at once, each one being scaled
+independently. The length and volume matrices must then be either a single
+matrix, used for all the stack, or a stack of the same shape.
+
 A review of the types of normalization is available in:
 Colon-Perez, Luis M., et al. "Dimensionless, scale-invariant, edge weight
 metric for the study of complex structural networks." PLOS one 10.7 (2015).
@@ -53,8 +63,8 @@ import nibabel as nib
 import numpy as np
 
 from scilpy.connectivity.matrix_tools import \
-    normalize_matrix_from_values, normalize_matrix_from_parcel
-from scilpy.image.volume_math import normalize_max, normalize_sum, base_10_log
+    ParcelStatistics, normalize_matrix_from_values, \
+    normalize_matrix_from_parcel, scale_matrix
 from scilpy.io.utils import (add_overwrite_arg,
                              add_verbose_arg,
                              assert_inputs_exist,
@@ -94,6 +104,10 @@ def _build_arg_parser():
                      metavar=('ATLAS', 'LABELS_LIST'),
                      help='Atlas and labels list for edge-wise division by \n'
                           'the sum of the node surface.')
+    edge_p.add_argument('--cache_dir',
+                        help='Directory where the parcel statistics of the '
+                             'atlas are cached,\nto be reused by later runs '
+                             'with the same atlas.')
 
     scaling_p = p.add_argument_group('Scaling options')
     scale = scaling_p.add_mutually_exclusive_group()
@@ -119,6 +133,9 @@ def main():
                                                  args.inverse_length,
                                                  args.bundle_volume])
     assert_outputs_exist(parser, args, args.out_matrix)
+    if args.cache_dir and not (args.parcel_volume or args.parcel_surface):
+        logging.warning('Option --cache_dir is only used with options '
+                        '--parcel_volume and --parcel_surface.')
 
     atlas_filepath = None
     labels_filepath = None
@@ -129,6 +146,10 @@ def main():
         assert_inputs_exist(parser, [atlas_filepath, labels_filepath])
 
     in_matrix = load_matrix_in_any_format(args.in_matrix)
+    if in_matrix.ndim not in [2, 3]:
+        parser.error('Input matrix should be 2D, or a stack of 2D matrices.')
+    if in_matrix.ndim == 3 and not args.out_matrix.endswith('.npy'):
+        parser.error('A stack of matrices can only be saved as .npy.')
 
     # Normalization can be combined.
     out_matrix = in_matrix
@@ -151,22 +172,19 @@ def main():
     if args.parcel_volume or args.parcel_surface:
         atlas_img = nib.load(atlas_filepath)
         labels_list = np.loadtxt(labels_filepath)
+        parcel_stats = ParcelStatistics.from_atlas(atlas_img,
+                                                   cache_dir=args.cache_dir)
         out_matrix = normalize_matrix_from_parcel(
             out_matrix, atlas_img, labels_list,
-            parcel_from_volume=args.parcel_volume)
+            parcel_from_volume=args.parcel_volume, parcel_stats=parcel_stats)
 
-    # Save as image
-    ref_matrix = nib.Nifti1Image(in_matrix, np.eye(4))
     # Simple scaling of the whole matrix, facilitate comparison across subject
     if args.max_at_one:
-        out_matrix = nib.Nifti1Image(out_matrix, np.eye(4))
-        out_matrix = normalize_max([out_matrix], ref_matrix)
+        out_matrix = scale_matrix(out_matrix, 'max_at_one')
     elif args.sum_to_one:
-        out_matrix = nib.Nifti1Image(out_matrix, np.eye(4))
-        out_matrix = normalize_sum([out_matrix], ref_matrix)
+        out_matrix = scale_matrix(out_matrix, 'sum_to_one')
     elif args.log_10:
-        out_matrix = nib.Nifti1Image(out_matrix, np.eye(4))
-        out_matrix = base_10_log([out_matrix], ref_matrix)
+        out_matrix = scale_matrix(out_matrix, 'log_10')
 
     save_matrix_in_any_format(args.out_matrix, out_matrix)
 
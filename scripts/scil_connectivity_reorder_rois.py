@@ -21,7 +21,13 @@ must use a label-based reording json and use --labels_list.
 You can also use the Optimal Leaf Ordering (OLO) algorithm to transform a
 sparse matrix into an ordering that reduces the matrix bandwidth. The output
 file can then be re-used with --in_ordering. Only one input can be used with
-this option, we recommand an average streamline count or volume matrix.
+this option, we recommand an average streamline count or volume matrix. If
+this input is a stack of matrices (N, X, Y) saved as .npy, its average is
+used. With --cache_dir, the ordering is saved and re-used whenever the same
+matrix is ordered again.
+
+Stacks of matrices (see scil_connectivity_stack_matrices.py) can also be
+re-ordered with --in_ordering, all their matrices being re-ordered at once.
 
 Formerly: scil_reorder_connectivity.py
 -----------------------------------------------------------------------------
@@ -75,6 +81,10 @@ def _build_arg_parser():
                    help='List saved by the decomposition script,\n'
                         '--in_ordering must contain labels rather than '
                         'coordinates (.txt).')
+    p.add_argument('--cache_dir',
+                   help='Directory where the optimal leaf ordering is cached '
+                        'and re-used,\nkeyed by the content of the input '
+                        'matrix.')
 
     add_verbose_arg(p)
     add_overwrite_arg(p)
@@ -114,6 +124,9 @@ def main():
 
     assert_inputs_exist(parser, args.in_matrices,
                         [args.labels_list, args.in_ordering])
+    if args.cache_dir and args.optimal_leaf_ordering is None:
+        logging.warning("Option --cache_dir is only used with option "
+                        "--optimal_leaf_ordering.")
     assert_output_dirs_exist_and_empty(parser, args, [], args.out_dir)
     # Verification of output matrices names will be done below.
 
@@ -126,7 +139,9 @@ def main():
         assert_outputs_exist(parser, args, args.optimal_leaf_ordering)
 
         matrix = load_matrix_in_any_format(args.in_matrices[0])
-        perm = compute_olo(matrix).astype(np.uint16)
+        if matrix.ndim == 3:
+            matrix = np.mean(matrix, axis=0)
+        perm = compute_olo(matrix, cache_dir=args.cache_dir).astype(np.uint16)
         np.savetxt(args.optimal_leaf_ordering, [perm.tolist(), perm.tolist()],
                    fmt='%i')
     else:
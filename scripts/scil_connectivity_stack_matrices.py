@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Stack many connectivity matrices (ex, one per subject) into a single .npy
+file of shape (N, X, Y). The matrices are written one at a time in the output
+file, so the whole population never needs to be loaded in memory.
+
+The stack can then be given directly to scil_connectivity_normalize.py,
+scil_connectivity_reorder_rois.py, scil_connectivity_filter.py and
+scil_connectivity_math.py, which process all its matrices at once, instead of
+loading each matrix file separately.
+
+Inputs can themselves be stacks: all their matrices are added, in order.
+
+Example:
+scil_connectivity_stack_matrices.py */sc.npy sc_stack.npy
+    --out_filenames sc_stack.txt
+"""
+
+import argparse
+import logging
+
+import numpy as np
+
+from scilpy.connectivity.matrix_tools import load_matrix_stack
+from scilpy.io.utils import (add_overwrite_arg,
+                             add_verbose_arg,
+                             assert_inputs_exist,
+                             assert_outputs_exist)
+from scilpy.version import version_string
+
+
+def _build_arg_parser():
+    p = argparse.ArgumentParser(description=__doc__,
+                                formatter_class=argparse.RawTextHelpFormatter,
+                                epilog=version_string)
+
+    p.add_argument('in_matrices', nargs='+',
+                   help='Connectivity matrices in .npy or .txt format.')
+    p.add_argument('out_stack',
+                   help='Output stack of matrices (.npy).')
+    p.add_argument('--out_filenames',
+                   help='Output text file with the input filename of each '
+                        'matrix of the stack.')
+
+    add_verbose_arg(p)
+    add_overwrite_arg(p)
+
+    return p
+
+
+def main():
+    parser = _build_arg_parser()
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.getLevelName(args.verbose))
+
+    assert_inputs_exist(parser, args.in_matrices)
+    assert_outputs_exist(parser, args, args.out_stack, args.out_filenames)
+    if not args.out_stack.endswith('.npy'):
+        parser.error('The output stack must be a .npy file.')
+    if args.out_stack in args.in_matrices:
+        parser.error('The output stack cannot be one of the inputs.')
+
+    try:
+        stack = load_matrix_stack(args.in_matrices, args.out_stack)
+    except ValueError as e:
+        parser.error(str(e))
+    logging.info('Saved a stack of {} matrices of shape {}.'.format(
+        len(stack), stack.shape[1:]))
+
+    if args.out_filenames:
+        filenames = []
+        for filename in args.in_matrices:
+            if filename.endswith('.npy'):
+                matrix = np.load(filename, mmap_mode='r')
+                if matrix.ndim == 3:
+                    filenames.extend([filename] * len(matrix))
+                    continue
+            filenames.append(filename)
+        np.savetxt(args.out_filenames, filenames, fmt='%s')
+
+
+if __name__ == "__main__":
+    main()
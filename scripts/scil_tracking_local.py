@@ -45,6 +45,13 @@ implementations:
 
 All the input nifti files must be in isotropic resolution.
 
+Connectome-only studies: with --in_labels and --out_connectivity, the
+streamlines kept after the length filtering are labelled (by their endpoints)
+on-the-fly, and a streamline count matrix is saved, as with
+scil_connectivity_compute_simple_matrix.py. With --connectivity_only, the
+tractogram itself is not saved (out_tractogram is then ignored), avoiding the
+tractogram I/O entirely.
+
 Formerly: scil_compute_local_tracking.py
 --------------------------------------------------------------------------------
 References:
@@ -68,18 +75,24 @@ from dipy.data import get_sphere
 from dipy.tracking import utils as track_utils
 from dipy.tracking.local_tracking import LocalTracking
 from dipy.tracking.stopping_criterion import BinaryStoppingCriterion
+from scilpy.connectivity.connectivity import ConnectivityAccumulator
+from scilpy.image.labels import get_data_as_labels
 from scilpy.io.image import get_data_as_mask
 from scilpy.io.utils import (add_sphere_arg, add_verbose_arg,
                              assert_headers_compatible, assert_inputs_exist,
                              assert_outputs_exist, parse_sh_basis_arg,
                              verify_compression_th, load_matrix_in_any_format)
 from scilpy.tracking.tracker import GPUTacker
-from scilpy.tracking.utils import (add_mandatory_options_tracking,
+from scilpy.tracking.utils import (add_connectivity_options,
+                                   add_mandatory_options_tracking,
                                    add_out_options, add_seeding_options,
                                    add_tracking_options,
                                    add_tracking_ptt_options,
                                    get_direction_getter, get_theta,
-                                   save_tractogram, verify_seed_options,
+                                   save_connectivity_matrices,
+                                   save_tractogram,
+                                   verify_connectivity_options,
+                                   verify_seed_options,
                                    verify_streamline_length_options)
 from scilpy.version import version_string
 
@@ -133,6 +146,8 @@ def _build_arg_parser():
     out_g.add_argument('--seed', type=int,
                        help='Random number generator seed.')
 
+    add_connectivity_options(p)
+
     log_g = p.add_argument_group('Logging options')
     add_verbose_arg(log_g)
     return p
@@ -164,12 +179,21 @@ def main():
             parser.error('Invalid argument --forward_only. '
                          'Set --use_gpu to enable.')
 
-    assert_inputs_exist(parser, [args.in_odf, args.in_seed, args.in_mask])
-    assert_outputs_exist(parser, args, args.out_tractogram)
+    verify_connectivity_options(parser, args)
+    connectivity_outputs = [args.out_connectivity, args.out_length_matrix,
+                            args.out_labels_list]
+
+    assert_inputs_exist(parser, [args.in_odf, args.in_seed, args.in_mask],
+                        args.in_labels)
+    assert_outputs_exist(parser, args,
+                         [] if args.connectivity_only
+                         else args.out_tractogram, connectivity_outputs)
     assert_headers_compatible(parser,
-                              [args.in_odf, args.in_seed, args.in_mask])
+                              [args.in_odf, args.in_seed, args.in_mask],
+                              args.in_labels)
 
-    if not nib.streamlines.is_supported(args.out_tractogram):
+    if not args.connectivity_only and \
+            not nib.streamlines.is_supported(args.out_tractogram):
         parser.error('Invalid output streamline file format (must be trk or ' +
                      'tck): {0}'.format(args.out_tractogram))
 
@@ -280,13 +304,26 @@ def main():
             rng_seed=args.seed,
             sphere=sphere)
 
+    connectivity_sink = None
+    if args.in_labels:
+        connectivity_sink = ConnectivityAccumulator(
+            get_data_as_labels(nib.load(args.in_labels)), voxel_size)
+
     # save streamlines on-the-fly to file
+    out_tractogram = None if args.connectivity_only else args.out_tractogram
     save_tractogram(streamlines_generator, tracts_format,
-                    odf_sh_img, total_nb_seeds, args.out_tractogram,
+                    odf_sh_img, total_nb_seeds, out_tractogram,
                     args.min_length, args.max_length, args.compress_th,
-                    args.save_seeds, args.verbose)
+                    args.save_seeds, args.verbose,
+                    connectivity_sink=connectivity_sink)
     # Final logging
-    logging.info('Saved tractogram to {0}.'.format(args.out_tractogram))
+    if out_tractogram is not None:
+        logging.info('Saved tractogram to {0}.'.format(args.out_tractogram))
+
+    if connectivity_sink is not None:
+        save_connectivity_matrices(connectivity_sink, args.out_connectivity,
+                                   args.out_length_matrix,
+                                   args.out_labels_list)
 
     # Total runtime
     logging.info('Total runtime of {0:.2f}s.'.format(perf_counter() - t_init))
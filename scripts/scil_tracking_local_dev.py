@@ -38,6 +38,12 @@ A few notes on Runge-Kutta integration.
     2. As a rule of thumb, doubling the rk_order will double the computation
        time in the worst case.
 
+Connectome-only studies: as in scil_tracking_local, with --in_labels and
+--out_connectivity, the streamlines are labelled (by their endpoints)
+on-the-fly, and a streamline count matrix is saved. With --connectivity_only,
+the streamlines are not even kept in memory and the tractogram is not saved
+(out_tractogram is then ignored).
+
 Formerly: scil_compute_local_tracking_dev.py
 -------------------------------------------------------------------------------
 Reference: 
@@ -59,9 +65,11 @@ from dipy.io.stateful_tractogram import Origin
 from dipy.io.streamline import save_tractogram
 from nibabel.streamlines import detect_format, TrkFile
 
+from scilpy.connectivity.connectivity import ConnectivityAccumulator
+from scilpy.image.labels import get_data_as_labels
 from scilpy.io.image import assert_same_resolution
 from scilpy.io.utils import (add_processes_arg, add_sphere_arg,
-                             add_verbose_arg,
+                             add_verbose_arg, assert_headers_compatible,
                              assert_inputs_exist, assert_outputs_exist,
                              parse_sh_basis_arg, verify_compression_th,
                              load_matrix_in_any_format)
@@ -69,10 +77,13 @@ from scilpy.image.volume_space_management import DataVolume
 from scilpy.tracking.propagator import ODFPropagator
 from scilpy.tracking.seed import SeedGenerator, CustomSeedsDispenser
 from scilpy.tracking.tracker import Tracker
-from scilpy.tracking.utils import (add_mandatory_options_tracking,
+from scilpy.tracking.utils import (add_connectivity_options,
+                                   add_mandatory_options_tracking,
                                    add_out_options, add_seeding_options,
                                    add_tracking_options,
                                    get_theta,
+                                   save_connectivity_matrices,
+                                   verify_connectivity_options,
                                    verify_streamline_length_options,
                                    verify_seed_options)
 from scilpy.version import version_string
@@ -154,6 +165,7 @@ def _build_arg_parser():
     add_processes_arg(m_g)
 
     add_out_options(p)
+    add_connectivity_options(p)
     add_verbose_arg(p)
 
     return p
@@ -164,13 +176,22 @@ def main():
     args = parser.parse_args()
     logging.getLogger().setLevel(logging.getLevelName(args.verbose))
 
-    if not nib.streamlines.is_supported(args.out_tractogram):
+    verify_connectivity_options(parser, args)
+    if not args.connectivity_only and \
+            not nib.streamlines.is_supported(args.out_tractogram):
         parser.error('Invalid output streamline file format (must be trk or ' +
                      'tck): {0}'.format(args.out_tractogram))
 
     inputs = [args.in_odf, args.in_seed, args.in_mask]
-    assert_inputs_exist(parser, inputs)
-    assert_outputs_exist(parser, args, args.out_tractogram)
+    assert_inputs_exist(parser, inputs, args.in_labels)
+    assert_outputs_exist(parser, args,
+                         [] if args.connectivity_only
+                         else args.out_tractogram,
+                         [args.out_connectivity, args.out_length_matrix,
+                          args.out_labels_list])
+    if args.in_labels:
+        # Labels are looked up at the (voxel) positions of the tracking.
+        assert_headers_compatible(parser, [args.in_mask, args.in_labels])
 
     verify_streamline_length_options(parser, args)
     verify_compression_th(args.compress_th)
@@ -260,6 +281,11 @@ def main():
         sub_sphere=args.sub_sphere,
         space=our_space, origin=our_origin, is_legacy=is_legacy)
 
+    connectivity_sink = None
+    if args.in_labels:
+        connectivity_sink = ConnectivityAccumulator(
+            get_data_as_labels(nib.load(args.in_labels)), voxel_size)
+
     logging.info("Instantiating tracker.")
     tracker = Tracker(propagator, mask, seed_generator, nbr_seeds, min_nbr_pts,
                       max_nbr_pts, args.max_invalid_nb_points,
@@ -270,35 +296,46 @@ def main():
                       track_forward_only=args.forward_only,
                       skip=args.skip,
                       append_last_point=args.keep_last_out_point,
-                      verbose=args.verbose)
+                      verbose=args.verbose,
+                      connectivity_sink=connectivity_sink,
+                      save_streamlines=not args.connectivity_only)
 
     start = time.time()
     logging.info("Tracking...")
     streamlines, seeds = tracker.track()
 
     str_time = "%.2f" % (time.time() - start)
-    logging.info("Tracked {} streamlines (out of {} seeds), in {} seconds.\n"
-                 "Now saving..."
-                 .format(len(streamlines), nbr_seeds, str_time))
-
-    # save seeds if args.save_seeds is given
-    # We seeded (and tracked) in vox, center, which is what is expected for
-    # seeds.
-    if args.save_seeds:
-        data_per_streamline = {'seeds': seeds}
+    if args.connectivity_only:
+        logging.info("Tracked {} seeds, in {} seconds."
+                     .format(nbr_seeds, str_time))
     else:
-        data_per_streamline = {}
-
-    # Compared with scil_tracking_local, using sft rather than
-    # LazyTractogram to deal with space.
-    # Contrary to scilpy or dipy, where space after tracking is vox, here
-    # space after tracking is voxmm.
-    # Smallest possible streamline coordinate is (0,0,0), equivalent of
-    # corner origin (TrackVis)
-    sft = StatefulTractogram(streamlines, mask_img,
-                             space=our_space, origin=our_origin,
-                             data_per_streamline=data_per_streamline)
-    save_tractogram(sft, args.out_tractogram)
+        logging.info("Tracked {} streamlines (out of {} seeds), in {} "
+                     "seconds.\nNow saving..."
+                     .format(len(streamlines), nbr_seeds, str_time))
+
+        # save seeds if args.save_seeds is given
+        # We seeded (and tracked) in vox, center, which is what is expected for
+        # seeds.
+        if args.save_seeds:
+            data_per_streamline = {'seeds': seeds}
+        else:
+            data_per_streamline = {}
+
+        # Compared with scil_tracking_local, using sft rather than
+        # LazyTractogram to deal with space.
+        # Contrary to scilpy or dipy, where space after tracking is vox, here
+        # space after tracking is voxmm.
+        # Smallest possible streamline coordinate is (0,0,0), equivalent of
+        # corner origin (TrackVis)
+        sft = StatefulTractogram(streamlines, mask_img,
+                                 space=our_space, origin=our_origin,
+                                 data_per_streamline=data_per_streamline)
+        save_tractogram(sft, args.out_tractogram)
+
+    if connectivity_sink is not None:
+        save_connectivity_matrices(connectivity_sink, args.out_connectivity,
+                                   args.out_length_matrix,
+                                   args.out_labels_list)
 
 
 if __name__ == "__main__":
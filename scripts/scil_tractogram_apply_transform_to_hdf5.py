@@ -26,7 +26,8 @@ import numpy as np
 
 from scilpy.io.hdf5 import (reconstruct_sft_from_hdf5,
                             construct_hdf5_from_sft)
-from scilpy.io.utils import (add_overwrite_arg,
+from scilpy.io.utils import (add_hdf5_compression_args,
+                             add_overwrite_arg,
                              add_reference_arg,
                              add_verbose_arg,
                              assert_inputs_exist,
@@ -73,6 +74,7 @@ def _build_arg_parser():
                          help='Keep the streamlines landing out of the '
                               'bounding box.')
 
+    add_hdf5_compression_args(p)
     add_reference_arg(p)
     add_verbose_arg(p)
     add_overwrite_arg(p)
@@ -111,7 +113,7 @@ def main():
             for key in in_hdf5_file.keys():
                 # Get the bundle as sft
                 moving_sft, _ = reconstruct_sft_from_hdf5(
-                    in_hdf5_file, key, load_dps=True, load_dpp=False)
+                    in_hdf5_file, key, load_dps=True, load_dpp=True)
                 if moving_sft is None:
                     continue
 
@@ -139,8 +141,10 @@ def main():
                             "--remove_invalid.")
 
                 # Save result to the hdf5
-                construct_hdf5_from_sft(out_hdf5_file, new_sft, key,
-                                        save_dps=True, save_dpp=False)
+                construct_hdf5_from_sft(
+                    out_hdf5_file, new_sft, key, save_dps=True,
+                    save_dpp=True, compression=args.hdf5_compression,
+                    compression_level=args.hdf5_compression_level)
 
 
 if __name__ == "__main__":
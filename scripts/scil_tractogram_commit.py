@@ -105,7 +105,7 @@ import nibabel as nib
 from scilpy.io.gradients import fsl2mrtrix
 from scilpy.io.hdf5 import (reconstruct_sft_from_hdf5,
                             construct_hdf5_group_from_streamlines,
-                            construct_hdf5_header)
+                            construct_hdf5_header, STREAMLINES_KEYS)
 from scilpy.io.streamlines import reconstruct_streamlines
 from scilpy.io.utils import (add_overwrite_arg,
                              add_processes_arg,
@@ -311,7 +311,7 @@ def _save_out_hdf5(commit_results_dir, sft, in_hdf5_file,
             tmp_length_list = length(tmp_streamlines)
             dps = {key: value[essential_ind]
                    for key, value in in_hdf5_file[key].items()
-                   if key not in ['data', 'offsets', 'lengths']}
+                   if key not in STREAMLINES_KEYS}
 
             # Adding commit values as dps
             dps_commit_key = 'commit2_weights' if is_commit_2 else \
@@ -20,8 +20,9 @@ import numpy as np
 from scilpy.io.streamlines import check_tracts_same_format
 from scilpy.tractograms.tractogram_operations import \
     compress_streamlines_wrapper
-from scilpy.io.utils import (add_overwrite_arg, add_verbose_arg,
-                             assert_inputs_exist, assert_outputs_exist,
+from scilpy.io.utils import (add_overwrite_arg, add_processes_arg,
+                             add_verbose_arg, assert_inputs_exist,
+                             assert_outputs_exist, validate_nbr_processes,
                              verify_compression_th)
 from scilpy.version import version_string
 
@@ -39,6 +40,7 @@ def _build_arg_parser():
     p.add_argument('-e', dest='error_rate', type=float, default=0.1,
                    help='Maximum compression distance in mm [%(default)s].')
 
+    add_processes_arg(p, threads=True)
     add_verbose_arg(p)
     add_overwrite_arg(p)
 
@@ -54,10 +56,11 @@ def main():
     assert_outputs_exist(parser, args, args.out_tractogram)
     check_tracts_same_format(parser, args.in_tractogram, args.out_tractogram)
     verify_compression_th(args.error_rate)
+    nbr_cpu = validate_nbr_processes(parser, args)
 
     in_tractogram = nib.streamlines.load(args.in_tractogram, lazy_load=True)
-    compressed_streamlines = compress_streamlines_wrapper(in_tractogram,
-                                                          args.error_rate)
+    compressed_streamlines = compress_streamlines_wrapper(
+        in_tractogram, args.error_rate, nbr_processes=nbr_cpu)
     out_tractogram = LazyTractogram(compressed_streamlines,
                                     affine_to_rasmm=np.eye(4))
     nib.streamlines.save(out_tractogram, args.out_tractogram,
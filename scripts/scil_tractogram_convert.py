@@ -5,6 +5,12 @@ Conversion of '.tck', '.trk', '.fib', '.vtk' and 'dpy' files using updated file
 format standard. TRK file always needs a reference file, a NIFTI, for
 conversion. The FIB file format is in fact a VTK, MITK Diffusion supports it.
 
+The '.sft' format is scilpy's native format: the streamlines are stored as
+flat arrays, in their current space, along with their reference and their
+data_per_streamline / data_per_point. It is memory-mapped when loaded, which
+makes it much faster to load than other formats. It is meant as a cache
+between scilpy scripts, not as an exchange format.
+
 Formerly: scil_convert_tractogram.py
 """
 
@@ -16,7 +22,8 @@ from dipy.io.streamline import save_tractogram
 from dipy.tracking.streamline import transform_streamlines
 import numpy as np
 
-from scilpy.io.streamlines import load_tractogram_with_reference
+from scilpy.io.streamlines import (load_tractogram_with_reference,
+                                   save_sft_cache, SFT_CACHE_EXTENSION)
 from scilpy.io.utils import (add_bbox_arg, add_overwrite_arg,
                              add_reference_arg, assert_inputs_exist,
                              assert_outputs_exist, add_verbose_arg)
@@ -31,16 +38,20 @@ def _build_arg_parser():
 
     p.add_argument('in_tractogram',
                    help='Tractogram filename. Format must be one of \n'
-                        'trk, tck, vtk, fib, dpy')
+                        'trk, tck, vtk, fib, dpy, sft')
 
     p.add_argument('output_name',
                    help='Output filename. Format must be one of \n'
-                        'trk, tck, vtk, fib, dpy')
+                        'trk, tck, vtk, fib, dpy, sft')
 
     p.add_argument('--legacy_vtk', action='store_true',
                    help='Use the legacy VTK format for streamlines. '
                         'This is the old VTK format, which is supported '
                         'by MI-Brain.')
+    p.add_argument('--float16', action='store_true',
+                   help='Store the points as float16 (only for the sft '
+                        'format). Halves \nthe size of the file, with a '
+                        'precision of ~0.01 mm.')
 
     add_bbox_arg(p)
     add_reference_arg(p)
@@ -67,11 +78,18 @@ def main():
     if in_extension == out_extension:
         parser.error('Input and output cannot be of the same file format')
 
+    if out_extension != SFT_CACHE_EXTENSION and args.float16:
+        parser.error('The --float16 option is only available for sft files')
+
     assert_outputs_exist(parser, args, args.output_name)
 
     sft = load_tractogram_with_reference(parser, args, args.in_tractogram)
 
-    if not args.legacy_vtk:
+    if out_extension == SFT_CACHE_EXTENSION:
+        save_sft_cache(sft, args.output_name,
+                       dtype=np.float16 if args.float16 else np.float32,
+                       bbox_valid_check=args.bbox_check)
+    elif not args.legacy_vtk:
         save_tractogram(sft, args.output_name,
                         bbox_valid_check=args.bbox_check)
     else:
@@ -54,6 +54,8 @@ def _build_arg_parser():
 
     p.add_argument('--include_dps', action='store_true',
                    help='Include the data_per_streamline the metadata.')
+    p.add_argument('--include_dpp', action='store_true',
+                   help='Include the data_per_point the metadata.')
 
     group = p.add_mutually_exclusive_group()
     group.add_argument('--edge_keys', nargs='+', metavar='LABEL1_LABEL2',
@@ -132,6 +134,7 @@ def main():
         for key in selected_keys:
             sft, _ = reconstruct_sft_from_hdf5(hdf5_file, key,
                                                load_dps=args.include_dps,
+                                               load_dpp=args.include_dpp,
                                                allow_empty=allow_empty)
             save_tractogram(sft, '{}.trk'
                             .format(os.path.join(args.out_dir, key)))
@@ -36,7 +36,8 @@ import h5py
 from scilpy.io.hdf5 import (construct_hdf5_header,
                             construct_hdf5_group_from_streamlines)
 from scilpy.io.streamlines import load_tractogram_with_reference
-from scilpy.io.utils import (add_overwrite_arg, add_verbose_arg,
+from scilpy.io.utils import (add_hdf5_compression_args, add_overwrite_arg,
+                             add_verbose_arg,
                              assert_inputs_exist,
                              assert_outputs_exist)
 from scilpy.version import version_string
@@ -63,9 +64,13 @@ def _build_arg_parser():
 
     p.add_argument('--include_dps', action='store_true',
                    help='Include the data_per_streamline the metadata.')
+    p.add_argument('--include_dpp', action='store_true',
+                   help='Include the data_per_point the metadata.')
     p.add_argument('--save_empty', action='store_true',
                    help='Save empty connections.')
 
+    add_hdf5_compression_args(p)
+
     add_verbose_arg(p)
     add_overwrite_arg(p)
 
@@ -103,8 +108,11 @@ def main():
                 construct_hdf5_header(hdf5_file, ref_sft)
             group = hdf5_file.create_group(in_basename)
             dps = curr_sft.data_per_streamline if args.include_dps else {}
-            construct_hdf5_group_from_streamlines(group, curr_sft.streamlines,
-                                                  dps=dps)
+            dpp = curr_sft.data_per_point if args.include_dpp else {}
+            construct_hdf5_group_from_streamlines(
+                group, curr_sft.streamlines, dps=dps, dpp=dpp,
+                compression=args.hdf5_compression,
+                compression_level=args.hdf5_compression_level)
 
 
 if __name__ == "__main__":
@@ -2,8 +2,12 @@
 # -*- coding: utf-8 -*-
 
 """
-Return the number of streamlines in a tractogram. Only support trk and tck in
-order to support the lazy loading from nibabel.
+Return the number of streamlines in tractogram(s). Supports trk, tck, trx
+and sft files, which can be read without loading the whole tractogram.
+
+By default, the count written in the header is used. With --verify_count,
+the files are read (by chunks, in bounded memory) to count the streamlines.
+Many files can be processed in parallel with --processes.
 
 Formerly: scil_count_streamlines.py
 """
@@ -11,11 +15,14 @@ Formerly: scil_count_streamlines.py
 import argparse
 import json
 import logging
+import multiprocessing
 import os
 
 from scilpy.io.utils import (add_json_args,
+                             add_processes_arg,
                              add_verbose_arg,
-                             assert_inputs_exist)
+                             assert_inputs_exist,
+                             validate_nbr_processes)
 from scilpy.tractograms.lazy_tractogram_operations import \
     lazy_streamlines_count
 from scilpy.version import version_string
@@ -26,14 +33,18 @@ def _build_arg_parser():
                                 formatter_class=argparse.RawTextHelpFormatter,
                                 epilog=version_string)
 
-    p.add_argument('in_tractogram',
-                   help='Path of the input tractogram file.')
+    p.add_argument('in_tractograms', nargs='+',
+                   help='Path of the input tractogram file(s).')
     p.add_argument('--print_count_alone', action='store_true',
-                   help="If true, prints the result only. \nElse, prints the "
-                        "bundle name and count formatted as a json dict."
-                        "(default)")
+                   help="If true, prints the result only (one line per "
+                        "file). \nElse, prints the bundle name and count "
+                        "formatted as a json dict. (default)")
+    p.add_argument('--verify_count', action='store_true',
+                   help='If set, counts the streamlines by reading the '
+                        'files instead of \ntrusting their header.')
 
     add_json_args(p)
+    add_processes_arg(p)
     add_verbose_arg(p)
 
     return p
@@ -44,19 +55,24 @@ def main():
     args = parser.parse_args()
     logging.getLogger().setLevel(logging.getLevelName(args.verbose))
 
-    assert_inputs_exist(parser, args.in_tractogram)
+    assert_inputs_exist(parser, args.in_tractograms)
+    nbr_cpu = validate_nbr_processes(parser, args)
 
-    bundle_name, _ = os.path.splitext(os.path.basename(args.in_tractogram))
-    count = lazy_streamlines_count(args.in_tractogram)
+    jobs = [(filename, args.verify_count) for filename in args.in_tractograms]
+    if nbr_cpu == 1 or len(jobs) == 1:
+        counts = [lazy_streamlines_count(*job) for job in jobs]
+    else:
+        with multiprocessing.get_context('spawn').Pool(nbr_cpu) as pool:
+            counts = pool.starmap(lazy_streamlines_count, jobs)
 
     if args.print_count_alone:
-        print(count)
+        for count in counts:
+            print(count)
     else:
-        stats = {
-            bundle_name: {
-                'streamline_count': count
-            }
-        }
+        stats = {}
+        for filename, count in zip(args.in_tractograms, counts):
+            bundle_name, _ = os.path.splitext(os.path.basename(filename))
+            stats[bundle_name] = {'streamline_count': count}
         print(json.dumps(stats, indent=args.indent))
 
 
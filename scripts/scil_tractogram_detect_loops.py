@@ -63,6 +63,11 @@ def _build_arg_parser():
                         'streamline to bundle \ndistance for a streamline to '
                         'be considered as a tracking error.\nDefault if '
                         'set: [%(const)s]')
+    p.add_argument('--qb_nb_samples', type=ranged_type(int, 1, None),
+                   help='If set, QuickBundles is only computed on a random '
+                        'subset of this many \nstreamlines. The other '
+                        'streamlines are assigned to their nearest \n'
+                        'centroid. Useful for large bundles.')
     p.add_argument('--angle', default=360,
                    type=ranged_type(float, 0.0, 360.0, min_excluded=True),
                    help='Maximum looping (or turning) angle of\n' +
@@ -73,7 +78,7 @@ def _build_arg_parser():
                    help="If set, will not save outputs if they are empty.")
 
     add_json_args(p)
-    add_processes_arg(p)
+    add_processes_arg(p, threads=True)
     add_reference_arg(p)
     add_verbose_arg(p)
     add_overwrite_arg(p)
@@ -106,7 +111,7 @@ def main():
     # Processing
     ids_clean = remove_loops_and_sharp_turns(
         sft.streamlines, args.angle, qb_threshold=args.qb_threshold,
-        num_processes=nbr_cpu)
+        num_processes=nbr_cpu, qb_nb_samples=args.qb_nb_samples)
     if len(ids_clean) == 0:
         logging.warning('No clean streamlines in {}. They are all looping '
                         'streamlines? Check your parameters.'
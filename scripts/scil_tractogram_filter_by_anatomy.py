@@ -141,7 +141,7 @@ def _build_arg_parser():
                    help='Do not write file if there is no streamlines.')
 
     add_json_args(p)
-    add_processes_arg(p)
+    add_processes_arg(p, threads=True)
     add_reference_arg(p)
     add_verbose_arg(p)
     add_overwrite_arg(p)
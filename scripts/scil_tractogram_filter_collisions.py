@@ -88,8 +88,10 @@ from scilpy.tractanalysis.fibertube_scoring import (min_external_distance,
 from scilpy.io.utils import (assert_inputs_exist,
                              assert_outputs_exist,
                              add_overwrite_arg,
+                             add_processes_arg,
                              add_verbose_arg,
-                             add_json_args)
+                             add_json_args,
+                             validate_nbr_processes)
 from scilpy.version import version_string
 
 
@@ -161,6 +163,7 @@ def _build_arg_parser():
                    'using the specified seed. [%(default)s]')
 
     add_json_args(p)
+    add_processes_arg(p, threads=True)
     add_overwrite_arg(p)
     add_verbose_arg(p)
 
@@ -203,6 +206,7 @@ def main():
     assert_inputs_exist(parser, args.in_tractogram)
     assert_outputs_exist(parser, args, outputs,
                          [args.out_metrics, args.out_rotation_matrix])
+    nbr_cpu = validate_nbr_processes(parser, args)
 
     logging.debug('Loading tractogram & diameters')
     in_sft = load_tractogram_with_reference(parser, args, args.in_tractogram)
@@ -237,7 +241,7 @@ def main():
         in_sft, diameters, args.verbose != 'WARNING')
 
     logging.debug('Finding intersections')
-    inter_finder.find_intersections(args.min_distance)
+    inter_finder.find_intersections(args.min_distance, nbr_cpu)
 
     logging.debug('Building new tractogram(s)')
     out_sft, invalid_sft, obstacle_sft = inter_finder.build_tractograms(
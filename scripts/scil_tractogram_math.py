@@ -17,6 +17,10 @@ concatenate:  Keep all streamlines with duplicates.
 lazy_concatenate:  Keep all streamlines with duplicates, never load the whole
                     tractograms in memory. Only works with trk/tck file,
                     metadata will be lost and invalid streamlines are kept.
+                    If all files have the same format as the output (and,
+                    for trk, identical headers), streamlines are copied
+                    without being decoded. Else, files can be decoded by
+                    many threads with --processes.
 
 If a file 'duplicate.trk' have identical streamlines, calling the script using
 the difference/intersection/union with a single input will remove these
@@ -53,12 +57,15 @@ from scilpy.io.streamlines import load_tractogram_with_reference
 from scilpy.io.utils import (add_bbox_arg,
                              add_json_args,
                              add_overwrite_arg,
+                             add_processes_arg,
                              add_reference_arg,
                              add_verbose_arg,
                              assert_inputs_exist,
                              assert_outputs_exist,
-                             assert_headers_compatible)
-from scilpy.tractograms.lazy_tractogram_operations import lazy_concatenate
+                             assert_headers_compatible,
+                             validate_nbr_processes)
+from scilpy.tractograms.lazy_tractogram_operations import (
+    lazy_concatenate, lazy_concatenate_raw)
 from scilpy.tractograms.tractogram_operations import (
     perform_tractogram_operation_on_sft, concatenate_sft)
 from scilpy.version import version_string
@@ -101,6 +108,7 @@ def _build_arg_parser():
 
     add_bbox_arg(p)
     add_json_args(p)
+    add_processes_arg(p, threads=True)
     add_reference_arg(p)
     add_verbose_arg(p)
     add_overwrite_arg(p)
@@ -119,6 +127,7 @@ def main():
                          optional=args.save_indices)
     assert_headers_compatible(parser, args.in_tractograms,
                               reference=args.reference)
+    nbr_cpu = validate_nbr_processes(parser, args)
 
     # Lazy operations:
     if args.operation == 'lazy_concatenate':
@@ -134,8 +143,12 @@ def main():
         if os.path.isfile(args.out_tractogram) and args.overwrite:
             os.remove(args.out_tractogram)
 
+        if lazy_concatenate_raw(args.in_tractograms, args.out_tractogram):
+            return
+
         # Reminder: loading and processing are done on-the-fly.
-        out_tractogram, header = lazy_concatenate(args.in_tractograms, out_ext)
+        out_tractogram, header = lazy_concatenate(args.in_tractograms, out_ext,
+                                                  nbr_processes=nbr_cpu)
         nib.streamlines.save(out_tractogram, args.out_tractogram,
                              header=header)
 
@@ -2,13 +2,23 @@
 # -*- coding: utf-8 -*-
 
 """
-Prints information on a loaded tractogram: number of streamlines, and
-mean / min / max / std of
+Prints information on a tractogram: number of streamlines and of points,
+bounding box, histogram of lengths, and mean / min / max / std of
     - length in number of points
     - length in mm
     - step size.
 
-For trk files: also prints the data_per_point and data_per_streamline keys.
+The trk, tck, trx and sft tractograms are read in a single pass, by chunks of
+streamlines, so they are never fully loaded in memory. Other formats (vtk,
+fib, dpy) are loaded first, and require the reference. Lengths and step sizes
+are computed in mm, in rasmm; the reference is thus not required for tck
+files.
+
+Also prints the data_per_point and data_per_streamline keys.
+
+With more than one input file, the information of each file is printed in
+a dictionary, using the filenames as keys. Files are processed in parallel
+with --processes.
 
 See also:
     - scil_header_print_info.py to see the header, affine, volume dimension.
@@ -18,15 +28,18 @@ See also:
 import argparse
 import json
 import logging
-
-from dipy.tracking.streamlinespeed import length
-import numpy as np
+import multiprocessing
+import os
 
 from scilpy.io.streamlines import load_tractogram_with_reference
 from scilpy.io.utils import (add_json_args,
+                             add_processes_arg,
                              add_reference_arg,
                              add_verbose_arg,
-                             assert_inputs_exist)
+                             assert_inputs_exist,
+                             validate_nbr_processes)
+from scilpy.tractograms.lazy_tractogram_operations import (
+    LAZY_TRACTOGRAM_EXTENSIONS, lazy_streamlines_statistics)
 from scilpy.version import version_string
 
 
@@ -35,9 +48,16 @@ def _build_arg_parser():
                                 formatter_class=argparse.RawTextHelpFormatter,
                                 epilog=version_string)
 
-    p.add_argument('in_tractogram',
-                   help='Tractogram file.')
+    p.add_argument('in_tractograms', nargs='+',
+                   help='Tractogram file(s).')
+    p.add_argument('--chunk_size', type=int, default=10000,
+                   help='Number of streamlines loaded at once. '
+                        '[%(default)s]')
+    p.add_argument('--bin_size', type=float, default=10.,
+                   help='Width of the bins of the histogram of lengths, in '
+                        'mm. [%(default)s]')
     add_reference_arg(p)
+    add_processes_arg(p)
     add_verbose_arg(p)
     add_json_args(p)
 
@@ -49,36 +69,30 @@ def main():
     args = parser.parse_args()
     logging.getLogger().setLevel(logging.getLevelName(args.verbose))
 
-    assert_inputs_exist(parser, args.in_tractogram, args.reference)
-
-    sft = load_tractogram_with_reference(parser, args, args.in_tractogram)
-
-    lengths = [len(s) for s in sft.streamlines]
-    lengths_mm = list(length(sft.streamlines))
-
-    sft.to_voxmm()
-    steps = [np.sqrt(np.sum(np.diff(s, axis=0) ** 2, axis=1))
-             for s in sft.streamlines]
-    steps = np.hstack(steps)
-
-    print(json.dumps(
-        {'number_streamlines': int(len(sft)),
-         'min_length_mm': float(np.min(lengths_mm)),
-         'mean_length_mm': float(np.mean(lengths_mm)),
-         'max_length_mm': float(np.max(lengths_mm)),
-         'std_length_mm': float(np.std(lengths_mm)),
-         'min_length_nb_points': float(np.min(lengths)),
-         'mean_length_nb_points': float(np.mean(lengths)),
-         'max_length_nb_points': float(np.max(lengths)),
-         'std_length_nb_points': float(np.std(lengths)),
-         'min_step_size': float(np.min(steps)),
-         'mean_step_size': float(np.mean(steps)),
-         'max_step_size': float(np.max(steps)),
-         'std_step_size': float(np.std(steps)),
-         'data_per_point_keys': list(sft.data_per_point.keys()),
-         'data_per_streamline_keys': list(sft.data_per_streamline.keys())
-         },
-        indent=args.indent, sort_keys=args.sort_keys))
+    assert_inputs_exist(parser, args.in_tractograms, args.reference)
+    nbr_cpu = validate_nbr_processes(parser, args)
+
+    jobs = []
+    for filename in args.in_tractograms:
+        if os.path.splitext(filename)[1] in LAZY_TRACTOGRAM_EXTENSIONS:
+            tractogram = filename
+        else:
+            # No lazy loading for this format.
+            tractogram = load_tractogram_with_reference(parser, args,
+                                                        filename)
+        jobs.append((tractogram, args.chunk_size, args.bin_size))
+    if nbr_cpu == 1 or len(jobs) == 1:
+        results = [lazy_streamlines_statistics(*job) for job in jobs]
+    else:
+        with multiprocessing.get_context('spawn').Pool(nbr_cpu) as pool:
+            results = pool.starmap(lazy_streamlines_statistics, jobs)
+
+    if len(results) == 1:
+        output = results[0]
+    else:
+        output = dict(zip(args.in_tractograms, results))
+
+    print(json.dumps(output, indent=args.indent, sort_keys=args.sort_keys))
 
 
 if __name__ == '__main__':
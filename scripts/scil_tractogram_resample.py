@@ -44,11 +44,11 @@ import logging
 from dipy.io.streamline import save_tractogram
 
 from scilpy.io.streamlines import load_tractogram_with_reference
-from scilpy.io.utils import (add_overwrite_arg, add_reference_arg,
-                             add_verbose_arg,
+from scilpy.io.utils import (add_overwrite_arg, add_processes_arg,
+                             add_reference_arg, add_verbose_arg,
                              assert_inputs_exist,
                              assert_outputs_exist, ranged_type,
-                             add_compression_arg)
+                             add_compression_arg, validate_nbr_processes)
 from scilpy.tractograms.tractogram_operations import (
     split_sft_randomly,
     split_sft_randomly_per_cluster,
@@ -117,6 +117,7 @@ def _build_arg_parser():
     p.add_argument('--seed', default=None, type=int,
                    help='Use a specific random seed for the resampling.')
 
+    add_processes_arg(p, threads=True)
     add_reference_arg(p)
     add_verbose_arg(p)
     add_overwrite_arg(p)
@@ -132,6 +133,7 @@ def main():
     # Verifications
     assert_inputs_exist(parser, args.in_tractogram, args.reference)
     assert_outputs_exist(parser, args, args.out_tractogram)
+    nbr_cpu = validate_nbr_processes(parser, args)
 
     if args.point_wise_std and args.point_wise_std > 10:
         logging.warning("Careful. A value --point_wise_std of {} means that "
@@ -166,7 +168,7 @@ def main():
             sft = upsample_tractogram(sft, args.nb_streamlines,
                                       args.point_wise_std, args.tube_radius,
                                       args.gaussian, args.compress_th,
-                                      args.seed)
+                                      args.seed, nbr_processes=nbr_cpu)
     elif args.nb_streamlines < original_number:
         if args.downsample_per_cluster:
             # output contains rejected streamlines, we don't use them.
@@ -3,7 +3,8 @@
 
 """
 Script to resample a set of streamlines to either a new number of points per
-streamline or to a fixed step size. WARNING: data_per_point is not carried.
+streamline or to a fixed step size. The data_per_point is interpolated along
+the resampled streamlines.
 
 Formerly: scil_resample_streamlines.py
 """
@@ -14,10 +15,12 @@ from dipy.io.streamline import save_tractogram
 
 from scilpy.io.streamlines import load_tractogram_with_reference
 from scilpy.io.utils import (add_overwrite_arg,
+                             add_processes_arg,
                              add_reference_arg,
                              add_verbose_arg,
                              assert_inputs_exist,
-                             assert_outputs_exist)
+                             assert_outputs_exist,
+                             validate_nbr_processes)
 from scilpy.tractograms.streamline_operations import \
     resample_streamlines_num_points, resample_streamlines_step_size
 from scilpy.version import version_string
@@ -39,6 +42,7 @@ def _build_arg_parser():
     g.add_argument('--step_size', type=float,
                    help='Step size in the output (in mm).')
 
+    add_processes_arg(p, threads=True)
     add_reference_arg(p)
     add_verbose_arg(p)
     add_overwrite_arg(p)
@@ -53,14 +57,17 @@ def main():
 
     assert_inputs_exist(parser, args.in_tractogram, args.reference)
     assert_outputs_exist(parser, args, args.out_tractogram)
+    nbr_cpu = validate_nbr_processes(parser, args)
 
     sft = load_tractogram_with_reference(parser, args, args.in_tractogram)
 
     if args.nb_pts_per_streamline:
         new_sft = resample_streamlines_num_points(sft,
-                                                  args.nb_pts_per_streamline)
+                                                  args.nb_pts_per_streamline,
+                                                  nbr_processes=nbr_cpu)
     else:
-        new_sft = resample_streamlines_step_size(sft, args.step_size)
+        new_sft = resample_streamlines_step_size(sft, args.step_size,
+                                                 nbr_processes=nbr_cpu)
 
     save_tractogram(new_sft, args.out_tractogram)
 
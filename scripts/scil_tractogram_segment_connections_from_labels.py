@@ -74,17 +74,18 @@ import numpy as np
 from scilpy.image.labels import get_data_as_labels
 from scilpy.io.hdf5 import construct_hdf5_header
 from scilpy.io.streamlines import load_tractogram_with_reference
-from scilpy.io.utils import (add_bbox_arg, add_overwrite_arg,
+from scilpy.io.utils import (add_bbox_arg, add_hdf5_compression_args,
+                             add_overwrite_arg,
                              add_processes_arg, add_verbose_arg,
                              add_reference_arg, assert_inputs_exist,
                              assert_outputs_exist,
                              assert_output_dirs_exist_and_empty,
                              validate_nbr_processes, assert_headers_compatible)
 from scilpy.tractanalysis.connectivity_segmentation import (
-    compute_connectivity,
-    construct_hdf5_from_connectivity,
-    extract_longest_segments_from_profile)
-from scilpy.tractograms.uncompress import streamlines_to_voxel_coordinates
+    compute_connectivity_arrays,
+    construct_hdf5_from_connectivity)
+from scilpy.tractograms.streamline_operations import \
+    streamlines_to_voxel_coordinates_parallel
 from scilpy.version import version_string
 
 
@@ -208,9 +209,10 @@ def _build_arg_parser():
                         'Needed for scil_connectivity_compute_matrices.py and '
                         'others.')
 
+    add_hdf5_compression_args(p)
     add_reference_arg(p)
     add_bbox_arg(p)
-    add_processes_arg(p)
+    add_processes_arg(p, threads=True)
     add_verbose_arg(p)
     add_overwrite_arg(p)
 
@@ -286,10 +288,8 @@ def main():
     # Get the indices of the voxels traversed by each streamline
     logging.info('*** Computing voxels traversed by each streamline ***')
     time1 = time.time()
-    indices, points_to_idx = streamlines_to_voxel_coordinates(
-        sft.streamlines,
-        return_mapping=True
-    )
+    indices, points_to_idx = streamlines_to_voxel_coordinates_parallel(
+        sft.streamlines, return_mapping=True, nbr_processes=nbr_cpu)
     time2 = time.time()
     logging.info('    Streamlines intersection took {} sec.'.format(
         round(time2 - time1, 2)))
@@ -297,8 +297,7 @@ def main():
     # Compute the connectivity mapping
     logging.info('*** Computing connectivity information ***')
     time1 = time.time()
-    con_info = compute_connectivity(indices, data_labels, real_labels,
-                                    extract_longest_segments_from_profile)
+    con_info = compute_connectivity_arrays(indices, data_labels, nbr_cpu)
     time2 = time.time()
     logging.info('    Connectivity computation took {} sec.'.format(
         round(time2 - time1, 2)))
@@ -319,7 +318,7 @@ def main():
             remove_loops, args.loop_max_angle,
             remove_outliers, args.outlier_threshold,
             remove_curv_dev, args.curv_qb_distance,
-            nbr_cpu)
+            nbr_cpu, args.hdf5_compression, args.hdf5_compression_level)
     time2 = time.time()
     logging.info(
         '    Connections post-processing and saving took {} sec.'.format(
@@ -4,11 +4,18 @@
 """
 Shuffle the ordering of streamlines.
 
+With --lazy_load, the tractogram is never fully loaded in memory: it is first
+streamed into temporary memory-mapped files (written next to the output), and
+streamlines are then read from these files, in the shuffled order, while
+saving. Only .trk and .tck files are supported in this mode.
+
 Formerly: scil_shuffle_streamlines.py
 """
 
 import argparse
 import logging
+import os
+import tempfile
 
 from dipy.io.streamline import save_tractogram
 
@@ -16,7 +23,11 @@ from scilpy.io.streamlines import load_tractogram_with_reference
 from scilpy.io.utils import (add_overwrite_arg, add_reference_arg,
                              assert_inputs_exist, add_verbose_arg,
                              assert_outputs_exist)
-from scilpy.tractograms.tractogram_operations import shuffle_streamlines
+from scilpy.tractograms.lazy_tractogram_operations import (
+    lazy_memmap_tractogram,
+    lazy_save_subset)
+from scilpy.tractograms.tractogram_operations import (get_shuffled_indices,
+                                                      shuffle_streamlines)
 from scilpy.version import version_string
 
 
@@ -31,6 +42,10 @@ def _build_arg_parser():
                    help='Output tractography file.')
     p.add_argument('--seed', type=int, default=None,
                    help='Random number generator seed [%(default)s].')
+    p.add_argument('--lazy_load', action='store_true',
+                   help='If set, use memory-mapped temporary files instead '
+                        'of loading \nthe whole tractogram in memory. '
+                        'Useful for very large tractograms.')
 
     add_reference_arg(p)
     add_verbose_arg(p)
@@ -47,6 +62,22 @@ def main():
     assert_inputs_exist(parser, args.in_tractogram, args.reference)
     assert_outputs_exist(parser, args, args.out_tractogram)
 
+    if args.lazy_load:
+        extensions = [os.path.splitext(f)[1]
+                      for f in [args.in_tractogram, args.out_tractogram]]
+        if not all(ext in ['.trk', '.tck'] for ext in extensions):
+            parser.error('Option --lazy_load only supports .trk and .tck '
+                         'files.')
+        out_dir = os.path.dirname(os.path.abspath(args.out_tractogram))
+        with tempfile.TemporaryDirectory(dir=out_dir) as tmp_dir:
+            streamlines, data_per_streamline, data_per_point, header = \
+                lazy_memmap_tractogram(args.in_tractogram, tmp_dir)
+            indices = get_shuffled_indices(len(streamlines), args.seed)
+            lazy_save_subset(streamlines, data_per_streamline,
+                             data_per_point, indices, args.out_tractogram,
+                             header)
+        return
+
     sft = load_tractogram_with_reference(parser, args, args.in_tractogram)
     shuffled_sft = shuffle_streamlines(sft, rng_seed=args.seed)
     save_tractogram(shuffled_sft, args.out_tractogram)
@@ -15,12 +15,16 @@ number of control points. The sigma represents the allowed distance from the
 control points. The final streamlines are obtained by evaluating the spline at
 constant intervals so that it will have the same number of points as initially.
 
-This script enforces endpoints to remain the same.
+This script enforces endpoints to remain the same. The number of points is
+unchanged, so data_per_point is kept (if --compress is used, only the
+data_per_point of the remaining points is kept).
+
+With --processes, the gaussian smoothing is multi-threaded, and the spline
+smoothing is computed by chunks of streamlines in a pool of processes.
 
 WARNING:
 - too low of a sigma (e.g: 1) with a lot of control points (e.g: 15)
 will create crazy streamlines that could end up out of the bounding box.
-- data_per_point will be lost.
 
 Formerly: scil_smooth_streamlines.py
 """
@@ -30,15 +34,15 @@ import logging
 
 from dipy.io.stateful_tractogram import StatefulTractogram
 from dipy.io.streamline import save_tractogram
-from dipy.tracking.streamlinespeed import compress_streamlines
 
 from scilpy.io.streamlines import load_tractogram_with_reference
-from scilpy.io.utils import (add_overwrite_arg, add_reference_arg,
-                             add_verbose_arg,
+from scilpy.io.utils import (add_overwrite_arg, add_processes_arg,
+                             add_reference_arg, add_verbose_arg,
                              assert_inputs_exist,
-                             assert_outputs_exist, add_compression_arg)
-from scilpy.tractograms.streamline_operations import smooth_line_gaussian, \
-    smooth_line_spline
+                             assert_outputs_exist, add_compression_arg,
+                             validate_nbr_processes)
+from scilpy.tractograms.streamline_operations import (
+    compress_sft, smooth_streamlines_gaussian, smooth_streamlines_spline)
 from scilpy.version import version_string
 
 
@@ -66,6 +70,7 @@ def _build_arg_parser():
                             'and control point around 10.')
 
     add_compression_arg(p)
+    add_processes_arg(p)
     add_reference_arg(p)
     add_verbose_arg(p)
     add_overwrite_arg(p)
@@ -80,24 +85,25 @@ def main():
 
     assert_inputs_exist(parser, args.in_tractogram, args.reference)
     assert_outputs_exist(parser, args, args.out_tractogram)
+    nbr_cpu = validate_nbr_processes(parser, args)
 
     sft = load_tractogram_with_reference(parser, args, args.in_tractogram)
-    smoothed_streamlines = []
-    for streamline in sft.streamlines:
-        if args.gaussian:
-            tmp_streamlines = smooth_line_gaussian(streamline, args.gaussian)
-        else:
-            tmp_streamlines = smooth_line_spline(streamline, args.spline[0],
-                                                 args.spline[1])
-
-        if args.compress_th:
-            tmp_streamlines = compress_streamlines(tmp_streamlines,
-                                                   args.compress_th)
-        smoothed_streamlines.append(tmp_streamlines)
+    if args.gaussian:
+        smoothed_streamlines = smooth_streamlines_gaussian(
+            sft.streamlines, args.gaussian, nbr_processes=nbr_cpu)
+    else:
+        smoothed_streamlines = smooth_streamlines_spline(
+            sft.streamlines, args.spline[0], args.spline[1],
+            nbr_processes=nbr_cpu)
 
     smoothed_sft = StatefulTractogram.from_sft(
                         smoothed_streamlines, sft,
+                        data_per_point=sft.data_per_point,
                         data_per_streamline=sft.data_per_streamline)
+
+    if args.compress_th:
+        smoothed_sft = compress_sft(smoothed_sft, args.compress_th,
+                                    nbr_processes=nbr_cpu)
     save_tractogram(smoothed_sft, args.out_tractogram)
 
 
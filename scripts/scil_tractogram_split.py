@@ -11,11 +11,17 @@ Optionally, you can split streamlines...
      on).
     - randomly, but per Quickbundles clusters.
 
+With --lazy_load, the tractogram is never fully loaded in memory: it is first
+streamed into temporary memory-mapped files (written next to the outputs),
+and each chunk is then read from these files only while it is being saved.
+Only .trk and .tck files are supported in this mode.
+
 Formerly: scil_split_tractogram.py
 """
 import argparse
 import logging
 import os
+import tempfile
 
 from dipy.io.streamline import save_tractogram
 import numpy as np
@@ -24,10 +30,13 @@ from scilpy.io.streamlines import load_tractogram_with_reference
 from scilpy.io.utils import (add_overwrite_arg, add_reference_arg,
                              assert_inputs_exist, assert_outputs_exist,
                              add_verbose_arg)
+from scilpy.tractograms.lazy_tractogram_operations import (
+    lazy_memmap_tractogram,
+    lazy_save_subset)
 from scilpy.tractograms.tractogram_operations import (
-    split_sft_sequentially,
-    split_sft_randomly,
-    split_sft_randomly_per_cluster)
+    get_split_indices_sequentially,
+    get_split_indices_randomly,
+    get_split_indices_randomly_per_cluster)
 from scilpy.version import version_string
 
 
@@ -69,6 +78,10 @@ def _build_arg_parser():
 
     p.add_argument('--seed', default=None, type=int,
                    help='Use a specific random seed for the subsampling.')
+    p.add_argument('--lazy_load', action='store_true',
+                   help='If set, use memory-mapped temporary files instead '
+                        'of loading \nthe whole tractogram in memory. '
+                        'Useful for very large tractograms.')
 
     add_reference_arg(p)
     add_verbose_arg(p)
@@ -77,25 +90,17 @@ def _build_arg_parser():
     return p
 
 
-def main():
-    parser = _build_arg_parser()
-    args = parser.parse_args()
-    logging.getLogger().setLevel(logging.getLevelName(args.verbose))
-
-    # Verifications
-    assert_inputs_exist(parser, args.in_tractogram, args.reference)
-
-    # out_names are: out_dir/out_prefix_0.trk, etc.
-    # Check only the first potential output filename, we don't know how many
-    # there are yet.
-    _, out_extension = os.path.splitext(args.in_tractogram)
-    assert_outputs_exist(parser, args, '{}_0{}'
-                         .format(args.out_prefix, out_extension))
-
+def _split(parser, args, out_extension, tmp_dir):
     # Loading
-    logging.info("Loading sft.")
-    sft = load_tractogram_with_reference(parser, args, args.in_tractogram)
-    streamlines_count = len(sft.streamlines)
+    if args.lazy_load:
+        logging.info("Streaming the tractogram to memory-mapped files.")
+        streamlines, data_per_streamline, data_per_point, header = \
+            lazy_memmap_tractogram(args.in_tractogram, tmp_dir.name)
+    else:
+        logging.info("Loading sft.")
+        sft = load_tractogram_with_reference(parser, args, args.in_tractogram)
+        streamlines = sft.streamlines
+    streamlines_count = len(streamlines)
 
     if args.nb_chunks:
         chunk_size = int(streamlines_count/args.nb_chunks)
@@ -113,26 +118,67 @@ def main():
 
     # Processing
     # All chunks will be equal except the last one
-    chunk_sizes = np.ones((nb_chunks,), dtype=np.int16) * chunk_size
+    chunk_sizes = np.ones((nb_chunks,), dtype=int) * chunk_size
     chunk_sizes[-1] += (streamlines_count - chunk_size * nb_chunks)
 
+    # Only the indices are computed; streamlines are sliced when saving.
     if args.do_not_randomize:
-        sfts = split_sft_sequentially(sft, chunk_sizes)
+        all_indices = get_split_indices_sequentially(streamlines_count,
+                                                     chunk_sizes)
     elif args.split_per_cluster:
-        # With this version, will contain an additional sft with non-included
-        # streamlines. Should be of size close to 0. Not using it.
-        sfts = split_sft_randomly_per_cluster(
-            sft, chunk_sizes, args.seed, args.qbx_thresholds)
+        # With this version, will contain an additional chunk with
+        # non-included streamlines. Should be of size close to 0. Not using
+        # it.
+        all_indices = get_split_indices_randomly_per_cluster(
+            streamlines, chunk_sizes, args.seed, args.qbx_thresholds)
         logging.info("Splitting per cluster may lead to a small variability "
                      "in the final tractogram sizes. Sizes are: {}. "
                      "({} streamlines were not included in any tractogram)."
-                     .format([len(sft) for sft in sfts[:-1]], len(sfts[-1])))
+                     .format([len(ind) for ind in all_indices[:-1]],
+                             len(all_indices[-1])))
     else:
-        sfts = split_sft_randomly(sft, chunk_sizes, args.seed)
+        all_indices = get_split_indices_randomly(streamlines_count,
+                                                 chunk_sizes, args.seed)
 
     # Saving
     for i in range(nb_chunks):
-        save_tractogram(sfts[i], out_names[i])
+        if args.lazy_load:
+            lazy_save_subset(streamlines, data_per_streamline,
+                             data_per_point, all_indices[i], out_names[i],
+                             header)
+        else:
+            save_tractogram(sft[all_indices[i]], out_names[i])
+
+
+def main():
+    parser = _build_arg_parser()
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.getLevelName(args.verbose))
+
+    # Verifications
+    assert_inputs_exist(parser, args.in_tractogram, args.reference)
+
+    # out_names are: out_dir/out_prefix_0.trk, etc.
+    # Check only the first potential output filename, we don't know how many
+    # there are yet.
+    _, out_extension = os.path.splitext(args.in_tractogram)
+    assert_outputs_exist(parser, args, '{}_0{}'
+                         .format(args.out_prefix, out_extension))
+
+    tmp_dir = None
+    if args.lazy_load:
+        if os.path.splitext(args.in_tractogram)[1] not in ['.trk', '.tck']:
+            parser.error('Option --lazy_load only supports .trk and .tck '
+                         'files.')
+        out_dir = os.path.dirname(os.path.abspath(args.out_prefix))
+        tmp_dir = tempfile.TemporaryDirectory(dir=out_dir)
+
+    try:
+        _split(parser, args, out_extension, tmp_dir)
+    finally:
+        # The temporary memory-mapped files are as large as the tractogram.
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
 
 
 if __name__ == "__main__":
@@ -27,3 +27,15 @@ def test_execution_connectivity(script_runner, monkeypatch):
                             'pval.npy', '--in_g1', in_1, '--in_g2', in_2,
                             '--filtering_mask', in_mask)
     assert ret.success
+
+
+def test_execution_permutations(script_runner, monkeypatch):
+    monkeypatch.chdir(os.path.expanduser(tmp_dir.name))
+    in_1 = os.path.join(SCILPY_HOME, 'connectivity', 'sc.npy')
+    in_2 = os.path.join(SCILPY_HOME, 'connectivity', 'sc_norm.npy')
+    ret = script_runner.run('scil_connectivity_compare_populations.py',
+                            'pval_perm.npy', '--in_g1', in_1, in_2,
+                            '--in_g2', in_2, in_1, '--paired',
+                            '--nb_permutations', '50', '--batch_size', '20',
+                            '--fdr')
+    assert ret.success
@@ -4,6 +4,9 @@
 import os
 import tempfile
 
+from dipy.io.streamline import load_tractogram, save_tractogram
+import numpy as np
+
 from scilpy import SCILPY_HOME
 from scilpy.io.fetcher import fetch_data, get_testing_files_dict
 
@@ -29,3 +32,26 @@ def test_script(script_runner, monkeypatch):
         'out_matrix.npy', 'out_labels.txt', '--hide_labels', '10',
         '--percentage', '--hide_fig', '--out_fig', 'matrices.png')
     assert ret.success
+
+
+def test_execution_not_lazy_format(script_runner, monkeypatch):
+    monkeypatch.chdir(os.path.expanduser(tmp_dir.name))
+    in_labels = os.path.join(SCILPY_HOME, 'tractometry',
+                             'IFGWM_labels_map.nii.gz')
+    in_sft = os.path.join(SCILPY_HOME, 'tractometry', 'IFGWM.trk')
+    sft = load_tractogram(in_sft, 'same')
+    save_tractogram(sft, 'IFGWM.vtk')
+
+    # No lazy loading for vtk: loaded with the reference.
+    ret = script_runner.run(
+        'scil_connectivity_compute_simple_matrix.py', 'IFGWM.vtk', in_labels,
+        'out_matrix_vtk.npy', 'out_labels_vtk.txt', '--hide_fig',
+        '--reference', in_sft)
+    assert ret.success
+
+    ret = script_runner.run(
+        'scil_connectivity_compute_simple_matrix.py', in_sft, in_labels,
+        'out_matrix_trk.npy', 'out_labels_trk.txt', '--hide_fig')
+    assert ret.success
+    assert np.array_equal(np.load('out_matrix_vtk.npy'),
+                          np.load('out_matrix_trk.npy'))
@@ -25,3 +25,12 @@ def test_execution_connectivity(script_runner, monkeypatch):
                             in_h5, 'avg_density_maps/', '--binary',
                             '--processes', '1')
     assert ret.success
+
+
+def test_execution_connectivity_batches(script_runner, monkeypatch):
+    monkeypatch.chdir(os.path.expanduser(tmp_dir.name))
+    in_h5 = os.path.join(SCILPY_HOME, 'connectivity', 'decompose.h5')
+    ret = script_runner.run('scil_connectivity_hdf5_average_density_map.py',
+                            in_h5, 'avg_density_maps_batches/',
+                            '--batch_size', '2', '--processes', '1')
+    assert ret.success
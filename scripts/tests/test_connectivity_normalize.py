@@ -29,3 +29,18 @@ def test_execution_connectivity(script_runner, monkeypatch):
                             'sc_norm.npy', '--length', in_len,
                             '--parcel_volume', in_atlas, in_labels_list)
     assert ret.success
+
+
+def test_execution_connectivity_surface_cache(script_runner, monkeypatch):
+    monkeypatch.chdir(os.path.expanduser(tmp_dir.name))
+    in_sc = os.path.join(SCILPY_HOME, 'connectivity', 'sc.npy')
+    in_atlas = os.path.join(SCILPY_HOME, 'connectivity',
+                            'endpoints_atlas.nii.gz')
+    in_labels_list = os.path.join(SCILPY_HOME, 'connectivity',
+                                  'labels_list.txt')
+    for out_name in ['sc_surf_1.npy', 'sc_surf_2.npy']:
+        ret = script_runner.run('scil_connectivity_normalize.py', in_sc,
+                                out_name, '--parcel_surface', in_atlas,
+                                in_labels_list, '--cache_dir', 'cache')
+        assert ret.success
+    assert len(os.listdir('cache')) == 1
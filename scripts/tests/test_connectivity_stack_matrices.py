@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+
+import numpy as np
+
+from scilpy import SCILPY_HOME
+from scilpy.io.fetcher import fetch_data, get_testing_files_dict
+
+# If they already exist, this only takes 5 seconds (check md5sum)
+fetch_data(get_testing_files_dict(), keys=['connectivity.zip'])
+tmp_dir = tempfile.TemporaryDirectory()
+
+
+def test_help_option(script_runner):
+    ret = script_runner.run('scil_connectivity_stack_matrices.py', '--help')
+    assert ret.success
+
+
+def test_execution_connectivity(script_runner, monkeypatch):
+    monkeypatch.chdir(os.path.expanduser(tmp_dir.name))
+    in_sc = os.path.join(SCILPY_HOME, 'connectivity',
+                         'sc.npy')
+    in_len = os.path.join(SCILPY_HOME, 'connectivity',
+                          'len.npy')
+    ret = script_runner.run('scil_connectivity_stack_matrices.py',
+                            in_sc, in_len, 'stack.npy',
+                            '--out_filenames', 'stack.txt')
+    assert ret.success
+
+    stack = np.load('stack.npy')
+    assert stack.shape[0] == 2
+    assert np.array_equal(stack[0], np.load(in_sc))
+
+    # A stack can be given to the other connectivity scripts.
+    ret = script_runner.run('scil_connectivity_normalize.py', 'stack.npy',
+                            'stack_norm.npy', '--max_at_one')
+    assert ret.success
+    assert np.allclose(np.max(np.load('stack_norm.npy'), axis=(1, 2)), 1)
@@ -201,3 +201,22 @@ def test_execution_tracking_fodf_custom_seeds(script_runner, monkeypatch):
                             '--compress', '0.1', '--sh_basis', 'descoteaux07',
                             '--min_length', '20', '--max_length', '200')
     assert ret.success
+
+
+def test_execution_tracking_connectivity_only(script_runner, monkeypatch):
+    monkeypatch.chdir(os.path.expanduser(tmp_dir.name))
+    in_fodf = os.path.join(SCILPY_HOME, 'tracking', 'fodf.nii.gz')
+    in_mask = os.path.join(SCILPY_HOME, 'tracking', 'seeding_mask.nii.gz')
+
+    # The mask is used as a (single) label volume.
+    ret = script_runner.run('scil_tracking_local.py', in_fodf,
+                            in_mask, in_mask, 'unused.trk', '--nt', '100',
+                            '--sh_basis', 'descoteaux07',
+                            '--min_length', '20', '--max_length', '200',
+                            '--in_labels', in_mask,
+                            '--out_connectivity', 'sc.npy',
+                            '--out_length_matrix', 'len.npy',
+                            '--connectivity_only')
+    assert ret.success
+    assert not os.path.isfile('unused.trk')
+    assert np.load('sc.npy').shape == (1, 1)
@@ -55,3 +55,39 @@ def test_execution_tracking_fodf_custom_seeds(script_runner, monkeypatch):
                             '--sub_sphere', '2',
                             '--rk_order', '4')
     assert ret.success
+
+
+def test_execution_tracking_connectivity(script_runner, monkeypatch):
+    monkeypatch.chdir(os.path.expanduser(tmp_dir.name))
+    in_fodf = os.path.join(SCILPY_HOME, 'tracking',
+                           'fodf.nii.gz')
+    in_mask = os.path.join(SCILPY_HOME, 'tracking',
+                           'seeding_mask.nii.gz')
+
+    # The mask is used as a (single) label volume. With the same seeds,
+    # the matrices must not depend on keeping the streamlines.
+    for processes in ['1', '2']:
+        ret = script_runner.run('scil_tracking_local_dev.py', in_fodf,
+                                in_mask, in_mask, 'local_sc.trk',
+                                '--nt', '20', '--sh_basis', 'descoteaux07',
+                                '--min_length', '20', '--max_length', '200',
+                                '--rng_seed', '0', '--processes', processes,
+                                '--in_labels', in_mask,
+                                '--out_connectivity', 'sc.npy',
+                                '--out_length_matrix', 'len.npy', '-f')
+        assert ret.success
+
+        ret = script_runner.run('scil_tracking_local_dev.py', in_fodf,
+                                in_mask, in_mask, 'unused.trk',
+                                '--nt', '20', '--sh_basis', 'descoteaux07',
+                                '--min_length', '20', '--max_length', '200',
+                                '--rng_seed', '0', '--processes', processes,
+                                '--in_labels', in_mask,
+                                '--out_connectivity', 'sc_only.npy',
+                                '--out_length_matrix', 'len_only.npy',
+                                '--connectivity_only', '-f')
+        assert ret.success
+        assert not os.path.isfile('unused.trk')
+        assert np.load('sc_only.npy').shape == (1, 1)
+        assert np.array_equal(np.load('sc_only.npy'), np.load('sc.npy'))
+        assert np.allclose(np.load('len_only.npy'), np.load('len.npy'))
@@ -26,3 +26,17 @@ def test_execution_surface_vtk_fib(script_runner, monkeypatch):
     ret = script_runner.run('scil_tractogram_convert.py', in_fib,
                             'gyri_fanning.trk', '--reference', in_fa)
     assert ret.success
+
+
+def test_execution_sft_cache(script_runner, monkeypatch):
+    monkeypatch.chdir(os.path.expanduser(tmp_dir.name))
+    in_trk = os.path.join(SCILPY_HOME, 'surface_vtk_fib',
+                          'gyri_fanning.trk')
+    ret = script_runner.run('scil_tractogram_convert.py', in_trk,
+                            'gyri_fanning.sft', '--float16')
+    assert ret.success
+
+    # The reference is stored in the sft file.
+    ret = script_runner.run('scil_tractogram_convert.py', 'gyri_fanning.sft',
+                            'gyri_fanning_from_sft.tck')
+    assert ret.success
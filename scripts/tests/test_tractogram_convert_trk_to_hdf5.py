@@ -53,3 +53,23 @@ def test_execution_edge_keys(script_runner, monkeypatch):
 
     assert len(sfts[0]) == 340
     assert len(sfts[1]) == 732
+
+
+def test_execution_compression(script_runner, monkeypatch):
+    monkeypatch.chdir(os.path.expanduser(tmp_dir.name))
+    ret = script_runner.run('scil_tractogram_convert_hdf5_to_trk.py',
+                            in_h5, 'save_trk_gzip/', '--edge_keys', '1_10')
+    assert ret.success
+
+    ret = script_runner.run('scil_tractogram_convert_trk_to_hdf5.py',
+                            'save_trk_gzip/1_10.trk', 'one_edge_gzip.h5',
+                            '--hdf5_compression', 'gzip',
+                            '--hdf5_compression_level', '6')
+    assert ret.success
+
+    with h5py.File('one_edge_gzip.h5', 'r') as hdf5_file:
+        assert hdf5_file['1_10']['data'].compression == 'gzip'
+        assert hdf5_file['1_10']['data'].chunks is not None
+
+        sft, _ = reconstruct_sft_from_hdf5(hdf5_file, '1_10')
+    assert len(sft) == 340
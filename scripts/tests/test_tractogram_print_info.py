@@ -4,6 +4,8 @@
 import os
 import tempfile
 
+from dipy.io.streamline import load_tractogram, save_tractogram
+
 from scilpy import SCILPY_HOME
 from scilpy.io.fetcher import fetch_data, get_testing_files_dict
 
@@ -22,3 +24,15 @@ def test_execution_filtering(script_runner, monkeypatch):
     in_bundle = os.path.join(SCILPY_HOME, 'filtering', 'bundle_4.trk')
     ret = script_runner.run('scil_tractogram_print_info.py', in_bundle)
     assert ret.success
+
+
+def test_execution_not_lazy_format(script_runner, monkeypatch):
+    monkeypatch.chdir(os.path.expanduser(tmp_dir.name))
+    in_bundle = os.path.join(SCILPY_HOME, 'filtering', 'bundle_4.trk')
+    sft = load_tractogram(in_bundle, 'same')
+    save_tractogram(sft, 'bundle_4.vtk')
+
+    # No lazy loading for vtk: loaded with the reference.
+    ret = script_runner.run('scil_tractogram_print_info.py', 'bundle_4.vtk',
+                            '--reference', in_bundle)
+    assert ret.success
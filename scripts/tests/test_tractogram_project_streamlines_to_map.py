@@ -4,6 +4,9 @@
 import os
 import tempfile
 
+from dipy.io.streamline import load_tractogram
+import numpy as np
+
 from scilpy import SCILPY_HOME
 from scilpy.io.fetcher import fetch_data, get_testing_files_dict
 
@@ -11,9 +14,6 @@ from scilpy.io.fetcher import fetch_data, get_testing_files_dict
 fetch_data(get_testing_files_dict(), keys=['tractometry.zip'])
 tmp_dir = tempfile.TemporaryDirectory()
 
-# toDo. For more coverage, save some DPS and DPP in a text file, and test
-#  options --load_dpp, --load_dps.
-
 
 def test_help_option(script_runner):
     ret = script_runner.run('scil_tractogram_project_streamlines_to_map.py',
@@ -76,3 +76,28 @@ def test_execution_dps(script_runner, monkeypatch):
                             '--use_dps', 'some_metric_dps', '--point_by_point',
                             '--to_wm')
     assert ret.success
+
+
+def test_execution_load_npy(script_runner, monkeypatch):
+    monkeypatch.chdir(os.path.expanduser(tmp_dir.name))
+    in_bundle = os.path.join(SCILPY_HOME, 'tractometry', 'IFGWM_uni.trk')
+    in_mni = os.path.join(SCILPY_HOME, 'tractometry', 'mni_masked.nii.gz')
+
+    # Saving some dpp and dps as npy files. They are memory-mapped when
+    # loaded.
+    sft = load_tractogram(in_bundle, in_mni)
+    nb_points = len(sft.streamlines._data)
+    np.save('some_dpp.npy', np.arange(nb_points, dtype=np.float32))
+    np.save('some_dps.npy', np.arange(len(sft), dtype=np.float32))
+
+    ret = script_runner.run('scil_tractogram_project_streamlines_to_map.py',
+                            in_bundle, 'project_loaded_dpp_',
+                            '--load_dpp', 'some_dpp.npy', '--mean_endpoints',
+                            '--to_endpoints')
+    assert ret.success
+
+    ret = script_runner.run('scil_tractogram_project_streamlines_to_map.py',
+                            in_bundle, 'project_loaded_dps_',
+                            '--load_dps', 'some_dps.npy', '--point_by_point',
+                            '--to_wm')
+    assert ret.success
@@ -23,3 +23,8 @@ def test_execution_tracking(script_runner, monkeypatch):
     ret = script_runner.run('scil_tractogram_shuffle.py', in_tracto,
                             'union_shuffle.trk')
     assert ret.success
+
+    ret = script_runner.run('scil_tractogram_shuffle.py', in_tracto,
+                            'union_shuffle_lazy.trk', '--lazy_load',
+                            '--seed', '0')
+    assert ret.success
@@ -34,3 +34,8 @@ def test_execution_tracking(script_runner, monkeypatch):
                             'local_split', '--nb_chunks', '3', '-f',
                             '--do_not_randomize')
     assert ret.success
+
+    ret = script_runner.run('scil_tractogram_split.py', in_tracto,
+                            'local_split', '--nb_chunks', '3', '-f',
+                            '--lazy_load')
+    assert ret.success